@@ -351,11 +351,13 @@ def prescriptions_admin_list(request):
 def appointments_admin_list(request):
     """View all appointments"""
     try:
+        from django.core.exceptions import ValidationError
         from appointments.models import Appointment
+        from appointments.services import AppointmentPaginationService
         appointments = Appointment.objects.select_related(
             'doctor__user', 
             'patient__user'
-        ).all().order_by('-created_at')
+        )
         
         # Apply search
         search = request.GET.get('search', '')
@@ -366,8 +368,18 @@ def appointments_admin_list(request):
                 Q(reason__icontains=search)
             )
         
+        # Newest first, one keyset page at a time
+        try:
+            page = AppointmentPaginationService.paginate(
+                appointments, cursor=request.GET.get('cursor'), limit=50, descending=True
+            )
+        except ValidationError:
+            page = AppointmentPaginationService.paginate(appointments, limit=50, descending=True)
+        
         context = {
-            'appointments': appointments,
+            'appointments': page['items'],
+            'next_cursor': page['next_cursor'],
+            'previous_cursor': page['previous_cursor'],
             'search': search,
         }
     except Exception as e:
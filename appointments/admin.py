@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Appointment
+from .models import Appointment, WaitlistEntry
 
 
 @admin.register(Appointment)
@@ -42,3 +42,33 @@ class AppointmentAdmin(admin.ModelAdmin):
     def doctor_full_name(self, obj):
         return obj.doctor.get_full_name() or obj.doctor.username
     doctor_full_name.short_description = "Doctor"
+
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    """
+    Admin panel configuration for the cancellation waitlist.
+    Staff can raise an entry's priority so it is offered freed times first.
+    """
+    list_display = (
+        'patient',
+        'doctor',
+        'specialization',
+        'priority',
+        'status',
+        'created_at',
+    )
+    list_editable = ('priority',)
+    search_fields = (
+        'patient__user__username',
+        'patient__user__first_name',
+        'patient__user__last_name',
+        'doctor__user__username',
+    )
+    list_filter = (
+        'status',
+        'specialization',
+    )
+    ordering = ('-priority', 'created_at')
+    readonly_fields = ('created_at', 'updated_at')
+    list_select_related = ('patient__user', 'doctor__user')
@@ -0,0 +1,169 @@
+"""
+appointments/management/commands/benchmark_appointment_booking.py
+
+Fires concurrent AppointmentService bookings at a small pool of times for
+one doctor and checks that no time ends up with two active appointments.
+
+A throwaway doctor and patients are created for the run and deleted
+afterwards (unless --keep is given), so it is safe to run against a shared
+database.
+
+Usage:
+    python manage.py benchmark_appointment_booking
+    python manage.py benchmark_appointment_booking --threads 16 --attempts 2000 --times 50
+"""
+
+import random
+import statistics
+import threading
+import time as _time
+from collections import Counter
+from datetime import timedelta
+from uuid import uuid4
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.db.models import Count
+from django.utils import timezone
+
+from appointments.models import ACTIVE_STATUSES, Appointment
+from appointments.services import AppointmentService
+from doctors.models import DoctorProfile
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Benchmark concurrent appointment booking and assert there are no double bookings"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent booking workers')
+        parser.add_argument('--attempts', type=int, default=400, help='Total booking attempts')
+        parser.add_argument('--times', type=int, default=20, help='Size of the contested time pool')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for time selection')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark fixture rows')
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['attempts'] < 1 or options['times'] < 1:
+            raise CommandError("--threads, --attempts and --times must be positive")
+
+        tag = uuid4().hex[:8]
+        user_ids, doctor_user, patient_users, times = self.create_fixture(tag, options['times'], options['threads'])
+        try:
+            report = self.run(doctor_user, patient_users, times, options)
+            self.print_report(report, options)
+            self.check_no_double_booking(doctor_user, report)
+        finally:
+            if not options['keep']:
+                User.objects.filter(id__in=user_ids).delete()
+
+    # -------------------------------
+    # Fixture
+    # -------------------------------
+    def create_fixture(self, tag, time_count, patient_count):
+        """Create a doctor, one patient per worker and ``time_count`` distinct future times"""
+        doctor_user = User.objects.create_user(username=f'bench_appt_dr_{tag}', password=None, role='DOCTOR')
+        DoctorProfile.objects.get_or_create(user=doctor_user, defaults={'specialization': 'family'})
+
+        patient_users = [
+            User.objects.create_user(username=f'bench_appt_pt_{tag}_{index}', password=None, role='PATIENT')
+            for index in range(patient_count)
+        ]
+        start = (timezone.now() + timedelta(days=365)).replace(second=0, microsecond=0)
+        times = [start + timedelta(minutes=15 * index) for index in range(time_count)]
+        user_ids = [doctor_user.id] + [user.id for user in patient_users]
+        return user_ids, doctor_user, patient_users, times
+
+    # -------------------------------
+    # Run
+    # -------------------------------
+    def run(self, doctor_user, patient_users, times, options):
+        """Spread the attempts over the worker threads and collect per-attempt results"""
+        rng = random.Random(options['seed'])
+        plan = [rng.choice(times) for _ in range(options['attempts'])]
+        chunks = [plan[index::options['threads']] for index in range(options['threads'])]
+
+        results = []
+        results_lock = threading.Lock()
+        barrier = threading.Barrier(options['threads'])
+
+        def worker(index):
+            patient_user = User.objects.get(id=patient_users[index].id)
+            local = []
+            try:
+                barrier.wait()
+                for scheduled_time in chunks[index]:
+                    local.append(self.attempt(patient_user, doctor_user, scheduled_time))
+            finally:
+                connection.close()
+                with results_lock:
+                    results.extend(local)
+
+        started = _time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = _time.perf_counter() - started
+
+        return {'results': results, 'elapsed': elapsed}
+
+    def attempt(self, patient_user, doctor_user, scheduled_time):
+        """One booking attempt; database lock timeouts are recorded, not raised"""
+        started = _time.perf_counter()
+        try:
+            AppointmentService.create_appointment(patient_user, doctor_user, scheduled_time)
+            outcome = 'booked'
+        except ValidationError as e:
+            outcome = 'conflict' if e.code == 'double_booking' else 'error'
+        except OperationalError:
+            # SQLite "database is locked" / lock wait timeouts on other backends
+            outcome = 'lock_error'
+        return {
+            'scheduled_time': scheduled_time,
+            'outcome': outcome,
+            'ms': (_time.perf_counter() - started) * 1000,
+        }
+
+    # -------------------------------
+    # Report
+    # -------------------------------
+    def print_report(self, report, options):
+        results = report['results']
+        outcomes = Counter(result['outcome'] for result in results)
+        latencies = sorted(result['ms'] for result in results)
+        p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)] if latencies else 0
+
+        self.stdout.write(
+            f"backend={connection.vendor} threads={options['threads']} times={options['times']}"
+        )
+        self.stdout.write(
+            f"attempts={len(results)} booked={outcomes['booked']} conflicts={outcomes['conflict']} "
+            f"conflict_rate={outcomes['conflict'] / len(results):.1%} "
+            f"lock_errors={outcomes['lock_error']} errors={outcomes['error']}"
+        )
+        self.stdout.write(
+            f"elapsed={report['elapsed']:.2f}s throughput={len(results) / report['elapsed']:.1f} attempts/s "
+            f"latency p50={statistics.median(latencies) if latencies else 0:.1f}ms p95={p95:.1f}ms "
+            f"max={latencies[-1] if latencies else 0:.1f}ms"
+        )
+
+    def check_no_double_booking(self, doctor_user, report):
+        """Every time must be won by at most one attempt, and the table must agree"""
+        wins = Counter(result['scheduled_time'] for result in report['results'] if result['outcome'] == 'booked')
+        doubled = [scheduled_time for scheduled_time, count in wins.items() if count > 1]
+        active = Appointment.objects.filter(doctor__user=doctor_user, status__in=ACTIVE_STATUSES)
+        stacked = active.values('scheduled_time').annotate(count=Count('id')).filter(count__gt=1).count()
+        booked_rows = active.count()
+
+        if doubled or stacked or booked_rows != len(wins):
+            raise CommandError(
+                f"Double booking detected: {len(doubled)} times won more than once, {stacked} times "
+                f"with several active rows, {booked_rows} active rows for {len(wins)} winning attempts"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"No double bookings: {booked_rows} times booked exactly once"
+        ))
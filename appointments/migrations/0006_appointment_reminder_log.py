@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0005_appointment_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentReminderLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scheduled_time', models.DateTimeField()),
+                ('claim_token', models.UUIDField(blank=True, null=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('appointment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminder_logs', to='appointments.appointment')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['claim_token'], name='appt_reminder_claim_idx')],
+                'constraints': [models.UniqueConstraint(fields=('appointment', 'scheduled_time'), name='unique_reminder_per_appointment_time')],
+            },
+        ),
+    ]
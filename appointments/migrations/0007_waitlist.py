@@ -0,0 +1,92 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0006_appointment_reminder_log'),
+        ('doctors', '0001_initial'),
+        ('patients', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('specialization', models.CharField(blank=True, choices=[('cardiology', 'Cardiology'), ('neurology', 'Neurology'), ('orthopedics', 'Orthopedics'), ('dermatology', 'Dermatology'), ('pediatrics', 'Pediatrics'), ('endocrinology', 'Endocrinology'), ('gastroenterology', 'Gastroenterology'), ('psychiatry', 'Psychiatry'), ('urology', 'Urology'), ('oncology', 'Oncology'), ('gynecology', 'Gynecology / Obstetrics'), ('nephrology', 'Nephrology'), ('pulmonology', 'Pulmonology'), ('rheumatology', 'Rheumatology'), ('ophthalmology', 'Ophthalmology'), ('ent', 'ENT (Otolaryngology)'), ('radiology', 'Radiology'), ('anesthesiology', 'Anesthesiology'), ('emergency', 'Emergency Medicine'), ('family', 'Family Medicine / General Practice')], max_length=50)),
+                ('priority', models.PositiveSmallIntegerField(default=0)),
+                ('not_before', models.DateTimeField(blank=True, null=True)),
+                ('not_after', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('waiting', 'Waiting'), ('offered', 'Offered'), ('booked', 'Booked'), ('left', 'Left')], default='waiting', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to='doctors.doctorprofile')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to='patients.patientprofile')),
+            ],
+            options={
+                'ordering': ['-priority', 'created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='WaitlistVacancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scheduled_time', models.DateTimeField()),
+                ('slot_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('slot_held', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('open', 'Open'), ('offered', 'Offered'), ('filled', 'Filled'), ('expired', 'Expired')], default='open', max_length=20)),
+                ('checked_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_vacancies', to='doctors.doctorprofile')),
+                ('source_appointment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='waitlist_vacancies', to='appointments.appointment')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WaitlistOffer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('accepted', 'Accepted'), ('declined', 'Declined'), ('expired', 'Expired')], default='pending', max_length=20)),
+                ('expires_at', models.DateTimeField()),
+                ('responded_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='offers', to='appointments.waitlistentry')),
+                ('vacancy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='offers', to='appointments.waitlistvacancy')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='waitlistentry',
+            index=models.Index(fields=['status', 'doctor'], name='waitlist_status_doctor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='waitlistentry',
+            index=models.Index(fields=['status', 'specialization'], name='waitlist_status_spec_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='waitlistentry',
+            constraint=models.CheckConstraint(condition=models.Q(('doctor__isnull', False), models.Q(('specialization', ''), _negated=True), _connector='OR'), name='waitlist_entry_has_target'),
+        ),
+        migrations.AddIndex(
+            model_name='waitlistvacancy',
+            index=models.Index(fields=['status', 'checked_at', 'created_at'], name='vacancy_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='waitlistoffer',
+            index=models.Index(fields=['status', 'expires_at'], name='waitlist_offer_expiry_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='waitlistoffer',
+            constraint=models.UniqueConstraint(fields=('vacancy', 'entry'), name='unique_waitlist_offer'),
+        ),
+        migrations.AddConstraint(
+            model_name='waitlistoffer',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('vacancy',), name='one_pending_offer_per_vacancy'),
+        ),
+        migrations.AddConstraint(
+            model_name='waitlistoffer',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('entry',), name='one_pending_offer_per_entry'),
+        ),
+    ]
@@ -1,9 +1,9 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
 from patients.models import PatientProfile
-from doctors.models import DoctorProfile
+from doctors.models import DoctorProfile, SPECIALIZATION_CHOICES
 
 
 class AppointmentStatus(models.TextChoices):
@@ -13,6 +13,10 @@ class AppointmentStatus(models.TextChoices):
     COMPLETED = "completed", "Completed"
 
 
+# Statuses that hold a doctor's time; at most one such appointment per time
+ACTIVE_STATUSES = (AppointmentStatus.PENDING, AppointmentStatus.CONFIRMED)
+
+
 class Appointment(models.Model):
     patient = models.ForeignKey(
         PatientProfile,
@@ -36,7 +40,20 @@ class Appointment(models.Model):
 
     class Meta:
         ordering = ["-scheduled_time"]
-        unique_together = ("doctor", "scheduled_time")
+        constraints = [
+            # Cancelled and completed appointments no longer block the time
+            models.UniqueConstraint(
+                fields=["doctor", "scheduled_time"],
+                condition=models.Q(status__in=ACTIVE_STATUSES),
+                name="unique_active_appointment_per_doctor_time",
+            ),
+        ]
+        indexes = [
+            # Keyset pagination on (scheduled_time, id), per owner and for staff lists
+            models.Index(fields=["patient", "scheduled_time", "id"], name="appt_patient_time_idx"),
+            models.Index(fields=["doctor", "scheduled_time", "id"], name="appt_doctor_time_idx"),
+            models.Index(fields=["scheduled_time", "id"], name="appt_time_idx"),
+        ]
 
     def __str__(self):
         patient_name = self.patient.get_full_name_or_username()
@@ -71,11 +88,177 @@ class Appointment(models.Model):
         """Reschedule the appointment if valid."""
         if new_time < timezone.now():
             raise ValidationError("Cannot reschedule to a past time.")
-        if Appointment.objects.filter(
-            doctor=self.doctor,
-            scheduled_time=new_time,
-            status__in=[AppointmentStatus.PENDING, AppointmentStatus.CONFIRMED]
-        ).exists():
-            raise ValidationError("This time slot is already booked for the selected doctor.")
+        previous_time = self.scheduled_time
         self.scheduled_time = new_time
-        self.save(update_fields=["scheduled_time", "updated_at"])
+        try:
+            with transaction.atomic():
+                self.save(update_fields=["scheduled_time", "updated_at"])
+        except IntegrityError:
+            self.scheduled_time = previous_time
+            raise ValidationError("This time slot is already booked for the selected doctor.", code="double_booking")
+
+
+class AppointmentReminderLog(models.Model):
+    """
+    Idempotency record for reminder emails: one row per appointment and
+    appointment time (a rescheduled appointment is reminded again).
+    A batch claims rows with claim_token and sets sent_at after delivery.
+    """
+    appointment = models.ForeignKey(
+        Appointment,
+        on_delete=models.CASCADE,
+        related_name="reminder_logs"
+    )
+    scheduled_time = models.DateTimeField()
+    claim_token = models.UUIDField(null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["appointment", "scheduled_time"],
+                name="unique_reminder_per_appointment_time",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["claim_token"], name="appt_reminder_claim_idx"),
+        ]
+
+    def __str__(self):
+        state = "sent" if self.sent_at else "pending"
+        return f"Reminder for appointment {self.appointment_id} at {self.scheduled_time} ({state})"
+
+
+class WaitlistStatus(models.TextChoices):
+    WAITING = "waiting", "Waiting"
+    OFFERED = "offered", "Offered"
+    BOOKED = "booked", "Booked"
+    LEFT = "left", "Left"
+
+
+class WaitlistEntry(models.Model):
+    """
+    A patient waiting for a freed time with one doctor, or with any doctor
+    of a specialization. Higher priority is offered first; equal
+    priorities are served in joining order.
+    """
+    patient = models.ForeignKey(
+        PatientProfile,
+        on_delete=models.CASCADE,
+        related_name="waitlist_entries"
+    )
+    doctor = models.ForeignKey(
+        DoctorProfile,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="waitlist_entries"
+    )
+    specialization = models.CharField(max_length=50, choices=SPECIALIZATION_CHOICES, blank=True)
+    priority = models.PositiveSmallIntegerField(default=0)
+    # Optional range of acceptable appointment times
+    not_before = models.DateTimeField(null=True, blank=True)
+    not_after = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=WaitlistStatus.choices, default=WaitlistStatus.WAITING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-priority", "created_at"]
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(doctor__isnull=False) | ~models.Q(specialization=""),
+                name="waitlist_entry_has_target",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["status", "doctor"], name="waitlist_status_doctor_idx"),
+            models.Index(fields=["status", "specialization"], name="waitlist_status_spec_idx"),
+        ]
+
+    def __str__(self):
+        target = f"doctor {self.doctor_id}" if self.doctor_id else self.specialization
+        return f"Waitlist {self.patient_id} for {target} (priority {self.priority}, {self.status})"
+
+
+class VacancyStatus(models.TextChoices):
+    OPEN = "open", "Open"
+    OFFERED = "offered", "Offered"
+    FILLED = "filled", "Filled"
+    EXPIRED = "expired", "Expired"
+
+
+class WaitlistVacancy(models.Model):
+    """
+    A cancelled appointment time waiting to be offered to the waitlist.
+    slot_id points at the schedules slot when the appointment had one;
+    slot_held is set while an offer keeps that slot out of open booking.
+    """
+    doctor = models.ForeignKey(
+        DoctorProfile,
+        on_delete=models.CASCADE,
+        related_name="waitlist_vacancies"
+    )
+    scheduled_time = models.DateTimeField()
+    slot_id = models.PositiveIntegerField(null=True, blank=True)
+    slot_held = models.BooleanField(default=False)
+    source_appointment = models.ForeignKey(
+        Appointment,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="waitlist_vacancies"
+    )
+    status = models.CharField(max_length=20, choices=VacancyStatus.choices, default=VacancyStatus.OPEN)
+    # Last time a batch looked at the vacancy; unmatched ones rotate to the back
+    checked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "checked_at", "created_at"], name="vacancy_queue_idx"),
+        ]
+
+    def __str__(self):
+        return f"Vacancy with doctor {self.doctor_id} at {self.scheduled_time} ({self.status})"
+
+
+class OfferStatus(models.TextChoices):
+    PENDING = "pending", "Pending"
+    ACCEPTED = "accepted", "Accepted"
+    DECLINED = "declined", "Declined"
+    EXPIRED = "expired", "Expired"
+
+
+class WaitlistOffer(models.Model):
+    """A vacancy offered to one waitlist entry until expires_at"""
+    vacancy = models.ForeignKey(WaitlistVacancy, on_delete=models.CASCADE, related_name="offers")
+    entry = models.ForeignKey(WaitlistEntry, on_delete=models.CASCADE, related_name="offers")
+    status = models.CharField(max_length=20, choices=OfferStatus.choices, default=OfferStatus.PENDING)
+    expires_at = models.DateTimeField()
+    responded_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # An entry is offered a vacancy at most once
+            models.UniqueConstraint(fields=["vacancy", "entry"], name="unique_waitlist_offer"),
+            models.UniqueConstraint(
+                fields=["vacancy"],
+                condition=models.Q(status="pending"),
+                name="one_pending_offer_per_vacancy",
+            ),
+            models.UniqueConstraint(
+                fields=["entry"],
+                condition=models.Q(status="pending"),
+                name="one_pending_offer_per_entry",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["status", "expires_at"], name="waitlist_offer_expiry_idx"),
+        ]
+
+    def __str__(self):
+        return f"Offer of vacancy {self.vacancy_id} to entry {self.entry_id} ({self.status})"
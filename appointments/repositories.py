@@ -1,8 +1,15 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.db.models.functions import TruncDate
 from django.utils import timezone
-from .models import Appointment, AppointmentStatus
+from .models import (
+    Appointment, AppointmentReminderLog, AppointmentStatus,
+    WaitlistEntry, WaitlistStatus, WaitlistVacancy, VacancyStatus, WaitlistOffer, OfferStatus,
+)
 
 from patients.models import PatientProfile
 from doctors.models import DoctorProfile
+from schedules.models import DoctorLeave
 
 
 class AppointmentRepository:
@@ -20,6 +27,85 @@ class AppointmentRepository:
             status=AppointmentStatus.PENDING
         )
 
+    @staticmethod
+    def create_if_free(patient, doctor, scheduled_time, reason=None):
+        """
+        Insert a pending appointment, or return None if the doctor already
+        has an active appointment at that time.
+        The partial unique constraint decides; there is no pre-check query.
+        """
+        try:
+            with transaction.atomic():
+                return AppointmentRepository.create(patient, doctor, scheduled_time, reason)
+        except IntegrityError:
+            return None
+
+    @staticmethod
+    def create_booking(patient, doctor_id, scheduled_time, reason=None):
+        """
+        Same as create_if_free, for callers that only know the doctor's id
+        (slot bookings resolve it in the slot query).
+        """
+        try:
+            with transaction.atomic():
+                return Appointment.objects.create(
+                    patient=patient,
+                    doctor_id=doctor_id,
+                    scheduled_time=scheduled_time,
+                    reason=reason,
+                    status=AppointmentStatus.PENDING
+                )
+        except IntegrityError:
+            return None
+
+    @staticmethod
+    def cancel_if_active(appointment_id):
+        """
+        Cancel a pending/confirmed appointment with one conditional UPDATE.
+        Returns True if this call cancelled it.
+        """
+        return Appointment.objects.filter(
+            id=appointment_id,
+            status__in=[AppointmentStatus.PENDING, AppointmentStatus.CONFIRMED]
+        ).update(status=AppointmentStatus.CANCELLED, updated_at=timezone.now()) == 1
+
+    @staticmethod
+    def move_if_free(appointment, new_time):
+        """
+        Move an appointment to a new time unless it collides with another
+        active appointment of the same doctor. Returns True on success.
+        """
+        try:
+            with transaction.atomic():
+                updated = Appointment.objects.filter(id=appointment.id).update(
+                    scheduled_time=new_time, updated_at=timezone.now()
+                )
+        except IntegrityError:
+            return False
+        if updated:
+            appointment.refresh_from_db(fields=["scheduled_time", "updated_at"])
+        return bool(updated)
+
+    @staticmethod
+    def keyset_slice(queryset, limit, scheduled_time=None, appointment_id=None, greater=True):
+        """
+        Up to ``limit`` rows strictly after (greater=True) or before the
+        (scheduled_time, id) key, nearest first.
+        The range bound on scheduled_time keeps the scan on the
+        (…, scheduled_time, id) indexes, so every page costs the same.
+        """
+        if scheduled_time is not None:
+            if greater:
+                queryset = queryset.filter(scheduled_time__gte=scheduled_time).filter(
+                    Q(scheduled_time__gt=scheduled_time) | Q(id__gt=appointment_id)
+                )
+            else:
+                queryset = queryset.filter(scheduled_time__lte=scheduled_time).filter(
+                    Q(scheduled_time__lt=scheduled_time) | Q(id__lt=appointment_id)
+                )
+        ordering = ("scheduled_time", "id") if greater else ("-scheduled_time", "-id")
+        return list(queryset.order_by(*ordering)[:limit])
+
     @staticmethod
     def get_by_id(appointment_id):
         """
@@ -83,3 +169,265 @@ class AppointmentRepository:
             scheduled_time=scheduled_time,
             status__in=[AppointmentStatus.PENDING, AppointmentStatus.CONFIRMED]
         ).exists()
+
+
+class AppointmentReminderRepository:
+    """Claims on AppointmentReminderLog for the batch reminder sender"""
+
+    @staticmethod
+    def get_due(now, stale_before, window_end=None, limit=500, appointment_ids=None):
+        """
+        (id, scheduled_time) of active appointments starting after ``now``
+        (and by ``window_end``) whose reminder is neither sent nor held by a
+        live claim, soonest first.
+        """
+        blocking = AppointmentReminderLog.objects.filter(
+            appointment_id=OuterRef("id"),
+            scheduled_time=OuterRef("scheduled_time")
+        ).filter(
+            Q(sent_at__isnull=False) | Q(claimed_at__gte=stale_before)
+        )
+        queryset = Appointment.objects.filter(
+            status__in=[AppointmentStatus.PENDING, AppointmentStatus.CONFIRMED],
+            scheduled_time__gt=now
+        ).filter(~Exists(blocking))
+        if window_end is not None:
+            queryset = queryset.filter(scheduled_time__lte=window_end)
+        if appointment_ids is not None:
+            queryset = queryset.filter(id__in=list(appointment_ids))
+        return list(queryset.order_by("scheduled_time", "id").values_list("id", "scheduled_time")[:limit])
+
+    @staticmethod
+    def claim(token, due, now, stale_before):
+        """
+        Claim reminders for (appointment_id, scheduled_time) pairs.
+        Missing log rows are inserted first; the claim itself is one
+        conditional UPDATE, so of two racing workers only one holds a row.
+        Returns the number of rows claimed under ``token``.
+        """
+        AppointmentReminderLog.objects.bulk_create([
+            AppointmentReminderLog(appointment_id=appointment_id, scheduled_time=scheduled_time)
+            for appointment_id, scheduled_time in due
+        ], ignore_conflicts=True)
+        current_time = Appointment.objects.filter(
+            id=OuterRef("appointment_id"), scheduled_time=OuterRef("scheduled_time")
+        )
+        return AppointmentReminderLog.objects.filter(
+            appointment_id__in=[appointment_id for appointment_id, _ in due],
+            sent_at__isnull=True
+        ).filter(
+            Q(claim_token__isnull=True) | Q(claimed_at__lt=stale_before)
+        ).filter(Exists(current_time)).update(claim_token=token, claimed_at=now)
+
+    @staticmethod
+    def get_claimed(token):
+        """Claimed reminders with appointment, patient and doctor users in one query"""
+        return list(AppointmentReminderLog.objects.filter(claim_token=token).select_related(
+            "appointment__patient__user", "appointment__doctor__user"
+        ).order_by("scheduled_time", "appointment_id"))
+
+    @staticmethod
+    def mark_sent(token, now, reminder_ids=None):
+        """Mark the reminders held by a claim (or only ``reminder_ids`` of them) as sent"""
+        queryset = AppointmentReminderLog.objects.filter(claim_token=token)
+        if reminder_ids is not None:
+            queryset = queryset.filter(id__in=list(reminder_ids))
+        return queryset.update(sent_at=now, claim_token=None)
+
+    @staticmethod
+    def release(token):
+        """Give up a claim so the next run picks the reminders up again"""
+        return AppointmentReminderLog.objects.filter(claim_token=token).update(claim_token=None, claimed_at=None)
+
+
+class WaitlistRepository:
+    """Entries, vacancies and offers of the cancellation waitlist"""
+
+    ACTIVE_ENTRY_STATUSES = [WaitlistStatus.WAITING, WaitlistStatus.OFFERED]
+
+    @staticmethod
+    def create_entry(patient, doctor=None, specialization="", priority=0, not_before=None, not_after=None):
+        return WaitlistEntry.objects.create(
+            patient=patient,
+            doctor=doctor,
+            specialization=specialization or "",
+            priority=priority,
+            not_before=not_before,
+            not_after=not_after,
+        )
+
+    @staticmethod
+    def has_active_entry(patient, doctor=None, specialization=""):
+        """
+        Check whether the patient already waits for this doctor or specialization.
+        """
+        return WaitlistEntry.objects.filter(
+            patient=patient,
+            doctor=doctor,
+            specialization=specialization or "",
+            status__in=WaitlistRepository.ACTIVE_ENTRY_STATUSES
+        ).exists()
+
+    @staticmethod
+    def get_entries_for_user(user):
+        """Active entries of a patient user, best priority first"""
+        return WaitlistEntry.objects.filter(
+            patient__user=user,
+            status__in=WaitlistRepository.ACTIVE_ENTRY_STATUSES
+        ).select_related("doctor__user")
+
+    @staticmethod
+    def has_waiting_entry(doctor):
+        """
+        Check whether anyone waits for this doctor, directly or by specialization.
+        """
+        return WaitlistEntry.objects.filter(
+            Q(doctor=doctor) | Q(doctor__isnull=True, specialization=doctor.specialization),
+            status=WaitlistStatus.WAITING
+        ).exists()
+
+    @staticmethod
+    def create_vacancy(appointment, slot_id=None):
+        return WaitlistVacancy.objects.create(
+            doctor_id=appointment.doctor_id,
+            scheduled_time=appointment.scheduled_time,
+            slot_id=slot_id,
+            source_appointment=appointment,
+        )
+
+    @staticmethod
+    def get_open_vacancies(now, limit, checked_before):
+        """
+        Future open vacancies not yet looked at during this run, the ones
+        never or least recently checked first. Annotated with the doctor's
+        specialization, the cancelling patient and whether the doctor has an
+        approved leave on that day.
+        """
+        on_leave = DoctorLeave.objects.filter(
+            doctor__user_id=OuterRef("doctor__user_id"),
+            status=DoctorLeave.LeaveStatus.APPROVED,
+            start_date__lte=OuterRef("scheduled_date"),
+            end_date__gte=OuterRef("scheduled_date")
+        )
+        return list(WaitlistVacancy.objects.filter(
+            status=VacancyStatus.OPEN,
+            scheduled_time__gt=now
+        ).filter(
+            Q(checked_at__isnull=True) | Q(checked_at__lt=checked_before)
+        ).annotate(
+            scheduled_date=TruncDate("scheduled_time"),
+            specialization=F("doctor__specialization"),
+            source_patient_id=F("source_appointment__patient_id"),
+        ).annotate(
+            on_leave=Exists(on_leave)
+        ).select_related("doctor__user").order_by(F("checked_at").asc(nulls_first=True), "created_at", "id")[:limit])
+
+    @staticmethod
+    def get_past_vacancies(now):
+        """Open vacancies whose time has passed, as (id, slot_id, slot_held)"""
+        return list(WaitlistVacancy.objects.filter(
+            status=VacancyStatus.OPEN,
+            scheduled_time__lte=now
+        ).values_list("id", "slot_id", "slot_held"))
+
+    @staticmethod
+    def get_candidates(doctor_ids, specializations):
+        """
+        Waiting entries for any of the doctors, or for any doctor of one of
+        the specializations, in one query.
+        """
+        return list(WaitlistEntry.objects.filter(
+            Q(doctor_id__in=list(doctor_ids)) | Q(doctor__isnull=True, specialization__in=list(specializations)),
+            status=WaitlistStatus.WAITING
+        ).select_related("patient__user"))
+
+    @staticmethod
+    def get_offered_pairs(vacancy_ids):
+        """(vacancy_id, entry_id) pairs that already had an offer"""
+        return set(WaitlistOffer.objects.filter(
+            vacancy_id__in=list(vacancy_ids)
+        ).values_list("vacancy_id", "entry_id"))
+
+    @staticmethod
+    def create_offers(offers):
+        """
+        Insert offers and flag their entries and vacancies as offered.
+        The one-pending-offer constraints make a racing batch fail instead
+        of offering a vacancy or an entry twice.
+        """
+        WaitlistOffer.objects.bulk_create(offers)
+        WaitlistEntry.objects.filter(
+            id__in=[offer.entry_id for offer in offers]
+        ).update(status=WaitlistStatus.OFFERED, updated_at=timezone.now())
+        WaitlistVacancy.objects.filter(
+            id__in=[offer.vacancy_id for offer in offers]
+        ).update(status=VacancyStatus.OFFERED)
+        return offers
+
+    @staticmethod
+    def update_vacancies(vacancy_ids, **fields):
+        return WaitlistVacancy.objects.filter(id__in=list(vacancy_ids)).update(**fields)
+
+    @staticmethod
+    def get_pending_offer(offer_id, user, now):
+        """A live offer of the given patient user with entry and vacancy, or None"""
+        return WaitlistOffer.objects.filter(
+            id=offer_id,
+            entry__patient__user=user,
+            status=OfferStatus.PENDING,
+            expires_at__gt=now
+        ).select_related("entry", "vacancy__doctor__user").first()
+
+    @staticmethod
+    def get_offers_for_user(user):
+        """Pending offers of a patient user, soonest expiry first"""
+        return WaitlistOffer.objects.filter(
+            entry__patient__user=user,
+            status=OfferStatus.PENDING
+        ).select_related("vacancy__doctor__user").order_by("expires_at")
+
+    @staticmethod
+    def close_offer(offer, status, now):
+        """
+        Move a pending offer to ``status`` with a conditional UPDATE.
+        Returns False if it was no longer pending.
+        """
+        return WaitlistOffer.objects.filter(
+            id=offer.id,
+            status=OfferStatus.PENDING
+        ).update(status=status, responded_at=now) == 1
+
+    @staticmethod
+    def set_offer_status(offer_id, status):
+        return WaitlistOffer.objects.filter(id=offer_id).update(status=status)
+
+    @staticmethod
+    def set_entry_status(entry_id, status):
+        return WaitlistEntry.objects.filter(id=entry_id).update(status=status, updated_at=timezone.now())
+
+    @staticmethod
+    def expire_offers(now):
+        """
+        Expire pending offers past their hold; their entries wait again and
+        their vacancies reopen at the front of the queue.
+        Returns the number of offers expired.
+        """
+        expired = list(WaitlistOffer.objects.filter(
+            status=OfferStatus.PENDING,
+            expires_at__lte=now
+        ).values_list("id", "entry_id", "vacancy_id"))
+        if not expired:
+            return 0
+        WaitlistOffer.objects.filter(
+            id__in=[offer_id for offer_id, _, _ in expired],
+            status=OfferStatus.PENDING
+        ).update(status=OfferStatus.EXPIRED)
+        WaitlistEntry.objects.filter(
+            id__in=[entry_id for _, entry_id, _ in expired],
+            status=WaitlistStatus.OFFERED
+        ).update(status=WaitlistStatus.WAITING, updated_at=timezone.now())
+        WaitlistVacancy.objects.filter(
+            id__in=[vacancy_id for _, _, vacancy_id in expired],
+            status=VacancyStatus.OFFERED
+        ).update(status=VacancyStatus.OPEN, checked_at=None)
+        return len(expired)
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Appointment
+from .models import Appointment, WaitlistEntry, WaitlistOffer
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -7,8 +7,8 @@ User = get_user_model()
 
 class AppointmentSerializer(serializers.ModelSerializer):
     # Basic identifiers
-    patient_name = serializers.CharField(source='patient.username', read_only=True)
-    doctor_name = serializers.CharField(source='doctor.username', read_only=True)
+    patient_name = serializers.CharField(source='patient.user.username', read_only=True)
+    doctor_name = serializers.CharField(source='doctor.user.username', read_only=True)
 
     # Full names for readability
     patient_full_name = serializers.SerializerMethodField()
@@ -36,11 +36,47 @@ class AppointmentSerializer(serializers.ModelSerializer):
         read_only_fields = ['status', 'created_at']
 
     def get_patient_full_name(self, obj):
-        if hasattr(obj.patient, "get_full_name"):
-            return obj.patient.get_full_name()
-        return obj.patient.username
+        return obj.patient.get_full_name_or_username()
 
     def get_doctor_full_name(self, obj):
-        if hasattr(obj.doctor, "get_full_name"):
-            return obj.doctor.get_full_name()
-        return obj.doctor.username
+        return obj.doctor.get_full_name_or_username()
+
+
+class WaitlistEntrySerializer(serializers.ModelSerializer):
+    doctor_name = serializers.CharField(source='doctor.user.username', read_only=True, default=None)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+
+    class Meta:
+        model = WaitlistEntry
+        fields = [
+            'id',
+            'doctor',
+            'doctor_name',
+            'specialization',
+            'priority',
+            'not_before',
+            'not_after',
+            'status',
+            'status_display',
+            'created_at',
+        ]
+        read_only_fields = fields
+
+
+class WaitlistOfferSerializer(serializers.ModelSerializer):
+    doctor = serializers.IntegerField(source='vacancy.doctor_id', read_only=True)
+    doctor_name = serializers.CharField(source='vacancy.doctor.user.username', read_only=True)
+    scheduled_time = serializers.DateTimeField(source='vacancy.scheduled_time', read_only=True)
+
+    class Meta:
+        model = WaitlistOffer
+        fields = [
+            'id',
+            'entry',
+            'doctor',
+            'doctor_name',
+            'scheduled_time',
+            'status',
+            'expires_at',
+        ]
+        read_only_fields = fields
@@ -1,10 +1,29 @@
+import heapq
+import logging
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from django.conf import settings
 from django.utils import timezone
 from django.core.exceptions import ValidationError
-from .repositories import AppointmentRepository
-from .models import AppointmentStatus, Appointment
+from django.core.mail import EmailMessage, EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.template.loader import get_template
+from .repositories import AppointmentRepository, AppointmentReminderRepository, WaitlistRepository
+from .models import (
+    AppointmentStatus, Appointment,
+    WaitlistStatus, WaitlistOffer, VacancyStatus, OfferStatus,
+)
+from .utils import encode_cursor, decode_cursor
 
 from patients.models import PatientProfile
 from doctors.models import DoctorProfile
+from schedules.models import ChangeLogEntry
+from schedules.repositories import AvailabilitySlotRepository
+from schedules.services import ChangeFeedService, SlotChangeService
+from schedules.utils import merge_config
+
+logger = logging.getLogger(__name__)
 
 
 class AppointmentService:
@@ -32,11 +51,13 @@ class AppointmentService:
         except DoctorProfile.DoesNotExist:
             raise ValidationError("Doctor profile not found.")
 
-        # Prevent double-booking
-        if Appointment.objects.filter(doctor=doctor, scheduled_time=scheduled_time).exists():
-            raise ValidationError("This time slot is already booked for the selected doctor.")
-
-        return AppointmentRepository.create(patient, doctor, scheduled_time, reason)
+        # The active-appointment constraint rejects double bookings atomically
+        appointment = AppointmentRepository.create_if_free(patient, doctor, scheduled_time, reason)
+        if appointment is None:
+            raise ValidationError(
+                "This time slot is already booked for the selected doctor.", code="double_booking"
+            )
+        return appointment
 
     @staticmethod
     def cancel_appointment(appointment_id, user):
@@ -52,13 +73,9 @@ class AppointmentService:
         patient_match = hasattr(user, "patientprofile") and appointment.patient == user.patientprofile
         doctor_match = hasattr(user, "doctorprofile") and appointment.doctor == user.doctorprofile
 
-        if (patient_match or doctor_match) and appointment.status in [
-            AppointmentStatus.PENDING,
-            AppointmentStatus.CONFIRMED,
-        ]:
-            appointment.status = AppointmentStatus.CANCELLED
-            appointment.save(update_fields=["status", "updated_at"])
-            return appointment
+        if patient_match or doctor_match:
+            # Also frees the linked slot, if any
+            return AppointmentBookingService.cancel(appointment)
 
         return None
 
@@ -75,14 +92,14 @@ class AppointmentService:
                 patient=user.patientprofile,
                 scheduled_time__gte=now,
                 status__in=[AppointmentStatus.PENDING, AppointmentStatus.CONFIRMED]
-            ).select_related("doctor", "patient").order_by("scheduled_time")
+            ).select_related("doctor__user", "patient__user").order_by("scheduled_time")
 
         if hasattr(user, "doctorprofile"):
             return Appointment.objects.filter(
                 doctor=user.doctorprofile,
                 scheduled_time__gte=now,
                 status__in=[AppointmentStatus.PENDING, AppointmentStatus.CONFIRMED]
-            ).select_related("doctor", "patient").order_by("scheduled_time")
+            ).select_related("doctor__user", "patient__user").order_by("scheduled_time")
 
         return Appointment.objects.none()
 
@@ -101,10 +118,707 @@ class AppointmentService:
         if not new_time or new_time < timezone.now():
             return None
 
-        # Prevent double-booking
-        if Appointment.objects.filter(doctor=appointment.doctor, scheduled_time=new_time).exists():
+        # Fails on a collision with another active appointment; frees the
+        # slot the appointment was booked through, if any
+        return AppointmentBookingService.move(appointment, new_time)
+
+
+class AppointmentBookingService:
+    """
+    Books appointments against schedules.AvailabilitySlot in one transaction.
+
+    Booking is a slot lookup, an appointment INSERT and one conditional slot
+    UPDATE that claims the slot and links the appointment. The partial unique
+    constraint on active appointments arbitrates concurrent bookings of the
+    same time; the conditional UPDATE rejects masked or otherwise taken
+    slots, rolling the INSERT back. Cancel and reschedule release and claim
+    slots with the same conditional UPDATEs.
+    """
+
+    @staticmethod
+    def _slot_time(scope):
+        """Aware appointment time for a slot"""
+        return timezone.make_aware(datetime.combine(scope["date"], scope["start_time"]))
+
+    @staticmethod
+    def _slots_changed(*scopes):
+        """
+        Notify the schedules read models about touched slots once the
+        current transaction commits.
+        - Keeps the rollup refresh out of the booking transaction, so bookings
+          for one doctor and day do not serialize on its rollup row
+        """
+        for scope in scopes:
+            if scope:
+                transaction.on_commit(
+                    lambda scope=scope: SlotChangeService.slots_changed(
+                        [scope["doctor_id"]], scope["date"], scope["date"], hospital_ids=[scope["hospital_id"]]
+                    ),
+                    robust=True,
+                )
+
+    @staticmethod
+    @transaction.atomic
+    def book(patient_user, slot_id, reason=None):
+        """
+        Book a slot for a patient and return the new appointment.
+        - patient_user: CustomUser instance
+        - Raises ValidationError (code "double_booking" when the time is taken)
+        """
+        scope = AvailabilitySlotRepository.get_booking_scope(slot_id)
+        if scope is None:
+            raise ValidationError("Slot not found.")
+        if scope["directory_doctor_id"] is None:
+            raise ValidationError("Doctor profile not found.")
+
+        scheduled_time = AppointmentBookingService._slot_time(scope)
+        if scheduled_time < timezone.now():
+            raise ValidationError("Cannot book an appointment in the past.")
+
+        try:
+            patient = patient_user.patientprofile
+        except PatientProfile.DoesNotExist:
+            raise ValidationError("Patient profile not found.")
+
+        appointment = AppointmentRepository.create_booking(
+            patient, scope["directory_doctor_id"], scheduled_time, reason
+        )
+        if appointment is None:
+            raise ValidationError(
+                "This time slot is already booked for the selected doctor.", code="double_booking"
+            )
+
+        claimed = AvailabilitySlotRepository.claim_slot(
+            slot_id, AvailabilitySlotRepository.patient_id_for_user(patient_user.id), appointment.id
+        )
+        if not claimed:
+            # Raising rolls the appointment back with the transaction
+            raise ValidationError("Slot is not available for booking.", code="slot_unavailable")
+
+        AppointmentBookingService._slots_changed(scope)
+        return appointment
+
+    @staticmethod
+    @transaction.atomic
+    def cancel(appointment):
+        """
+        Cancel an active appointment and free its slot.
+        Returns the appointment, or None if it was not pending/confirmed.
+        """
+        if not AppointmentRepository.cancel_if_active(appointment.id):
+            return None
+        appointment.status = AppointmentStatus.CANCELLED
+
+        scope = AvailabilitySlotRepository.get_appointment_slot_scope(appointment.id)
+        if scope:
+            AvailabilitySlotRepository.release_slot(scope["id"])
+        AppointmentBookingService._slots_changed(scope)
+        ChangeFeedService.record_object(ChangeLogEntry.ObjectType.APPOINTMENT, appointment)
+        # Offered to the waitlist by the next batch of process_waitlist_offers
+        WaitlistService.add_vacancy(appointment, scope["id"] if scope else None)
+        return appointment
+
+    @staticmethod
+    @transaction.atomic
+    def move(appointment, new_time):
+        """
+        Move an appointment to a time outside the slot grid.
+        Its linked slot, if any, is released. Returns the appointment, or
+        None if the new time collides with another active appointment.
+        """
+        if not AppointmentRepository.move_if_free(appointment, new_time):
             return None
 
-        appointment.scheduled_time = new_time
-        appointment.save(update_fields=["scheduled_time", "updated_at"])
+        scope = AvailabilitySlotRepository.get_appointment_slot_scope(appointment.id)
+        if scope:
+            AvailabilitySlotRepository.release_slot(scope["id"])
+        AppointmentBookingService._slots_changed(scope)
+        ChangeFeedService.record_object(ChangeLogEntry.ObjectType.APPOINTMENT, appointment)
+        return appointment
+
+    @staticmethod
+    @transaction.atomic
+    def reschedule(appointment, new_slot_id):
+        """
+        Move a pending appointment to another slot of the same doctor.
+        - Releases the old slot and claims the new one; raises ValidationError
+          and changes nothing if the new slot or time is taken
+        """
+        if appointment.status != AppointmentStatus.PENDING:
+            raise ValidationError("Only pending appointments can be rescheduled.")
+
+        scope = AvailabilitySlotRepository.get_booking_scope(new_slot_id)
+        if scope is None:
+            raise ValidationError("Slot not found.")
+        if scope["directory_doctor_id"] != appointment.doctor_id:
+            raise ValidationError("The new slot belongs to a different doctor.")
+
+        new_time = AppointmentBookingService._slot_time(scope)
+        if new_time < timezone.now():
+            raise ValidationError("Cannot reschedule to a past time.")
+        previous_time = appointment.scheduled_time
+        if not AppointmentRepository.move_if_free(appointment, new_time):
+            raise ValidationError(
+                "This time slot is already booked for the selected doctor.", code="double_booking"
+            )
+
+        # Release first: a slot links at most one appointment
+        old_scope = AvailabilitySlotRepository.get_appointment_slot_scope(appointment.id)
+        if old_scope:
+            AvailabilitySlotRepository.release_slot(old_scope["id"])
+        claimed = AvailabilitySlotRepository.claim_slot(
+            new_slot_id,
+            AvailabilitySlotRepository.patient_id_for_user(appointment.patient.user_id),
+            appointment.id
+        )
+        if not claimed:
+            appointment.scheduled_time = previous_time
+            raise ValidationError("Slot is not available for booking.", code="slot_unavailable")
+
+        AppointmentBookingService._slots_changed(old_scope, scope)
+        ChangeFeedService.record_object(ChangeLogEntry.ObjectType.APPOINTMENT, appointment)
         return appointment
+
+
+class AppointmentPaginationService:
+    """
+    Keyset (cursor) pagination over (scheduled_time, id).
+
+    A page is one indexed range scan from the cursor's key, so page 1000
+    costs the same as page 1 and rows inserted meanwhile never shift the
+    pages. Cursors are opaque and carry the direction they page in.
+    """
+
+    PAGE_SIZE = 25
+    MAX_PAGE_SIZE = 100
+
+    @staticmethod
+    def paginate(queryset, cursor=None, limit=None, descending=False):
+        """
+        One page of a queryset ordered by (scheduled_time, id).
+        - descending: newest first (history lists) instead of soonest first
+        - Returns {"items", "next_cursor", "previous_cursor"}
+        - Raises ValidationError for a malformed cursor
+        """
+        limit = min(limit or AppointmentPaginationService.PAGE_SIZE, AppointmentPaginationService.MAX_PAGE_SIZE)
+        direction, scheduled_time, appointment_id = "n", None, None
+        if cursor:
+            try:
+                direction, scheduled_time, appointment_id = decode_cursor(cursor)
+            except ValueError:
+                raise ValidationError("Invalid cursor.")
+
+        backwards = direction == "p"
+        rows = AppointmentRepository.keyset_slice(
+            queryset, limit + 1, scheduled_time, appointment_id, greater=backwards == descending
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+
+        has_next = has_more if not backwards else True
+        has_previous = has_more if backwards else cursor is not None
+        return {
+            "items": rows,
+            "next_cursor": encode_cursor("n", rows[-1].scheduled_time, rows[-1].id) if rows and has_next else None,
+            "previous_cursor": encode_cursor("p", rows[0].scheduled_time, rows[0].id) if rows and has_previous else None,
+        }
+
+
+class AppointmentReminderService:
+    """
+    Windowed, batched reminder emails for appointments.
+
+    Each batch selects due appointments, claims their AppointmentReminderLog
+    rows with one conditional UPDATE, loads them with patient and doctor in
+    one query, renders them with templates compiled once per run and sends
+    them one by one over the run's single mail connection. Rows are marked
+    sent only after delivery; when a send fails, the rows delivered before
+    it are marked and the rest released, and claims older than
+    lease_seconds (a crashed worker) are taken over, so retries never send
+    twice.
+
+    Configuration (all optional) lives in ``settings.APPOINTMENT_REMINDERS``:
+        window_hours: Remind appointments starting within this many hours
+        batch_size: Reminders claimed and sent per batch
+        max_batches: Upper bound on batches per run
+        lease_seconds: Age after which another worker may take over a claim
+    """
+
+    DEFAULTS = {
+        "window_hours": 24,
+        "batch_size": 200,
+        "max_batches": 100,
+        "lease_seconds": 600,
+    }
+    SUBJECT = "Appointment Reminder"
+    TEXT_TEMPLATE = "appointments/emails/reminder.txt"
+    HTML_TEMPLATE = "appointments/emails/reminder.html"
+
+    @staticmethod
+    def get_config(**overrides):
+        """Merge defaults, settings.APPOINTMENT_REMINDERS and explicit overrides"""
+        return merge_config(AppointmentReminderService.DEFAULTS, "APPOINTMENT_REMINDERS", overrides)
+
+    @staticmethod
+    def build_message(reminder, templates, mail_connection):
+        """Render one reminder, or None when the patient has no address"""
+        appointment = reminder.appointment
+        patient_user = appointment.patient.user
+        if not patient_user.email:
+            return None
+        context = {
+            "patient_name": patient_user.get_full_name() or patient_user.username,
+            "doctor_name": appointment.doctor.user.get_full_name() or appointment.doctor.user.username,
+            "when": timezone.localtime(reminder.scheduled_time).strftime("%A, %B %d at %I:%M %p"),
+        }
+        text_template, html_template = templates
+        message = EmailMultiAlternatives(
+            subject=AppointmentReminderService.SUBJECT,
+            body=text_template.render(context),
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[patient_user.email],
+            connection=mail_connection,
+        )
+        message.attach_alternative(html_template.render(context), "text/html")
+        return message
+
+    @staticmethod
+    def send_batch(config, now, templates, mail_connection, appointment_ids=None):
+        """
+        Claim, deliver and mark one batch.
+        - Returns {"claimed", "sent", "skipped"} counts
+        """
+        stale_before = now - timedelta(seconds=config["lease_seconds"])
+        window_end = now + timedelta(hours=config["window_hours"])
+        due = AppointmentReminderRepository.get_due(
+            now, stale_before, window_end, config["batch_size"], appointment_ids
+        )
+        if not due:
+            return {"claimed": 0, "sent": 0, "skipped": 0}
+
+        token = uuid4()
+        claimed = AppointmentReminderRepository.claim(token, due, now, stale_before)
+        if not claimed:
+            return {"claimed": 0, "sent": 0, "skipped": 0}
+
+        sent = skipped = 0
+        # Reminders handled so far: a failure mid-batch must not release
+        # messages the connection already delivered
+        done = []
+        try:
+            for reminder in AppointmentReminderRepository.get_claimed(token):
+                message = AppointmentReminderService.build_message(reminder, templates, mail_connection)
+                if message is None:
+                    skipped += 1
+                else:
+                    sent += mail_connection.send_messages([message]) or 0
+                done.append(reminder.id)
+        except Exception:
+            AppointmentReminderRepository.mark_sent(token, now, reminder_ids=done)
+            AppointmentReminderRepository.release(token)
+            raise
+        AppointmentReminderRepository.mark_sent(token, now)
+        return {"claimed": claimed, "sent": sent, "skipped": skipped}
+
+    @staticmethod
+    def run(appointment_ids=None, **overrides):
+        """
+        Send due reminders batch by batch until none are left or max_batches is hit.
+        - appointment_ids: only remind these appointments (still within the window)
+        - Returns claimed/sent/skipped/batch counts and the error of a failed batch
+        """
+        config = AppointmentReminderService.get_config(**overrides)
+        stats = {"claimed": 0, "sent": 0, "skipped": 0, "batches": 0, "error": None}
+        # Compiled once, rendered for every message of the run
+        templates = (
+            get_template(AppointmentReminderService.TEXT_TEMPLATE),
+            get_template(AppointmentReminderService.HTML_TEMPLATE),
+        )
+
+        with get_connection() as mail_connection:
+            while stats["batches"] < config["max_batches"]:
+                try:
+                    batch = AppointmentReminderService.send_batch(
+                        config, timezone.now(), templates, mail_connection, appointment_ids
+                    )
+                except Exception as e:
+                    logger.exception("Appointment reminder batch failed; its claims were released")
+                    stats["error"] = str(e)
+                    break
+                if not batch["claimed"]:
+                    break
+                stats["batches"] += 1
+                for key in ("claimed", "sent", "skipped"):
+                    stats[key] += batch[key]
+                if batch["claimed"] < config["batch_size"]:
+                    break
+
+        return stats
+
+
+class WaitlistService:
+    """
+    Cancellation waitlist: freed appointment times offered to waiting patients.
+
+    Cancelling only records a WaitlistVacancy. Vacancies are offered in
+    batches by process_batch: the waiting entries of every doctor and
+    specialization in the batch are loaded in one query into heaps ordered
+    by (-priority, joined), and each vacancy pops the best eligible entry.
+    An offer holds the vacancy's slot (booked, without an appointment) for
+    hold_minutes; expired or declined offers pass the vacancy to the next
+    entry. Slots that were masked or booked meanwhile, and days the doctor is
+    on approved leave, are never offered, so a mass cancellation during a
+    leave turns into closed vacancies rather than a burst of offers.
+
+    Configuration (all optional) lives in ``settings.APPOINTMENT_WAITLIST``:
+        hold_minutes: How long an offer holds the time for its patient
+        batch_size: Vacancies matched per batch
+        max_batches: Upper bound on batches per run
+    """
+
+    DEFAULTS = {
+        "hold_minutes": 15,
+        "batch_size": 50,
+        "max_batches": 20,
+    }
+    SUBJECT = "An earlier appointment is available"
+    TEXT_TEMPLATE = "appointments/emails/waitlist_offer.txt"
+
+    @staticmethod
+    def get_config(**overrides):
+        """Merge defaults, settings.APPOINTMENT_WAITLIST and explicit overrides"""
+        return merge_config(WaitlistService.DEFAULTS, "APPOINTMENT_WAITLIST", overrides)
+
+    @staticmethod
+    def join(patient_user, doctor_user=None, specialization="", priority=0, not_before=None, not_after=None):
+        """
+        Put a patient on the waitlist of a doctor or of a specialization.
+        - patient_user / doctor_user: CustomUser instances
+        - priority: higher is offered first; equal priorities in joining order
+        - not_before / not_after: optional range of acceptable times
+        """
+        if doctor_user is None and not specialization:
+            raise ValidationError("Choose a doctor or a specialization.")
+        if not_before and not_after and not_before > not_after:
+            raise ValidationError("The earliest time must come before the latest time.")
+
+        try:
+            patient = patient_user.patientprofile
+        except PatientProfile.DoesNotExist:
+            raise ValidationError("Patient profile not found.")
+
+        doctor = None
+        if doctor_user is not None:
+            try:
+                doctor = doctor_user.doctorprofile
+            except DoctorProfile.DoesNotExist:
+                raise ValidationError("Doctor profile not found.")
+            specialization = ""
+
+        if WaitlistRepository.has_active_entry(patient, doctor, specialization):
+            raise ValidationError("You are already on this waitlist.")
+        return WaitlistRepository.create_entry(
+            patient, doctor, specialization, priority, not_before, not_after
+        )
+
+    @staticmethod
+    @transaction.atomic
+    def leave(entry):
+        """
+        Take an entry off the waitlist, declining its pending offer.
+        Returns the entry, or None if it was no longer active.
+        """
+        if entry.status not in (WaitlistStatus.WAITING, WaitlistStatus.OFFERED):
+            return None
+        offer = entry.offers.filter(status=OfferStatus.PENDING).select_related("vacancy").first()
+        if offer:
+            WaitlistService._close_offer(offer, OfferStatus.DECLINED, timezone.now())
+        WaitlistRepository.set_entry_status(entry.id, WaitlistStatus.LEFT)
+        entry.status = WaitlistStatus.LEFT
+        return entry
+
+    @staticmethod
+    def add_vacancy(appointment, slot_id=None):
+        """
+        Record a cancelled future time for the waitlist.
+        Returns the vacancy, or None when the time has passed or nobody waits.
+        """
+        if appointment.scheduled_time <= timezone.now():
+            return None
+        if not WaitlistRepository.has_waiting_entry(appointment.doctor):
+            return None
+        return WaitlistRepository.create_vacancy(appointment, slot_id)
+
+    @staticmethod
+    def _is_eligible(entry, vacancy, offered):
+        """Whether an entry may be offered a vacancy"""
+        if (vacancy.id, entry.id) in offered or entry.patient_id == vacancy.source_patient_id:
+            return False
+        if entry.not_before and vacancy.scheduled_time < entry.not_before:
+            return False
+        if entry.not_after and vacancy.scheduled_time > entry.not_after:
+            return False
+        return True
+
+    @staticmethod
+    def match(vacancies, entries, offered):
+        """
+        Pair vacancies, in order, with the best eligible entry.
+        - entries: waiting entries; each is matched at most once
+        - offered: (vacancy_id, entry_id) pairs never to offer again
+        - Returns [(vacancy, entry)] for the vacancies that found someone
+        """
+        # One heap per doctor and per specialization; an entry sits in one
+        heaps = {}
+        for entry in entries:
+            key = ("doctor", entry.doctor_id) if entry.doctor_id else ("specialization", entry.specialization)
+            heaps.setdefault(key, []).append((-entry.priority, entry.created_at, entry.id, entry))
+        for heap in heaps.values():
+            heapq.heapify(heap)
+
+        matched = []
+        for vacancy in vacancies:
+            candidates = [
+                heap for heap in (
+                    heaps.get(("doctor", vacancy.doctor_id)),
+                    heaps.get(("specialization", vacancy.specialization)),
+                ) if heap
+            ]
+            skipped = []
+            while True:
+                # Best head across the doctor's and the specialization's heap
+                heads = [heap for heap in candidates if heap]
+                if not heads:
+                    break
+                heap = min(heads, key=lambda h: h[0][:3])
+                item = heapq.heappop(heap)
+                if WaitlistService._is_eligible(item[3], vacancy, offered):
+                    matched.append((vacancy, item[3]))
+                    break
+                skipped.append((heap, item))
+            # Ineligible here, but still candidates for later vacancies
+            for heap, item in skipped:
+                heapq.heappush(heap, item)
+        return matched
+
+    @staticmethod
+    def _release_holds(slot_ids):
+        """Release offer holds; returns the ids of the slots actually freed"""
+        return [slot_id for slot_id in slot_ids if AvailabilitySlotRepository.release_hold(slot_id)]
+
+    @staticmethod
+    def _slots_changed(slot_ids):
+        """Notify the schedules read models about held or released slots"""
+        if slot_ids:
+            AppointmentBookingService._slots_changed(*AvailabilitySlotRepository.get_slot_scopes(slot_ids))
+
+    @staticmethod
+    @transaction.atomic
+    def process_batch(config, now, checked_before):
+        """
+        Offer one batch of open vacancies.
+        - checked_before: vacancies checked since then are left for the next run
+        - Returns (vacancy count, offers made)
+        """
+        # Slots held or released by this batch, notified once at the end
+        touched = []
+        past = WaitlistRepository.get_past_vacancies(now)
+        if past:
+            WaitlistRepository.update_vacancies([row[0] for row in past], status=VacancyStatus.EXPIRED)
+            touched += WaitlistService._release_holds(slot_id for _, slot_id, held in past if held)
+
+        vacancies = WaitlistRepository.get_open_vacancies(now, config["batch_size"], checked_before)
+        if not vacancies:
+            WaitlistService._slots_changed(touched)
+            return 0, []
+
+        closed = [vacancy for vacancy in vacancies if vacancy.on_leave]
+        if closed:
+            WaitlistRepository.update_vacancies([vacancy.id for vacancy in closed], status=VacancyStatus.EXPIRED)
+            touched += WaitlistService._release_holds(vacancy.slot_id for vacancy in closed if vacancy.slot_held)
+        live = [vacancy for vacancy in vacancies if not vacancy.on_leave]
+
+        entries = WaitlistRepository.get_candidates(
+            {vacancy.doctor_id for vacancy in live},
+            {vacancy.specialization for vacancy in live}
+        )
+        offered = WaitlistRepository.get_offered_pairs(vacancy.id for vacancy in live)
+        matched = WaitlistService.match(live, entries, offered)
+
+        offers = []
+        lost = []
+        held = []
+        for vacancy, entry in matched:
+            if vacancy.slot_id:
+                # The hold is a claim without an appointment, moved to the
+                # newly offered patient; it fails if the slot was booked or
+                # masked since the cancellation
+                if vacancy.slot_held:
+                    AvailabilitySlotRepository.release_hold(vacancy.slot_id)
+                if not AvailabilitySlotRepository.claim_slot(
+                    vacancy.slot_id, AvailabilitySlotRepository.patient_id_for_user(entry.patient.user_id)
+                ):
+                    lost.append(vacancy.id)
+                    continue
+                held.append(vacancy.id)
+                touched.append(vacancy.slot_id)
+            offers.append(WaitlistOffer(
+                vacancy=vacancy,
+                entry=entry,
+                expires_at=now + timedelta(minutes=config["hold_minutes"])
+            ))
+
+        if lost:
+            WaitlistRepository.update_vacancies(lost, status=VacancyStatus.EXPIRED, slot_held=False)
+        if held:
+            WaitlistRepository.update_vacancies(held, slot_held=True)
+        if offers:
+            WaitlistRepository.create_offers(offers)
+
+        matched_ids = {vacancy.id for vacancy, _ in matched}
+        unmatched = [vacancy for vacancy in live if vacancy.id not in matched_ids]
+        if unmatched:
+            # Nobody eligible: free held slots for open booking and move to the back
+            touched += WaitlistService._release_holds(
+                vacancy.slot_id for vacancy in unmatched if vacancy.slot_held
+            )
+            WaitlistRepository.update_vacancies(
+                [vacancy.id for vacancy in unmatched], checked_at=now, slot_held=False
+            )
+        WaitlistService._slots_changed(touched)
+        return len(vacancies), offers
+
+    @staticmethod
+    def notify(offers, template, mail_connection):
+        """Email offered patients; returns the number of messages sent"""
+        messages = []
+        for offer in offers:
+            patient_user = offer.entry.patient.user
+            if not patient_user.email:
+                continue
+            doctor_user = offer.vacancy.doctor.user
+            context = {
+                "patient_name": patient_user.get_full_name() or patient_user.username,
+                "doctor_name": doctor_user.get_full_name() or doctor_user.username,
+                "when": timezone.localtime(offer.vacancy.scheduled_time).strftime("%A, %B %d at %I:%M %p"),
+                "expires": timezone.localtime(offer.expires_at).strftime("%I:%M %p"),
+            }
+            messages.append(EmailMessage(
+                subject=WaitlistService.SUBJECT,
+                body=template.render(context),
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                to=[patient_user.email],
+                connection=mail_connection,
+            ))
+        if not messages:
+            return 0
+        return mail_connection.send_messages(messages) or 0
+
+    @staticmethod
+    def run(**overrides):
+        """
+        Expire lapsed offers, then offer open vacancies batch by batch until
+        each has been looked at once or max_batches is hit.
+        - Returns vacancy/offer/email/batch counts and the error of a failed batch
+        """
+        config = WaitlistService.get_config(**overrides)
+        stats = {"expired": 0, "vacancies": 0, "offers": 0, "notified": 0, "batches": 0, "error": None}
+        started = timezone.now()
+        stats["expired"] = WaitlistRepository.expire_offers(started)
+        template = get_template(WaitlistService.TEXT_TEMPLATE)
+
+        with get_connection() as mail_connection:
+            while stats["batches"] < config["max_batches"]:
+                try:
+                    count, offers = WaitlistService.process_batch(config, timezone.now(), started)
+                except Exception as e:
+                    logger.exception("Waitlist batch failed and was rolled back")
+                    stats["error"] = str(e)
+                    break
+                if not count:
+                    break
+                stats["batches"] += 1
+                stats["vacancies"] += count
+                stats["offers"] += len(offers)
+                try:
+                    stats["notified"] += WaitlistService.notify(offers, template, mail_connection)
+                except Exception:
+                    # Offers stand; patients still see them on their waitlist page
+                    logger.exception("Waitlist offer emails failed")
+                if count < config["batch_size"]:
+                    break
+
+        return stats
+
+    @staticmethod
+    def _close_offer(offer, status, now):
+        """
+        Decline or expire a pending offer: the entry waits again and the
+        vacancy goes back to the front of the queue, keeping its hold.
+        """
+        if not WaitlistRepository.close_offer(offer, status, now):
+            return False
+        WaitlistRepository.set_entry_status(offer.entry_id, WaitlistStatus.WAITING)
+        WaitlistRepository.update_vacancies([offer.vacancy_id], status=VacancyStatus.OPEN, checked_at=None)
+        return True
+
+    @staticmethod
+    def decline_offer(offer_id, patient_user):
+        """
+        Decline a pending offer; the patient stays on the waitlist.
+        Returns True, or False if the offer is not a live offer of this patient.
+        """
+        now = timezone.now()
+        offer = WaitlistRepository.get_pending_offer(offer_id, patient_user, now)
+        if offer is None:
+            return False
+        with transaction.atomic():
+            return WaitlistService._close_offer(offer, OfferStatus.DECLINED, now)
+
+    @staticmethod
+    def accept_offer(offer_id, patient_user, reason=None):
+        """
+        Book the offered time for the patient and return the appointment.
+        - Raises ValidationError if the offer is gone, expired or the time
+          could not be booked (the vacancy is then closed)
+        """
+        now = timezone.now()
+        offer = WaitlistRepository.get_pending_offer(offer_id, patient_user, now)
+        if offer is None:
+            raise ValidationError("This offer is no longer available.")
+        vacancy = offer.vacancy
+
+        with transaction.atomic():
+            if not WaitlistRepository.close_offer(offer, OfferStatus.ACCEPTED, now):
+                raise ValidationError("This offer is no longer available.")
+            error = None
+            try:
+                with transaction.atomic():
+                    if vacancy.slot_id:
+                        # Drop the hold and book the slot in one step
+                        AvailabilitySlotRepository.release_hold(vacancy.slot_id)
+                        appointment = AppointmentBookingService.book(patient_user, vacancy.slot_id, reason)
+                    else:
+                        appointment = AppointmentService.create_appointment(
+                            patient_user, vacancy.doctor.user, vacancy.scheduled_time, reason
+                        )
+            except ValidationError as e:
+                error = e
+                appointment = None
+
+            if appointment is not None:
+                WaitlistRepository.set_entry_status(offer.entry_id, WaitlistStatus.BOOKED)
+                WaitlistRepository.update_vacancies([vacancy.id], status=VacancyStatus.FILLED, slot_held=False)
+                return appointment
+
+            # The time went elsewhere (or the slot was masked): close the
+            # vacancy and put the patient back on the waitlist
+            WaitlistRepository.set_offer_status(offer.id, OfferStatus.EXPIRED)
+            WaitlistRepository.set_entry_status(offer.entry_id, WaitlistStatus.WAITING)
+            WaitlistRepository.update_vacancies([vacancy.id], status=VacancyStatus.EXPIRED)
+            if vacancy.slot_held:
+                WaitlistService._slots_changed(WaitlistService._release_holds([vacancy.slot_id]))
+                WaitlistRepository.update_vacancies([vacancy.id], slot_held=False)
+        raise ValidationError(error.messages[0], code=getattr(error, "code", None))
@@ -1,9 +1,7 @@
 from celery import shared_task
-from django.core.mail import send_mail
-from django.utils import timezone
 import logging
 
-from .models import Appointment, AppointmentStatus
+from .services import AppointmentReminderService, WaitlistService
 
 logger = logging.getLogger(__name__)
 
@@ -11,48 +9,53 @@ logger = logging.getLogger(__name__)
 @shared_task
 def send_appointment_reminder(appointment_id):
     """
-    Celery task to send an appointment reminder email.
-    - Only sends for pending/confirmed appointments.
-    - Uses both plain text and HTML formats.
+    Celery task to send the reminder email for one appointment.
+    - Only sends for pending/confirmed appointments within the reminder window;
+      later ones are left to send_due_appointment_reminders.
+    - Goes through the reminder log, so a retried task never sends twice.
+    """
+    stats = AppointmentReminderService.run(appointment_ids=[appointment_id])
+    if stats["error"]:
+        logger.error(f"Reminder for appointment {appointment_id} failed: {stats['error']}")
+    elif stats["sent"]:
+        logger.info(f"Reminder sent for appointment {appointment_id}")
+    else:
+        logger.info(f"Skipping reminder: appointment {appointment_id} is not due or already reminded")
+
+
+@shared_task
+def send_due_appointment_reminders(window_hours=None, batch_size=None):
+    """
+    Send reminders for every appointment starting within the window.
+    Should be scheduled to run hourly.
     """
     try:
-        appointment = Appointment.objects.get(id=appointment_id)
-
-        # Only send reminders for active appointments
-        if appointment.status not in [AppointmentStatus.PENDING, AppointmentStatus.CONFIRMED]:
-            logger.info(f"Skipping reminder: appointment {appointment_id} has status {appointment.status}")
-            return
-
-        subject = "Appointment Reminder"
-        patient_name = appointment.patient.get_full_name() or appointment.patient.username
-        doctor_name = appointment.doctor.get_full_name() or appointment.doctor.username
-        scheduled_time = timezone.localtime(appointment.scheduled_time).strftime("%A, %B %d at %I:%M %p")
-
-        message = (
-            f"Dear {patient_name},\n\n"
-            f"This is a reminder that you have an appointment with Dr. {doctor_name} "
-            f"on {scheduled_time}.\n\n"
-            "Please ensure you are available at the scheduled time.\n\n"
-            "Best regards,\nMedApp Team"
+        stats = AppointmentReminderService.run(window_hours=window_hours, batch_size=batch_size)
+        if stats["error"]:
+            return f"Sent {stats['sent']} appointment reminders before failing: {stats['error']}"
+        return (
+            f"Sent {stats['sent']} appointment reminders in {stats['batches']} batches "
+            f"({stats['skipped']} without an email address)"
         )
 
-        html_message = f"""
-            <p>Dear <strong>{patient_name}</strong>,</p>
-            <p>This is a reminder that you have an appointment with <strong>Dr. {doctor_name}</strong> 
-            on <strong>{scheduled_time}</strong>.</p>
-            <p>Please ensure you are available at the scheduled time.</p>
-            <p>Best regards,<br><em>MedApp Team</em></p>
-        """
-
-        send_mail(
-            subject,
-            message,
-            'noreply@medapp.com',
-            [appointment.patient.email],
-            html_message=html_message,
-        )
+    except Exception as e:
+        return f"Error sending appointment reminders: {str(e)}"
 
-        logger.info(f"Reminder sent for appointment {appointment_id}")
 
-    except Appointment.DoesNotExist:
-        logger.error(f"Appointment {appointment_id} does not exist")
+@shared_task
+def process_waitlist_offers(batch_size=None, hold_minutes=None):
+    """
+    Expire lapsed waitlist offers and offer freed times to waiting patients.
+    Vacancies are matched a batch at a time; should be scheduled every minute.
+    """
+    try:
+        stats = WaitlistService.run(batch_size=batch_size, hold_minutes=hold_minutes)
+        if stats["error"]:
+            return f"Made {stats['offers']} waitlist offers before failing: {stats['error']}"
+        return (
+            f"Made {stats['offers']} waitlist offers for {stats['vacancies']} vacancies "
+            f"in {stats['batches']} batches ({stats['expired']} offers expired)"
+        )
+
+    except Exception as e:
+        return f"Error processing waitlist offers: {str(e)}"
@@ -1,7 +1,26 @@
-from django.test import TestCase
+from io import StringIO
+from unittest import mock
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.contrib.auth import get_user_model
-from appointments.services import AppointmentService
-from datetime import datetime, timedelta
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from accounts.models import DoctorProfile as SlotDoctorProfile, HospitalProfile, PatientProfile as SlotPatientProfile
+from appointments.models import (
+    Appointment, AppointmentReminderLog, AppointmentStatus,
+    WaitlistStatus, WaitlistVacancy, VacancyStatus, WaitlistOffer, OfferStatus,
+)
+from appointments.services import (
+    AppointmentService, AppointmentBookingService, AppointmentPaginationService, AppointmentReminderService,
+    WaitlistService,
+)
+from schedules.models import AvailabilitySlot, DoctorDailyAvailability, DoctorLeave, Duty, Shift
+from schedules.services import SlotGenerationEngine, SlotMaskingService
+from datetime import date, datetime, time, timedelta
 
 User = get_user_model()
 
@@ -22,3 +41,432 @@ class AppointmentServiceTest(TestCase):
 
         cancelled = AppointmentService.cancel_appointment(appointment.id, self.patient)
         self.assertEqual(cancelled.status, 'cancelled')
+
+
+class AppointmentDoubleBookingTest(TestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user(username='pt_double', password='pass', role='PATIENT')
+        self.other_patient = User.objects.create_user(username='pt_double_2', password='pass', role='PATIENT')
+        self.doctor = User.objects.create_user(username='dr_double', password='pass', role='DOCTOR')
+        self.scheduled_time = (timezone.now() + timedelta(days=2)).replace(microsecond=0)
+
+    def test_second_active_booking_fails_without_a_pre_check(self):
+        AppointmentService.create_appointment(self.patient, self.doctor, self.scheduled_time)
+        with CaptureQueriesContext(connection) as ctx:
+            with self.assertRaises(ValidationError) as raised:
+                AppointmentService.create_appointment(self.other_patient, self.doctor, self.scheduled_time)
+        self.assertEqual(raised.exception.code, 'double_booking')
+        self.assertFalse(any(q['sql'].lstrip().startswith('SELECT (1) AS "a"') for q in ctx.captured_queries))
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_cancelled_time_can_be_rebooked(self):
+        first = AppointmentService.create_appointment(self.patient, self.doctor, self.scheduled_time)
+        first.cancel()
+        second = AppointmentService.create_appointment(self.other_patient, self.doctor, self.scheduled_time)
+        self.assertEqual(second.status, AppointmentStatus.PENDING)
+
+    def test_reschedule_onto_an_active_time_fails(self):
+        AppointmentService.create_appointment(self.patient, self.doctor, self.scheduled_time)
+        other = AppointmentService.create_appointment(
+            self.other_patient, self.doctor, self.scheduled_time + timedelta(hours=1)
+        )
+        self.assertIsNone(AppointmentService.reschedule_appointment(other.id, self.scheduled_time))
+        new_time = self.scheduled_time + timedelta(hours=2)
+        moved = AppointmentService.reschedule_appointment(other.id, new_time)
+        self.assertEqual(moved.scheduled_time, new_time)
+        with self.assertRaises(ValidationError):
+            moved.reschedule(self.scheduled_time)
+        self.assertEqual(moved.scheduled_time, new_time)
+
+
+class AppointmentBookingBenchmarkTest(TransactionTestCase):
+    def test_benchmark_reports_no_double_booking(self):
+        out = StringIO()
+        call_command('benchmark_appointment_booking', threads=4, attempts=40, times=5, seed=1, stdout=out)
+        self.assertIn('No double bookings', out.getvalue())
+        self.assertIn('conflict_rate=', out.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='bench_appt_').exists())
+
+
+class AppointmentBookingServiceTest(TestCase):
+    def setUp(self):
+        self.doctor_user = User.objects.create_user(username='dr_booking', password='pass', role='DOCTOR')
+        self.patient_user = User.objects.create_user(username='pt_booking', password='pass', role='PATIENT')
+        self.other_user = User.objects.create_user(username='pt_booking_2', password='pass', role='PATIENT')
+        hospital_user = User.objects.create_user(username='hosp_booking', password='pass', role='HOSPITAL')
+        self.slot_doctor = SlotDoctorProfile.objects.create(
+            user=self.doctor_user, specialization='cardiology', license_number='B-1'
+        )
+        self.slot_patient = SlotPatientProfile.objects.create(user=self.patient_user, date_of_birth=date(1990, 1, 1))
+        SlotPatientProfile.objects.create(user=self.other_user, date_of_birth=date(1991, 1, 1))
+        hospital = HospitalProfile.objects.create(user=hospital_user, hospital_name='Booking Hospital', license_number='H-B')
+
+        self.day = timezone.now().date() + timedelta(days=14)
+        duty = Duty.objects.create(doctor=self.slot_doctor, hospital=hospital, duty_type='OPD', start_date=self.day)
+        shift = Shift.objects.create(duty=duty, day_of_week=self.day.weekday(), start_time=time(9, 0), end_time=time(10, 0))
+        SlotGenerationEngine.generate([shift], self.day, self.day)
+        self.slot, self.later_slot = AvailabilitySlot.objects.filter(shift=shift).order_by('start_time')
+
+    def test_booking_claims_and_links_the_slot_in_one_update(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as ctx:
+                appointment = AppointmentBookingService.book(self.patient_user, self.slot.id, reason='Chest pain')
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "appointments_appointment"')]
+        slot_updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "schedules_availabilityslot"')]
+        self.assertEqual((len(inserts), len(slot_updates)), (1, 1))
+        # The read models are refreshed after commit, outside the booking
+        self.assertFalse([
+            q for q in ctx.captured_queries
+            if 'schedules_earliestslotindex' in q['sql'] or 'schedules_doctordailyavailability' in q['sql']
+        ])
+
+        self.slot.refresh_from_db()
+        self.assertEqual(self.slot.appointment_id, appointment.id)
+        self.assertEqual(self.slot.booked_by_id, self.slot_patient.id)
+        self.assertEqual(timezone.localtime(appointment.scheduled_time).time(), time(9, 0))
+        self.assertEqual(DoctorDailyAvailability.objects.get(date=self.day).booked_slots, 1)
+
+        with self.assertRaises(ValidationError) as raised:
+            AppointmentBookingService.book(self.other_user, self.slot.id)
+        self.assertEqual(raised.exception.code, 'double_booking')
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_unavailable_slot_rolls_the_appointment_back(self):
+        SlotMaskingService.mask([self.slot_doctor.id], self.day, self.day)
+        with self.assertRaises(ValidationError) as raised:
+            AppointmentBookingService.book(self.patient_user, self.slot.id)
+        self.assertEqual(raised.exception.code, 'slot_unavailable')
+        self.assertFalse(Appointment.objects.exists())
+
+    def test_cancel_frees_the_slot_for_rebooking(self):
+        appointment = AppointmentBookingService.book(self.patient_user, self.slot.id)
+        cancelled = AppointmentService.cancel_appointment(appointment.id, self.patient_user)
+        self.assertEqual(cancelled.status, AppointmentStatus.CANCELLED)
+        self.slot.refresh_from_db()
+        self.assertFalse(self.slot.is_booked)
+        self.assertIsNone(self.slot.appointment_id)
+        self.assertIsNone(AppointmentBookingService.cancel(appointment))
+
+        rebooked = AppointmentBookingService.book(self.other_user, self.slot.id)
+        self.assertEqual(rebooked.scheduled_time, appointment.scheduled_time)
+
+    def test_time_only_reschedule_releases_the_slot(self):
+        appointment = AppointmentBookingService.book(self.patient_user, self.slot.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            moved = AppointmentService.reschedule_appointment(
+                appointment.id, appointment.scheduled_time + timedelta(hours=3)
+            )
+        self.assertEqual(moved.scheduled_time, appointment.scheduled_time + timedelta(hours=3))
+        self.slot.refresh_from_db()
+        self.assertFalse(self.slot.is_booked)
+        self.assertIsNone(self.slot.appointment_id)
+        self.assertEqual(DoctorDailyAvailability.objects.get(date=self.day).booked_slots, 0)
+
+    def test_reschedule_moves_the_booking_between_slots(self):
+        appointment = AppointmentBookingService.book(self.patient_user, self.slot.id)
+        AppointmentBookingService.reschedule(appointment, self.later_slot.id)
+        self.slot.refresh_from_db()
+        self.later_slot.refresh_from_db()
+        self.assertFalse(self.slot.is_booked)
+        self.assertEqual(self.later_slot.appointment_id, appointment.id)
+        self.assertEqual(timezone.localtime(appointment.scheduled_time).time(), self.later_slot.start_time)
+
+        blocker = AppointmentBookingService.book(self.other_user, self.slot.id)
+        with self.assertRaises(ValidationError):
+            AppointmentBookingService.reschedule(appointment, self.slot.id)
+        self.later_slot.refresh_from_db()
+        self.assertEqual(self.later_slot.appointment_id, appointment.id)
+        self.assertEqual(Appointment.objects.get(id=appointment.id).scheduled_time, appointment.scheduled_time)
+        self.assertNotEqual(blocker.scheduled_time, appointment.scheduled_time)
+
+
+class AppointmentPaginationTest(TestCase):
+    def setUp(self):
+        patients = [
+            User.objects.create_user(username=f'pt_page_{index}', password='pass', role='PATIENT').patientprofile
+            for index in range(2)
+        ]
+        doctors = [
+            User.objects.create_user(username=f'dr_page_{index}', password='pass', role='DOCTOR').doctorprofile
+            for index in range(4)
+        ]
+        start = (timezone.now() + timedelta(days=1)).replace(microsecond=0)
+        # Three doctors share each time, so ids break the ties
+        for hour in range(3):
+            for doctor in doctors[:3]:
+                Appointment.objects.create(
+                    patient=patients[hour % 2], doctor=doctor, scheduled_time=start + timedelta(hours=hour)
+                )
+        Appointment.objects.create(patient=patients[0], doctor=doctors[3], scheduled_time=start)
+        self.expected = list(Appointment.objects.order_by('scheduled_time', 'id'))
+
+    def walk(self, descending=False):
+        seen, cursor = [], None
+        while True:
+            with CaptureQueriesContext(connection) as ctx:
+                page = AppointmentPaginationService.paginate(
+                    Appointment.objects.all(), cursor=cursor, limit=4, descending=descending
+                )
+            self.assertEqual(len(ctx.captured_queries), 1)
+            seen.append(page)
+            cursor = page['next_cursor']
+            if cursor is None:
+                return seen
+
+    def test_pages_cover_every_row_once_in_order(self):
+        pages = self.walk()
+        self.assertEqual([len(page['items']) for page in pages], [4, 4, 2])
+        self.assertEqual([row for page in pages for row in page['items']], self.expected)
+        self.assertIsNone(pages[0]['previous_cursor'])
+
+        descending = self.walk(descending=True)
+        self.assertEqual([row for page in descending for row in page['items']], self.expected[::-1])
+
+    def test_previous_cursor_returns_the_prior_page(self):
+        pages = self.walk()
+        back = AppointmentPaginationService.paginate(
+            Appointment.objects.all(), cursor=pages[2]['previous_cursor'], limit=4
+        )
+        self.assertEqual(back['items'], pages[1]['items'])
+        self.assertEqual(back['next_cursor'], pages[1]['next_cursor'])
+        first = AppointmentPaginationService.paginate(
+            Appointment.objects.all(), cursor=back['previous_cursor'], limit=4
+        )
+        self.assertEqual(first['items'], pages[0]['items'])
+        self.assertIsNone(first['previous_cursor'])
+
+    def test_invalid_cursor_is_rejected(self):
+        for cursor in ('garbage', 'eHx5fHo'):
+            with self.assertRaises(ValidationError):
+                AppointmentPaginationService.paginate(Appointment.objects.all(), cursor=cursor)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class AppointmentReminderServiceTest(TestCase):
+    def setUp(self):
+        self.doctor = User.objects.create_user(
+            username='dr_remind', password='pass', role='DOCTOR', first_name='Ada', last_name='Cole'
+        ).doctorprofile
+        self.now = timezone.now()
+
+    def book(self, hours, email='pt@example.com', status=AppointmentStatus.PENDING):
+        index = Appointment.objects.count()
+        patient = User.objects.create_user(
+            username=f'pt_remind_{index}', password='pass', role='PATIENT', email=email, first_name=f'P{index}'
+        ).patientprofile
+        return Appointment.objects.create(
+            patient=patient, doctor=self.doctor, status=status,
+            scheduled_time=self.now + timedelta(hours=hours, minutes=index)
+        )
+
+    def test_window_batches_render_once_and_never_resend(self):
+        self.book(2)
+        self.book(5, email='')
+        self.book(30)
+        self.book(3, status=AppointmentStatus.CANCELLED)
+
+        stats = AppointmentReminderService.run(batch_size=1)
+        self.assertEqual((stats['sent'], stats['skipped'], stats['batches']), (1, 1, 2))
+        self.assertEqual(len(mail.outbox), 1)
+        message = mail.outbox[0]
+        self.assertEqual(message.to, ['pt@example.com'])
+        self.assertIn('Dr. Ada Cole', message.body)
+        self.assertIn('<strong>P0</strong>', message.alternatives[0][0])
+
+        self.assertEqual(AppointmentReminderService.run()['sent'], 0)
+        self.assertEqual(AppointmentReminderLog.objects.filter(sent_at__isnull=False).count(), 2)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        for hours in (1, 2):
+            self.book(hours)
+        with CaptureQueriesContext(connection) as small:
+            AppointmentReminderService.run()
+        for hours in range(1, 7):
+            self.book(hours)
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(AppointmentReminderService.run()['sent'], 6)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_failed_batch_is_released_and_retried(self):
+        self.book(1)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            with self.assertLogs('appointments.services', 'ERROR'):
+                stats = AppointmentReminderService.run()
+        self.assertEqual((stats['sent'], stats['error']), (0, 'down'))
+        self.assertFalse(AppointmentReminderLog.objects.filter(claim_token__isnull=False).exists())
+        self.assertEqual(AppointmentReminderService.run()['sent'], 1)
+
+    def test_failure_mid_batch_never_resends_delivered_reminders(self):
+        self.book(1, email='first@example.com')
+        self.book(2, email='second@example.com')
+        deliver = EmailBackend.send_messages
+        calls = []
+
+        def flaky(backend, messages):
+            calls.append(messages)
+            if len(calls) > 1:
+                raise OSError('down')
+            return deliver(backend, messages)
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', flaky):
+            with self.assertLogs('appointments.services', 'ERROR'):
+                stats = AppointmentReminderService.run()
+        self.assertEqual(stats['error'], 'down')
+        self.assertEqual(AppointmentReminderService.run()['sent'], 1)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['first@example.com', 'second@example.com'])
+
+    def test_rescheduled_appointment_is_reminded_again(self):
+        appointment = self.book(1)
+        AppointmentReminderService.run()
+        Appointment.objects.filter(id=appointment.id).update(scheduled_time=self.now + timedelta(hours=4))
+        self.assertEqual(AppointmentReminderService.run(appointment_ids=[appointment.id])['sent'], 1)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_per_appointment_reminder_waits_for_the_window(self):
+        appointment = self.book(48)
+        self.assertEqual(AppointmentReminderService.run(appointment_ids=[appointment.id])['sent'], 0)
+        self.assertFalse(AppointmentReminderLog.objects.filter(sent_at__isnull=False).exists())
+        self.assertEqual(AppointmentReminderService.run(window_hours=72)['sent'], 1)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class WaitlistServiceTest(TestCase):
+    def setUp(self):
+        self.doctor_user = User.objects.create_user(username='dr_wait', password='pass', role='DOCTOR')
+        self.doctor_user.doctorprofile.specialization = 'cardiology'
+        self.doctor_user.doctorprofile.save()
+        hospital_user = User.objects.create_user(username='hosp_wait', password='pass', role='HOSPITAL')
+        self.slot_doctor = SlotDoctorProfile.objects.create(
+            user=self.doctor_user, specialization='cardiology', license_number='W-1'
+        )
+        hospital = HospitalProfile.objects.create(user=hospital_user, hospital_name='Wait Hospital', license_number='H-W')
+
+        self.booker, self.early, self.urgent, self.later_urgent = [
+            User.objects.create_user(username=f'pt_wait_{i}', password='pass', role='PATIENT', email=f'pt{i}@example.com')
+            for i in range(4)
+        ]
+        for i, user in enumerate([self.booker, self.early, self.urgent, self.later_urgent]):
+            SlotPatientProfile.objects.create(user=user, date_of_birth=date(1990, 1, i + 1))
+
+        self.day = timezone.now().date() + timedelta(days=14)
+        duty = Duty.objects.create(doctor=self.slot_doctor, hospital=hospital, duty_type='OPD', start_date=self.day)
+        shift = Shift.objects.create(duty=duty, day_of_week=self.day.weekday(), start_time=time(9, 0), end_time=time(10, 0))
+        SlotGenerationEngine.generate([shift], self.day, self.day)
+        self.slot, self.later_slot = AvailabilitySlot.objects.filter(shift=shift).order_by('start_time')
+
+        # Doctor waitlist at priority 0, then two priority 5 entries; the
+        # specialization entry joined first
+        WaitlistService.join(self.early, doctor_user=self.doctor_user)
+        self.urgent_entry = WaitlistService.join(self.urgent, specialization='cardiology', priority=5)
+        self.later_entry = WaitlistService.join(self.later_urgent, doctor_user=self.doctor_user, priority=5)
+
+    def _cancel(self, slot):
+        appointment = AppointmentBookingService.book(self.booker, slot.id)
+        AppointmentService.cancel_appointment(appointment.id, self.booker)
+        return appointment
+
+    def test_cancellation_offers_and_holds_the_slot_for_the_best_entry(self):
+        self._cancel(self.slot)
+        vacancy = WaitlistVacancy.objects.get()
+        self.assertEqual((vacancy.slot_id, vacancy.status), (self.slot.id, VacancyStatus.OPEN))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = WaitlistService.run()
+        self.assertEqual((stats['offers'], stats['notified']), (1, 1))
+        offer = WaitlistOffer.objects.get()
+        self.assertEqual(offer.entry_id, self.urgent_entry.id)
+        self.assertEqual(mail.outbox[0].to, ['pt2@example.com'])
+
+        # Held: booked for the offered patient, without an appointment
+        self.slot.refresh_from_db()
+        self.assertTrue(self.slot.is_booked)
+        self.assertIsNone(self.slot.appointment_id)
+        with self.assertRaises(ValidationError):
+            AppointmentBookingService.book(self.early, self.slot.id)
+        # The read models stop advertising the held slot
+        self.assertEqual(DoctorDailyAvailability.objects.get(date=self.day).available_slots, 1)
+
+    def test_accepting_books_the_held_slot(self):
+        cancelled = self._cancel(self.slot)
+        WaitlistService.run()
+        offer = WaitlistOffer.objects.get()
+
+        appointment = WaitlistService.accept_offer(offer.id, self.urgent)
+        self.assertEqual(appointment.scheduled_time, cancelled.scheduled_time)
+        self.slot.refresh_from_db()
+        self.assertEqual(self.slot.appointment_id, appointment.id)
+        offer.refresh_from_db()
+        self.assertEqual(offer.status, OfferStatus.ACCEPTED)
+        self.assertEqual(offer.vacancy.status, VacancyStatus.FILLED)
+        self.assertEqual(offer.entry.status, WaitlistStatus.BOOKED)
+
+        with self.assertRaises(ValidationError):
+            WaitlistService.accept_offer(offer.id, self.urgent)
+
+    def test_expired_and_declined_offers_pass_to_the_next_entry(self):
+        self._cancel(self.slot)
+        WaitlistService.run()
+        WaitlistOffer.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        stats = WaitlistService.run()
+        self.assertEqual((stats['expired'], stats['offers']), (1, 1))
+        offer = WaitlistOffer.objects.get(status=OfferStatus.PENDING)
+        self.assertEqual(offer.entry_id, self.later_entry.id)
+        self.urgent_entry.refresh_from_db()
+        self.assertEqual(self.urgent_entry.status, WaitlistStatus.WAITING)
+
+        self.assertTrue(WaitlistService.decline_offer(offer.id, self.later_urgent))
+        WaitlistService.run()
+        offer = WaitlistOffer.objects.get(status=OfferStatus.PENDING)
+        self.assertEqual(offer.entry.patient.user, self.early)
+
+        # Everyone passed: the hold is released for open booking
+        WaitlistService.decline_offer(offer.id, self.early)
+        with self.captureOnCommitCallbacks(execute=True):
+            WaitlistService.run()
+        self.slot.refresh_from_db()
+        self.assertFalse(self.slot.is_booked)
+        self.assertEqual(DoctorDailyAvailability.objects.get(date=self.day).available_slots, 2)
+        self.assertEqual(WaitlistVacancy.objects.get().status, VacancyStatus.OPEN)
+
+    def test_batches_offer_each_vacancy_to_a_different_patient(self):
+        self._cancel(self.slot)
+        self._cancel(self.later_slot)
+
+        stats = WaitlistService.run(batch_size=1)
+        self.assertEqual((stats['batches'], stats['offers']), (2, 2))
+        self.assertEqual(
+            set(WaitlistOffer.objects.values_list('entry_id', flat=True)),
+            {self.urgent_entry.id, self.later_entry.id}
+        )
+
+    def test_rebooked_slots_are_not_offered(self):
+        self._cancel(self.slot)
+        AppointmentBookingService.book(self.booker, self.slot.id)
+
+        self.assertEqual(WaitlistService.run()['offers'], 0)
+        self.assertEqual(WaitlistVacancy.objects.get().status, VacancyStatus.EXPIRED)
+
+    def test_vacancies_on_leave_days_are_not_offered(self):
+        self._cancel(self.slot)
+        DoctorLeave.objects.create(
+            doctor=self.slot_doctor, leave_type='SICK', start_date=self.day, end_date=self.day, status='APPROVED'
+        )
+
+        stats = WaitlistService.run()
+        self.assertEqual(stats['offers'], 0)
+        self.assertFalse(WaitlistVacancy.objects.exclude(status=VacancyStatus.EXPIRED).exists())
+        self.slot.refresh_from_db()
+        self.assertFalse(self.slot.is_booked)
+
+    def test_no_vacancy_without_waiting_patients(self):
+        WaitlistService.leave(self.urgent_entry)
+        self.later_entry.refresh_from_db()
+        WaitlistService.leave(self.later_entry)
+        WaitlistService.leave(self.early.patientprofile.waitlist_entries.get())
+        self._cancel(self.slot)
+        self.assertFalse(WaitlistVacancy.objects.exists())
+
+        with self.assertRaises(ValidationError):
+            WaitlistService.join(self.early)
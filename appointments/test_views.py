@@ -1,6 +1,8 @@
 from rest_framework.test import APITestCase, APIClient
 from django.contrib.auth import get_user_model
+from django.urls import reverse
 from appointments.models import Appointment
+from appointments.services import AppointmentService, WaitlistService
 from django.utils import timezone
 from datetime import timedelta
 
@@ -25,3 +27,71 @@ class AppointmentViewTest(APITestCase):
         print("DATA:", response.data)
         self.assertEqual(response.status_code, 201)
         self.assertEqual(response.data['status'], 'pending')
+
+
+class AppointmentListPaginationTest(APITestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user(username='pt_list', password='pass', role='PATIENT')
+        start = timezone.now() + timedelta(days=1)
+        for index in range(5):
+            doctor = User.objects.create_user(username=f'dr_list_{index}', password='pass', role='DOCTOR')
+            Appointment.objects.create(
+                patient=self.patient.patientprofile, doctor=doctor.doctorprofile,
+                scheduled_time=start + timedelta(hours=index)
+            )
+        self.client.force_authenticate(user=self.patient)
+
+    def test_api_list_follows_next_links(self):
+        response = self.client.get(reverse('appointments:appointment-api-list'), {'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        ids = [item['id'] for item in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids.extend(item['id'] for item in response.data['results'])
+        self.assertEqual(ids, list(Appointment.objects.order_by('scheduled_time').values_list('id', flat=True)))
+
+        response = self.client.get(reverse('appointments:appointment-api-list'), {'cursor': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+
+
+class WaitlistApiTest(APITestCase):
+    def setUp(self):
+        self.doctor = User.objects.create_user(username='dr_wait_api', password='pass')
+        self.booker = User.objects.create_user(username='pt_wait_api_1', password='pass')
+        self.patient = User.objects.create_user(username='pt_wait_api_2', password='pass')
+        self.scheduled_time = timezone.now() + timedelta(days=5)
+        self.appointment = AppointmentService.create_appointment(self.booker, self.doctor, self.scheduled_time)
+        self.client.force_authenticate(user=self.patient)
+
+    def test_join_then_accept_the_offered_time(self):
+        response = self.client.post(reverse('appointments:waitlist'), {'doctor': self.doctor.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        AppointmentService.cancel_appointment(self.appointment.id, self.booker)
+        WaitlistService.run()
+        offers = self.client.get(reverse('appointments:waitlist')).data['offers']
+        self.assertEqual(len(offers), 1)
+
+        response = self.client.post(
+            reverse('appointments:waitlist-offer', args=[offers[0]['id'], 'accept']), format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        booked = Appointment.objects.get(id=response.data['id'])
+        self.assertEqual((booked.patient.user, booked.scheduled_time), (self.patient, self.scheduled_time))
+
+    def test_staff_enrol_patients_with_priority(self):
+        staff = User.objects.create_user(username='desk_wait_api', password='pass', is_staff=True)
+        self.client.force_authenticate(user=staff)
+        response = self.client.post(
+            reverse('appointments:waitlist'),
+            {'doctor': self.doctor.id, 'patient': self.patient.id, 'priority': 3},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        entry = self.patient.patientprofile.waitlist_entries.get()
+        self.assertEqual(entry.priority, 3)
+
+        # Patients cannot raise their own priority
+        self.client.force_authenticate(user=self.booker)
+        self.client.post(reverse('appointments:waitlist'), {'doctor': self.doctor.id, 'priority': 9}, format='json')
+        self.assertEqual(self.booker.patientprofile.waitlist_entries.get().priority, 0)
@@ -5,6 +5,9 @@ from .views import (
     appointment_list_view,
     AppointmentCancelView,  # ✅ added for cancellation
     appointment_detail_view,
+    WaitlistView,
+    WaitlistEntryView,
+    WaitlistOfferView,
 )
 from . import views  # ✅ import views module directly
 app_name = "appointments"
@@ -22,4 +25,9 @@ urlpatterns = [
     # -------------------------------
     path('api/', AppointmentViewSet.as_view({'get': 'list'}), name='appointment-api-list'),
     path('api/<int:pk>/', AppointmentViewSet.as_view({'get': 'retrieve'}), name='appointment-api-detail'),
+    path('api/waitlist/', WaitlistView.as_view(), name='waitlist'),
+    path('api/waitlist/<int:pk>/', WaitlistEntryView.as_view(), name='waitlist-entry'),
+    path(
+        'api/waitlist/offers/<int:pk>/<str:decision>/', WaitlistOfferView.as_view(), name='waitlist-offer'
+    ),
 ]
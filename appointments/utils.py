@@ -1,3 +1,4 @@
+import base64
 from datetime import datetime
 from django.utils import timezone
 
@@ -45,3 +46,29 @@ def is_future_datetime(dt):
     if not dt:
         return False
     return dt > timezone.now()
+
+
+def encode_cursor(direction, scheduled_time, appointment_id):
+    """
+    Opaque keyset cursor for appointment lists.
+    direction is "n" (rows after the key) or "p" (rows before it).
+    """
+    raw = f"{direction}|{scheduled_time.isoformat()}|{appointment_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Reverse of encode_cursor: (direction, scheduled_time, appointment_id).
+    Raises ValueError for anything that is not a cursor we issued.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        direction, scheduled_time, appointment_id = raw.split("|")
+        scheduled_time = datetime.fromisoformat(scheduled_time)
+        appointment_id = int(appointment_id)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if direction not in ("n", "p") or timezone.is_naive(scheduled_time):
+        raise ValueError("Invalid cursor")
+    return direction, scheduled_time, appointment_id
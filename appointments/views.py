@@ -1,16 +1,21 @@
 from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
+from rest_framework.utils.urls import replace_query_param
 from django.utils.dateparse import parse_datetime
 from django.views.generic import CreateView
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views import View
 from django.http import HttpResponseForbidden
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 
-from .models import Appointment, AppointmentStatus
-from .serializers import AppointmentSerializer
-from .services import AppointmentService
+from .models import Appointment, AppointmentStatus, WaitlistEntry
+from .serializers import AppointmentSerializer, WaitlistEntrySerializer, WaitlistOfferSerializer
+from .repositories import WaitlistRepository
+from .services import AppointmentService, AppointmentBookingService, AppointmentPaginationService, WaitlistService
 from .permissions import IsOwnerOrDoctor
 from .forms import AppointmentForm
 
@@ -26,12 +31,35 @@ class AppointmentViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
 
     def list(self, request, *args, **kwargs):
-        appointments = AppointmentService.get_upcoming_appointments(request.user)
-        serializer = AppointmentSerializer(appointments, many=True)
-        return Response(serializer.data)
+        """Upcoming appointments, soonest first, paged with ?cursor=&limit="""
+        try:
+            limit = int(request.query_params['limit']) if request.query_params.get('limit') else None
+            if limit is not None and limit < 1:
+                raise ValueError
+            page = AppointmentPaginationService.paginate(
+                AppointmentService.get_upcoming_appointments(request.user),
+                cursor=request.query_params.get('cursor'),
+                limit=limit
+            )
+        except ValueError:
+            return Response({'error': 'limit must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+        except ValidationError as e:
+            return Response({'error': e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+
+        url = request.build_absolute_uri()
+        return Response({
+            'next': replace_query_param(url, 'cursor', page['next_cursor']) if page['next_cursor'] else None,
+            'previous': (
+                replace_query_param(url, 'cursor', page['previous_cursor']) if page['previous_cursor'] else None
+            ),
+            'results': AppointmentSerializer(page['items'], many=True).data,
+        })
 
     def create(self, request, *args, **kwargs):
         data = request.data
+        if data.get('slot'):
+            return self._book_slot(request, data)
+
         from django.contrib.auth import get_user_model
         User = get_user_model()
 
@@ -45,17 +73,44 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         if not scheduled_time:
             return Response({'error': 'Invalid scheduled_time format'}, status=status.HTTP_400_BAD_REQUEST)
 
-        appointment = AppointmentService.create_appointment(
-            patient=request.user,
-            doctor=doctor,
-            scheduled_time=scheduled_time,
-            reason=data.get('reason')
-        )
+        try:
+            appointment = AppointmentService.create_appointment(
+                patient_user=request.user,
+                doctor_user=doctor,
+                scheduled_time=scheduled_time,
+                reason=data.get('reason')
+            )
+        except ValidationError as e:
+            return self._booking_error(e)
         serializer = AppointmentSerializer(appointment)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    def _book_slot(self, request, data):
+        """Book an availability slot: the appointment time comes from the slot"""
+        try:
+            slot_id = int(data['slot'])
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid slot'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            appointment = AppointmentBookingService.book(request.user, slot_id, reason=data.get('reason'))
+        except ValidationError as e:
+            return self._booking_error(e)
+        serializer = AppointmentSerializer(appointment)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def _booking_error(self, e):
+        """409 when the time or slot is taken, 400 for other validation errors"""
+        conflict = e.code in ('double_booking', 'slot_unavailable')
+        return Response(
+            {'error': e.messages[0]},
+            status=status.HTTP_409_CONFLICT if conflict else status.HTTP_400_BAD_REQUEST
+        )
+
     def update(self, request, *args, **kwargs):
         pk = kwargs.get('pk')
+        if request.data.get('slot'):
+            return self._reschedule_to_slot(request, pk)
+
         new_time = parse_datetime(request.data.get('scheduled_time'))
         if not new_time:
             return Response({'error': 'Invalid scheduled_time format'}, status=status.HTTP_400_BAD_REQUEST)
@@ -66,6 +121,21 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             return Response(serializer.data)
         return Response({'error': 'Unable to reschedule'}, status=status.HTTP_400_BAD_REQUEST)
 
+    def _reschedule_to_slot(self, request, pk):
+        """Move the appointment to another slot of the same doctor"""
+        try:
+            slot_id = int(request.data['slot'])
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid slot'}, status=status.HTTP_400_BAD_REQUEST)
+        appointment = get_object_or_404(Appointment, pk=pk)
+        if request.user not in [appointment.patient.user, appointment.doctor.user]:
+            return Response({'error': 'Unauthorized or not found'}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            appointment = AppointmentBookingService.reschedule(appointment, slot_id)
+        except ValidationError as e:
+            return self._booking_error(e)
+        return Response(AppointmentSerializer(appointment).data)
+
     def destroy(self, request, *args, **kwargs):
         pk = kwargs.get('pk')
         appointment = AppointmentService.cancel_appointment(pk, request.user)
@@ -74,6 +144,101 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         return Response({'error': 'Unauthorized or not found'}, status=status.HTTP_403_FORBIDDEN)
 
 
+# -------------------------------
+# Waitlist API (DRF)
+# -------------------------------
+class WaitlistView(APIView):
+    """
+    The user's waitlist entries and pending offers; POST joins a waitlist.
+    Staff may pass a patient user id and a priority.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response({
+            'entries': WaitlistEntrySerializer(WaitlistRepository.get_entries_for_user(request.user), many=True).data,
+            'offers': WaitlistOfferSerializer(WaitlistRepository.get_offers_for_user(request.user), many=True).data,
+        })
+
+    def post(self, request):
+        from django.contrib.auth import get_user_model
+        User = get_user_model()
+
+        data = request.data
+        doctor = None
+        if data.get('doctor'):
+            try:
+                doctor = User.objects.get(id=data.get('doctor'))
+            except (User.DoesNotExist, ValueError):
+                return Response({'error': 'Doctor not found'}, status=status.HTTP_400_BAD_REQUEST)
+
+        window = {}
+        for field in ('not_before', 'not_after'):
+            if data.get(field):
+                window[field] = parse_datetime(data.get(field))
+                if not window[field]:
+                    return Response({'error': f'Invalid {field} format'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Only staff may enrol another patient or queue one ahead of others
+        patient = request.user
+        priority = 0
+        if request.user.is_staff:
+            if data.get('patient'):
+                try:
+                    patient = User.objects.get(id=data.get('patient'))
+                except (User.DoesNotExist, ValueError):
+                    return Response({'error': 'Patient not found'}, status=status.HTTP_400_BAD_REQUEST)
+            if data.get('priority'):
+                try:
+                    priority = int(data.get('priority'))
+                except (TypeError, ValueError):
+                    return Response({'error': 'Invalid priority'}, status=status.HTTP_400_BAD_REQUEST)
+                if priority < 0:
+                    return Response({'error': 'Invalid priority'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            entry = WaitlistService.join(
+                patient,
+                doctor_user=doctor,
+                specialization=data.get('specialization') or '',
+                priority=priority,
+                **window
+            )
+        except ValidationError as e:
+            return Response({'error': e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(WaitlistEntrySerializer(entry).data, status=status.HTTP_201_CREATED)
+
+
+class WaitlistEntryView(APIView):
+    """DELETE leaves the waitlist"""
+    permission_classes = [IsAuthenticated]
+
+    def delete(self, request, pk):
+        entry = get_object_or_404(WaitlistEntry, pk=pk, patient__user=request.user)
+        if WaitlistService.leave(entry) is None:
+            return Response({'error': 'Entry is no longer active'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'status': 'left'})
+
+
+class WaitlistOfferView(APIView):
+    """POST accepts or declines an offer"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk, decision):
+        if decision not in ('accept', 'decline'):
+            return Response({'error': 'Unknown decision'}, status=status.HTTP_404_NOT_FOUND)
+        if decision == 'decline':
+            if not WaitlistService.decline_offer(pk, request.user):
+                return Response({'error': 'This offer is no longer available.'}, status=status.HTTP_404_NOT_FOUND)
+            return Response({'status': 'declined'})
+
+        try:
+            appointment = WaitlistService.accept_offer(pk, request.user, reason=request.data.get('reason'))
+        except ValidationError as e:
+            return Response({'error': e.messages[0]}, status=status.HTTP_409_CONFLICT)
+        return Response(AppointmentSerializer(appointment).data, status=status.HTTP_201_CREATED)
+
+
 # -------------------------------
 # Frontend CreateView
 # -------------------------------
@@ -90,7 +255,13 @@ class AppointmentCreateView(CreateView):
         except PatientProfile.DoesNotExist:
             return redirect('patients:profile')
         appointment.status = AppointmentStatus.PENDING
-        appointment.save()
+        try:
+            with transaction.atomic():
+                appointment.save()
+        except IntegrityError:
+            # Lost a race with a concurrent booking after form validation
+            form.add_error("scheduled_time", "This time slot is already booked for the selected doctor.")
+            return self.form_invalid(form)
         return redirect(self.success_url)
 
     def get_context_data(self, **kwargs):
@@ -125,7 +296,17 @@ def appointment_list_view(request):
     if status_filter:
         appointments = appointments.filter(status=status_filter)
 
-    appointments = appointments.select_related("doctor", "patient").order_by("-scheduled_time")
+    try:
+        page = AppointmentPaginationService.paginate(
+            appointments.select_related("doctor", "patient"),
+            cursor=request.GET.get("cursor"),
+            descending=True
+        )
+    except ValidationError:
+        # Stale or hand-edited cursor: start over at the newest page
+        page = AppointmentPaginationService.paginate(
+            appointments.select_related("doctor", "patient"), descending=True
+        )
 
     crumbs = [
         {"label": "Home", "url": "/"},
@@ -136,7 +317,9 @@ def appointment_list_view(request):
         request,
         "appointments/appointment_list.html",
         {
-            "appointments": appointments,
+            "appointments": page["items"],
+            "next_cursor": page["next_cursor"],
+            "previous_cursor": page["previous_cursor"],
             "crumbs": crumbs,
             "status_filter": status_filter,
         }
@@ -151,8 +334,8 @@ class AppointmentCancelView(View):
         appointment = get_object_or_404(Appointment, pk=pk)
         if request.user not in [appointment.patient.user, appointment.doctor.user]:
             return HttpResponseForbidden("You are not authorized to cancel this appointment.")
-        appointment.status = AppointmentStatus.CANCELLED
-        appointment.save(update_fields=["status", "updated_at"])
+        # Frees the linked slot in the same transaction
+        AppointmentBookingService.cancel(appointment)
         return redirect("appointments:appointment-list")
 
 
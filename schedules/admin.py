@@ -9,7 +9,9 @@ from .models import (
     Shift,
     AvailabilitySlot,
     DoctorLeave,
-    ScheduleOverride
+    ScheduleOverride,
+    RotationTemplate,
+    RotationTemplateBlock
 )
 
 # -------------------------------
@@ -78,8 +80,11 @@ class DutyAdmin(admin.ModelAdmin):
 # -------------------------------
 @admin.register(Shift)
 class ShiftAdmin(admin.ModelAdmin):
-    list_display = ('duty', 'day_of_week', 'start_time', 'end_time', 'max_appointments', 'is_active')
-    list_filter = ('day_of_week', 'is_active')
+    list_display = (
+        'duty', 'day_of_week', 'start_time', 'end_time', 'max_appointments',
+        'rotation_cycle_weeks', 'rotation_week_index', 'is_active'
+    )
+    list_filter = ('day_of_week', 'is_active', 'rotation_cycle_weeks')
     search_fields = ('duty__doctor__user__username',)
     readonly_fields = ('created_at', 'updated_at')
 
@@ -114,6 +119,21 @@ class ScheduleOverrideAdmin(admin.ModelAdmin):
     search_fields = ('doctor__user__username', 'reason')
     readonly_fields = ('created_at', 'updated_at')
 
+# -------------------------------
+# Rotation Template Admin
+# -------------------------------
+class RotationTemplateBlockInline(admin.TabularInline):
+    model = RotationTemplateBlock
+    extra = 0
+
+@admin.register(RotationTemplate)
+class RotationTemplateAdmin(admin.ModelAdmin):
+    list_display = ('name', 'cycle_weeks', 'is_active')
+    list_filter = ('is_active', 'cycle_weeks')
+    search_fields = ('name', 'description')
+    readonly_fields = ('created_at', 'updated_at')
+    inlines = [RotationTemplateBlockInline]
+
 # -------------------------------
 # Custom Admin Branding
 # -------------------------------
@@ -0,0 +1,44 @@
+"""
+schedules/management/commands/audit_shift_conflicts.py
+
+Sweeps every active shift and fails if any doctor has two shifts that
+overlap on the same weekday while both duties are running.
+
+Usage:
+    python manage.py audit_shift_conflicts
+    python manage.py audit_shift_conflicts --doctor 12 --doctor 15 --limit 50
+"""
+
+import time as _time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from schedules.services import ShiftConflictService
+
+
+class Command(BaseCommand):
+    help = "Audit active shifts for overlaps across duties and hospitals"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctor', dest='doctor_ids', type=int, action='append',
+                            help='Only audit this doctor (repeatable)')
+        parser.add_argument('--limit', type=int, default=20, help='Conflicts to print')
+
+    def handle(self, *args, **options):
+        started = _time.perf_counter()
+        conflicts = ShiftConflictService.audit(options['doctor_ids'])
+        elapsed = _time.perf_counter() - started
+
+        for conflict in conflicts[:options['limit']]:
+            self.stdout.write(
+                f"doctor {conflict['doctor_id']} {conflict['day_name']}: "
+                f"shift {conflict['shift_ids'][0]} {conflict['windows'][0]} (hospital {conflict['hospital_ids'][0]}) "
+                f"overlaps shift {conflict['shift_ids'][1]} {conflict['windows'][1]} "
+                f"(hospital {conflict['hospital_ids'][1]})"
+            )
+
+        if not conflicts:
+            self.stdout.write(self.style.SUCCESS(f"No shift conflicts ({elapsed:.2f}s)"))
+            return
+
+        raise CommandError(f"{len(conflicts)} overlapping shift pairs found ({elapsed:.2f}s)")
@@ -0,0 +1,191 @@
+"""
+schedules/management/commands/benchmark_slot_booking.py
+
+Fires concurrent bookings at a small pool of slots and checks that no slot
+is ever booked twice.
+
+A throwaway doctor, shift, slot pool and patients are created for the run
+and deleted afterwards (unless --keep is given), so it is safe to run
+against a shared database.
+
+Usage:
+    python manage.py benchmark_slot_booking
+    python manage.py benchmark_slot_booking --threads 16 --attempts 2000 --slots 50 --row-lock
+"""
+
+import random
+import statistics
+import threading
+import time as _time
+from collections import Counter
+from datetime import date, time, timedelta
+from uuid import uuid4
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.utils import timezone
+
+from accounts.models import DoctorProfile, HospitalProfile, PatientProfile
+from schedules.models import AvailabilitySlot, Duty, Shift
+from schedules.services import AvailabilitySlotService
+from schedules.utils import minutes_to_time
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Benchmark concurrent slot booking and assert there are no double bookings"
+
+    # One-minute slots within a single day
+    MAX_SLOTS = 1439
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent booking workers')
+        parser.add_argument('--attempts', type=int, default=400, help='Total booking attempts')
+        parser.add_argument('--slots', type=int, default=20, help='Size of the contested slot pool')
+        parser.add_argument('--row-lock', action='store_true',
+                            help='Lock the slot row with SELECT ... FOR UPDATE before claiming')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for slot selection')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark fixture rows')
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['attempts'] < 1 or options['slots'] < 1:
+            raise CommandError("--threads, --attempts and --slots must be positive")
+        if options['slots'] > self.MAX_SLOTS:
+            raise CommandError(f"--slots cannot exceed {self.MAX_SLOTS}")
+
+        tag = uuid4().hex[:8]
+        users, slot_ids, patients = self.create_fixture(tag, options['slots'], options['threads'])
+        try:
+            report = self.run(slot_ids, patients, options)
+            self.print_report(report, options)
+            self.check_no_double_booking(slot_ids, report)
+        finally:
+            if not options['keep']:
+                User.objects.filter(id__in=users).delete()
+
+    # -------------------------------
+    # Fixture
+    # -------------------------------
+    def create_fixture(self, tag, slot_count, patient_count):
+        """Create a doctor with one shift holding ``slot_count`` slots, plus patients"""
+        doctor_user = User.objects.create_user(username=f'bench_dr_{tag}', password=None, role='DOCTOR')
+        hospital_user = User.objects.create_user(username=f'bench_hosp_{tag}', password=None, role='HOSPITAL')
+        doctor = DoctorProfile.objects.create(
+            user=doctor_user, specialization='benchmark', license_number=f'BENCH-D-{tag}'
+        )
+        hospital = HospitalProfile.objects.create(
+            user=hospital_user, hospital_name=f'Benchmark {tag}', license_number=f'BENCH-H-{tag}'
+        )
+        day = timezone.now().date() + timedelta(days=365)
+        duty = Duty.objects.create(doctor=doctor, hospital=hospital, duty_type='OPD', start_date=day)
+        shift = Shift.objects.create(
+            duty=duty, day_of_week=day.weekday(),
+            start_time=time(0, 0), end_time=minutes_to_time(slot_count),
+        )
+        # One-minute slots; the pool is about contention, not realism
+        AvailabilitySlot.objects.bulk_create([
+            AvailabilitySlot(
+                shift=shift, date=day,
+                start_time=minutes_to_time(minute), end_time=minutes_to_time(minute + 1),
+            )
+            for minute in range(slot_count)
+        ])
+        slot_ids = list(AvailabilitySlot.objects.filter(shift=shift).values_list('id', flat=True))
+
+        user_ids = [doctor_user.id, hospital_user.id]
+        patients = []
+        for index in range(patient_count):
+            user = User.objects.create_user(username=f'bench_pt_{tag}_{index}', password=None, role='PATIENT')
+            user_ids.append(user.id)
+            patients.append(PatientProfile.objects.create(user=user, date_of_birth=date(1990, 1, 1)))
+        return user_ids, slot_ids, patients
+
+    # -------------------------------
+    # Run
+    # -------------------------------
+    def run(self, slot_ids, patients, options):
+        """Spread the attempts over the worker threads and collect per-attempt results"""
+        rng = random.Random(options['seed'])
+        plan = [rng.choice(slot_ids) for _ in range(options['attempts'])]
+        chunks = [plan[index::options['threads']] for index in range(options['threads'])]
+
+        results = []
+        results_lock = threading.Lock()
+        barrier = threading.Barrier(options['threads'])
+
+        def worker(index):
+            patient = patients[index]
+            local = []
+            try:
+                barrier.wait()
+                for slot_id in chunks[index]:
+                    local.append(self.attempt(slot_id, patient, options['row_lock']))
+            finally:
+                connection.close()
+                with results_lock:
+                    results.extend(local)
+
+        started = _time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = _time.perf_counter() - started
+
+        return {'results': results, 'elapsed': elapsed}
+
+    def attempt(self, slot_id, patient, row_lock):
+        """One booking attempt; database lock timeouts are recorded, not raised"""
+        started = _time.perf_counter()
+        try:
+            success, message = AvailabilitySlotService.book_slot(slot_id, patient, row_lock=row_lock)
+            outcome = 'booked' if success else 'conflict'
+        except OperationalError:
+            # SQLite "database is locked" / lock wait timeouts on other backends
+            outcome = 'lock_error'
+        return {
+            'slot_id': slot_id,
+            'outcome': outcome,
+            'ms': (_time.perf_counter() - started) * 1000,
+        }
+
+    # -------------------------------
+    # Report
+    # -------------------------------
+    def print_report(self, report, options):
+        results = report['results']
+        outcomes = Counter(result['outcome'] for result in results)
+        latencies = sorted(result['ms'] for result in results)
+        p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)] if latencies else 0
+
+        self.stdout.write(
+            f"backend={connection.vendor} threads={options['threads']} slots={options['slots']} "
+            f"row_lock={options['row_lock'] and connection.features.has_select_for_update}"
+        )
+        self.stdout.write(
+            f"attempts={len(results)} booked={outcomes['booked']} conflicts={outcomes['conflict']} "
+            f"lock_errors={outcomes['lock_error']}"
+        )
+        self.stdout.write(
+            f"elapsed={report['elapsed']:.2f}s throughput={len(results) / report['elapsed']:.1f} attempts/s "
+            f"latency p50={statistics.median(latencies) if latencies else 0:.1f}ms p95={p95:.1f}ms "
+            f"max={latencies[-1] if latencies else 0:.1f}ms"
+        )
+
+    def check_no_double_booking(self, slot_ids, report):
+        """Every slot must be won by at most one attempt, and the table must agree"""
+        wins = Counter(result['slot_id'] for result in report['results'] if result['outcome'] == 'booked')
+        doubled = [slot_id for slot_id, count in wins.items() if count > 1]
+        booked_rows = AvailabilitySlot.objects.filter(id__in=slot_ids, is_booked=True).count()
+
+        if doubled or booked_rows != len(wins):
+            raise CommandError(
+                f"Double booking detected: {len(doubled)} slots won more than once, "
+                f"{booked_rows} booked rows for {len(wins)} winning attempts"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"No double bookings: {booked_rows} slots booked exactly once"
+        ))
@@ -0,0 +1,56 @@
+"""
+schedules/management/commands/check_daily_availability.py
+
+Diffs the DoctorDailyAvailability rollup against live slot counts and fails
+if they disagree.
+
+Usage:
+    python manage.py check_daily_availability
+    python manage.py check_daily_availability --from 2030-01-01 --to 2030-03-31 --fix
+"""
+
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from schedules.repositories import AvailabilitySlotRepository
+from schedules.services import DailyAvailabilityService
+
+
+class Command(BaseCommand):
+    help = "Check the daily availability rollup against live slots"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', type=date.fromisoformat,
+                            help='First date to check (default: earliest slot)')
+        parser.add_argument('--to', dest='end', type=date.fromisoformat,
+                            help='Last date to check (default: latest slot)')
+        parser.add_argument('--fix', action='store_true', help='Refresh every mismatching day')
+        parser.add_argument('--limit', type=int, default=20, help='Mismatches to print')
+
+    def handle(self, *args, **options):
+        first, last = AvailabilitySlotRepository.get_date_bounds()
+        start = options['start'] or first
+        end = options['end'] or last
+        if start is None or end is None:
+            self.stdout.write(self.style.SUCCESS("No slots to check"))
+            return
+
+        mismatches = DailyAvailabilityService.diff(start, end)
+        for mismatch in mismatches[:options['limit']]:
+            self.stdout.write(
+                f"doctor {mismatch['doctor_id']} {mismatch['date']}: "
+                f"live={mismatch['live']} rollup={mismatch['rollup']}"
+            )
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS(f"Rollup matches live slots from {start} to {end}"))
+            return
+
+        if options['fix']:
+            for mismatch in mismatches:
+                DailyAvailabilityService.refresh([mismatch['doctor_id']], mismatch['date'], mismatch['date'])
+            self.stdout.write(self.style.WARNING(f"Refreshed {len(mismatches)} mismatching days"))
+            return
+
+        raise CommandError(f"{len(mismatches)} rollup rows disagree with live slots")
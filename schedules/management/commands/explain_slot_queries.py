@@ -0,0 +1,94 @@
+"""
+schedules/management/commands/explain_slot_queries.py
+
+Runs EXPLAIN (QUERY PLAN) for the slot repository queries and fails if any
+of them falls back to a full table scan.
+
+Usage:
+    python manage.py explain_slot_queries
+    python manage.py explain_slot_queries --verbose
+"""
+
+import json
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from accounts.models import DoctorProfile, PatientProfile
+from schedules.repositories import AvailabilitySlotRepository, ShiftRepository
+
+# Plan lines that mean "read every row of a table"
+FULL_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (?!.*\bUSING (COVERING )?INDEX\b)(?P<table>\w+)'),
+    'postgresql': re.compile(r'\bSeq Scan on (?P<table>\w+)'),
+}
+
+# MySQL's default EXPLAIN is a table; its JSON plan names the access type per table
+MYSQL_FULL_SCAN = 'ALL'
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the slot repository queries and fail on full table scans"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose', action='store_true', help='Print every query plan')
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor != 'mysql' and vendor not in FULL_SCAN_PATTERNS:
+            raise CommandError(f"Unsupported database vendor: {vendor}")
+
+        failures = []
+        for name, queryset in self.get_queries():
+            if vendor == 'mysql':
+                plan = queryset.explain(format='json')
+                scans = self.find_mysql_scans(json.loads(plan))
+            else:
+                plan = queryset.explain()
+                scans = [line.strip() for line in plan.splitlines() if FULL_SCAN_PATTERNS[vendor].search(line)]
+
+            if options['verbose']:
+                self.stdout.write(f"-- {name}\n{plan}\n")
+
+            if scans:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f"FULL SCAN  {name}: {'; '.join(scans)}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"ok         {name}"))
+
+        if failures:
+            raise CommandError(f"{len(failures)} slot queries do a full table scan: {', '.join(failures)}")
+
+    def find_mysql_scans(self, node):
+        """Tables read with access_type ALL anywhere in a MySQL JSON plan"""
+        if isinstance(node, list):
+            return [scan for child in node for scan in self.find_mysql_scans(child)]
+        if not isinstance(node, dict):
+            return []
+        scans = []
+        if node.get('access_type') == MYSQL_FULL_SCAN:
+            scans.append(f"full scan of {node.get('table_name', '?')}")
+        for child in node.values():
+            scans.extend(self.find_mysql_scans(child))
+        return scans
+
+    def get_queries(self):
+        """(name, queryset) pairs for every repository query worth checking"""
+        # Unsaved instances are enough to build the SQL
+        doctor = DoctorProfile(pk=1)
+        patient = PatientProfile(pk=1)
+        today = timezone.now().date()
+        horizon = today + timedelta(days=30)
+
+        return [
+            ('get_available_slots', AvailabilitySlotRepository.get_available_slots(doctor, today)),
+            ('get_slots_by_date_range',
+             AvailabilitySlotRepository.get_slots_by_date_range(doctor, today, horizon)),
+            ('get_booked_slots', AvailabilitySlotRepository.get_booked_slots(patient)),
+            ('get_existing_slot_keys',
+             AvailabilitySlotRepository.existing_slot_keys_query([1, 2, 3], today, horizon)),
+            ('get_weekday_shifts', ShiftRepository.get_weekday_shifts(doctor, today)),
+        ]
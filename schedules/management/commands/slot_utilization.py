@@ -0,0 +1,58 @@
+"""
+schedules/management/commands/slot_utilization.py
+
+Reports booked vs offered slot minutes per appointment type, and how many
+bookable minutes each packed shift gains over the fixed 30-minute grid.
+
+Usage:
+    python manage.py slot_utilization
+    python manage.py slot_utilization --from 2030-01-01 --to 2030-01-31 --hospital 4 --packing
+"""
+
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from schedules.services import SlotUtilizationService
+
+
+class Command(BaseCommand):
+    help = "Report slot utilization and the capacity gain of packed shifts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', type=date.fromisoformat,
+                            help='First date (default: 30 days ago)')
+        parser.add_argument('--to', dest='end', type=date.fromisoformat, help='Last date (default: today)')
+        parser.add_argument('--doctor', dest='doctor_ids', type=int, action='append',
+                            help='Only this doctor (repeatable)')
+        parser.add_argument('--hospital', type=int, help='Only this hospital')
+        parser.add_argument('--packing', action='store_true',
+                            help='Also compare packed shifts with the fixed grid')
+        parser.add_argument('--slot-minutes', type=int, default=30, help='Fixed grid slot length')
+
+    def handle(self, *args, **options):
+        end = options['end'] or timezone.now().date()
+        start = options['start'] or end - timedelta(days=30)
+
+        report = SlotUtilizationService.report(start, end, options['doctor_ids'], options['hospital'])
+        self.stdout.write(
+            f"{start} - {end}: {report['booked_minutes']} of {report['slot_minutes']} minutes booked "
+            f"({report['utilization']:.1%}) across {report['slots']} slots"
+        )
+        for appointment_type, bucket in report['by_type'].items():
+            self.stdout.write(
+                f"  {appointment_type:<20} {bucket['booked']:>6}/{bucket['slots']:<6} slots "
+                f"{bucket['booked_minutes']:>8}/{bucket['slot_minutes']:<8} minutes ({bucket['utilization']:.1%})"
+            )
+
+        if options['packing']:
+            gains = SlotUtilizationService.packing_report(options['doctor_ids'], options['slot_minutes'])
+            for gain in gains:
+                self.stdout.write(
+                    f"shift {gain['shift_id']}: grid {gain['grid_minutes']} min / {gain['grid_slots']} slots, "
+                    f"packed {gain['packed_minutes']} min / {gain['packed_slots']} slots "
+                    f"({gain['gain_minutes']:+d} of {gain['working_minutes']} working minutes)"
+                )
+            if not gains:
+                self.stdout.write("No shifts declare an appointment mix")
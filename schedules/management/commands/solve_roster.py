@@ -0,0 +1,76 @@
+"""
+schedules/management/commands/solve_roster.py
+
+Plans a hospital roster from coverage requirements and, with --apply,
+creates the duties and shifts. Without --apply it is a dry run that only
+prints the plan summary and the coverage gaps.
+
+The requirements file is a JSON list such as:
+    [{"department": 3, "specialization": "cardiology", "days": [0, 1, 2, 3, 4],
+      "start": "09:00", "end": "13:00", "doctors": 2}]
+
+Usage:
+    python manage.py solve_roster --hospital 4 --from 2030-01-07 --weeks 4 --requirements coverage.json
+    python manage.py solve_roster --hospital 4 --from 2030-01-07 --requirements coverage.json --apply
+"""
+
+import json
+import time as _time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from schedules.services import RosterSolverService
+
+
+class Command(BaseCommand):
+    help = "Assign doctors to shifts from coverage requirements (dry run unless --apply)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hospital', type=int, required=True, help='HospitalProfile id')
+        parser.add_argument('--from', dest='start', type=date.fromisoformat, required=True,
+                            help='A day in the first week to plan')
+        parser.add_argument('--weeks', type=int, default=4, help='Weeks to plan')
+        parser.add_argument('--requirements', required=True, help='Path to the JSON requirements file')
+        parser.add_argument('--max-hours', type=int, default=RosterSolverService.DEFAULT_MAX_HOURS_PER_WEEK,
+                            help='Weekly hours limit per doctor across all hospitals')
+        parser.add_argument('--doctor', dest='doctor_ids', type=int, action='append',
+                            help='Restrict the candidate pool (repeatable)')
+        parser.add_argument('--apply', action='store_true', help='Create the planned duties and shifts')
+        parser.add_argument('--limit', type=int, default=20, help='Gaps to print')
+
+    def handle(self, *args, **options):
+        if options['weeks'] < 1:
+            raise CommandError("--weeks must be positive")
+        try:
+            with open(options['requirements']) as handle:
+                requirements = RosterSolverService.parse_requirements(json.load(handle))
+        except (OSError, json.JSONDecodeError, ValueError) as e:
+            raise CommandError(f"Invalid requirements: {e}")
+
+        started = _time.perf_counter()
+        plan = RosterSolverService.run(
+            options['hospital'], options['start'], options['weeks'], requirements,
+            dry_run=not options['apply'],
+            max_hours_per_week=options['max_hours'],
+            doctor_ids=options['doctor_ids']
+        )
+        elapsed = _time.perf_counter() - started
+
+        self.stdout.write(
+            f"{plan['start_date']} - {plan['end_date']}: filled {plan['blocks_filled']} of "
+            f"{plan['blocks_required']} blocks with {plan['doctors_assigned']} doctors ({elapsed:.2f}s)"
+        )
+        for gap in plan['gaps'][:options['limit']]:
+            self.stdout.write(self.style.WARNING(
+                f"gap {gap['date']} {gap['start_time']:%H:%M}-{gap['end_time']:%H:%M} "
+                f"department={gap['department_id']} specialization={gap['specialization']}: "
+                f"{gap['assigned']}/{gap['required']} doctors"
+            ))
+
+        if options['apply']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Created {plan['duties_created']} duties and {plan['shifts_created']} shifts"
+            ))
+        else:
+            self.stdout.write("Dry run: nothing was created (use --apply)")
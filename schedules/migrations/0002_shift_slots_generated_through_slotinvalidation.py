@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_alter_useractivity_user_agent'),
+        ('schedules', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shift',
+            name='slots_generated_through',
+            field=models.DateField(blank=True, help_text='Last date for which availability slots have been materialised', null=True),
+        ),
+        migrations.CreateModel(
+            name='SlotInvalidation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slot_invalidations', to='accounts.doctorprofile')),
+            ],
+        ),
+    ]
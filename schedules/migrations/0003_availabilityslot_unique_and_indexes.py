@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:18
+
+from django.db import migrations, models
+
+
+DEDUP_BATCH_SIZE = 500
+
+
+def deduplicate_slots(apps, schema_editor):
+    """
+    Keep one slot per (shift, date, start_time) before the unique constraint lands.
+    The booked slot wins over unbooked ones, then the oldest row. Only unbooked
+    duplicates are deleted: a key booked more than once stops the migration
+    with the slot ids, to be merged by hand.
+    """
+    AvailabilitySlot = apps.get_model('schedules', 'AvailabilitySlot')
+    rows = AvailabilitySlot.objects.order_by(
+        'shift_id', 'date', 'start_time', '-is_booked', 'id'
+    ).values_list('id', 'shift_id', 'date', 'start_time', 'is_booked')
+
+    duplicate_ids = []
+    double_booked = {}
+    previous_key = None
+    kept_id = None
+    for slot_id, shift_id, date, start_time, is_booked in rows.iterator(chunk_size=2000):
+        key = (shift_id, date, start_time)
+        if key != previous_key:
+            kept_id = slot_id
+        elif is_booked:
+            double_booked.setdefault(kept_id, [kept_id]).append(slot_id)
+        else:
+            duplicate_ids.append(slot_id)
+        previous_key = key
+
+    if double_booked:
+        raise RuntimeError(
+            "Booked duplicate availability slots must be merged by hand before "
+            "the unique constraint can be added (slot ids per duplicate group): "
+            + "; ".join(", ".join(map(str, ids)) for ids in double_booked.values())
+        )
+
+    for offset in range(0, len(duplicate_ids), DEDUP_BATCH_SIZE):
+        AvailabilitySlot.objects.filter(
+            id__in=duplicate_ids[offset:offset + DEDUP_BATCH_SIZE]
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_alter_useractivity_user_agent'),
+        ('appointments', '0003_alter_appointment_doctor_alter_appointment_patient'),
+        ('schedules', '0002_shift_slots_generated_through_slotinvalidation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='availabilityslot',
+            index=models.Index(fields=['shift', 'date', 'is_available', 'is_booked', 'start_time'], name='slot_shift_date_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='availabilityslot',
+            index=models.Index(fields=['date', 'is_booked'], name='slot_date_booked_idx'),
+        ),
+        migrations.RunPython(deduplicate_slots, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='availabilityslot',
+            constraint=models.UniqueConstraint(fields=('shift', 'date', 'start_time'), name='unique_slot_per_shift_start'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_alter_useractivity_user_agent'),
+        ('schedules', '0003_availabilityslot_unique_and_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorDailyAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('total_slots', models.PositiveIntegerField(default=0)),
+                ('available_slots', models.PositiveIntegerField(default=0)),
+                ('booked_slots', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_availability', to='accounts.doctorprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'doctor'], name='daily_avail_date_doctor_idx')],
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'date'), name='unique_daily_availability')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_alter_useractivity_user_agent'),
+        ('schedules', '0004_doctordailyavailability'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EarliestSlotIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('specialization', models.CharField(max_length=100)),
+                ('date', models.DateField()),
+                ('start_time', models.TimeField()),
+                ('rating', models.FloatField(default=0.0)),
+                ('experience_years', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='earliest_slots', to='accounts.doctorprofile')),
+                ('hospital', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='earliest_slots', to='accounts.hospitalprofile')),
+                ('slot', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='earliest_index', to='schedules.availabilityslot')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['specialization', 'date', 'start_time'], name='earliest_spec_date_idx'), models.Index(fields=['specialization', 'hospital', 'date', 'start_time'], name='earliest_spec_hosp_date_idx')],
+            },
+        ),
+    ]
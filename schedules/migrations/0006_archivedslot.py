@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedules', '0005_earliestslotindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot_id', models.PositiveIntegerField(unique=True)),
+                ('month', models.DateField()),
+                ('date', models.DateField()),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+                ('doctor_id', models.PositiveIntegerField()),
+                ('hospital_id', models.PositiveIntegerField()),
+                ('patient_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('appointment_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['month', 'doctor_id'], name='archived_slot_month_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:59
+
+from django.db import migrations, models
+
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def backfill_send_buckets(apps, schema_editor):
+    """Fill send_bucket (hours since the epoch of send_time) for existing reminders."""
+    ScheduleReminder = apps.get_model('schedules', 'ScheduleReminder')
+
+    batch = []
+    for reminder in ScheduleReminder.objects.only('id', 'send_time').iterator(chunk_size=BACKFILL_BATCH_SIZE):
+        reminder.send_bucket = int(reminder.send_time.timestamp()) // 3600
+        batch.append(reminder)
+        if len(batch) == BACKFILL_BATCH_SIZE:
+            ScheduleReminder.objects.bulk_update(batch, ['send_bucket'])
+            batch = []
+    if batch:
+        ScheduleReminder.objects.bulk_update(batch, ['send_bucket'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedules', '0006_archivedslot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schedulereminder',
+            name='claim_token',
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='schedulereminder',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='schedulereminder',
+            name='send_bucket',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='schedulereminder',
+            name='sent_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='schedulereminder',
+            index=models.Index(fields=['is_sent', 'send_bucket', 'send_time'], name='reminder_due_bucket_idx'),
+        ),
+        migrations.RunPython(backfill_send_buckets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:07
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedules', '0007_schedulereminder_send_bucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RotationTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('description', models.TextField(blank=True)),
+                ('cycle_weeks', models.PositiveSmallIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(52)])),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='shift',
+            name='rotation_cycle_weeks',
+            field=models.PositiveSmallIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(52)]),
+        ),
+        migrations.AddField(
+            model_name='shift',
+            name='rotation_week_index',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='RotationTemplateBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('week_index', models.PositiveSmallIntegerField(default=0, help_text='0 = first week of the cycle')),
+                ('day_of_week', models.IntegerField(choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')], help_text='0 = Monday, 6 = Sunday')),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+                ('max_appointments', models.PositiveIntegerField(default=10)),
+                ('break_start', models.TimeField(blank=True, null=True)),
+                ('break_end', models.TimeField(blank=True, null=True)),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocks', to='schedules.rotationtemplate')),
+            ],
+            options={
+                'ordering': ['week_index', 'day_of_week', 'start_time'],
+                'constraints': [models.UniqueConstraint(fields=('template', 'week_index', 'day_of_week', 'start_time'), name='unique_rotation_block')],
+            },
+        ),
+    ]
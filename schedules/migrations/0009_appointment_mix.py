@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedules', '0008_rotation_templates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='availabilityslot',
+            name='appointment_type',
+            field=models.CharField(blank=True, default='', max_length=30),
+        ),
+        migrations.AddField(
+            model_name='shift',
+            name='appointment_mix',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedules', '0009_appointment_mix'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLogEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('object_type', models.CharField(choices=[('SLOTS', 'Doctor slots'), ('SCHEDULE', 'Schedule'), ('APPOINTMENT', 'Appointment')], max_length=20)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('action', models.CharField(choices=[('SAVE', 'Saved'), ('DELETE', 'Deleted')], default='SAVE', max_length=10)),
+                ('start_date', models.DateField(blank=True, null=True)),
+                ('end_date', models.DateField(blank=True, null=True)),
+                ('doctor_user_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('patient_user_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['object_type', 'object_id', 'id'], name='change_log_object_idx')],
+            },
+        ),
+    ]
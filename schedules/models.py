@@ -5,11 +5,13 @@ Models for managing doctor schedules, duties, shifts, availability, and override
 Supports hospital-assigned duties and doctor-driven availability.
 """
 
+from datetime import datetime
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from accounts.models import DoctorProfile, PatientProfile, HospitalProfile, Department
+from .utils import epoch_hour
 #kdk
 
 # -------------------------------
@@ -72,6 +74,19 @@ class Shift(models.Model):
     break_start = models.TimeField(null=True, blank=True)
     break_end = models.TimeField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
+    slots_generated_through = models.DateField(
+        null=True, blank=True,
+        help_text="Last date for which availability slots have been materialised"
+    )
+    # Multi-week rotations: the shift runs in week ``rotation_week_index`` of
+    # every ``rotation_cycle_weeks``-week cycle, counted from the duty's first Monday
+    rotation_cycle_weeks = models.PositiveSmallIntegerField(
+        default=1, validators=[MinValueValidator(1), MaxValueValidator(52)]
+    )
+    rotation_week_index = models.PositiveSmallIntegerField(default=0)
+    # Variable-length packing, e.g. [{"type": "FOLLOW_UP", "minutes": 15, "ratio": 2},
+    # {"type": "NEW_PATIENT", "minutes": 45, "ratio": 1}]; empty = fixed grid
+    appointment_mix = models.JSONField(default=list, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -85,6 +100,53 @@ class Shift(models.Model):
         return f"{self.duty} - {self.get_day_of_week_display()}"
 
 
+# -------------------------------
+# Shift Rotation Templates
+# -------------------------------
+class RotationTemplate(models.Model):
+    """
+    Named, reusable pattern of shift blocks over a cycle of one or more weeks,
+    applied to many duties at once.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    description = models.TextField(blank=True)
+    cycle_weeks = models.PositiveSmallIntegerField(
+        default=1, validators=[MinValueValidator(1), MaxValueValidator(52)]
+    )
+    is_active = models.BooleanField(default=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.cycle_weeks}-week cycle)"
+
+
+class RotationTemplateBlock(models.Model):
+    template = models.ForeignKey(RotationTemplate, on_delete=models.CASCADE, related_name='blocks')
+    week_index = models.PositiveSmallIntegerField(default=0, help_text="0 = first week of the cycle")
+    day_of_week = models.IntegerField(
+        choices=[(i, day) for i, day in enumerate(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'])],
+        help_text="0 = Monday, 6 = Sunday"
+    )
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    max_appointments = models.PositiveIntegerField(default=10)
+    break_start = models.TimeField(null=True, blank=True)
+    break_end = models.TimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.template.name} week {self.week_index + 1} - {self.get_day_of_week_display()}"
+
+    class Meta:
+        ordering = ['week_index', 'day_of_week', 'start_time']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['template', 'week_index', 'day_of_week', 'start_time'], name='unique_rotation_block'
+            ),
+        ]
+
+
 # -------------------------------
 # Availability Slots for Booking
 # -------------------------------
@@ -95,6 +157,8 @@ class AvailabilitySlot(models.Model):
     end_time = models.TimeField()
     is_available = models.BooleanField(default=True)
     is_booked = models.BooleanField(default=False)
+    # Set for slots packed from the shift's appointment mix
+    appointment_type = models.CharField(max_length=30, blank=True, default='')
 
     booked_by = models.ForeignKey(PatientProfile, on_delete=models.SET_NULL, null=True, blank=True)
     appointment = models.OneToOneField('appointments.Appointment', on_delete=models.SET_NULL, null=True, blank=True)
@@ -105,6 +169,171 @@ class AvailabilitySlot(models.Model):
     def __str__(self):
         return f"{self.shift} - {self.date} {self.start_time}"
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['shift', 'date', 'start_time'], name='unique_slot_per_shift_start'),
+        ]
+        indexes = [
+            # Covers get_available_slots / get_slots_by_date_range once the shift is resolved
+            models.Index(fields=['shift', 'date', 'is_available', 'is_booked', 'start_time'], name='slot_shift_date_state_idx'),
+            # Fleet-wide date scans (cleanup, reminders)
+            models.Index(fields=['date', 'is_booked'], name='slot_date_booked_idx'),
+        ]
+
+
+# -------------------------------
+# Daily Availability Rollup
+# -------------------------------
+class DoctorDailyAvailability(models.Model):
+    """
+    Per-doctor, per-day slot counts kept in step with AvailabilitySlot,
+    so availability summaries never have to load slot rows.
+    """
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, related_name='daily_availability')
+    date = models.DateField()
+    total_slots = models.PositiveIntegerField(default=0)
+    available_slots = models.PositiveIntegerField(default=0)
+    booked_slots = models.PositiveIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.doctor} {self.date}: {self.available_slots}/{self.total_slots} available"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'date'], name='unique_daily_availability'),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'doctor'], name='daily_avail_date_doctor_idx'),
+        ]
+
+
+# -------------------------------
+# Earliest Free Slot Index
+# -------------------------------
+class EarliestSlotIndex(models.Model):
+    """
+    The next few free slots of every doctor at every hospital, denormalised
+    with the doctor's specialization, rating and experience so "first free
+    <specialization> slot" is a single indexed range scan.
+    """
+    specialization = models.CharField(max_length=100)
+    hospital = models.ForeignKey(HospitalProfile, on_delete=models.CASCADE, related_name='earliest_slots')
+    date = models.DateField()
+    start_time = models.TimeField()
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, related_name='earliest_slots')
+    slot = models.OneToOneField(AvailabilitySlot, on_delete=models.CASCADE, related_name='earliest_index')
+
+    # Copied from doctors.DoctorProfile (matched on the user account)
+    rating = models.FloatField(default=0.0)
+    experience_years = models.PositiveIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.specialization} {self.date} {self.start_time} - {self.doctor}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['specialization', 'date', 'start_time'], name='earliest_spec_date_idx'),
+            models.Index(fields=['specialization', 'hospital', 'date', 'start_time'], name='earliest_spec_hosp_date_idx'),
+        ]
+
+
+# -------------------------------
+# Archived Slots
+# -------------------------------
+class ArchivedSlot(models.Model):
+    """
+    Compact copy of a booked slot removed by the past-slot cleanup.
+    
+    Stores plain ids instead of foreign keys so the archive survives later
+    deletes of doctors, patients or appointments; rows are grouped by month.
+    """
+    slot_id = models.PositiveIntegerField(unique=True)
+    month = models.DateField()
+    date = models.DateField()
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    doctor_id = models.PositiveIntegerField()
+    hospital_id = models.PositiveIntegerField()
+    patient_id = models.PositiveIntegerField(null=True, blank=True)
+    appointment_id = models.PositiveIntegerField(null=True, blank=True)
+    
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Archived slot {self.slot_id} on {self.date} {self.start_time}"
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['month', 'doctor_id'], name='archived_slot_month_idx'),
+        ]
+
+
+# -------------------------------
+# Change Log (delta sync)
+# -------------------------------
+class ChangeLogEntry(models.Model):
+    """
+    Append-only feed of slot, schedule and appointment mutations.
+    
+    The auto-increment id is the sync token: clients ask for entries after
+    the last id they saw. Slot changes are logged per doctor and date range
+    (the unit SlotChangeService reports), other objects per row. Owner user
+    ids are copied in so a patient or doctor only syncs their own objects.
+    """
+    class ObjectType(models.TextChoices):
+        SLOTS = 'SLOTS', _('Doctor slots')
+        SCHEDULE = 'SCHEDULE', _('Schedule')
+        APPOINTMENT = 'APPOINTMENT', _('Appointment')
+    
+    class Action(models.TextChoices):
+        SAVE = 'SAVE', _('Saved')
+        DELETE = 'DELETE', _('Deleted')
+    
+    id = models.BigAutoField(primary_key=True)
+    object_type = models.CharField(max_length=20, choices=ObjectType.choices)
+    object_id = models.PositiveBigIntegerField()
+    action = models.CharField(max_length=10, choices=Action.choices, default=Action.SAVE)
+    
+    # Slot ranges only; a null end_date means "from start_date on"
+    start_date = models.DateField(null=True, blank=True)
+    end_date = models.DateField(null=True, blank=True)
+    
+    doctor_user_id = models.PositiveIntegerField(null=True, blank=True)
+    patient_user_id = models.PositiveIntegerField(null=True, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"#{self.id} {self.action} {self.object_type} {self.object_id}"
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['object_type', 'object_id', 'id'], name='change_log_object_idx'),
+        ]
+
+
+# -------------------------------
+# Slot Invalidations
+# -------------------------------
+class SlotInvalidation(models.Model):
+    """
+    Date range whose slots must be re-materialised for a doctor
+    (recorded when leaves or overrides change, consumed by the nightly job).
+    """
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, related_name='slot_invalidations')
+    start_date = models.DateField()
+    end_date = models.DateField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.doctor} slots invalidated {self.start_date} - {self.end_date}"
+
 
 # -------------------------------
 # Doctor Leave Requests
@@ -224,10 +453,28 @@ class ScheduleReminder(models.Model):
     send_time = models.DateTimeField()
     is_sent = models.BooleanField(default=False)
 
+    # Hours since the epoch of send_time, kept in step by save()
+    send_bucket = models.PositiveIntegerField(default=0, editable=False)
+    # Set by the dispatcher that is delivering the reminder
+    claim_token = models.UUIDField(null=True, blank=True, editable=False)
+    claimed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    sent_at = models.DateTimeField(null=True, blank=True, editable=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
 
+    def save(self, *args, **kwargs):
+        self.send_bucket = epoch_hour(self.send_time)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'send_time' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'send_bucket'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Reminder for {self.schedule.title}"
 
     class Meta:
         ordering = ['-send_time']
+        indexes = [
+            # Due-reminder claims read one run of hourly buckets
+            models.Index(fields=['is_sent', 'send_bucket', 'send_time'], name='reminder_due_bucket_idx'),
+        ]
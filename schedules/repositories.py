@@ -5,11 +5,23 @@ Data access layer for schedule management.
 Encapsulates all database queries for schedules.
 """
 
-from django.db.models import Q, Count, Prefetch
+from django.db.models import (
+    Q, F, Value, Case, When, Count, Sum, Min, Max, FloatField, ExpressionWrapper,
+    Prefetch, Exists, OuterRef, Subquery, Window
+)
+from django.db.models.functions import RowNumber
+from accounts.models import DoctorProfile, PatientProfile
+from doctors.models import DoctorProfile as DoctorDirectoryProfile
 from django.utils import timezone
 from datetime import datetime, timedelta, time
-from typing import Optional, List
-from .models import Duty, Shift, AvailabilitySlot, DoctorLeave, ScheduleOverride
+from typing import Optional, List, Dict, Tuple, Iterable, Iterator
+from .utils import shift_runs_on
+from .models import (
+    Duty, Shift, AvailabilitySlot, DoctorLeave, ScheduleOverride, SlotInvalidation,
+    DoctorDailyAvailability, EarliestSlotIndex, ArchivedSlot, Schedule, ScheduleReminder,
+    RotationTemplate, RotationTemplateBlock, ChangeLogEntry
+)
+from appointments.models import Appointment
 
 
 class DutyRepository:
@@ -26,6 +38,11 @@ class DutyRepository:
             **kwargs
         )
     
+    @staticmethod
+    def bulk_create_duties(duties_data: List[dict]) -> List[Duty]:
+        """Bulk create duties (signals are not sent)"""
+        return Duty.objects.bulk_create([Duty(**data) for data in duties_data])
+    
     @staticmethod
     def get_by_id(duty_id: int) -> Optional[Duty]:
         """Get duty by ID"""
@@ -36,6 +53,11 @@ class DutyRepository:
         except Duty.DoesNotExist:
             return None
     
+    @staticmethod
+    def get_by_ids(duty_ids: Iterable[int], is_active: bool = True) -> List[Duty]:
+        """Get several duties in one query"""
+        return list(Duty.objects.filter(id__in=list(duty_ids), is_active=is_active).order_by('id'))
+    
     @staticmethod
     def get_doctor_duties(doctor, is_active: bool = True) -> List[Duty]:
         """Get all duties for a doctor"""
@@ -52,6 +74,22 @@ class DutyRepository:
             queryset = queryset.filter(is_active=True)
         return queryset.select_related('doctor__user', 'department')
     
+    @staticmethod
+    def get_active_hospital_ids() -> List[int]:
+        """Get ids of hospitals that have at least one active duty"""
+        return list(
+            Duty.objects.filter(is_active=True, hospital__user__is_active=True)
+            .values_list('hospital_id', flat=True).distinct().order_by('hospital_id')
+        )
+    
+    @staticmethod
+    def get_hospital_ids_for_doctors(doctor_ids: Iterable[int]) -> List[int]:
+        """Get ids of hospitals where any of the given doctors holds an active duty"""
+        return list(
+            Duty.objects.filter(doctor_id__in=list(doctor_ids), is_active=True)
+            .values_list('hospital_id', flat=True).distinct().order_by()
+        )
+    
     @staticmethod
     def get_current_duties(doctor) -> List[Duty]:
         """Get currently active duties for a doctor"""
@@ -64,6 +102,25 @@ class DutyRepository:
             Q(end_date__isnull=True) | Q(end_date__gte=today)
         ).select_related('hospital__user', 'department')
     
+    @staticmethod
+    def iter_active_doctor_ids(chunk_size: int = 2000) -> Iterator[int]:
+        """
+        Stream ids of active doctors holding at least one active duty.
+        Pages by id so no cursor stays open while callers write.
+        """
+        queryset = Duty.objects.filter(
+            is_active=True,
+            doctor__user__is_active=True
+        ).values_list('doctor_id', flat=True).distinct().order_by('doctor_id')
+        
+        last_id = 0
+        while True:
+            page = list(queryset.filter(doctor_id__gt=last_id)[:chunk_size])
+            yield from page
+            if len(page) < chunk_size:
+                return
+            last_id = page[-1]
+    
     @staticmethod
     def update_duty(duty: Duty, **fields) -> Duty:
         """Update duty fields"""
@@ -104,6 +161,11 @@ class ShiftRepository:
         except Shift.DoesNotExist:
             return None
     
+    @staticmethod
+    def get_by_ids(shift_ids: Iterable[int]) -> List[Shift]:
+        """Get several shifts with their duty in one query"""
+        return list(Shift.objects.filter(id__in=list(shift_ids)).select_related('duty'))
+    
     @staticmethod
     def get_duty_shifts(duty, is_active: bool = True) -> List[Shift]:
         """Get all shifts for a duty"""
@@ -126,9 +188,16 @@ class ShiftRepository:
     
     @staticmethod
     def get_shifts_for_date(doctor, date) -> List[Shift]:
-        """Get shifts for a specific date"""
+        """Get shifts for a specific date, leaving out rotation weeks the shift is off"""
+        return [
+            shift for shift in ShiftRepository.get_weekday_shifts(doctor, date)
+            if shift_runs_on(shift, date)
+        ]
+    
+    @staticmethod
+    def get_weekday_shifts(doctor, date):
+        """Queryset of a doctor's shifts on the date's weekday within their duty range"""
         day_of_week = date.weekday()
-        today = timezone.now().date()
         
         return Shift.objects.filter(
             duty__doctor=doctor,
@@ -153,6 +222,92 @@ class ShiftRepository:
         """Delete a shift"""
         shift.delete()
     
+    # Fields needed to turn a shift into a conflict-detection interval
+    INTERVAL_FIELDS = (
+        'id', 'duty__doctor_id', 'duty__hospital_id', 'day_of_week', 'start_time', 'end_time',
+        'duty__start_date', 'duty__end_date', 'rotation_cycle_weeks', 'rotation_week_index'
+    )
+    
+    @staticmethod
+    def get_interval_rows(doctor_ids: Optional[Iterable[int]] = None, exclude_shift_ids: Iterable[int] = ()):
+        """Get interval fields of active shifts under active duties, as a values queryset"""
+        queryset = Shift.objects.filter(is_active=True, duty__is_active=True)
+        if doctor_ids is not None:
+            queryset = queryset.filter(duty__doctor_id__in=list(doctor_ids))
+        exclude_shift_ids = list(exclude_shift_ids)
+        if exclude_shift_ids:
+            queryset = queryset.exclude(id__in=exclude_shift_ids)
+        return queryset.values(*ShiftRepository.INTERVAL_FIELDS)
+    
+    @staticmethod
+    def get_shifts_in_range(doctor, start_date, end_date) -> List[Shift]:
+        """Get active shifts whose duty overlaps a date range, with hospital loaded"""
+        return list(Shift.objects.filter(
+            duty__doctor=doctor,
+            duty__is_active=True,
+            duty__start_date__lte=end_date,
+            is_active=True
+        ).filter(
+            Q(duty__end_date__isnull=True) | Q(duty__end_date__gte=start_date)
+        ).select_related('duty__hospital').order_by('start_time'))
+    
+    @staticmethod
+    def get_hospital_shifts_for_date(hospital_id: int, date) -> List[Shift]:
+        """Get every active shift at a hospital on a date, with doctor and user loaded"""
+        shifts = Shift.objects.filter(
+            duty__hospital_id=hospital_id,
+            duty__is_active=True,
+            duty__start_date__lte=date,
+            day_of_week=date.weekday(),
+            is_active=True
+        ).filter(
+            Q(duty__end_date__isnull=True) | Q(duty__end_date__gte=date)
+        ).select_related('duty__doctor__user').order_by('duty__doctor_id', 'start_time')
+        return [shift for shift in shifts if shift_runs_on(shift, date)]
+    
+    @staticmethod
+    def get_shifts_for_doctors(doctor_ids: Iterable[int]) -> List[Shift]:
+        """Get active shifts of several doctors with their duty in one query"""
+        return list(Shift.objects.filter(
+            duty__doctor_id__in=list(doctor_ids),
+            duty__is_active=True,
+            is_active=True
+        ).select_related('duty'))
+    
+    @staticmethod
+    def get_shifts_behind_horizon(horizon_end, doctor_ids: Iterable[int] = None) -> List[Shift]:
+        """Get active shifts whose slots are not materialised through the horizon"""
+        queryset = Shift.objects.filter(
+            duty__is_active=True,
+            duty__doctor__user__is_active=True,
+            is_active=True
+        ).filter(
+            Q(slots_generated_through__isnull=True) | Q(slots_generated_through__lt=horizon_end)
+        )
+        if doctor_ids is not None:
+            queryset = queryset.filter(duty__doctor_id__in=list(doctor_ids))
+        return list(queryset.select_related('duty'))
+    
+    @staticmethod
+    def set_generated_through(shift_ids: Iterable[int], through_date) -> int:
+        """Move the slot generation watermark of several shifts"""
+        return Shift.objects.filter(id__in=list(shift_ids)).update(slots_generated_through=through_date)
+    
+    @staticmethod
+    def get_packed_shifts(doctor_ids: Optional[Iterable[int]] = None) -> List[Shift]:
+        """Get active shifts that declare an appointment mix"""
+        queryset = Shift.objects.filter(is_active=True, duty__is_active=True).exclude(appointment_mix=[])
+        if doctor_ids is not None:
+            queryset = queryset.filter(duty__doctor_id__in=list(doctor_ids))
+        return list(queryset.select_related('duty').order_by('id'))
+    
+    @staticmethod
+    def get_rotation_keys(duty_ids: Iterable[int]) -> set:
+        """Get (duty_id, day_of_week, start_time, cycle_weeks, week_index) of the duties' shifts"""
+        return set(Shift.objects.filter(duty_id__in=list(duty_ids)).values_list(
+            'duty_id', 'day_of_week', 'start_time', 'rotation_cycle_weeks', 'rotation_week_index'
+        ))
+    
     @staticmethod
     def bulk_create_shifts(shifts_data: List[dict]) -> List[Shift]:
         """Bulk create shifts"""
@@ -160,6 +315,44 @@ class ShiftRepository:
         return Shift.objects.bulk_create(shifts)
 
 
+class RotationTemplateRepository:
+    """Repository for RotationTemplate model operations"""
+    
+    @staticmethod
+    def create_template(name: str, cycle_weeks: int, blocks_data: List[dict], **kwargs) -> RotationTemplate:
+        """Create a template and its blocks"""
+        template = RotationTemplate.objects.create(name=name, cycle_weeks=cycle_weeks, **kwargs)
+        RotationTemplateBlock.objects.bulk_create([
+            RotationTemplateBlock(template=template, **data) for data in blocks_data
+        ])
+        return template
+    
+    @staticmethod
+    def get_with_blocks(template_id: int) -> Optional[RotationTemplate]:
+        """Get an active template with its blocks prefetched"""
+        return RotationTemplate.objects.filter(id=template_id, is_active=True).prefetch_related('blocks').first()
+    
+    @staticmethod
+    def name_exists(name: str) -> bool:
+        """Check whether a template name is taken"""
+        return RotationTemplate.objects.filter(name=name).exists()
+
+
+class RosterRepository:
+    """Lookups for the roster solver"""
+    
+    @staticmethod
+    def get_candidate_doctors(specializations: Optional[Iterable[str]] = None,
+                              doctor_ids: Optional[Iterable[int]] = None) -> Dict[int, str]:
+        """Get {doctor_id: specialization} for active doctors matching the filters (None = no filter)"""
+        queryset = DoctorProfile.objects.filter(user__is_active=True)
+        if specializations is not None:
+            queryset = queryset.filter(specialization__in=list(specializations))
+        if doctor_ids is not None:
+            queryset = queryset.filter(id__in=list(doctor_ids))
+        return dict(queryset.values_list('id', 'specialization'))
+
+
 class AvailabilitySlotRepository:
     """Repository for AvailabilitySlot model operations"""
     
@@ -214,16 +407,122 @@ class AvailabilitySlotRepository:
         ).order_by('date', 'start_time')
     
     @staticmethod
-    def mark_slot_as_booked(slot: AvailabilitySlot, patient, appointment=None) -> AvailabilitySlot:
-        """Mark slot as booked"""
-        slot.mark_as_booked(patient, appointment)
-        return slot
+    def claim_slot(slot_id: int, patient_id, appointment_id: Optional[int] = None) -> bool:
+        """
+        Book a slot with a single conditional UPDATE.
+        
+        The WHERE clause only matches a free slot, so of several concurrent
+        claims exactly one updates a row; the others see 0 rows and lose.
+        patient_id may be an id or an expression (see patient_id_for_user).
+        
+        Returns:
+            True if this call claimed the slot
+        """
+        return AvailabilitySlot.objects.filter(
+            id=slot_id,
+            is_available=True,
+            is_booked=False
+        ).update(
+            is_booked=True,
+            booked_by_id=patient_id,
+            appointment_id=appointment_id,
+            updated_at=timezone.now()
+        ) == 1
+    
+    @staticmethod
+    def release_slot(slot_id: int) -> bool:
+        """
+        Free a booked slot with a single conditional UPDATE.
+        
+        Returns:
+            True if this call released the slot
+        """
+        return AvailabilitySlot.objects.filter(
+            id=slot_id,
+            is_booked=True
+        ).update(
+            is_booked=False,
+            booked_by=None,
+            appointment=None,
+            updated_at=timezone.now()
+        ) == 1
+    
+    @staticmethod
+    def release_hold(slot_id: int) -> bool:
+        """
+        Free a slot held without an appointment (a waitlist offer hold).
+        
+        Slots booked by an appointment are never touched.
+        
+        Returns:
+            True if this call released the hold
+        """
+        return AvailabilitySlot.objects.filter(
+            id=slot_id,
+            is_booked=True,
+            appointment__isnull=True
+        ).update(
+            is_booked=False,
+            booked_by=None,
+            updated_at=timezone.now()
+        ) == 1
+    
+    @staticmethod
+    def lock_slot(slot_id: int) -> Optional[AvailabilitySlot]:
+        """Get a slot with its row locked until the end of the transaction"""
+        return AvailabilitySlot.objects.select_for_update().filter(id=slot_id).first()
+    
+    @staticmethod
+    def get_slot_scope(slot_id: int) -> Optional[Dict]:
+        """Get the doctor, hospital and date a slot belongs to (for change notifications)"""
+        return AvailabilitySlot.objects.filter(id=slot_id).values(
+            'date',
+            doctor_id=F('shift__duty__doctor_id'),
+            hospital_id=F('shift__duty__hospital_id')
+        ).first()
     
     @staticmethod
-    def mark_slot_as_available(slot: AvailabilitySlot) -> AvailabilitySlot:
-        """Mark slot as available"""
-        slot.mark_as_available()
-        return slot
+    def get_slot_scopes(slot_ids: Iterable[int]) -> List[Dict]:
+        """Distinct (date, doctor, hospital) scopes of several slots in one query"""
+        return list(AvailabilitySlot.objects.filter(id__in=list(slot_ids)).values(
+            'date',
+            doctor_id=F('shift__duty__doctor_id'),
+            hospital_id=F('shift__duty__hospital_id')
+        ).distinct())
+    
+    @staticmethod
+    def get_booking_scope(slot_id: int) -> Optional[Dict]:
+        """
+        Everything needed to turn a slot into an appointment, in one query.
+        
+        directory_doctor_id is the doctors-app profile of the slot's doctor
+        (the one appointments point at), or None if the doctor has none.
+        """
+        return AvailabilitySlot.objects.filter(id=slot_id).annotate(
+            directory_doctor_id=Subquery(
+                DoctorDirectoryProfile.objects.filter(
+                    user_id=OuterRef('shift__duty__doctor__user_id')
+                ).values('id')[:1]
+            )
+        ).values(
+            'id', 'date', 'start_time', 'end_time', 'is_available', 'is_booked', 'directory_doctor_id',
+            doctor_id=F('shift__duty__doctor_id'),
+            hospital_id=F('shift__duty__hospital_id')
+        ).first()
+    
+    @staticmethod
+    def get_appointment_slot_scope(appointment_id: int) -> Optional[Dict]:
+        """Get the slot linked to an appointment with its doctor, hospital and date"""
+        return AvailabilitySlot.objects.filter(appointment_id=appointment_id).values(
+            'id', 'date',
+            doctor_id=F('shift__duty__doctor_id'),
+            hospital_id=F('shift__duty__hospital_id')
+        ).first()
+    
+    @staticmethod
+    def patient_id_for_user(user_id: int) -> Subquery:
+        """Slot patient profile id of a user, as an expression usable inside claim_slot's UPDATE"""
+        return Subquery(PatientProfile.objects.filter(user_id=user_id).values('id')[:1])
     
     @staticmethod
     def bulk_create_slots(slots_data: List[dict]) -> List[AvailabilitySlot]:
@@ -231,6 +530,207 @@ class AvailabilitySlotRepository:
         slots = [AvailabilitySlot(**data) for data in slots_data]
         return AvailabilitySlot.objects.bulk_create(slots, ignore_conflicts=True)
     
+    @staticmethod
+    def bulk_insert_slots(slots: List[AvailabilitySlot], batch_size: int = 1000) -> int:
+        """
+        Bulk insert prebuilt slot instances in batches, skipping existing ones.
+        
+        Keys already stored are dropped with one lookup before the insert;
+        ignore_conflicts still covers rows a concurrent writer adds meanwhile.
+        
+        Args:
+            slots: Unsaved AvailabilitySlot instances
+            batch_size: Rows per INSERT statement
+        
+        Returns:
+            Number of slots submitted for insert
+        """
+        if not slots:
+            return 0
+        existing = AvailabilitySlotRepository.get_existing_slot_keys(
+            {slot.shift_id for slot in slots},
+            min(slot.date for slot in slots),
+            max(slot.date for slot in slots)
+        )
+        new_slots = [
+            slot for slot in slots
+            if (slot.shift_id, slot.date, slot.start_time) not in existing
+        ]
+        AvailabilitySlot.objects.bulk_create(new_slots, batch_size=batch_size, ignore_conflicts=True)
+        return len(new_slots)
+    
+    @staticmethod
+    def get_daily_slot_counts(doctor_ids: Optional[Iterable[int]], start_date, end_date) -> Dict:
+        """
+        Aggregate slot counts per doctor and day in one grouped query.
+        
+        Args:
+            doctor_ids: Doctor ids to include, or None for every doctor
+            start_date: First date (inclusive)
+            end_date: Last date (inclusive), or None for no upper bound
+        
+        Returns:
+            Dictionary keyed by (doctor_id, date) with total/available/booked counts
+        """
+        queryset = AvailabilitySlot.objects.filter(date__gte=start_date)
+        if end_date is not None:
+            queryset = queryset.filter(date__lte=end_date)
+        if doctor_ids is not None:
+            queryset = queryset.filter(shift__duty__doctor_id__in=list(doctor_ids))
+        rows = queryset.values('shift__duty__doctor_id', 'date').annotate(
+            total=Count('id'),
+            available=Count('id', filter=Q(is_available=True, is_booked=False)),
+            booked=Count('id', filter=Q(is_booked=True))
+        ).order_by()
+        return {
+            (row['shift__duty__doctor_id'], row['date']): {
+                'total_slots': row['total'],
+                'available_slots': row['available'],
+                'booked_slots': row['booked'],
+            }
+            for row in rows
+        }
+    
+    @staticmethod
+    def get_utilization_rows(start_date, end_date, doctor_ids: Optional[Iterable[int]] = None,
+                             hospital_id: Optional[int] = None) -> List[Dict]:
+        """
+        Count offered slots (open or booked, masked ones excluded) per
+        appointment type, timing and booked state in one grouped query.
+        """
+        queryset = AvailabilitySlot.objects.filter(
+            date__gte=start_date, date__lte=end_date
+        ).filter(Q(is_available=True) | Q(is_booked=True))
+        if doctor_ids is not None:
+            queryset = queryset.filter(shift__duty__doctor_id__in=list(doctor_ids))
+        if hospital_id is not None:
+            queryset = queryset.filter(shift__duty__hospital_id=hospital_id)
+        return list(queryset.values(
+            'appointment_type', 'start_time', 'end_time', 'is_booked'
+        ).annotate(slots=Count('id')).order_by())
+    
+    @staticmethod
+    def get_hospital_slot_counts(hospital_id: int, date) -> Dict[int, Dict]:
+        """
+        Aggregate one day's slot counts per doctor for a hospital's shifts.
+        
+        Returns:
+            Dictionary keyed by doctor_id with total/available/booked counts
+        """
+        rows = AvailabilitySlot.objects.filter(
+            shift__duty__hospital_id=hospital_id,
+            date=date
+        ).values('shift__duty__doctor_id').annotate(
+            total=Count('id'),
+            available=Count('id', filter=Q(is_available=True, is_booked=False)),
+            booked=Count('id', filter=Q(is_booked=True))
+        ).order_by()
+        return {
+            row['shift__duty__doctor_id']: {
+                'total_slots': row['total'],
+                'available_slots': row['available'],
+                'booked_slots': row['booked'],
+            }
+            for row in rows
+        }
+    
+    @staticmethod
+    def get_date_bounds() -> Tuple:
+        """Get the (earliest, latest) slot dates, or (None, None) without slots"""
+        bounds = AvailabilitySlot.objects.aggregate(first=Min('date'), last=Max('date'))
+        return bounds['first'], bounds['last']
+    
+    @staticmethod
+    def mask_slots(doctor_ids: Iterable[int], start_date, end_date) -> int:
+        """Mark unbooked slots in a date range unavailable with a single UPDATE"""
+        return AvailabilitySlot.objects.filter(
+            shift__duty__doctor_id__in=list(doctor_ids),
+            date__gte=start_date,
+            date__lte=end_date,
+            is_booked=False,
+            is_available=True
+        ).update(is_available=False, updated_at=timezone.now())
+    
+    @staticmethod
+    def unmask_slots(doctor_ids: Iterable[int], start_date, end_date) -> int:
+        """
+        Make unbooked slots in a date range available again with a single UPDATE,
+        leaving days still covered by an approved leave or an unavailable override masked.
+        """
+        covering_leave = DoctorLeave.objects.filter(
+            doctor_id=OuterRef('shift__duty__doctor_id'),
+            status='APPROVED',
+            start_date__lte=OuterRef('date'),
+            end_date__gte=OuterRef('date')
+        )
+        unavailable_override = ScheduleOverride.objects.filter(
+            doctor_id=OuterRef('shift__duty__doctor_id'),
+            date=OuterRef('date'),
+            is_available=False
+        )
+        return AvailabilitySlot.objects.filter(
+            shift__duty__doctor_id__in=list(doctor_ids),
+            date__gte=start_date,
+            date__lte=end_date,
+            is_booked=False,
+            is_available=False
+        ).filter(
+            ~Exists(covering_leave),
+            ~Exists(unavailable_override)
+        ).update(is_available=True, updated_at=timezone.now())
+    
+    @staticmethod
+    def get_existing_slot_keys(shift_ids: Iterable[int], start_date, end_date) -> set:
+        """Get (shift_id, date, start_time) keys of slots already in a date range"""
+        return set(AvailabilitySlotRepository.existing_slot_keys_query(shift_ids, start_date, end_date))
+    
+    @staticmethod
+    def existing_slot_keys_query(shift_ids: Iterable[int], start_date, end_date):
+        """Values queryset behind get_existing_slot_keys"""
+        return AvailabilitySlot.objects.filter(
+            shift_id__in=list(shift_ids),
+            date__gte=start_date,
+            date__lte=end_date
+        ).values_list('shift_id', 'date', 'start_time')
+    
+    @staticmethod
+    def get_past_id_bounds(before_date) -> Tuple:
+        """Get the (lowest, highest) id of slots dated before a day, or (None, None)"""
+        bounds = AvailabilitySlot.objects.filter(date__lt=before_date).aggregate(
+            first=Min('id'), last=Max('id')
+        )
+        return bounds['first'], bounds['last']
+    
+    @staticmethod
+    def get_past_booked_rows(first_id: int, last_id: int, before_date) -> List[Dict]:
+        """Get the archive fields of booked slots in an id range dated before a day"""
+        return list(AvailabilitySlot.objects.filter(
+            id__gte=first_id,
+            id__lte=last_id,
+            date__lt=before_date,
+            is_booked=True
+        ).values(
+            'id', 'date', 'start_time', 'end_time', 'booked_by_id', 'appointment_id',
+            'shift__duty__doctor_id', 'shift__duty__hospital_id'
+        ))
+    
+    @staticmethod
+    def delete_past_slots(first_id: int, last_id: int, before_date, include_booked: bool = False) -> Tuple:
+        """
+        Delete slots in an id range dated before a day; booked slots only if asked.
+        
+        Returns:
+            (slots deleted, first date, last date) with (0, None, None) if nothing matched
+        """
+        queryset = AvailabilitySlot.objects.filter(id__gte=first_id, id__lte=last_id, date__lt=before_date)
+        if not include_booked:
+            queryset = queryset.filter(is_booked=False)
+        bounds = queryset.aggregate(first=Min('date'), last=Max('date'))
+        if bounds['first'] is None:
+            return 0, None, None
+        deleted = queryset.delete()[1].get(AvailabilitySlot._meta.label, 0)
+        return deleted, bounds['first'], bounds['last']
+    
     @staticmethod
     def delete_future_slots(shift, from_date) -> int:
         """Delete future slots for a shift"""
@@ -285,6 +785,16 @@ class DoctorLeaveRepository:
             end_date__gte=today
         )
     
+    @staticmethod
+    def get_approved_leaves_in_range(doctor_ids: Iterable[int], start_date, end_date) -> List[DoctorLeave]:
+        """Get approved leaves overlapping a date range for several doctors"""
+        return list(DoctorLeave.objects.filter(
+            doctor_id__in=list(doctor_ids),
+            status='APPROVED',
+            start_date__lte=end_date,
+            end_date__gte=start_date
+        ).only('id', 'doctor_id', 'start_date', 'end_date'))
+    
     @staticmethod
     def get_pending_leaves(hospital=None) -> List[DoctorLeave]:
         """Get pending leave requests"""
@@ -370,6 +880,16 @@ class ScheduleOverrideRepository:
         except ScheduleOverride.DoesNotExist:
             return None
     
+    @staticmethod
+    def get_overrides_in_range(doctor_ids: Iterable[int], start_date, end_date) -> Dict:
+        """Get overrides in a date range keyed by (doctor_id, date)"""
+        overrides = ScheduleOverride.objects.filter(
+            doctor_id__in=list(doctor_ids),
+            date__gte=start_date,
+            date__lte=end_date
+        )
+        return {(override.doctor_id, override.date): override for override in overrides}
+    
     @staticmethod
     def get_doctor_overrides(doctor, from_date=None) -> List[ScheduleOverride]:
         """Get overrides for a doctor"""
@@ -389,4 +909,521 @@ class ScheduleOverrideRepository:
     @staticmethod
     def delete_override(override: ScheduleOverride):
         """Delete override"""
-        override.delete()
\ No newline at end of file
+        override.delete()
+
+
+class SlotInvalidationRepository:
+    """Repository for SlotInvalidation model operations"""
+    
+    @staticmethod
+    def create_invalidation(doctor_id: int, start_date, end_date) -> SlotInvalidation:
+        """Record a date range whose slots must be re-materialised"""
+        return SlotInvalidation.objects.create(
+            doctor_id=doctor_id,
+            start_date=start_date,
+            end_date=end_date
+        )
+    
+    @staticmethod
+    def get_pending(doctor_ids: Iterable[int] = None) -> List[SlotInvalidation]:
+        """Get pending invalidations, optionally for a subset of doctors"""
+        queryset = SlotInvalidation.objects.all()
+        if doctor_ids is not None:
+            queryset = queryset.filter(doctor_id__in=list(doctor_ids))
+        return list(queryset.order_by('doctor_id', 'start_date'))
+    
+    @staticmethod
+    def delete_by_ids(invalidation_ids: Iterable[int]) -> int:
+        """Delete processed invalidations"""
+        return SlotInvalidation.objects.filter(id__in=list(invalidation_ids)).delete()[0]
+
+
+class DoctorDailyAvailabilityRepository:
+    """Repository for the DoctorDailyAvailability rollup"""
+    
+    COUNT_FIELDS = ('total_slots', 'available_slots', 'booked_slots')
+    
+    @staticmethod
+    def get_range(doctor, start_date, end_date):
+        """Get rollup rows for a doctor in a date range, ordered by date"""
+        return DoctorDailyAvailability.objects.filter(
+            doctor=doctor,
+            date__gte=start_date,
+            date__lte=end_date
+        ).order_by('date')
+    
+    @staticmethod
+    def get_totals(doctor, start_date, end_date) -> Dict:
+        """Sum the rollup for a doctor over a date range in one query"""
+        totals = DoctorDailyAvailability.objects.filter(
+            doctor=doctor,
+            date__gte=start_date,
+            date__lte=end_date
+        ).aggregate(
+            total=Sum('total_slots'),
+            available=Sum('available_slots'),
+            booked=Sum('booked_slots'),
+            days=Count('id', filter=Q(total_slots__gt=0))
+        )
+        return {
+            'total_slots': totals['total'] or 0,
+            'available_slots': totals['available'] or 0,
+            'booked_slots': totals['booked'] or 0,
+            'working_days': totals['days'],
+        }
+    
+    @staticmethod
+    def get_low_availability(start_date, end_date, threshold: float,
+                             specialization_thresholds: Optional[Dict[str, float]] = None):
+        """
+        Per-doctor totals for doctors whose available share is below their threshold.
+        
+        One grouped query over the rollup, joined to the doctor and user so
+        the caller can notify without further lookups.
+        
+        Args:
+            start_date: First date of the window
+            end_date: Last date of the window
+            threshold: Default available/total ratio below which a doctor is reported
+            specialization_thresholds: Optional per-specialization ratios overriding the default
+        
+        Returns:
+            Rows with doctor_id, contact fields, specialization, total and available
+        """
+        doctor_threshold = Case(
+            *[
+                When(doctor__specialization=specialization, then=Value(float(value)))
+                for specialization, value in (specialization_thresholds or {}).items()
+            ],
+            default=Value(float(threshold)),
+            output_field=FloatField()
+        )
+        return DoctorDailyAvailability.objects.filter(
+            date__gte=start_date,
+            date__lte=end_date,
+            doctor__user__is_active=True
+        ).values(
+            'doctor_id',
+            'doctor__specialization',
+            'doctor__user__email',
+            'doctor__user__first_name',
+            'doctor__user__last_name'
+        ).annotate(
+            total=Sum('total_slots'),
+            available=Sum('available_slots')
+        ).filter(
+            total__gt=0,
+            available__lt=ExpressionWrapper(F('total') * doctor_threshold, output_field=FloatField())
+        ).order_by('doctor_id')
+    
+    @staticmethod
+    def get_counts(doctor_ids: Optional[Iterable[int]], start_date, end_date) -> Dict:
+        """Rollup counts keyed by (doctor_id, date), shaped like get_daily_slot_counts"""
+        queryset = DoctorDailyAvailability.objects.filter(date__gte=start_date, date__lte=end_date)
+        if doctor_ids is not None:
+            queryset = queryset.filter(doctor_id__in=list(doctor_ids))
+        return {
+            (row['doctor_id'], row['date']): {
+                field: row[field] for field in DoctorDailyAvailabilityRepository.COUNT_FIELDS
+            }
+            for row in queryset.values('doctor_id', 'date', *DoctorDailyAvailabilityRepository.COUNT_FIELDS)
+        }
+    
+    @staticmethod
+    def replace_range(doctor_ids: Optional[Iterable[int]], start_date, end_date, counts: Dict) -> int:
+        """
+        Replace the rollup rows of a range with freshly aggregated counts.
+        
+        Rows for days that no longer have slots are deleted; the rest are
+        written with a single upsert.
+        
+        Args:
+            doctor_ids: Doctor ids covered by ``counts``, or None for every doctor
+            start_date: First date (inclusive)
+            end_date: Last date (inclusive), or None for no upper bound
+            counts: Output of AvailabilitySlotRepository.get_daily_slot_counts
+        
+        Returns:
+            Number of rows written
+        """
+        stale = DoctorDailyAvailability.objects.filter(date__gte=start_date)
+        if end_date is not None:
+            stale = stale.filter(date__lte=end_date)
+        if doctor_ids is not None:
+            stale = stale.filter(doctor_id__in=list(doctor_ids))
+        stale.delete()
+        
+        rows = [
+            DoctorDailyAvailability(doctor_id=doctor_id, date=date, **day_counts)
+            for (doctor_id, date), day_counts in counts.items()
+        ]
+        DoctorDailyAvailability.objects.bulk_create(
+            rows,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['doctor', 'date'],
+            update_fields=list(DoctorDailyAvailabilityRepository.COUNT_FIELDS) + ['updated_at']
+        )
+        return len(rows)
+    
+    @staticmethod
+    def delete_outside(start_date, end_date) -> int:
+        """Delete rollup rows outside a date range (all rows when the range is empty)"""
+        queryset = DoctorDailyAvailability.objects.all()
+        if start_date is not None and end_date is not None:
+            queryset = queryset.exclude(date__gte=start_date, date__lte=end_date)
+        return queryset.delete()[0]
+
+
+class ScheduleExportRepository:
+    """Streaming-friendly querysets for schedule and reminder exports"""
+    
+    SCHEDULE_FIELDS = (
+        'id', 'title', 'description', 'status', 'priority', 'start_time', 'end_time',
+        'doctor_id', 'doctor__user__first_name', 'doctor__user__last_name',
+        'patient_id', 'patient__user__first_name', 'patient__user__last_name',
+        'category__name',
+    )
+    
+    REMINDER_FIELDS = (
+        'id', 'reminder_type', 'send_time', 'is_sent',
+        'schedule_id', 'schedule__title', 'schedule__status',
+        'schedule__start_time', 'schedule__end_time',
+        'schedule__doctor_id', 'schedule__doctor__user__first_name', 'schedule__doctor__user__last_name',
+        'schedule__patient__user__first_name', 'schedule__patient__user__last_name',
+    )
+    
+    @staticmethod
+    def _filter(queryset, prefix: str, doctor_id=None, hospital_id=None, start=None, end=None):
+        """Apply the shared export filters; ``prefix`` points at the Schedule relation"""
+        if doctor_id is not None:
+            queryset = queryset.filter(**{f'{prefix}doctor_id': doctor_id})
+        if hospital_id is not None:
+            queryset = queryset.filter(**{
+                f'{prefix}doctor_id__in': Duty.objects.filter(hospital_id=hospital_id).values('doctor_id')
+            })
+        if start is not None:
+            queryset = queryset.filter(**{f'{prefix}start_time__gte': start})
+        if end is not None:
+            queryset = queryset.filter(**{f'{prefix}start_time__lt': end})
+        return queryset
+    
+    @staticmethod
+    def get_schedule_rows(doctor_id=None, hospital_id=None, start=None, end=None):
+        """Schedule rows as dictionaries, ordered by start time"""
+        queryset = ScheduleExportRepository._filter(
+            Schedule.objects.all(), '', doctor_id, hospital_id, start, end
+        )
+        return queryset.order_by('start_time', 'id').values(*ScheduleExportRepository.SCHEDULE_FIELDS)
+    
+    @staticmethod
+    def get_reminder_rows(doctor_id=None, hospital_id=None, start=None, end=None):
+        """Reminder rows with their schedule as dictionaries, ordered by schedule start time"""
+        queryset = ScheduleExportRepository._filter(
+            ScheduleReminder.objects.all(), 'schedule__', doctor_id, hospital_id, start, end
+        )
+        return queryset.order_by('schedule__start_time', 'id').values(*ScheduleExportRepository.REMINDER_FIELDS)
+
+
+class ScheduleReminderRepository:
+    """Due-reminder claims for the batch dispatcher"""
+    
+    @staticmethod
+    def _due(now, first_bucket: int, last_bucket: int, reminder_types: Iterable[str], stale_before):
+        """Unsent reminders due by ``now`` within a bucket range, unclaimed or with an expired claim"""
+        return ScheduleReminder.objects.filter(
+            is_sent=False,
+            send_bucket__gte=first_bucket,
+            send_bucket__lte=last_bucket,
+            send_time__lte=now,
+            reminder_type__in=list(reminder_types)
+        ).filter(
+            Q(claim_token__isnull=True) | Q(claimed_at__lt=stale_before)
+        )
+    
+    @staticmethod
+    def claim_due(token, now, first_bucket: int, last_bucket: int, reminder_types: Iterable[str],
+                  stale_before, batch_size: int) -> int:
+        """
+        Claim up to batch_size due reminders with one conditional UPDATE.
+        
+        The claim predicate is repeated on the updated rows, so two workers
+        racing for the same reminder cannot both end up holding it.
+        
+        Returns:
+            Number of reminders claimed under ``token``
+        """
+        due = ScheduleReminderRepository._due(now, first_bucket, last_bucket, reminder_types, stale_before)
+        batch = due.order_by('send_bucket', 'send_time').values('id')[:batch_size]
+        return due.filter(id__in=Subquery(batch)).update(claim_token=token, claimed_at=now)
+    
+    @staticmethod
+    def get_claimed(token) -> List[ScheduleReminder]:
+        """Get the reminders held by a claim, with schedule, patient and doctor loaded"""
+        return list(ScheduleReminder.objects.filter(claim_token=token).select_related(
+            'schedule__patient__user', 'schedule__doctor__user'
+        ).order_by('send_time'))
+    
+    @staticmethod
+    def mark_sent(token, now) -> int:
+        """Mark every reminder held by a claim as sent"""
+        return ScheduleReminder.objects.filter(claim_token=token).update(
+            is_sent=True, sent_at=now, claim_token=None
+        )
+    
+    @staticmethod
+    def release(token) -> int:
+        """Give up a claim so the next run picks the reminders up again"""
+        return ScheduleReminder.objects.filter(claim_token=token).update(claim_token=None, claimed_at=None)
+
+
+class ArchivedSlotRepository:
+    """Repository for ArchivedSlot model operations"""
+    
+    @staticmethod
+    def archive(rows: List[Dict]) -> int:
+        """Store slot rows from get_past_booked_rows; already archived slots are skipped"""
+        created = ArchivedSlot.objects.bulk_create([
+            ArchivedSlot(
+                slot_id=row['id'],
+                month=row['date'].replace(day=1),
+                date=row['date'],
+                start_time=row['start_time'],
+                end_time=row['end_time'],
+                doctor_id=row['shift__duty__doctor_id'],
+                hospital_id=row['shift__duty__hospital_id'],
+                patient_id=row['booked_by_id'],
+                appointment_id=row['appointment_id']
+            )
+            for row in rows
+        ], ignore_conflicts=True)
+        return len(created)
+    
+    @staticmethod
+    def get_month(month, doctor_id: Optional[int] = None):
+        """Get archived slots for the month containing a date"""
+        queryset = ArchivedSlot.objects.filter(month=month.replace(day=1))
+        if doctor_id is not None:
+            queryset = queryset.filter(doctor_id=doctor_id)
+        return queryset.order_by('date', 'start_time')
+
+
+class EarliestSlotIndexRepository:
+    """Repository for the EarliestSlotIndex lookup table"""
+    
+    @staticmethod
+    def get_next_free_slots(doctor_ids: Optional[Iterable[int]], from_date, per_doctor: int):
+        """
+        The first ``per_doctor`` free slots of each (doctor, hospital) from a date on.
+        
+        One query: slots are ranked with ROW_NUMBER() per doctor and hospital,
+        and rating / experience come from doctors.DoctorProfile through a
+        subquery on the shared user account.
+        """
+        directory = DoctorDirectoryProfile.objects.filter(user_id=OuterRef('shift__duty__doctor__user_id'))
+        queryset = AvailabilitySlot.objects.filter(
+            date__gte=from_date,
+            is_available=True,
+            is_booked=False,
+            shift__is_active=True,
+            shift__duty__is_active=True
+        )
+        if doctor_ids is not None:
+            queryset = queryset.filter(shift__duty__doctor_id__in=list(doctor_ids))
+        return queryset.annotate(
+            position=Window(
+                RowNumber(),
+                partition_by=[F('shift__duty__doctor_id'), F('shift__duty__hospital_id')],
+                order_by=[F('date').asc(), F('start_time').asc()]
+            ),
+            rating=Subquery(directory.values('rating')[:1]),
+            experience_years=Subquery(directory.values('experience_years')[:1])
+        ).filter(position__lte=per_doctor).values(
+            'id', 'date', 'start_time', 'rating', 'experience_years',
+            doctor_id=F('shift__duty__doctor_id'),
+            hospital_id=F('shift__duty__hospital_id'),
+            specialization=F('shift__duty__doctor__specialization')
+        )
+    
+    @staticmethod
+    def replace_for_doctors(doctor_ids: Optional[Iterable[int]], rows) -> int:
+        """Replace the index entries of some doctors (None = all) with ``rows``"""
+        stale = EarliestSlotIndex.objects.all()
+        if doctor_ids is not None:
+            stale = stale.filter(doctor_id__in=list(doctor_ids))
+        stale.delete()
+        
+        entries = [
+            EarliestSlotIndex(
+                specialization=row['specialization'],
+                hospital_id=row['hospital_id'],
+                date=row['date'],
+                start_time=row['start_time'],
+                doctor_id=row['doctor_id'],
+                slot_id=row['id'],
+                rating=row['rating'] or 0.0,
+                experience_years=row['experience_years'] or 0
+            )
+            for row in rows
+        ]
+        EarliestSlotIndex.objects.bulk_create(entries, batch_size=1000)
+        return len(entries)
+    
+    @staticmethod
+    def delete_stale(today) -> int:
+        """Delete entries for past days or for doctors without an active duty"""
+        return EarliestSlotIndex.objects.filter(
+            Q(date__lt=today) |
+            ~Exists(Duty.objects.filter(doctor_id=OuterRef('doctor_id'), is_active=True))
+        ).delete()[0]
+    
+    @staticmethod
+    def search(specialization: str, after_date, after_time, end_date, limit: int,
+               hospital_id: Optional[int] = None, min_rating: Optional[float] = None,
+               min_experience: Optional[int] = None):
+        """
+        Earliest indexed slots for a specialization, ordered by date and time.
+        
+        Uses the (specialization[, hospital], date, start_time) indexes; slots
+        that already started today are skipped.
+        """
+        queryset = EarliestSlotIndex.objects.filter(
+            specialization=specialization,
+            date__lte=end_date
+        ).filter(
+            Q(date__gt=after_date) | Q(date=after_date, start_time__gte=after_time)
+        )
+        if hospital_id is not None:
+            queryset = queryset.filter(hospital_id=hospital_id)
+        if min_rating is not None:
+            queryset = queryset.filter(rating__gte=min_rating)
+        if min_experience is not None:
+            queryset = queryset.filter(experience_years__gte=min_experience)
+        return queryset.select_related('doctor__user', 'hospital').order_by('date', 'start_time', 'id')[:limit]
+
+
+class ChangeLogRepository:
+    """Repository for the ChangeLogEntry delta-sync feed"""
+    
+    SLOT_FIELDS = (
+        'id', 'shift_id', 'date', 'start_time', 'end_time', 'is_available', 'is_booked',
+        'appointment_type', 'shift__duty__doctor_id', 'shift__duty__hospital_id'
+    )
+    SCHEDULE_FIELDS = (
+        'id', 'title', 'doctor_id', 'patient_id', 'category_id', 'start_time', 'end_time',
+        'status', 'priority', 'is_recurring', 'recurrence_pattern', 'updated_at'
+    )
+    APPOINTMENT_FIELDS = ('id', 'doctor_id', 'patient_id', 'scheduled_time', 'status', 'updated_at')
+    
+    # Doctor ranges OR-ed into one slot query
+    RANGE_BATCH = 50
+    
+    @staticmethod
+    def record(entries: List[ChangeLogEntry]) -> None:
+        """Append entries in one insert"""
+        ChangeLogEntry.objects.bulk_create(entries)
+    
+    @staticmethod
+    def owner_user_id(model, pk: int) -> Subquery:
+        """user_id of a profile row, as an expression resolved inside record's INSERT"""
+        return Subquery(model.objects.filter(pk=pk).values('user_id')[:1])
+    
+    @staticmethod
+    def get_head(created_before=None) -> int:
+        """Id of the newest entry (optionally created before a cutoff), 0 for an empty log"""
+        queryset = ChangeLogEntry.objects.all()
+        if created_before is not None:
+            queryset = queryset.filter(created_at__lt=created_before)
+        return queryset.aggregate(head=Max('id'))['head'] or 0
+    
+    @staticmethod
+    def get_after(since: int, limit: int, user_id: Optional[int] = None, created_before=None) -> List[Dict]:
+        """
+        Entries after a token in id order.
+        
+        With user_id, only slot ranges and the user's own schedules and
+        appointments are returned.
+        """
+        queryset = ChangeLogEntry.objects.filter(id__gt=since)
+        if user_id is not None:
+            queryset = queryset.filter(
+                Q(object_type=ChangeLogEntry.ObjectType.SLOTS) |
+                Q(doctor_user_id=user_id) | Q(patient_user_id=user_id)
+            )
+        if created_before is not None:
+            queryset = queryset.filter(created_at__lt=created_before)
+        return list(queryset.order_by('id').values(
+            'id', 'object_type', 'object_id', 'action', 'start_date', 'end_date'
+        )[:limit])
+    
+    @staticmethod
+    def get_slots(ranges: Dict[int, Tuple], hospital_id: Optional[int] = None) -> List[Dict]:
+        """
+        Current slots for {doctor_id: (start_date, end_date or None)} ranges.
+        
+        Doctors sharing a range are matched with one IN clause.
+        """
+        by_range = {}
+        for doctor_id, date_range in ranges.items():
+            by_range.setdefault(date_range, []).append(doctor_id)
+        
+        conditions = []
+        for (start_date, end_date), doctor_ids in by_range.items():
+            condition = Q(shift__duty__doctor_id__in=doctor_ids, date__gte=start_date)
+            if end_date is not None:
+                condition &= Q(date__lte=end_date)
+            conditions.append(condition)
+        
+        rows = []
+        for index in range(0, len(conditions), ChangeLogRepository.RANGE_BATCH):
+            combined = Q()
+            for condition in conditions[index:index + ChangeLogRepository.RANGE_BATCH]:
+                combined |= condition
+            queryset = AvailabilitySlot.objects.filter(combined)
+            if hospital_id is not None:
+                queryset = queryset.filter(shift__duty__hospital_id=hospital_id)
+            rows.extend(queryset.order_by('date', 'start_time', 'id').values(*ChangeLogRepository.SLOT_FIELDS))
+        return rows
+    
+    @staticmethod
+    def get_schedules(schedule_ids: Iterable[int]) -> List[Dict]:
+        """Current state of schedules by id"""
+        return list(
+            Schedule.objects.filter(id__in=list(schedule_ids)).order_by('id')
+            .values(*ChangeLogRepository.SCHEDULE_FIELDS)
+        )
+    
+    @staticmethod
+    def get_appointments(appointment_ids: Iterable[int]) -> List[Dict]:
+        """Current state of appointments by id"""
+        return list(
+            Appointment.objects.filter(id__in=list(appointment_ids)).order_by('id')
+            .values(*ChangeLogRepository.APPOINTMENT_FIELDS)
+        )
+    
+    @staticmethod
+    def get_id_bounds(before_id: int) -> Tuple[Optional[int], Optional[int]]:
+        """Smallest and largest entry id below a token"""
+        bounds = ChangeLogEntry.objects.filter(id__lt=before_id).aggregate(first=Min('id'), last=Max('id'))
+        return bounds['first'], bounds['last']
+    
+    @staticmethod
+    def delete_superseded(first_id: int, last_id: int) -> int:
+        """
+        Delete entries in an id range that a later entry makes redundant.
+        
+        A later entry for the same object supersedes an earlier one; for slot
+        ranges the later range must also cover the earlier one.
+        """
+        later = ChangeLogEntry.objects.filter(
+            object_type=OuterRef('object_type'),
+            object_id=OuterRef('object_id'),
+            id__gt=OuterRef('id')
+        ).filter(
+            Q(start_date__isnull=True) | Q(start_date__lte=OuterRef('start_date'))
+        ).filter(
+            Q(end_date__isnull=True) | Q(end_date__gte=OuterRef('end_date'))
+        )
+        return ChangeLogEntry.objects.filter(
+            id__gte=first_id, id__lte=last_id
+        ).filter(Exists(later)).delete()[0]
@@ -9,6 +9,8 @@ from rest_framework import serializers
 from django.utils import timezone
 from datetime import datetime, timedelta
 from .models import Duty, Shift, AvailabilitySlot, DoctorLeave, ScheduleOverride, ScheduleCategory, Schedule, ScheduleReminder
+from .services import ShiftConflictService
+from .utils import parse_recurrence, parse_appointment_mix
 
 
 class DutySerializer(serializers.ModelSerializer):
@@ -64,6 +66,7 @@ class ShiftSerializer(serializers.ModelSerializer):
             'id', 'duty', 'duty_details', 'day_of_week', 'day_name',
             'start_time', 'end_time', 'max_appointments',
             'break_start', 'break_end', 'is_active',
+            'rotation_cycle_weeks', 'rotation_week_index', 'appointment_mix',
             'duration_minutes', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
@@ -72,6 +75,14 @@ class ShiftSerializer(serializers.ModelSerializer):
         """Get shift duration in minutes"""
         return obj.duration_minutes()
     
+    def validate_appointment_mix(self, value):
+        """Validate the variable-length slot mix"""
+        try:
+            parse_appointment_mix(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+    
     def validate(self, attrs):
         """Validate shift times"""
         start_time = attrs.get('start_time')
@@ -96,7 +107,34 @@ class ShiftSerializer(serializers.ModelSerializer):
                         'break_start': "Break must be within shift hours"
                     })
         
+        cycle_weeks = attrs.get('rotation_cycle_weeks', getattr(self.instance, 'rotation_cycle_weeks', 1))
+        week_index = attrs.get('rotation_week_index', getattr(self.instance, 'rotation_week_index', 0))
+        if week_index >= cycle_weeks:
+            raise serializers.ValidationError({
+                'rotation_week_index': "Rotation week must be within the rotation cycle"
+            })
+        
+        self._check_conflicts(attrs)
         return attrs
+    
+    def _check_conflicts(self, attrs):
+        """Reject shifts that overlap the doctor's other active shifts"""
+        def current(field):
+            return attrs.get(field, getattr(self.instance, field, None))
+        
+        duty = current('duty')
+        day_of_week, start_time, end_time = current('day_of_week'), current('start_time'), current('end_time')
+        if duty is None or day_of_week is None or not (start_time and end_time) or current('is_active') is False:
+            return
+        
+        conflicts = ShiftConflictService.check(
+            duty,
+            [(day_of_week, start_time, end_time,
+              current('rotation_cycle_weeks') or 1, current('rotation_week_index') or 0)],
+            exclude_shift_id=self.instance.id if self.instance else None
+        )
+        if conflicts:
+            raise serializers.ValidationError(ShiftConflictService.format_message(conflicts))
 
 
 class ShiftCreateSerializer(serializers.Serializer):
@@ -150,7 +188,7 @@ class AvailabilitySlotSerializer(serializers.ModelSerializer):
         model = AvailabilitySlot
         fields = [
             'id', 'shift', 'doctor_name', 'hospital_name',
-            'date', 'start_time', 'end_time',
+            'date', 'start_time', 'end_time', 'appointment_type',
             'is_available', 'is_booked', 'booked_by', 'booked_by_name',
             'appointment', 'created_at', 'updated_at'
         ]
@@ -408,6 +446,13 @@ class ScheduleSerializer(serializers.ModelSerializer):
         if doctor and patient and doctor == patient:
             raise serializers.ValidationError("Doctor and patient cannot be the same")
         
+        # Validate recurrence rule
+        if data.get('is_recurring'):
+            try:
+                parse_recurrence(data.get('recurrence_pattern'))
+            except ValueError as e:
+                raise serializers.ValidationError({'recurrence_pattern': str(e)})
+        
         return data
 
 class ScheduleReminderSerializer(serializers.ModelSerializer):
@@ -5,16 +5,40 @@ Business logic layer for schedule management.
 Handles duty assignments, shift creation, slot generation, and leave management.
 """
 
-from django.db import transaction
+import csv
+import heapq
+import logging
+import time as _time
+from collections import defaultdict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, connection, connections, transaction
 from django.utils import timezone
 from datetime import datetime, timedelta, time
-from typing import List, Tuple, Optional, Dict
-from .models import Duty, Shift, AvailabilitySlot, DoctorLeave, ScheduleOverride
+from typing import List, Tuple, Optional, Dict, Iterable, Iterator, NamedTuple
+from uuid import uuid4
+from .models import (
+    Duty, Shift, AvailabilitySlot, DoctorLeave, ScheduleOverride, Schedule, RotationTemplate, ChangeLogEntry
+)
 from .repositories import (
     DutyRepository, ShiftRepository, AvailabilitySlotRepository,
-    DoctorLeaveRepository, ScheduleOverrideRepository
+    DoctorLeaveRepository, ScheduleOverrideRepository, SlotInvalidationRepository,
+    DoctorDailyAvailabilityRepository, ScheduleExportRepository, EarliestSlotIndexRepository,
+    ArchivedSlotRepository, ScheduleReminderRepository, RosterRepository, RotationTemplateRepository,
+    ChangeLogRepository
+)
+from .utils import (
+    QueryCounter, build_slot_template, Echo, ics_event, iter_ics_calendar,
+    parse_recurrence, iter_occurrences, ShiftInterval, find_overlaps, time_to_minutes, minutes_to_time,
+    epoch_hour, runs_on, rotation_week, shift_runs_on, parse_appointment_mix, pack_slot_template,
+    merge_config
 )
 
+logger = logging.getLogger(__name__)
+
 
 class DutyService:
     """Service for managing doctor duties"""
@@ -84,14 +108,30 @@ class DutyService:
 class ShiftService:
     """Service for managing work shifts"""
     
+    # Fields whose change invalidates the shift's future slots
+    TIMING_FIELDS = (
+        'day_of_week', 'start_time', 'end_time', 'break_start', 'break_end', 'is_active',
+        'rotation_cycle_weeks', 'rotation_week_index', 'appointment_mix'
+    )
+    
     @staticmethod
     @transaction.atomic
-    def create_shift(duty_id: int, day_of_week: int, start_time, end_time, **kwargs) -> Tuple[bool, str, Optional[Shift]]:
-        """Create a new shift"""
+    def create_shift(duty_id: int, day_of_week: int, start_time, end_time,
+                     allow_overlap: bool = False, **kwargs) -> Tuple[bool, str, Optional[Shift]]:
+        """Create a new shift, refusing overlaps with the doctor's other shifts unless allow_overlap"""
         duty = DutyRepository.get_by_id(duty_id)
         if not duty:
             return False, "Duty not found", None
         
+        if not allow_overlap:
+            conflicts = ShiftConflictService.check(duty, [(
+                day_of_week, start_time, end_time,
+                kwargs.get('rotation_cycle_weeks', 1),
+                kwargs.get('rotation_week_index', 0)
+            )])
+            if conflicts:
+                return False, ShiftConflictService.format_message(conflicts), None
+        
         shift = ShiftRepository.create_shift(
             duty=duty,
             day_of_week=day_of_week,
@@ -105,7 +145,8 @@ class ShiftService:
     @staticmethod
     @transaction.atomic
     def create_multiple_shifts(duty_id: int, days_of_week: List[int], 
-                               start_time, end_time, **kwargs) -> Tuple[bool, str, List[Shift]]:
+                               start_time, end_time, allow_overlap: bool = False,
+                               **kwargs) -> Tuple[bool, str, List[Shift]]:
         """
         Create shifts for multiple days of the week.
         
@@ -114,6 +155,7 @@ class ShiftService:
             days_of_week: List of day numbers (0-6)
             start_time: Shift start time
             end_time: Shift end time
+            allow_overlap: Skip the check against the doctor's other shifts
             **kwargs: Additional shift fields
         
         Returns:
@@ -123,6 +165,18 @@ class ShiftService:
         if not duty:
             return False, "Duty not found", []
         
+        if not allow_overlap:
+            conflicts = ShiftConflictService.check(duty, [
+                (
+                    day, start_time, end_time,
+                    kwargs.get('rotation_cycle_weeks', 1),
+                    kwargs.get('rotation_week_index', 0)
+                )
+                for day in days_of_week
+            ])
+            if conflicts:
+                return False, ShiftConflictService.format_message(conflicts), []
+        
         shifts_data = []
         for day in days_of_week:
             shifts_data.append({
@@ -148,13 +202,37 @@ class ShiftService:
     
     @staticmethod
     @transaction.atomic
-    def update_shift(shift_id: int, **fields) -> Tuple[bool, str, Optional[Shift]]:
-        """Update a shift"""
+    def update_shift(shift_id: int, allow_overlap: bool = False, **fields) -> Tuple[bool, str, Optional[Shift]]:
+        """Update a shift, refusing overlaps with the doctor's other shifts unless allow_overlap"""
         shift = ShiftRepository.get_by_id(shift_id)
         if not shift:
             return False, "Shift not found", None
         
+        timing_changed = any(
+            field in ShiftService.TIMING_FIELDS and getattr(shift, field) != value
+            for field, value in fields.items()
+        )
+        
+        if timing_changed and not allow_overlap and fields.get('is_active', shift.is_active):
+            conflicts = ShiftConflictService.check(
+                shift.duty,
+                [(
+                    fields.get('day_of_week', shift.day_of_week),
+                    fields.get('start_time', shift.start_time),
+                    fields.get('end_time', shift.end_time),
+                    fields.get('rotation_cycle_weeks', shift.rotation_cycle_weeks),
+                    fields.get('rotation_week_index', shift.rotation_week_index)
+                )],
+                exclude_shift_id=shift.id
+            )
+            if conflicts:
+                return False, ShiftConflictService.format_message(conflicts), None
+        
         updated_shift = ShiftRepository.update_shift(shift, **fields)
+        
+        if timing_changed:
+            SlotHorizonService.rebuild_shift(updated_shift)
+        
         return True, "Shift updated successfully", updated_shift
     
     @staticmethod
@@ -168,472 +246,2647 @@ class ShiftService:
         # Delete future unbooked slots
         today = timezone.now().date()
         AvailabilitySlotRepository.delete_future_slots(shift, today)
+        SlotChangeService.slots_changed(
+            [shift.duty.doctor_id], today, None, hospital_ids=[shift.duty.hospital_id]
+        )
         
         ShiftRepository.delete_shift(shift)
         return True, "Shift deleted successfully"
 
 
-class AvailabilitySlotService:
-    """Service for managing availability slots"""
+class ShiftConflictService:
+    """
+    Detects overlapping weekly shifts of the same doctor, across all of the
+    doctor's duties and hospitals.
+    
+    Shifts are compared as minute intervals per (doctor, weekday) with a
+    sweep line (utils.find_overlaps); two shifts only clash when their
+    duties' date ranges overlap as well.
+    """
+    
+    DAY_NAMES = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
     
     @staticmethod
-    @transaction.atomic
-    def generate_slots_for_shift(shift_id: int, start_date, end_date, 
-                                 slot_duration_minutes: int = 30) -> Tuple[bool, str, int]:
-        """
-        Generate availability slots for a shift.
-        
-        Args:
-            shift_id: Shift ID
-            start_date: Start date for slot generation
-            end_date: End date for slot generation
-            slot_duration_minutes: Duration of each slot in minutes
-        
-        Returns:
-            Tuple of (success, message, slots_created_count)
-        """
-        shift = ShiftRepository.get_by_id(shift_id)
-        if not shift:
-            return False, "Shift not found", 0
-        
-        # Generate slots for each occurrence of the shift day
-        slots_data = []
-        current_date = start_date
-        
-        while current_date <= end_date:
-            # Check if this date matches the shift's day of week
-            if current_date.weekday() == shift.day_of_week:
-                # Check for overrides
-                override = ScheduleOverrideRepository.get_override_for_date(
-                    shift.duty.doctor, current_date
-                )
-                
-                if override and not override.is_available:
-                    # Skip this date
-                    current_date += timedelta(days=1)
-                    continue
-                
-                # Check for leaves
-                leaves = DoctorLeaveRepository.get_active_leaves(shift.duty.doctor)
-                is_on_leave = any(
-                    leave.start_date <= current_date <= leave.end_date
-                    for leave in leaves
-                )
-                
-                if is_on_leave:
-                    current_date += timedelta(days=1)
-                    continue
-                
-                # Generate time slots
-                current_time = shift.start_time
-                end_time = shift.end_time
-                
-                while True:
-                    # Calculate slot end time
-                    slot_end = (
-                        datetime.combine(current_date, current_time) + 
-                        timedelta(minutes=slot_duration_minutes)
-                    ).time()
-                    
-                    # Check if slot end exceeds shift end
-                    if slot_end > end_time:
-                        break
-                    
-                    # Skip break time
-                    if shift.break_start and shift.break_end:
-                        if not (slot_end <= shift.break_start or current_time >= shift.break_end):
-                            current_time = (
-                                datetime.combine(current_date, current_time) + 
-                                timedelta(minutes=slot_duration_minutes)
-                            ).time()
-                            continue
-                    
-                    slots_data.append({
-                        'shift': shift,
-                        'date': current_date,
-                        'start_time': current_time,
-                        'end_time': slot_end,
-                        'is_available': True,
-                        'is_booked': False
-                    })
-                    
-                    # Move to next slot
-                    current_time = slot_end
-            
-            current_date += timedelta(days=1)
-        
-        # Bulk create slots
-        created_slots = AvailabilitySlotRepository.bulk_create_slots(slots_data)
+    def to_interval(row: Dict) -> ShiftInterval:
+        """Build an interval from a ShiftRepository.get_interval_rows row"""
+        return ShiftInterval(
+            shift_id=row['id'],
+            doctor_id=row['duty__doctor_id'],
+            hospital_id=row['duty__hospital_id'],
+            day_of_week=row['day_of_week'],
+            start=time_to_minutes(row['start_time']),
+            end=time_to_minutes(row['end_time']),
+            valid_from=row['duty__start_date'],
+            valid_until=row['duty__end_date'],
+            cycle_weeks=row['rotation_cycle_weeks'],
+            week_index=row['rotation_week_index']
+        )
+    
+    @staticmethod
+    def describe(first: ShiftInterval, second: ShiftInterval) -> Dict:
+        """Turn an overlapping pair into a serialisable conflict entry"""
+        def window(interval):
+            return f"{minutes_to_time(interval.start):%H:%M}-{minutes_to_time(interval.end):%H:%M}"
         
-        return True, f"{len(created_slots)} slots generated successfully", len(created_slots)
+        return {
+            'doctor_id': first.doctor_id,
+            'day_of_week': first.day_of_week,
+            'day_name': ShiftConflictService.DAY_NAMES[first.day_of_week],
+            'shift_ids': [first.shift_id, second.shift_id],
+            'hospital_ids': [first.hospital_id, second.hospital_id],
+            'windows': [window(first), window(second)],
+        }
     
     @staticmethod
-    def get_available_slots(doctor, date) -> List[AvailabilitySlot]:
-        """Get available slots for a doctor on a specific date"""
-        return AvailabilitySlotRepository.get_available_slots(doctor, date, is_booked=False)
+    def candidate(duty: Duty, day_of_week: int, start_time, end_time, cycle_weeks: int = 1,
+                  week_index: int = 0, shift_id: Optional[int] = None) -> ShiftInterval:
+        """Build the interval of a proposed shift under a duty"""
+        return ShiftInterval(
+            shift_id=shift_id,
+            doctor_id=duty.doctor_id,
+            hospital_id=duty.hospital_id,
+            day_of_week=day_of_week,
+            start=time_to_minutes(start_time),
+            end=time_to_minutes(end_time),
+            valid_from=duty.start_date,
+            valid_until=duty.end_date,
+            cycle_weeks=cycle_weeks,
+            week_index=week_index
+        )
     
     @staticmethod
-    def get_doctor_availability(doctor, start_date, end_date) -> Dict:
+    def check(duty: Duty, shifts: List[Tuple], exclude_shift_id: Optional[int] = None) -> List[Dict]:
         """
-        Get doctor availability for a date range.
+        Check proposed shifts of a duty against the doctor's active shifts (one query).
+        
+        Args:
+            duty: Duty the shifts belong to
+            shifts: (day_of_week, start_time, end_time) tuples, optionally followed
+                by (rotation_cycle_weeks, rotation_week_index)
+            exclude_shift_id: Shift being updated, left out of the comparison
         
         Returns:
-            Dictionary with dates as keys and slot counts as values
+            Conflict entries; empty when the shifts fit
         """
-        slots = AvailabilitySlotRepository.get_slots_by_date_range(
-            doctor, start_date, end_date
-        )
-        
-        availability = {}
-        for slot in slots:
-            date_str = slot.date.isoformat()
-            if date_str not in availability:
-                availability[date_str] = {
-                    'total_slots': 0,
-                    'available_slots': 0,
-                    'booked_slots': 0
-                }
-            
-            availability[date_str]['total_slots'] += 1
-            if slot.is_available and not slot.is_booked:
-                availability[date_str]['available_slots'] += 1
-            if slot.is_booked:
-                availability[date_str]['booked_slots'] += 1
+        if not duty.is_active:
+            return []
         
-        return availability
+        candidates = [
+            ShiftConflictService.candidate(duty, *shift, shift_id=exclude_shift_id)
+            for shift in shifts
+        ]
+        return ShiftConflictService.check_intervals(
+            candidates, [exclude_shift_id] if exclude_shift_id else ()
+        )
     
     @staticmethod
-    @transaction.atomic
-    def book_slot(slot_id: int, patient, appointment=None) -> Tuple[bool, str]:
-        """Book an availability slot"""
-        slot = AvailabilitySlotRepository.get_by_id(slot_id)
-        if not slot:
-            return False, "Slot not found"
-        
-        if not slot.is_available or slot.is_booked:
-            return False, "Slot is not available for booking"
+    def check_intervals(candidates: List[ShiftInterval], exclude_shift_ids: Iterable[int] = ()) -> List[Dict]:
+        """Check proposed intervals of any number of doctors against their active shifts (one query)"""
+        if not candidates:
+            return []
+        rows = ShiftRepository.get_interval_rows(
+            {candidate.doctor_id for candidate in candidates}, exclude_shift_ids
+        )
+        existing = [ShiftConflictService.to_interval(row) for row in rows]
         
-        AvailabilitySlotRepository.mark_slot_as_booked(slot, patient, appointment)
-        return True, "Slot booked successfully"
+        return [
+            ShiftConflictService.describe(first, second)
+            for first, second in find_overlaps(existing, candidates)
+        ]
     
     @staticmethod
-    @transaction.atomic
-    def cancel_slot_booking(slot_id: int) -> Tuple[bool, str]:
-        """Cancel a slot booking"""
-        slot = AvailabilitySlotRepository.get_by_id(slot_id)
-        if not slot:
-            return False, "Slot not found"
-        
-        if not slot.is_booked:
-            return False, "Slot is not booked"
-        
-        AvailabilitySlotRepository.mark_slot_as_available(slot)
-        return True, "Booking cancelled successfully"
+    def audit(doctor_ids: Optional[List[int]] = None, chunk_size: int = 5000) -> List[Dict]:
+        """Find every overlapping pair of active shifts, fleet-wide or for some doctors"""
+        rows = ShiftRepository.get_interval_rows(doctor_ids).iterator(chunk_size=chunk_size)
+        intervals = [ShiftConflictService.to_interval(row) for row in rows]
+        return [
+            ShiftConflictService.describe(first, second)
+            for first, second in find_overlaps(intervals)
+        ]
+    
+    @staticmethod
+    def format_message(conflicts: List[Dict]) -> str:
+        """Human-readable summary of conflict entries"""
+        clashes = ', '.join(
+            f"{conflict['day_name']} {conflict['windows'][0]} / {conflict['windows'][1]}"
+            for conflict in conflicts
+        )
+        return f"Shift overlaps the doctor's other shifts: {clashes}"
 
 
-class DoctorLeaveService:
-    """Service for managing doctor leaves"""
+class RotationTemplateService:
+    """
+    Reusable weekly / multi-week shift patterns.
+    
+    Applying a template to many duties is one validation pass (a single
+    conflict query for every doctor involved), chunked bulk inserts in one
+    transaction, and slot generation for the new shifts only.
+    """
+    
+    DEFAULT_CHUNK_SIZE = 500
     
     @staticmethod
     @transaction.atomic
-    def request_leave(doctor, leave_type, start_date, end_date, reason) -> Tuple[bool, str, Optional[DoctorLeave]]:
+    def create_template(name: str, blocks: List[Dict], cycle_weeks: int = 1,
+                        description: str = '') -> Tuple[bool, str, Optional[RotationTemplate]]:
         """
-        Request leave for a doctor.
+        Create a rotation template.
         
         Args:
-            doctor: DoctorProfile instance
-            leave_type: Type of leave
-            start_date: Leave start date
-            end_date: Leave end date
-            reason: Leave reason
+            name: Unique template name
+            blocks: Dictionaries with day_of_week, start_time, end_time and optionally
+                week_index (default 0), break_start, break_end and max_appointments
+            cycle_weeks: Length of the rotation cycle in weeks
+            description: Free text
         
         Returns:
-            Tuple of (success, message, leave)
+            Tuple of (success, message, template)
         """
-        # Check for overlapping leaves
-        if DoctorLeaveRepository.check_leave_overlap(doctor, start_date, end_date):
-            return False, "Leave request overlaps with existing leave", None
+        if not 1 <= cycle_weeks <= 52:
+            return False, "Cycle must be between 1 and 52 weeks", None
+        if not blocks:
+            return False, "A template needs at least one block", None
+        if RotationTemplateRepository.name_exists(name):
+            return False, "A template with this name already exists", None
         
-        leave = DoctorLeaveRepository.create_leave(
-            doctor=doctor,
-            leave_type=leave_type,
-            start_date=start_date,
-            end_date=end_date,
-            reason=reason
-        )
+        for block in blocks:
+            if not 0 <= block.get('week_index', 0) < cycle_weeks:
+                return False, f"Block week_index must be below {cycle_weeks}", None
+            if block['day_of_week'] not in range(7):
+                return False, "Block day_of_week must be between 0 and 6", None
+            if block['start_time'] >= block['end_time']:
+                return False, "Block end time must be after start time", None
+            break_start, break_end = block.get('break_start'), block.get('break_end')
+            if break_start and break_end and not (block['start_time'] <= break_start < break_end <= block['end_time']):
+                return False, "Block break must be within shift hours", None
         
-        return True, "Leave request submitted successfully", leave
+        template = RotationTemplateRepository.create_template(
+            name, cycle_weeks, blocks, description=description
+        )
+        return True, "Rotation template created successfully", template
     
     @staticmethod
-    @transaction.atomic
-    def approve_leave(leave_id: int, approved_by, notes: str = '') -> Tuple[bool, str]:
-        """Approve a leave request"""
-        leave = DoctorLeaveRepository.get_by_id(leave_id)
-        if not leave:
-            return False, "Leave request not found"
+    def apply_template(template_id: int, duty_ids: List[int], allow_overlap: bool = False,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE, horizon_days: int = 30) -> Tuple[bool, str, Dict]:
+        """
+        Create the template's shifts under many duties at once.
         
-        if leave.status != 'PENDING':
-            return False, "Only pending leave requests can be approved"
+        Blocks a duty already has (same weekday, start and rotation week) are
+        skipped, so applying a template twice is harmless.
         
-        DoctorLeaveRepository.approve_leave(leave, approved_by, notes)
+        Args:
+            template_id: RotationTemplate ID
+            duty_ids: Duties to receive the shifts
+            allow_overlap: Skip the conflict check against the doctors' other shifts
+            chunk_size: Shifts per bulk INSERT
+            horizon_days: Generate slots for the new shifts up to this many days ahead
         
-        # Mark slots as unavailable for leave period
-        AvailabilitySlotService._handle_leave_slots(leave)
+        Returns:
+            Tuple of (success, message, stats) where stats holds shifts_created,
+            shifts_skipped, slots_created and, on failure, conflicts
+        """
+        stats = {'shifts_created': 0, 'shifts_skipped': 0, 'slots_created': 0, 'conflicts': []}
+        template = RotationTemplateRepository.get_with_blocks(template_id)
+        if not template:
+            return False, "Rotation template not found", stats
+        duties = DutyRepository.get_by_ids(duty_ids)
+        missing = set(duty_ids) - {duty.id for duty in duties}
+        if missing:
+            return False, f"Active duties not found: {sorted(missing)}", stats
         
-        return True, "Leave request approved"
-    
-    @staticmethod
-    @transaction.atomic
-    def reject_leave(leave_id: int, rejected_by, notes: str = '') -> Tuple[bool, str]:
-        """Reject a leave request"""
-        leave = DoctorLeaveRepository.get_by_id(leave_id)
-        if not leave:
-            return False, "Leave request not found"
+        existing = ShiftRepository.get_rotation_keys(duty_ids)
+        shifts_data, candidates = [], []
+        for duty in duties:
+            for block in template.blocks.all():
+                key = (duty.id, block.day_of_week, block.start_time, template.cycle_weeks, block.week_index)
+                if key in existing:
+                    stats['shifts_skipped'] += 1
+                    continue
+                shifts_data.append({
+                    'duty': duty,
+                    'day_of_week': block.day_of_week,
+                    'start_time': block.start_time,
+                    'end_time': block.end_time,
+                    'break_start': block.break_start,
+                    'break_end': block.break_end,
+                    'max_appointments': block.max_appointments,
+                    'rotation_cycle_weeks': template.cycle_weeks,
+                    'rotation_week_index': block.week_index,
+                })
+                candidates.append(ShiftConflictService.candidate(
+                    duty, block.day_of_week, block.start_time, block.end_time,
+                    template.cycle_weeks, block.week_index
+                ))
         
-        if leave.status != 'PENDING':
-            return False, "Only pending leave requests can be rejected"
+        if not allow_overlap:
+            stats['conflicts'] = ShiftConflictService.check_intervals(candidates)
+            if stats['conflicts']:
+                return False, ShiftConflictService.format_message(stats['conflicts'][:5]), stats
         
-        DoctorLeaveRepository.reject_leave(leave, rejected_by, notes)
-        return True, "Leave request rejected"
+        created = []
+        with transaction.atomic():
+            for offset in range(0, len(shifts_data), chunk_size):
+                created += ShiftRepository.bulk_create_shifts(shifts_data[offset:offset + chunk_size])
+            # Bulk creates skip the Shift signals
+            HospitalRosterService.invalidate({duty.hospital_id for duty in duties})
+        stats['shifts_created'] = len(created)
+        
+        if created and horizon_days:
+            stats['slots_created'] = SlotHorizonService.advance_shifts(created, horizon_days)
+        
+        return True, f"{len(created)} shifts created from template {template.name}", stats
+
+
+class CoverageRequirement(NamedTuple):
+    """Doctors needed in one department for one weekly time block"""
+    department_id: Optional[int]
+    specialization: Optional[str]
+    day_of_week: int
+    start_time: time
+    end_time: time
+    doctors: int
+
+
+class RosterSolverService:
+    """
+    Greedy roster auto-assignment.
     
-    @staticmethod
-    def get_doctor_leaves(doctor, status: str = None) -> List[DoctorLeave]:
-        """Get leaves for a doctor"""
-        return DoctorLeaveRepository.get_doctor_leaves(doctor, status)
+    Every (week, requirement) block becomes a demand. Demands are filled
+    scarcest first (fewest eligible doctors per requested head), longest
+    first on ties; each demand takes the least-loaded feasible doctors from
+    a lazy min-heap of weekly minutes per (specialization, week). A doctor
+    is feasible when they are not on approved leave that day, do not already
+    work an overlapping shift anywhere (existing duties included) and stay
+    within the weekly hours limit.
     
-    @staticmethod
-    def get_pending_leaves(hospital=None) -> List[DoctorLeave]:
-        """Get pending leave requests"""
-        return DoctorLeaveRepository.get_pending_leaves(hospital)
+    The result is one Duty per doctor, department and week, with one Shift
+    per assigned block. Loading the inputs costs three queries regardless
+    of roster size.
+    """
+    
+    DEFAULT_MAX_HOURS_PER_WEEK = 40
     
     @staticmethod
-    def _handle_leave_slots(leave: DoctorLeave):
-        """Mark slots as unavailable during leave period"""
-        slots = AvailabilitySlotRepository.get_slots_by_date_range(
-            leave.doctor, leave.start_date, leave.end_date
-        )
+    def parse_requirements(items: List[Dict]) -> List[CoverageRequirement]:
+        """
+        Build requirements from dictionaries (e.g. a JSON file).
         
-        for slot in slots:
-            if not slot.is_booked:
-                slot.is_available = False
-                slot.save()
-
-
-class ScheduleOverrideService:
-    """Service for managing schedule overrides"""
+        Each item has ``start``/``end`` ("HH:MM"), ``doctors``, either ``day_of_week``
+        or ``days`` (0 = Monday), and optionally ``department`` and ``specialization``.
+        
+        Raises:
+            ValueError: On a malformed item
+        """
+        requirements = []
+        for index, item in enumerate(items):
+            try:
+                days = item['days'] if 'days' in item else [item['day_of_week']]
+                start_time = time.fromisoformat(item['start'])
+                end_time = time.fromisoformat(item['end'])
+                doctors = int(item['doctors'])
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"Requirement {index}: {e}")
+            if start_time >= end_time:
+                raise ValueError(f"Requirement {index}: end must be after start")
+            if doctors < 1:
+                raise ValueError(f"Requirement {index}: doctors must be positive")
+            for day in days:
+                if day not in range(7):
+                    raise ValueError(f"Requirement {index}: invalid day {day!r}")
+                requirements.append(CoverageRequirement(
+                    department_id=item.get('department'),
+                    specialization=item.get('specialization') or None,
+                    day_of_week=day,
+                    start_time=start_time,
+                    end_time=end_time,
+                    doctors=doctors
+                ))
+        return requirements
     
     @staticmethod
-    @transaction.atomic
-    def create_override(doctor, date, is_available, reason, created_by, **kwargs) -> Tuple[bool, str, Optional[ScheduleOverride]]:
+    def solve(hospital_id: int, start_date, weeks: int, requirements: List[CoverageRequirement],
+              max_hours_per_week: int = DEFAULT_MAX_HOURS_PER_WEEK,
+              doctor_ids: Optional[List[int]] = None) -> Dict:
         """
-        Create a schedule override.
+        Plan a roster without writing anything.
         
         Args:
-            doctor: DoctorProfile instance
-            date: Override date
-            is_available: Whether doctor is available
-            reason: Override reason
-            created_by: User creating override
-            **kwargs: Additional fields
+            hospital_id: Hospital the duties are for
+            start_date: Any day of the first week (the plan starts on its Monday)
+            weeks: Number of weeks to plan
+            requirements: Coverage requirements, repeated every week
+            max_hours_per_week: Weekly limit across all hospitals
+            doctor_ids: Restrict the candidate pool
         
         Returns:
-            Tuple of (success, message, override)
+            Dictionary with the assignments, coverage gaps and summary counts
         """
-        # Check if override already exists
-        existing = ScheduleOverrideRepository.get_override_for_date(doctor, date)
-        if existing:
-            return False, "Override already exists for this date", None
+        week_start = start_date - timedelta(days=start_date.weekday())
+        end_date = week_start + timedelta(days=7 * weeks - 1)
         
-        override = ScheduleOverrideRepository.create_override(
-            doctor=doctor,
-            date=date,
-            is_available=is_available,
-            reason=reason,
-            created_by=created_by,
-            **kwargs
+        specializations = {requirement.specialization for requirement in requirements}
+        candidates = RosterRepository.get_candidate_doctors(
+            None if None in specializations else specializations, doctor_ids
         )
         
-        # Update existing slots for this date
-        if not is_available:
-            slots = AvailabilitySlotRepository.get_available_slots(doctor, date)
-            for slot in slots:
-                if not slot.is_booked:
-                    slot.is_available = False
-                    slot.save()
+        # Existing commitments, expanded onto the planned dates
+        busy = defaultdict(list)
+        load = defaultdict(int)
+        for row in ShiftRepository.get_interval_rows(candidates):
+            interval = ShiftConflictService.to_interval(row)
+            for week in range(weeks):
+                day = week_start + timedelta(days=7 * week + interval.day_of_week)
+                if runs_on(interval, day):
+                    busy[(interval.doctor_id, day)].append((interval.start, interval.end))
+                    load[(interval.doctor_id, week)] += interval.end - interval.start
         
-        return True, "Schedule override created successfully", override
+        on_leave = set()
+        for leave in DoctorLeaveRepository.get_approved_leaves_in_range(candidates, week_start, end_date):
+            day = max(leave.start_date, week_start)
+            while day <= min(leave.end_date, end_date):
+                on_leave.add((leave.doctor_id, day))
+                day += timedelta(days=1)
+        
+        assignments, gaps = RosterSolverService.assign(
+            requirements, candidates, week_start, weeks, busy, load, on_leave, max_hours_per_week * 60
+        )
+        return {
+            'hospital_id': hospital_id,
+            'start_date': week_start,
+            'end_date': end_date,
+            'assignments': assignments,
+            'gaps': gaps,
+            'doctors_assigned': len({assignment['doctor_id'] for assignment in assignments}),
+            'blocks_required': sum(requirement.doctors for requirement in requirements) * weeks,
+            'blocks_filled': len(assignments),
+        }
     
     @staticmethod
-    @transaction.atomic
-    def update_override(override_id: int, **fields) -> Tuple[bool, str, Optional[ScheduleOverride]]:
-        """Update a schedule override"""
-        override = ScheduleOverrideRepository.get_by_id(override_id)
-        if not override:
-            return False, "Override not found", None
+    def assign(requirements: List[CoverageRequirement], candidates: Dict[int, str], week_start, weeks: int,
+               busy: Dict, load: Dict, on_leave: set, max_minutes: int) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Greedy assignment over in-memory inputs (no queries).
         
-        updated_override = ScheduleOverrideRepository.update_override(override, **fields)
-        return True, "Override updated successfully", updated_override
+        ``busy`` maps (doctor_id, date) to occupied (start, end) minutes and
+        ``load`` maps (doctor_id, week index) to minutes already worked; both
+        are updated in place as doctors are assigned.
+        
+        Returns:
+            (assignments, gaps)
+        """
+        pools = defaultdict(list)
+        for doctor_id, specialization in candidates.items():
+            pools[specialization].append(doctor_id)
+            pools[None].append(doctor_id)
+        
+        demands = []
+        for week in range(weeks):
+            for requirement in requirements:
+                start = time_to_minutes(requirement.start_time)
+                end = time_to_minutes(requirement.end_time)
+                scarcity = len(pools.get(requirement.specialization, ())) / requirement.doctors
+                day = week_start + timedelta(days=7 * week + requirement.day_of_week)
+                demands.append((scarcity, start - end, day, start, week, requirement))
+        demands.sort(key=lambda demand: demand[:4])
+        
+        heaps = {}
+        assignments, gaps = [], []
+        for _, _, day, start, week, requirement in demands:
+            end = time_to_minutes(requirement.end_time)
+            minutes = end - start
+            key = (requirement.specialization, week)
+            heap = heaps.get(key)
+            if heap is None:
+                heap = heaps[key] = [(load[(doctor_id, week)], doctor_id) for doctor_id in pools.get(key[0], ())]
+                heapq.heapify(heap)
+            
+            chosen, skipped = [], []
+            while heap and len(chosen) < requirement.doctors:
+                entry_load, doctor_id = heapq.heappop(heap)
+                current = load[(doctor_id, week)]
+                if entry_load != current:
+                    # Load changed through another specialization's heap; requeue with the real value
+                    heapq.heappush(heap, (current, doctor_id))
+                    continue
+                if (
+                    current + minutes > max_minutes or
+                    (doctor_id, day) in on_leave or
+                    any(start < other_end and other_start < end for other_start, other_end in busy[(doctor_id, day)])
+                ):
+                    skipped.append((current, doctor_id))
+                    continue
+                chosen.append(doctor_id)
+            
+            for doctor_id in chosen:
+                load[(doctor_id, week)] += minutes
+                busy[(doctor_id, day)].append((start, end))
+                heapq.heappush(heap, (load[(doctor_id, week)], doctor_id))
+                assignments.append({
+                    'doctor_id': doctor_id,
+                    'department_id': requirement.department_id,
+                    'week_start': week_start + timedelta(days=7 * week),
+                    'date': day,
+                    'day_of_week': requirement.day_of_week,
+                    'start_time': requirement.start_time,
+                    'end_time': requirement.end_time,
+                })
+            for entry in skipped:
+                heapq.heappush(heap, entry)
+            
+            if len(chosen) < requirement.doctors:
+                gaps.append({
+                    'date': day,
+                    'day_of_week': requirement.day_of_week,
+                    'department_id': requirement.department_id,
+                    'specialization': requirement.specialization,
+                    'start_time': requirement.start_time,
+                    'end_time': requirement.end_time,
+                    'required': requirement.doctors,
+                    'assigned': len(chosen),
+                    'missing': requirement.doctors - len(chosen),
+                })
+        
+        assignments.sort(key=lambda assignment: (assignment['date'], assignment['start_time'], assignment['doctor_id']))
+        gaps.sort(key=lambda gap: (gap['date'], gap['start_time']))
+        return assignments, gaps
     
     @staticmethod
     @transaction.atomic
-    def delete_override(override_id: int) -> Tuple[bool, str]:
-        """Delete a schedule override"""
-        override = ScheduleOverrideRepository.get_by_id(override_id)
-        if not override:
-            return False, "Override not found"
+    def apply(plan: Dict, duty_type: str = Duty.DutyType.OPD) -> Tuple[int, int]:
+        """
+        Bulk-create the duties and shifts of a plan.
         
-        ScheduleOverrideRepository.delete_override(override)
-        return True, "Override deleted successfully"
+        Returns:
+            (duties created, shifts created)
+        """
+        grouped = defaultdict(list)
+        for assignment in plan['assignments']:
+            grouped[(assignment['doctor_id'], assignment['department_id'], assignment['week_start'])].append(assignment)
+        if not grouped:
+            return 0, 0
+        
+        keys = list(grouped)
+        duties = DutyRepository.bulk_create_duties([
+            {
+                'doctor_id': doctor_id,
+                'hospital_id': plan['hospital_id'],
+                'department_id': department_id,
+                'duty_type': duty_type,
+                'start_date': week_start,
+                'end_date': week_start + timedelta(days=6),
+                'notes': 'Assigned by the roster solver',
+            }
+            for doctor_id, department_id, week_start in keys
+        ])
+        shifts = ShiftRepository.bulk_create_shifts([
+            {
+                'duty': duty,
+                'day_of_week': assignment['day_of_week'],
+                'start_time': assignment['start_time'],
+                'end_time': assignment['end_time'],
+            }
+            for key, duty in zip(keys, duties)
+            for assignment in grouped[key]
+        ])
+        # Bulk creates skip the Duty / Shift signals
+        HospitalRosterService.invalidate([plan['hospital_id']])
+        return len(duties), len(shifts)
     
     @staticmethod
-    def get_doctor_overrides(doctor, from_date=None) -> List[ScheduleOverride]:
-        """Get overrides for a doctor"""
-        return ScheduleOverrideRepository.get_doctor_overrides(doctor, from_date)
+    def run(hospital_id: int, start_date, weeks: int, requirements: List[CoverageRequirement],
+            dry_run: bool = True, **options) -> Dict:
+        """
+        Solve a roster and, unless dry_run, create it.
+        
+        Returns:
+            The plan from solve(), plus duties_created / shifts_created
+        """
+        plan = RosterSolverService.solve(hospital_id, start_date, weeks, requirements, **options)
+        plan['duties_created'], plan['shifts_created'] = (
+            (0, 0) if dry_run else RosterSolverService.apply(plan)
+        )
+        return plan
 
 
-class ScheduleAnalyticsService:
-    """Service for schedule analytics and reporting"""
+class SlotGenerationEngine:
+    """
+    Batch slot generator.
+    
+    Loads overrides and approved leaves for the whole range in one query each,
+    builds every shift's daily slot template once and stamps it across the
+    matching dates, so the query count does not grow with the range length.
+    """
+    
+    DEFAULT_BATCH_SIZE = 1000
     
     @staticmethod
-    def get_doctor_schedule_summary(doctor, start_date, end_date) -> Dict:
+    def generate(shifts: List[Shift], start_date, end_date,
+                 slot_duration_minutes: int = 30,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 skip_existing: bool = False,
+                 allowed_days: Optional[set] = None) -> Dict:
         """
-        Get comprehensive schedule summary for a doctor.
+        Generate slots for several shifts over a date range.
+        
+        Args:
+            shifts: Shift instances (with ``duty`` loaded)
+            start_date: First date to generate
+            end_date: Last date to generate (inclusive)
+            slot_duration_minutes: Duration of each slot in minutes
+            batch_size: Rows per INSERT statement
+            skip_existing: Skip slots that already exist in the range (one extra query)
+            allowed_days: Optional set of (doctor_id, date) pairs to restrict generation to
         
         Returns:
-            Dictionary with schedule statistics
+            Dictionary with shifts, dates, slots_created, queries and elapsed_ms
         """
-        # Get shifts
-        shifts = ShiftRepository.get_doctor_shifts(doctor)
+        stats = {'shifts': len(shifts), 'dates': 0, 'slots_created': 0}
         
-        # Get slots
-        slots = AvailabilitySlotRepository.get_slots_by_date_range(
-            doctor, start_date, end_date
-        )
+        with QueryCounter() as counter:
+            if shifts and start_date <= end_date:
+                doctor_ids = {shift.duty.doctor_id for shift in shifts}
+                overrides = ScheduleOverrideRepository.get_overrides_in_range(
+                    doctor_ids, start_date, end_date
+                )
+                leave_days = SlotGenerationEngine._leave_days(doctor_ids, start_date, end_date)
+                existing = (
+                    AvailabilitySlotRepository.get_existing_slot_keys(
+                        [shift.id for shift in shifts], start_date, end_date
+                    )
+                    if skip_existing else None
+                )
+                
+                templates = {}
+                buffer = []
+                for shift in shifts:
+                    for current_date, template in SlotGenerationEngine._shift_days(
+                        shift, start_date, end_date, slot_duration_minutes,
+                        overrides, leave_days, templates
+                    ):
+                        if allowed_days is not None and (shift.duty.doctor_id, current_date) not in allowed_days:
+                            continue
+                        stats['dates'] += 1
+                        buffer.extend(
+                            AvailabilitySlot(
+                                shift_id=shift.id,
+                                date=current_date,
+                                start_time=slot_start,
+                                end_time=slot_end,
+                                appointment_type=appointment_type,
+                            )
+                            for slot_start, slot_end, appointment_type in template
+                            if existing is None or (shift.id, current_date, slot_start) not in existing
+                        )
+                        if len(buffer) >= batch_size:
+                            stats['slots_created'] += AvailabilitySlotRepository.bulk_insert_slots(
+                                buffer, batch_size
+                            )
+                            buffer = []
+                
+                if buffer:
+                    stats['slots_created'] += AvailabilitySlotRepository.bulk_insert_slots(
+                        buffer, batch_size
+                    )
         
-        # Get leaves
-        leaves = DoctorLeaveRepository.get_doctor_leaves(doctor, status='APPROVED')
-        active_leaves = [l for l in leaves if l.is_active()]
+        if stats['slots_created']:
+            SlotChangeService.slots_changed(
+                {shift.duty.doctor_id for shift in shifts}, start_date, end_date,
+                hospital_ids={shift.duty.hospital_id for shift in shifts}
+            )
         
-        # Calculate statistics
-        total_slots = len(slots)
-        available_slots = sum(1 for s in slots if s.is_available and not s.is_booked)
-        booked_slots = sum(1 for s in slots if s.is_booked)
+        stats['queries'] = counter.queries
+        stats['elapsed_ms'] = counter.elapsed_ms
+        return stats
+    
+    @staticmethod
+    def _leave_days(doctor_ids, start_date, end_date) -> set:
+        """Expand approved leaves into a set of (doctor_id, date) pairs within the range"""
+        days = set()
+        for leave in DoctorLeaveRepository.get_approved_leaves_in_range(doctor_ids, start_date, end_date):
+            current = max(leave.start_date, start_date)
+            last = min(leave.end_date, end_date)
+            while current <= last:
+                days.add((leave.doctor_id, current))
+                current += timedelta(days=1)
+        return days
+    
+    @staticmethod
+    def _appointment_mix(shift) -> tuple:
+        """The shift's parsed appointment mix, or () to use the fixed grid"""
+        try:
+            return parse_appointment_mix(shift.appointment_mix)
+        except ValueError as e:
+            logger.warning(f"Shift {shift.id} has an invalid appointment mix, using the fixed grid: {e}")
+            return ()
+    
+    @staticmethod
+    def build_template(start_time, end_time, slot_duration_minutes, break_start, break_end,
+                       mix: tuple = ()) -> List[Tuple]:
+        """Day template of (start, end, appointment_type): packed from the mix, or the fixed grid"""
+        if mix:
+            return pack_slot_template(start_time, end_time, mix, break_start, break_end)
+        return [
+            (slot_start, slot_end, '')
+            for slot_start, slot_end in build_slot_template(
+                start_time, end_time, slot_duration_minutes, break_start, break_end
+            )
+        ]
+    
+    @staticmethod
+    def _shift_days(shift, start_date, end_date, slot_duration_minutes,
+                    overrides, leave_days, templates):
+        """Yield (date, slot_template) for every date the shift should produce slots"""
+        duty = shift.duty
+        mix = SlotGenerationEngine._appointment_mix(shift)
+        first = max(start_date, duty.start_date)
+        last = min(end_date, duty.end_date) if duty.end_date else end_date
+        current = first + timedelta(days=(shift.day_of_week - first.weekday()) % 7)
+        cycle_weeks = shift.rotation_cycle_weeks
+        if cycle_weeks > 1:
+            # Jump to the first week of the cycle this shift is worked in
+            behind = shift.rotation_week_index - rotation_week(current, duty.start_date, cycle_weeks)
+            current += timedelta(days=7 * (behind % cycle_weeks))
+        
+        while current <= last:
+            key = (duty.doctor_id, current)
+            override = overrides.get(key)
+            if key not in leave_days and not (override and not override.is_available):
+                start_time, end_time = shift.start_time, shift.end_time
+                if override and override.custom_start_time and override.custom_end_time:
+                    start_time = max(start_time, override.custom_start_time)
+                    end_time = min(end_time, override.custom_end_time)
+                
+                template_key = (start_time, end_time, shift.break_start, shift.break_end, slot_duration_minutes, mix)
+                if template_key not in templates:
+                    templates[template_key] = SlotGenerationEngine.build_template(
+                        start_time, end_time, slot_duration_minutes,
+                        shift.break_start, shift.break_end, mix
+                    )
+                yield current, templates[template_key]
+            
+            current += timedelta(days=7 * cycle_weeks)
+
+
+class SlotUtilizationService:
+    """
+    Capacity reporting for fixed-grid and packed slots.
+    
+    Utilization is booked minutes over offered minutes (open or booked
+    slots; masked slots are not capacity). packing_gain compares a shift's
+    packed day with the fixed grid it would otherwise get.
+    """
+    
+    @staticmethod
+    def report(start_date, end_date, doctor_ids: Optional[List[int]] = None,
+               hospital_id: Optional[int] = None) -> Dict:
+        """
+        Offered vs booked minutes over a date range, overall and per appointment type.
+        
+        Returns:
+            Dictionary with slots, booked, slot_minutes, booked_minutes, utilization and by_type
+        """
+        def empty():
+            return {'slots': 0, 'booked': 0, 'slot_minutes': 0, 'booked_minutes': 0, 'utilization': 0.0}
+        
+        totals = empty()
+        by_type = defaultdict(empty)
+        for row in AvailabilitySlotRepository.get_utilization_rows(start_date, end_date, doctor_ids, hospital_id):
+            minutes = (time_to_minutes(row['end_time']) - time_to_minutes(row['start_time'])) * row['slots']
+            for bucket in (totals, by_type[row['appointment_type'] or 'STANDARD']):
+                bucket['slots'] += row['slots']
+                bucket['slot_minutes'] += minutes
+                if row['is_booked']:
+                    bucket['booked'] += row['slots']
+                    bucket['booked_minutes'] += minutes
+        
+        for bucket in (totals, *by_type.values()):
+            if bucket['slot_minutes']:
+                bucket['utilization'] = round(bucket['booked_minutes'] / bucket['slot_minutes'], 4)
+        totals['by_type'] = dict(sorted(by_type.items()))
+        return totals
+    
+    @staticmethod
+    def packing_gain(shift: Shift, slot_duration_minutes: int = 30) -> Dict:
+        """
+        Bookable minutes per working day of a shift: packed mix vs fixed grid.
+        
+        Returns:
+            Dictionary with working, grid and packed minutes and slot counts, and gain_minutes
+        """
+        working = time_to_minutes(shift.end_time) - time_to_minutes(shift.start_time)
+        if shift.break_start and shift.break_end:
+            working -= time_to_minutes(shift.break_end) - time_to_minutes(shift.break_start)
+        grid = build_slot_template(
+            shift.start_time, shift.end_time, slot_duration_minutes, shift.break_start, shift.break_end
+        )
+        packed = SlotGenerationEngine.build_template(
+            shift.start_time, shift.end_time, slot_duration_minutes, shift.break_start, shift.break_end,
+            SlotGenerationEngine._appointment_mix(shift)
+        )
         
-        # Group by date
-        dates_with_slots = set(slot.date for slot in slots)
-        working_days = len(dates_with_slots)
+        def minutes(template):
+            return sum(time_to_minutes(slot[1]) - time_to_minutes(slot[0]) for slot in template)
         
         return {
-            'total_shifts': len(shifts),
-            'total_slots': total_slots,
-            'available_slots': available_slots,
-            'booked_slots': booked_slots,
-            'booking_rate': (booked_slots / total_slots * 100) if total_slots > 0 else 0,
-            'working_days': working_days,
-            'active_leaves': len(active_leaves),
-            'shifts_by_day': {
-                shift.get_day_of_week_display(): {
-                    'start_time': shift.start_time.strftime('%H:%M'),
-                    'end_time': shift.end_time.strftime('%H:%M'),
-                    'duration_minutes': shift.duration_minutes()
-                }
-                for shift in shifts
-            }
+            'shift_id': shift.id,
+            'working_minutes': working,
+            'grid_slots': len(grid),
+            'grid_minutes': minutes(grid),
+            'packed_slots': len(packed),
+            'packed_minutes': minutes(packed),
+            'gain_minutes': minutes(packed) - minutes(grid),
         }
     
     @staticmethod
-    def get_weekly_schedule(doctor, week_start) -> Dict:
+    def packing_report(doctor_ids: Optional[List[int]] = None, slot_duration_minutes: int = 30) -> List[Dict]:
+        """packing_gain for every active shift with an appointment mix"""
+        return [
+            SlotUtilizationService.packing_gain(shift, slot_duration_minutes)
+            for shift in ShiftRepository.get_packed_shifts(doctor_ids)
+        ]
+
+
+class AvailabilitySlotService:
+    """Service for managing availability slots"""
+    
+    @staticmethod
+    @transaction.atomic
+    def generate_slots_for_shift(shift_id: int, start_date, end_date, 
+                                 slot_duration_minutes: int = 30) -> Tuple[bool, str, int]:
         """
-        Get weekly schedule for a doctor.
+        Generate availability slots for a shift.
         
         Args:
-            doctor: DoctorProfile instance
-            week_start: Monday of the week
+            shift_id: Shift ID
+            start_date: Start date for slot generation
+            end_date: End date for slot generation
+            slot_duration_minutes: Duration of each slot in minutes
         
         Returns:
-            Dictionary with daily schedules
+            Tuple of (success, message, slots_created_count)
         """
-        week_end = week_start + timedelta(days=6)
+        shift = ShiftRepository.get_by_id(shift_id)
+        if not shift:
+            return False, "Shift not found", 0
         
-        weekly_schedule = {}
-        current_date = week_start
+        stats = SlotGenerationEngine.generate(
+            [shift], start_date, end_date, slot_duration_minutes=slot_duration_minutes
+        )
+        created = stats['slots_created']
         
-        while current_date <= week_end:
-            day_name = current_date.strftime('%A')
-            
-            # Get shifts for this day
-            shifts = ShiftRepository.get_shifts_for_date(doctor, current_date)
-            
-            # Get slots for this day
-            slots = AvailabilitySlotRepository.get_available_slots(doctor, current_date)
-            
-            # Check for override
-            override = ScheduleOverrideRepository.get_override_for_date(doctor, current_date)
-            
-            # Check for leave
-            leaves = DoctorLeaveRepository.get_active_leaves(doctor)
-            is_on_leave = any(
-                leave.start_date <= current_date <= leave.end_date
-                for leave in leaves
-            )
-            
-            weekly_schedule[day_name] = {
-                'date': current_date.isoformat(),
-                'shifts': [
-                    {
-                        'start_time': shift.start_time.strftime('%H:%M'),
-                        'end_time': shift.end_time.strftime('%H:%M'),
-                        'hospital': shift.duty.hospital.hospital_name
-                    }
-                    for shift in shifts
-                ],
-                'total_slots': len(slots),
-                'available_slots': sum(1 for s in slots if s.is_available and not s.is_booked),
-                'booked_slots': sum(1 for s in slots if s.is_booked),
-                'is_on_leave': is_on_leave,
-                'has_override': override is not None,
-                'override_available': override.is_available if override else None
+        return True, f"{created} slots generated successfully", created
+    
+    @staticmethod
+    @transaction.atomic
+    def generate_slots_for_doctor(doctor, start_date, end_date,
+                                  slot_duration_minutes: int = 30,
+                                  batch_size: int = SlotGenerationEngine.DEFAULT_BATCH_SIZE) -> Dict:
+        """
+        Generate availability slots for all active shifts of a doctor in one engine run.
+        
+        Returns:
+            Engine statistics (see SlotGenerationEngine.generate)
+        """
+        shifts = list(ShiftRepository.get_doctor_shifts(doctor))
+        return SlotGenerationEngine.generate(
+            shifts, start_date, end_date,
+            slot_duration_minutes=slot_duration_minutes, batch_size=batch_size
+        )
+    
+    @staticmethod
+    def get_available_slots(doctor, date) -> List[AvailabilitySlot]:
+        """Get available slots for a doctor on a specific date"""
+        return AvailabilitySlotRepository.get_available_slots(doctor, date, is_booked=False)
+    
+    @staticmethod
+    def get_doctor_availability(doctor, start_date, end_date) -> Dict:
+        """
+        Get doctor availability for a date range.
+        
+        Returns:
+            Dictionary with dates as keys and slot counts as values
+        """
+        rows = DoctorDailyAvailabilityRepository.get_range(doctor, start_date, end_date)
+        
+        availability = {}
+        for row in rows:
+            availability[row.date.isoformat()] = {
+                'total_slots': row.total_slots,
+                'available_slots': row.available_slots,
+                'booked_slots': row.booked_slots
             }
-            
-            current_date += timedelta(days=1)
         
-        return weekly_schedule
+        return availability
     
     @staticmethod
-    def get_hospital_doctor_schedules(hospital, date) -> List[Dict]:
+    @transaction.atomic
+    def book_slot(slot_id: int, patient, appointment=None, row_lock: bool = False) -> Tuple[bool, str]:
         """
-        Get all doctor schedules at a hospital for a date.
+        Book an availability slot.
+        
+        The slot is claimed with a conditional UPDATE that only matches a free
+        slot, so concurrent requests cannot both succeed. The appointment (if
+        any) is linked in the same statement. With ``row_lock`` the row is
+        first locked with SELECT ... FOR UPDATE on backends that support it.
         
         Args:
-            hospital: HospitalProfile instance
-            date: Date to check
+            slot_id: AvailabilitySlot ID
+            patient: PatientProfile instance
+            appointment: Optional Appointment to link to the slot
+            row_lock: Lock the row before claiming it
         
         Returns:
-            List of doctor schedule summaries
+            Tuple of (success, message)
         """
-        duties = DutyRepository.get_hospital_duties(hospital, is_active=True)
+        if row_lock and connection.features.has_select_for_update:
+            locked = AvailabilitySlotRepository.lock_slot(slot_id)
+            if not locked:
+                return False, "Slot not found"
+            if not locked.is_available or locked.is_booked:
+                return False, "Slot is not available for booking"
         
-        schedules = []
-        for duty in duties:
-            doctor = duty.doctor
-            shifts = ShiftRepository.get_shifts_for_date(doctor, date)
-            slots = AvailabilitySlotRepository.get_available_slots(doctor, date)
+        try:
+            with transaction.atomic():
+                claimed = AvailabilitySlotRepository.claim_slot(
+                    slot_id, patient.id, appointment.id if appointment else None
+                )
+        except IntegrityError:
+            return False, "Appointment is already linked to another slot"
+        
+        scope = AvailabilitySlotRepository.get_slot_scope(slot_id)
+        if not claimed:
+            if scope is None:
+                return False, "Slot not found"
+            return False, "Slot is not available for booking"
+        
+        SlotChangeService.slots_changed(
+            [scope['doctor_id']], scope['date'], scope['date'], hospital_ids=[scope['hospital_id']]
+        )
+        return True, "Slot booked successfully"
+    
+    @staticmethod
+    @transaction.atomic
+    def cancel_slot_booking(slot_id: int) -> Tuple[bool, str]:
+        """Cancel a slot booking with a single conditional UPDATE"""
+        released = AvailabilitySlotRepository.release_slot(slot_id)
+        scope = AvailabilitySlotRepository.get_slot_scope(slot_id)
+        if scope is None:
+            return False, "Slot not found"
+        if not released:
+            return False, "Slot is not booked"
+        
+        SlotChangeService.slots_changed(
+            [scope['doctor_id']], scope['date'], scope['date'], hospital_ids=[scope['hospital_id']]
+        )
+        return True, "Booking cancelled successfully"
+
+
+class SlotHorizonService:
+    """
+    Rolling-horizon slot materialisation.
+    
+    Every shift keeps a ``slots_generated_through`` watermark. A run only
+    materialises the days between the watermark and the horizon, plus the
+    date ranges recorded as SlotInvalidation rows by leave and override edits.
+    """
+    
+    @staticmethod
+    def advance(horizon_days: int = 30, doctor_ids=None, slot_duration_minutes: int = 30,
+                batch_size: int = SlotGenerationEngine.DEFAULT_BATCH_SIZE) -> Dict:
+        """
+        Materialise newly uncovered and invalidated days up to the horizon.
+        
+        Args:
+            horizon_days: Number of days ahead slots should exist for
+            doctor_ids: Optional subset of doctors to advance
+            slot_duration_minutes: Duration of each slot in minutes
+            batch_size: Rows per INSERT statement
+        
+        Returns:
+            Dictionary with shifts_advanced, invalidations, slots_created, queries and elapsed_ms
+        """
+        today = timezone.now().date()
+        horizon_end = today + timedelta(days=horizon_days)
+        stats = {'shifts_advanced': 0, 'invalidations': 0, 'slots_created': 0}
+        
+        with QueryCounter() as counter:
+            shifts = ShiftRepository.get_shifts_behind_horizon(horizon_end, doctor_ids)
+            stats['slots_created'] += SlotHorizonService._materialise(
+                shifts, today, horizon_end, slot_duration_minutes, batch_size
+            )
+            stats['shifts_advanced'] = len(shifts)
             
-            if shifts:  # Only include doctors with shifts on this date
-                schedules.append({
-                    'doctor_id': doctor.id,
-                    'doctor_name': doctor.user.get_full_name(),
-                    'specialty': doctor.specialty,
-                    'shifts': [
-                        {
-                            'start_time': shift.start_time.strftime('%H:%M'),
-                            'end_time': shift.end_time.strftime('%H:%M')
-                        }
-                        for shift in shifts
-                    ],
-                    'total_slots': len(slots),
-                    'available_slots': sum(1 for s in slots if s.is_available and not s.is_booked),
-                    'booked_slots': sum(1 for s in slots if s.is_booked)
-                })
+            invalidations = SlotInvalidationRepository.get_pending(doctor_ids)
+            if invalidations:
+                with transaction.atomic():
+                    stats['slots_created'] += SlotHorizonService._apply_invalidations(
+                        invalidations, today, horizon_end, slot_duration_minutes, batch_size
+                    )
+                    SlotInvalidationRepository.delete_by_ids([inv.id for inv in invalidations])
+            stats['invalidations'] = len(invalidations)
+        
+        stats['queries'] = counter.queries
+        stats['elapsed_ms'] = counter.elapsed_ms
+        return stats
+    
+    @staticmethod
+    def advance_shifts(shifts: List[Shift], horizon_days: int = 30, slot_duration_minutes: int = 30,
+                       batch_size: int = SlotGenerationEngine.DEFAULT_BATCH_SIZE) -> int:
+        """
+        Materialise slots up to the horizon for specific shifts only (with ``duty`` loaded),
+        e.g. right after they were created.
+        
+        Returns:
+            Number of slots created
+        """
+        today = timezone.now().date()
+        return SlotHorizonService._materialise(
+            shifts, today, today + timedelta(days=horizon_days), slot_duration_minutes, batch_size
+        )
+    
+    @staticmethod
+    def _materialise(shifts, today, horizon_end, slot_duration_minutes, batch_size) -> int:
+        """Generate each shift's days between its watermark and the horizon, then move the watermark"""
+        # Shifts share a watermark in the steady state, so this is usually one group
+        by_start = defaultdict(list)
+        for shift in shifts:
+            watermark = shift.slots_generated_through
+            if watermark and watermark >= horizon_end:
+                continue
+            start = max(today, watermark + timedelta(days=1)) if watermark else today
+            by_start[start].append(shift)
+        
+        created = 0
+        for start, group in by_start.items():
+            with transaction.atomic():
+                run = SlotGenerationEngine.generate(
+                    group, start, horizon_end, slot_duration_minutes, batch_size
+                )
+                ShiftRepository.set_generated_through([shift.id for shift in group], horizon_end)
+            created += run['slots_created']
+        return created
+    
+    @staticmethod
+    def _apply_invalidations(invalidations, today, horizon_end,
+                             slot_duration_minutes, batch_size) -> int:
+        """Re-materialise the invalidated days of several doctors in one engine run"""
+        allowed_days = set()
+        for invalidation in invalidations:
+            current = max(invalidation.start_date, today)
+            last = min(invalidation.end_date, horizon_end)
+            while current <= last:
+                allowed_days.add((invalidation.doctor_id, current))
+                current += timedelta(days=1)
+        
+        if not allowed_days:
+            return 0
+        
+        doctor_ids = {doctor_id for doctor_id, _ in allowed_days}
+        dates = [day for _, day in allowed_days]
+        shifts = ShiftRepository.get_shifts_for_doctors(doctor_ids)
+        run = SlotGenerationEngine.generate(
+            shifts, min(dates), max(dates), slot_duration_minutes, batch_size,
+            skip_existing=True, allowed_days=allowed_days
+        )
+        return run['slots_created']
+    
+    @staticmethod
+    def rebuild_shift(shift: Shift, slot_duration_minutes: int = 30) -> int:
+        """
+        Replace a shift's future unbooked slots after its timing changed.
+        
+        Slots are regenerated up to the existing watermark so availability
+        does not disappear until the next nightly run.
+        
+        Returns:
+            Number of slots created
+        """
+        today = timezone.now().date()
+        if AvailabilitySlotRepository.delete_future_slots(shift, today):
+            SlotChangeService.slots_changed(
+                [shift.duty.doctor_id], today, None, hospital_ids=[shift.duty.hospital_id]
+            )
+        
+        through = shift.slots_generated_through
+        if not shift.is_active or not through or through < today:
+            return 0
+        
+        run = SlotGenerationEngine.generate(
+            [shift], today, through, slot_duration_minutes, skip_existing=True
+        )
+        return run['slots_created']
+
+
+def _generate_shard(shard_index: int, doctor_ids: List[int], days_ahead: int,
+                    incremental: bool, batch_size: int) -> Dict:
+    """
+    Generate slots for one shard of doctors.
+    
+    Module-level so process pools can pickle it. Every shard uses its own
+    database connection and closes it when done.
+    """
+    started = _time.perf_counter()
+    result = {
+        'shard': shard_index,
+        'doctors': len(doctor_ids),
+        'slots_created': 0,
+        'queries': 0,
+        'failures': [],
+    }
+    
+    try:
+        if incremental:
+            stats = SlotHorizonService.advance(
+                horizon_days=days_ahead, doctor_ids=doctor_ids, batch_size=batch_size
+            )
+            result['slots_created'] = stats['slots_created']
+            result['queries'] = stats['queries']
+        else:
+            today = timezone.now().date()
+            end_date = today + timedelta(days=days_ahead)
+            shifts_by_doctor = defaultdict(list)
+            for shift in ShiftRepository.get_shifts_for_doctors(doctor_ids):
+                shifts_by_doctor[shift.duty.doctor_id].append(shift)
+            
+            for doctor_id in doctor_ids:
+                try:
+                    with transaction.atomic():
+                        stats = SlotGenerationEngine.generate(
+                            shifts_by_doctor.get(doctor_id, []), today, end_date,
+                            batch_size=batch_size
+                        )
+                    result['slots_created'] += stats['slots_created']
+                    result['queries'] += stats['queries']
+                except Exception as e:
+                    result['failures'].append({'doctor_id': doctor_id, 'error': str(e)})
+    except Exception as e:
+        result['failures'].append({'doctor_ids': doctor_ids, 'error': str(e)})
+    finally:
+        connections.close_all()
+    
+    result['elapsed_ms'] = round((_time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+def _init_shard_worker():
+    """Process pool initializer: make sure Django is configured in the child"""
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+class FleetSlotGenerationService:
+    """
+    Sharded slot generation across all active doctors.
+    
+    Doctor ids are streamed from the database, grouped into shards and run on
+    a thread or process pool. Only a bounded number of shards is in flight at
+    any time, so memory does not grow with the size of the fleet.
+    """
+    
+    DEFAULTS = {
+        'workers': 4,
+        'shard_size': 50,
+        'executor': 'thread',
+        'batch_size': SlotGenerationEngine.DEFAULT_BATCH_SIZE,
+    }
+    
+    @staticmethod
+    def get_config(**overrides) -> Dict:
+        """Merge defaults, settings.SCHEDULES_FLEET_GENERATION and explicit overrides"""
+        return merge_config(FleetSlotGenerationService.DEFAULTS, 'SCHEDULES_FLEET_GENERATION', overrides)
+    
+    @staticmethod
+    def iter_shards(shard_size: int, doctor_ids=None) -> Iterator[List[int]]:
+        """Yield lists of at most ``shard_size`` doctor ids"""
+        source = doctor_ids if doctor_ids is not None else DutyRepository.iter_active_doctor_ids()
+        shard = []
+        for doctor_id in source:
+            shard.append(doctor_id)
+            if len(shard) >= shard_size:
+                yield shard
+                shard = []
+        if shard:
+            yield shard
+    
+    @staticmethod
+    def run(days_ahead: int = 30, incremental: bool = True, doctor_ids=None,
+            workers: int = None, shard_size: int = None, executor: str = None,
+            batch_size: int = None) -> Dict:
+        """
+        Generate slots for the fleet (or a subset of doctors) on a worker pool.
+        
+        Args:
+            days_ahead: Length of the horizon in days
+            incremental: Use the rolling-horizon mode instead of full regeneration
+            doctor_ids: Optional explicit list of doctor ids
+            workers: Pool size
+            shard_size: Doctors per shard
+            executor: 'thread' or 'process'
+            batch_size: Rows per INSERT statement
+        
+        Returns:
+            Dictionary with totals and a per-shard list of counts, failures and timings
+        """
+        config = FleetSlotGenerationService.get_config(
+            workers=workers, shard_size=shard_size, executor=executor, batch_size=batch_size
+        )
+        started = _time.perf_counter()
+        
+        if config['executor'] == 'process':
+            # Forked children must not share the parent's database sockets
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=config['workers'], initializer=_init_shard_worker)
+        else:
+            pool = ThreadPoolExecutor(max_workers=config['workers'])
+        
+        shards = []
+        pending = set()
+        max_in_flight = config['workers'] * 2
+        with pool:
+            shard_iter = FleetSlotGenerationService.iter_shards(config['shard_size'], doctor_ids)
+            for index, shard in enumerate(shard_iter):
+                pending.add(pool.submit(
+                    _generate_shard, index, shard, days_ahead, incremental, config['batch_size']
+                ))
+                if len(pending) >= max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    shards.extend(future.result() for future in done)
+            done, _ = wait(pending)
+            shards.extend(future.result() for future in done)
+        
+        shards.sort(key=lambda shard: shard['shard'])
+        return {
+            'shards': shards,
+            'doctors': sum(shard['doctors'] for shard in shards),
+            'slots_created': sum(shard['slots_created'] for shard in shards),
+            'failures': sum(len(shard['failures']) for shard in shards),
+            'elapsed_ms': round((_time.perf_counter() - started) * 1000, 2),
+        }
+
+
+class SlotMaskingService:
+    """
+    Set-based slot masking for leaves and overrides.
+    
+    Each operation is a single UPDATE over the affected window; booked slots
+    are never touched.
+    """
+    
+    @staticmethod
+    def mask(doctor_ids, start_date, end_date) -> int:
+        """
+        Mark unbooked slots unavailable for the given doctors and dates.
+        
+        Returns:
+            Number of slots masked
+        """
+        masked = AvailabilitySlotRepository.mask_slots(doctor_ids, start_date, end_date)
+        if masked:
+            SlotChangeService.slots_changed(doctor_ids, start_date, end_date)
+        return masked
+    
+    @staticmethod
+    def unmask(doctor_ids, start_date, end_date) -> int:
+        """
+        Make unbooked slots available again, except on days still covered by
+        another approved leave or an unavailable override.
+        
+        Returns:
+            Number of slots unmasked
+        """
+        unmasked = AvailabilitySlotRepository.unmask_slots(doctor_ids, start_date, end_date)
+        if unmasked:
+            SlotChangeService.slots_changed(doctor_ids, start_date, end_date)
+        return unmasked
+
+
+class DoctorLeaveService:
+    """Service for managing doctor leaves"""
+    
+    @staticmethod
+    @transaction.atomic
+    def request_leave(doctor, leave_type, start_date, end_date, reason) -> Tuple[bool, str, Optional[DoctorLeave]]:
+        """
+        Request leave for a doctor.
+        
+        Args:
+            doctor: DoctorProfile instance
+            leave_type: Type of leave
+            start_date: Leave start date
+            end_date: Leave end date
+            reason: Leave reason
+        
+        Returns:
+            Tuple of (success, message, leave)
+        """
+        # Check for overlapping leaves
+        if DoctorLeaveRepository.check_leave_overlap(doctor, start_date, end_date):
+            return False, "Leave request overlaps with existing leave", None
         
-        return schedules
\ No newline at end of file
+        leave = DoctorLeaveRepository.create_leave(
+            doctor=doctor,
+            leave_type=leave_type,
+            start_date=start_date,
+            end_date=end_date,
+            reason=reason
+        )
+        
+        return True, "Leave request submitted successfully", leave
+    
+    @staticmethod
+    @transaction.atomic
+    def approve_leave(leave_id: int, approved_by, notes: str = '') -> Tuple[bool, str]:
+        """Approve a leave request"""
+        leave = DoctorLeaveRepository.get_by_id(leave_id)
+        if not leave:
+            return False, "Leave request not found"
+        
+        if leave.status != 'PENDING':
+            return False, "Only pending leave requests can be approved"
+        
+        DoctorLeaveRepository.approve_leave(leave, approved_by, notes)
+        
+        # Mark slots as unavailable for leave period
+        masked = DoctorLeaveService._handle_leave_slots(leave)
+        
+        return True, f"Leave request approved ({masked} slots blocked)"
+    
+    @staticmethod
+    @transaction.atomic
+    def reject_leave(leave_id: int, rejected_by, notes: str = '') -> Tuple[bool, str]:
+        """Reject a leave request"""
+        leave = DoctorLeaveRepository.get_by_id(leave_id)
+        if not leave:
+            return False, "Leave request not found"
+        
+        if leave.status != 'PENDING':
+            return False, "Only pending leave requests can be rejected"
+        
+        DoctorLeaveRepository.reject_leave(leave, rejected_by, notes)
+        return True, "Leave request rejected"
+    
+    @staticmethod
+    def get_doctor_leaves(doctor, status: str = None) -> List[DoctorLeave]:
+        """Get leaves for a doctor"""
+        return DoctorLeaveRepository.get_doctor_leaves(doctor, status)
+    
+    @staticmethod
+    def get_pending_leaves(hospital=None) -> List[DoctorLeave]:
+        """Get pending leave requests"""
+        return DoctorLeaveRepository.get_pending_leaves(hospital)
+    
+    @staticmethod
+    @transaction.atomic
+    def cancel_leave(leave_id: int) -> Tuple[bool, str]:
+        """Cancel a leave request, releasing slots if it had been approved"""
+        leave = DoctorLeaveRepository.get_by_id(leave_id)
+        if not leave:
+            return False, "Leave request not found"
+        
+        if leave.status not in ('PENDING', 'APPROVED'):
+            return False, "Only pending or approved leave requests can be cancelled"
+        
+        was_approved = leave.status == 'APPROVED'
+        DoctorLeaveRepository.cancel_leave(leave)
+        
+        released = 0
+        if was_approved:
+            released = SlotMaskingService.unmask([leave.doctor_id], leave.start_date, leave.end_date)
+        
+        return True, f"Leave request cancelled ({released} slots released)"
+    
+    @staticmethod
+    def _handle_leave_slots(leave: DoctorLeave) -> int:
+        """Mark slots as unavailable during leave period"""
+        return SlotMaskingService.mask([leave.doctor_id], leave.start_date, leave.end_date)
+
+
+class ScheduleOverrideService:
+    """Service for managing schedule overrides"""
+    
+    @staticmethod
+    @transaction.atomic
+    def create_override(doctor, date, is_available, reason, created_by, **kwargs) -> Tuple[bool, str, Optional[ScheduleOverride]]:
+        """
+        Create a schedule override.
+        
+        Args:
+            doctor: DoctorProfile instance
+            date: Override date
+            is_available: Whether doctor is available
+            reason: Override reason
+            created_by: User creating override
+            **kwargs: Additional fields
+        
+        Returns:
+            Tuple of (success, message, override)
+        """
+        # Check if override already exists
+        existing = ScheduleOverrideRepository.get_override_for_date(doctor, date)
+        if existing:
+            return False, "Override already exists for this date", None
+        
+        override = ScheduleOverrideRepository.create_override(
+            doctor=doctor,
+            date=date,
+            is_available=is_available,
+            reason=reason,
+            created_by=created_by,
+            **kwargs
+        )
+        
+        # Update existing slots for this date
+        if not is_available:
+            SlotMaskingService.mask([doctor.id], date, date)
+        
+        return True, "Schedule override created successfully", override
+    
+    @staticmethod
+    @transaction.atomic
+    def update_override(override_id: int, **fields) -> Tuple[bool, str, Optional[ScheduleOverride]]:
+        """Update a schedule override"""
+        override = ScheduleOverrideRepository.get_by_id(override_id)
+        if not override:
+            return False, "Override not found", None
+        
+        was_available = override.is_available
+        updated_override = ScheduleOverrideRepository.update_override(override, **fields)
+        
+        if was_available and not updated_override.is_available:
+            SlotMaskingService.mask([override.doctor_id], override.date, override.date)
+        elif not was_available and updated_override.is_available:
+            SlotMaskingService.unmask([override.doctor_id], override.date, override.date)
+        
+        return True, "Override updated successfully", updated_override
+    
+    @staticmethod
+    @transaction.atomic
+    def delete_override(override_id: int) -> Tuple[bool, str]:
+        """Delete a schedule override"""
+        override = ScheduleOverrideRepository.get_by_id(override_id)
+        if not override:
+            return False, "Override not found"
+        
+        was_unavailable = not override.is_available
+        ScheduleOverrideRepository.delete_override(override)
+        
+        if was_unavailable:
+            SlotMaskingService.unmask([override.doctor_id], override.date, override.date)
+        
+        return True, "Override deleted successfully"
+    
+    @staticmethod
+    def get_doctor_overrides(doctor, from_date=None) -> List[ScheduleOverride]:
+        """Get overrides for a doctor"""
+        return ScheduleOverrideRepository.get_doctor_overrides(doctor, from_date)
+
+
+class ScheduleAnalyticsService:
+    """Service for schedule analytics and reporting"""
+    
+    @staticmethod
+    def get_doctor_schedule_summary(doctor, start_date, end_date) -> Dict:
+        """
+        Get comprehensive schedule summary for a doctor.
+        
+        Returns:
+            Dictionary with schedule statistics
+        """
+        # Get shifts
+        shifts = ShiftRepository.get_doctor_shifts(doctor)
+        
+        # Get slot counts from the daily rollup
+        totals = DoctorDailyAvailabilityRepository.get_totals(doctor, start_date, end_date)
+        
+        # Get leaves
+        leaves = DoctorLeaveRepository.get_doctor_leaves(doctor, status='APPROVED')
+        active_leaves = [l for l in leaves if l.is_active()]
+        
+        # Calculate statistics
+        total_slots = totals['total_slots']
+        available_slots = totals['available_slots']
+        booked_slots = totals['booked_slots']
+        working_days = totals['working_days']
+        
+        return {
+            'total_shifts': len(shifts),
+            'total_slots': total_slots,
+            'available_slots': available_slots,
+            'booked_slots': booked_slots,
+            'booking_rate': (booked_slots / total_slots * 100) if total_slots > 0 else 0,
+            'working_days': working_days,
+            'active_leaves': len(active_leaves),
+            'shifts_by_day': {
+                shift.get_day_of_week_display(): {
+                    'start_time': shift.start_time.strftime('%H:%M'),
+                    'end_time': shift.end_time.strftime('%H:%M'),
+                    'duration_minutes': shift.duration_minutes()
+                }
+                for shift in shifts
+            }
+        }
+    
+    @staticmethod
+    def get_weekly_schedule(doctor, week_start) -> Dict:
+        """
+        Get weekly schedule for a doctor.
+        
+        Args:
+            doctor: DoctorProfile instance
+            week_start: Monday of the week
+        
+        Returns:
+            Dictionary with daily schedules
+        """
+        return ScheduleAnalyticsService.get_weekly_schedules(doctor, week_start, weeks=1)[week_start.isoformat()]
+    
+    @staticmethod
+    def get_weekly_schedules(doctor, week_start, weeks: int = 1) -> Dict:
+        """
+        Materialise several consecutive weeks of a doctor's schedule.
+        
+        Shifts, per-day slot counts, overrides and leaves are each fetched once
+        for the whole window, so the query count does not depend on ``weeks``.
+        
+        Args:
+            doctor: DoctorProfile instance
+            week_start: Monday of the first week
+            weeks: Number of weeks
+        
+        Returns:
+            Dictionary keyed by each week's Monday (ISO date) holding the
+            same per-day structure as get_weekly_schedule
+        """
+        window_end = week_start + timedelta(days=7 * weeks - 1)
+        
+        shifts = ShiftRepository.get_shifts_in_range(doctor, week_start, window_end)
+        slot_counts = AvailabilitySlotRepository.get_daily_slot_counts([doctor.id], week_start, window_end)
+        overrides = ScheduleOverrideRepository.get_overrides_in_range([doctor.id], week_start, window_end)
+        leaves = DoctorLeaveRepository.get_approved_leaves_in_range([doctor.id], week_start, window_end)
+        
+        shifts_by_day = defaultdict(list)
+        for shift in shifts:
+            shifts_by_day[shift.day_of_week].append(shift)
+        
+        empty_counts = {'total_slots': 0, 'available_slots': 0, 'booked_slots': 0}
+        schedules = {}
+        for week in range(weeks):
+            monday = week_start + timedelta(days=7 * week)
+            weekly_schedule = {}
+            
+            for offset in range(7):
+                current_date = monday + timedelta(days=offset)
+                override = overrides.get((doctor.id, current_date))
+                counts = slot_counts.get((doctor.id, current_date), empty_counts)
+                
+                weekly_schedule[current_date.strftime('%A')] = {
+                    'date': current_date.isoformat(),
+                    'shifts': [
+                        {
+                            'start_time': shift.start_time.strftime('%H:%M'),
+                            'end_time': shift.end_time.strftime('%H:%M'),
+                            'hospital': shift.duty.hospital.hospital_name
+                        }
+                        for shift in shifts_by_day[current_date.weekday()]
+                        if shift_runs_on(shift, current_date)
+                    ],
+                    **counts,
+                    'is_on_leave': any(
+                        leave.start_date <= current_date <= leave.end_date
+                        for leave in leaves
+                    ),
+                    'has_override': override is not None,
+                    'override_available': override.is_available if override else None
+                }
+            
+            schedules[monday.isoformat()] = weekly_schedule
+        
+        return schedules
+    
+    @staticmethod
+    def get_hospital_doctor_schedules(hospital, date) -> List[Dict]:
+        """
+        Get all doctor schedules at a hospital for a date.
+        
+        Args:
+            hospital: HospitalProfile instance
+            date: Date to check
+        
+        Returns:
+            List of doctor schedule summaries
+        """
+        return HospitalRosterService.get_roster(hospital.id, date)
+
+
+class HospitalRosterService:
+    """
+    Cached daily roster of the doctors working at a hospital.
+    
+    A roster is built from two queries (shifts with doctors, grouped slot
+    counts) and cached per (hospital, date). Each hospital has a version
+    number in the cache; bumping it drops all of that hospital's rosters at
+    once without knowing which dates were cached.
+    """
+    
+    DEFAULT_TIMEOUT = 300
+    
+    @staticmethod
+    def _version_key(hospital_id: int) -> str:
+        return f"schedules:roster:version:{hospital_id}"
+    
+    @staticmethod
+    def _roster_key(hospital_id: int, version: int, date) -> str:
+        return f"schedules:roster:{hospital_id}:{version}:{date.isoformat()}"
+    
+    @staticmethod
+    def get_roster(hospital_id: int, date, use_cache: bool = True) -> List[Dict]:
+        """
+        Get the doctors with shifts at a hospital on a date.
+        
+        Args:
+            hospital_id: HospitalProfile ID
+            date: Date to check
+            use_cache: Read and populate the roster cache
+        
+        Returns:
+            One entry per doctor with their shifts and slot counts at this hospital
+        """
+        if not use_cache:
+            return HospitalRosterService.build_roster(hospital_id, date)
+        
+        version = cache.get_or_set(HospitalRosterService._version_key(hospital_id), 1, None)
+        key = HospitalRosterService._roster_key(hospital_id, version, date)
+        roster = cache.get(key)
+        if roster is None:
+            roster = HospitalRosterService.build_roster(hospital_id, date)
+            timeout = getattr(settings, 'SCHEDULES_ROSTER_CACHE_TIMEOUT', HospitalRosterService.DEFAULT_TIMEOUT)
+            cache.set(key, roster, timeout)
+        return roster
+    
+    @staticmethod
+    def build_roster(hospital_id: int, date) -> List[Dict]:
+        """Build a roster from the database, bypassing the cache"""
+        shifts = ShiftRepository.get_hospital_shifts_for_date(hospital_id, date)
+        if not shifts:
+            return []
+        slot_counts = AvailabilitySlotRepository.get_hospital_slot_counts(hospital_id, date)
+        
+        empty_counts = {'total_slots': 0, 'available_slots': 0, 'booked_slots': 0}
+        roster = {}
+        for shift in shifts:
+            doctor = shift.duty.doctor
+            entry = roster.get(doctor.id)
+            if entry is None:
+                entry = roster[doctor.id] = {
+                    'doctor_id': doctor.id,
+                    'doctor_name': doctor.user.get_full_name(),
+                    'specialty': doctor.specialization,
+                    'shifts': [],
+                    **slot_counts.get(doctor.id, empty_counts)
+                }
+            entry['shifts'].append({
+                'start_time': shift.start_time.strftime('%H:%M'),
+                'end_time': shift.end_time.strftime('%H:%M')
+            })
+        
+        return list(roster.values())
+    
+    @staticmethod
+    def invalidate(hospital_ids) -> None:
+        """
+        Drop every cached roster of the given hospitals once the current
+        transaction commits (at once in autocommit), so a read racing the
+        commit cannot cache pre-commit rows under the new version.
+        """
+        hospital_ids = set(hospital_ids)
+        transaction.on_commit(lambda: HospitalRosterService._bump_versions(hospital_ids), robust=True)
+    
+    @staticmethod
+    def _bump_versions(hospital_ids) -> None:
+        """Bump the cache version of each hospital's rosters"""
+        for hospital_id in hospital_ids:
+            try:
+                cache.incr(HospitalRosterService._version_key(hospital_id))
+            except ValueError:
+                # Nothing cached yet for this hospital
+                pass
+    
+    @staticmethod
+    def invalidate_for_doctors(doctor_ids) -> None:
+        """Drop cached rosters of every hospital where the doctors hold an active duty"""
+        HospitalRosterService.invalidate(DutyRepository.get_hospital_ids_for_doctors(doctor_ids))
+
+
+class DailyAvailabilityService:
+    """
+    Maintains the DoctorDailyAvailability rollup.
+    
+    A refresh recomputes a (doctors, date range) window from live slots with
+    one grouped query and writes it back with one upsert, so callers only
+    need to say which window they touched.
+    """
+    
+    REBUILD_WINDOW_DAYS = 31
+    
+    @staticmethod
+    @transaction.atomic
+    def refresh(doctor_ids, start_date, end_date=None) -> int:
+        """
+        Recompute the rollup for some doctors over a date range.
+        
+        Args:
+            doctor_ids: Doctor ids, or None for every doctor
+            start_date: First date (inclusive)
+            end_date: Last date (inclusive), or None for no upper bound
+        
+        Returns:
+            Number of rollup rows written
+        """
+        if doctor_ids is not None:
+            doctor_ids = list(doctor_ids)
+            if not doctor_ids:
+                return 0
+        counts = AvailabilitySlotRepository.get_daily_slot_counts(doctor_ids, start_date, end_date)
+        return DoctorDailyAvailabilityRepository.replace_range(doctor_ids, start_date, end_date, counts)
+    
+    @staticmethod
+    def iter_windows(start_date, end_date, window_days: int = REBUILD_WINDOW_DAYS) -> Iterator[Tuple]:
+        """Split a date range into consecutive (start, end) windows"""
+        current = start_date
+        while current <= end_date:
+            last = min(current + timedelta(days=window_days - 1), end_date)
+            yield current, last
+            current = last + timedelta(days=1)
+    
+    @staticmethod
+    def rebuild(start_date, end_date, window_days: int = REBUILD_WINDOW_DAYS) -> int:
+        """Recompute the rollup for every doctor, one date window per transaction"""
+        written = 0
+        for window_start, window_end in DailyAvailabilityService.iter_windows(start_date, end_date, window_days):
+            written += DailyAvailabilityService.refresh(None, window_start, window_end)
+        return written
+    
+    @staticmethod
+    def rebuild_all(window_days: int = REBUILD_WINDOW_DAYS) -> int:
+        """Recompute the whole rollup from scratch"""
+        first, last = AvailabilitySlotRepository.get_date_bounds()
+        DoctorDailyAvailabilityRepository.delete_outside(first, last)
+        if first is None:
+            return 0
+        return DailyAvailabilityService.rebuild(first, last, window_days)
+    
+    @staticmethod
+    def diff(start_date, end_date, window_days: int = REBUILD_WINDOW_DAYS) -> List[Dict]:
+        """
+        Compare the rollup with live slot counts.
+        
+        Returns:
+            One entry per (doctor, date) whose rollup row is missing, stale or orphaned
+        """
+        mismatches = []
+        for window_start, window_end in DailyAvailabilityService.iter_windows(start_date, end_date, window_days):
+            live = AvailabilitySlotRepository.get_daily_slot_counts(None, window_start, window_end)
+            stored = DoctorDailyAvailabilityRepository.get_counts(None, window_start, window_end)
+            for key in sorted(set(live) | set(stored)):
+                if live.get(key) != stored.get(key):
+                    mismatches.append({
+                        'doctor_id': key[0],
+                        'date': key[1],
+                        'live': live.get(key),
+                        'rollup': stored.get(key),
+                    })
+        return mismatches
+
+
+class SlotChangeService:
+    """
+    Single notification point for code that changes slots.
+    
+    Keeps the derived views of AvailabilitySlot (daily rollup, earliest
+    free slot index, cached hospital rosters) in step after inserts,
+    updates and deletes.
+    """
+    
+    @staticmethod
+    def slots_changed(doctor_ids, start_date, end_date=None, hospital_ids=None) -> None:
+        """
+        Record that slots of the given doctors changed within a date range.
+        
+        Args:
+            doctor_ids: Doctor ids whose slots changed
+            start_date: First affected date
+            end_date: Last affected date, or None for no upper bound
+            hospital_ids: Hospitals affected, if already known (saves a lookup)
+        """
+        doctor_ids = list(doctor_ids)
+        ChangeFeedService.record_slots(doctor_ids, start_date, end_date)
+        DailyAvailabilityService.refresh(doctor_ids, start_date, end_date)
+        if end_date is None or end_date >= timezone.now().date():
+            EarliestSlotIndexService.refresh_on_commit(doctor_ids)
+        if hospital_ids is None:
+            HospitalRosterService.invalidate_for_doctors(doctor_ids)
+        else:
+            HospitalRosterService.invalidate(hospital_ids)
+
+
+class ChangeFeedService:
+    """
+    Delta sync over the ChangeLogEntry feed.
+    
+    Writers append entries (slot ranges through SlotChangeService, schedules
+    and appointments through signals). Clients keep the token of the last
+    page and ask for what changed since; each page is compacted to the
+    latest state per object, so a slot booked and cancelled ten times
+    between polls is sent once. Slots are sent per doctor range: the client
+    replaces its slots for that doctor and range with the ones returned.
+    
+    Entries are inserted when the writing transaction commits, so a long
+    transaction cannot commit a lower id behind a token a client already
+    holds. Entries younger than settle_seconds are also held back, which
+    covers concurrent commit-time inserts finishing out of id order.
+    
+    Configuration (all optional) lives in ``settings.SCHEDULES_CHANGE_FEED``:
+        page_size: Default number of log entries read per page
+        max_page_size: Upper bound for a client-supplied limit
+        settle_seconds: Age an entry must reach before it is served
+        compact_chunk_size: Width of each id range during compaction
+    """
+    
+    DEFAULTS = {
+        'page_size': 500,
+        'max_page_size': 5000,
+        'settle_seconds': 1,
+        'compact_chunk_size': 5000,
+    }
+    
+    @staticmethod
+    def get_config(**overrides) -> Dict:
+        """Merge defaults, settings.SCHEDULES_CHANGE_FEED and explicit overrides"""
+        return merge_config(ChangeFeedService.DEFAULTS, 'SCHEDULES_CHANGE_FEED', overrides)
+    
+    # -------------------------------
+    # Recording
+    # -------------------------------
+    
+    @staticmethod
+    def _record(entries: List[ChangeLogEntry]) -> None:
+        """
+        Insert entries once the current transaction commits (at once in
+        autocommit); nothing is logged for a rolled-back change. A failed
+        insert is logged rather than raised into the committed change.
+        """
+        transaction.on_commit(lambda: ChangeLogRepository.record(entries), robust=True)
+    
+    @staticmethod
+    def record_slots(doctor_ids: Iterable[int], start_date, end_date=None) -> None:
+        """Log that slots of these doctors changed within a date range"""
+        ChangeFeedService._record([
+            ChangeLogEntry(
+                object_type=ChangeLogEntry.ObjectType.SLOTS, object_id=doctor_id,
+                start_date=start_date, end_date=end_date
+            )
+            for doctor_id in doctor_ids
+        ])
+    
+    @staticmethod
+    def _owner_user_id(instance, field: str):
+        """
+        user_id of a doctor / patient relation without loading it: taken from
+        the related object when already cached, else resolved from the
+        foreign key inside the INSERT (None once the profile is gone)
+        """
+        relation = instance._meta.get_field(field)
+        if relation.is_cached(instance):
+            related = getattr(instance, field)
+            return related.user_id if related is not None else None
+        pk = getattr(instance, relation.attname)
+        if pk is None:
+            return None
+        return ChangeLogRepository.owner_user_id(relation.related_model, pk)
+    
+    @staticmethod
+    def record_object(object_type: str, instance, deleted: bool = False) -> None:
+        """Log a save or delete of a schedule or appointment"""
+        ChangeFeedService._record([ChangeLogEntry(
+            object_type=object_type,
+            object_id=instance.pk,
+            action=ChangeLogEntry.Action.DELETE if deleted else ChangeLogEntry.Action.SAVE,
+            doctor_user_id=ChangeFeedService._owner_user_id(instance, 'doctor'),
+            patient_user_id=ChangeFeedService._owner_user_id(instance, 'patient')
+        )])
+    
+    # -------------------------------
+    # Reading
+    # -------------------------------
+    
+    @staticmethod
+    def compact(entries: List[Dict]) -> Tuple[Dict[int, Tuple], Dict[str, Dict[int, str]]]:
+        """
+        Reduce a page of entries to one range per doctor and one action per object.
+        
+        Returns:
+            ({doctor_id: (start_date, end_date)}, {object_type: {object_id: action}})
+        """
+        slot_ranges = {}
+        objects = defaultdict(dict)
+        for entry in entries:
+            if entry['object_type'] != ChangeLogEntry.ObjectType.SLOTS:
+                objects[entry['object_type']][entry['object_id']] = entry['action']
+                continue
+            start_date, end_date = entry['start_date'], entry['end_date']
+            if entry['object_id'] in slot_ranges:
+                known_start, known_end = slot_ranges[entry['object_id']]
+                start_date = min(start_date, known_start)
+                end_date = None if end_date is None or known_end is None else max(end_date, known_end)
+            slot_ranges[entry['object_id']] = (start_date, end_date)
+        return slot_ranges, objects
+    
+    @staticmethod
+    def _object_changes(actions: Dict[int, str], fetch) -> Dict:
+        """Current rows for saved objects; deleted or vanished ones become ids"""
+        saved = [object_id for object_id, action in actions.items() if action == ChangeLogEntry.Action.SAVE]
+        changed = fetch(saved) if saved else []
+        present = {row['id'] for row in changed}
+        return {
+            'changed': changed,
+            'deleted': sorted(object_id for object_id in actions if object_id not in present),
+        }
+    
+    @staticmethod
+    def changes(since: Optional[int] = None, limit: Optional[int] = None, user=None,
+                hospital_id: Optional[int] = None, **options) -> Dict:
+        """
+        One page of changes after a token.
+        
+        Without a token this only returns the current head token: a new
+        client takes it, loads the full lists, then polls from it.
+        
+        Args:
+            since: Token from the previous page
+            limit: Log entries to read (capped at max_page_size)
+            user: Requesting user; non-staff users only get their own schedules and appointments
+            hospital_id: Only return slots of this hospital
+        
+        Returns:
+            Dictionary with token, has_more, slots, schedules and appointments
+        """
+        config = ChangeFeedService.get_config(**options)
+        settled = timezone.now() - timedelta(seconds=config['settle_seconds'])
+        page = {
+            'token': since,
+            'has_more': False,
+            'slots': [],
+            'schedules': {'changed': [], 'deleted': []},
+            'appointments': {'changed': [], 'deleted': []},
+        }
+        if since is None:
+            page['token'] = ChangeLogRepository.get_head(created_before=settled)
+            return page
+        
+        limit = min(limit or config['page_size'], config['max_page_size'])
+        user_id = None if user is None or user.is_staff else user.id
+        entries = ChangeLogRepository.get_after(since, limit, user_id, created_before=settled)
+        if not entries:
+            return page
+        page['token'] = entries[-1]['id']
+        page['has_more'] = len(entries) == limit
+        
+        slot_ranges, objects = ChangeFeedService.compact(entries)
+        if slot_ranges:
+            slots_by_doctor = defaultdict(list)
+            for row in ChangeLogRepository.get_slots(slot_ranges, hospital_id):
+                slots_by_doctor[row.pop('shift__duty__doctor_id')].append(row)
+            page['slots'] = [
+                {
+                    'doctor_id': doctor_id,
+                    'start_date': start_date,
+                    'end_date': end_date,
+                    'slots': slots_by_doctor.get(doctor_id, []),
+                }
+                for doctor_id, (start_date, end_date) in sorted(slot_ranges.items())
+            ]
+        page['schedules'] = ChangeFeedService._object_changes(
+            objects[ChangeLogEntry.ObjectType.SCHEDULE], ChangeLogRepository.get_schedules
+        )
+        page['appointments'] = ChangeFeedService._object_changes(
+            objects[ChangeLogEntry.ObjectType.APPOINTMENT], ChangeLogRepository.get_appointments
+        )
+        return page
+    
+    # -------------------------------
+    # Maintenance
+    # -------------------------------
+    
+    @staticmethod
+    def compact_log(chunk_size: Optional[int] = None) -> int:
+        """
+        Delete entries that a later entry for the same object supersedes.
+        
+        Clients holding any token still converge: the surviving entry is
+        newer than the removed one and carries the same object.
+        
+        Returns:
+            Number of entries deleted
+        """
+        chunk_size = ChangeFeedService.get_config(compact_chunk_size=chunk_size)['compact_chunk_size']
+        first_id, last_id = ChangeLogRepository.get_id_bounds(ChangeLogRepository.get_head())
+        if first_id is None:
+            return 0
+        deleted = 0
+        for chunk_first, chunk_last in SlotCleanupService.iter_id_ranges(first_id, last_id, chunk_size):
+            deleted += ChangeLogRepository.delete_superseded(chunk_first, chunk_last)
+        return deleted
+
+
+class SlotCleanupService:
+    """
+    Removes past slots in bounded primary-key chunks.
+    
+    Each chunk is its own short transaction, with an optional pause between
+    chunks, so the write lock is released regularly and the delete collector
+    never holds more than one chunk of rows. Booked slots are kept unless
+    archive_booked is set, in which case they are copied to ArchivedSlot in
+    the same transaction that deletes them.
+    
+    Configuration (all optional) lives in ``settings.SCHEDULES_SLOT_CLEANUP``:
+        retention_days: Keep slots dated within this many days before today
+        chunk_size: Width of each primary-key range
+        pause: Seconds to sleep between chunks
+        archive_booked: Archive and delete booked slots as well
+    """
+    
+    DEFAULTS = {
+        'retention_days': 7,
+        'chunk_size': 5000,
+        'pause': 0.05,
+        'archive_booked': False,
+    }
+    
+    @staticmethod
+    def get_config(**overrides) -> Dict:
+        """Merge defaults, settings.SCHEDULES_SLOT_CLEANUP and explicit overrides"""
+        return merge_config(SlotCleanupService.DEFAULTS, 'SCHEDULES_SLOT_CLEANUP', overrides)
+    
+    @staticmethod
+    def iter_id_ranges(first_id: int, last_id: int, chunk_size: int) -> Iterator[Tuple[int, int]]:
+        """Split an inclusive id range into consecutive (first, last) chunks"""
+        current = first_id
+        while current <= last_id:
+            last = min(current + chunk_size - 1, last_id)
+            yield current, last
+            current = last + 1
+    
+    @staticmethod
+    @transaction.atomic
+    def clean_chunk(first_id: int, last_id: int, cutoff_date, archive_booked: bool) -> Dict:
+        """
+        Delete one id range of past slots.
+        
+        Returns:
+            Dictionary with deleted and archived counts and the deleted date span
+        """
+        archived = 0
+        if archive_booked:
+            rows = AvailabilitySlotRepository.get_past_booked_rows(first_id, last_id, cutoff_date)
+            if rows:
+                ArchivedSlotRepository.archive(rows)
+                archived = len(rows)
+        deleted, first_date, last_date = AvailabilitySlotRepository.delete_past_slots(
+            first_id, last_id, cutoff_date, include_booked=archive_booked
+        )
+        return {'deleted': deleted, 'archived': archived, 'first_date': first_date, 'last_date': last_date}
+    
+    @staticmethod
+    def run(**overrides) -> Dict:
+        """
+        Delete slots dated before the retention cutoff.
+        
+        Returns:
+            Dictionary with deleted/archived/chunk counts, elapsed seconds and rows per second
+        """
+        config = SlotCleanupService.get_config(**overrides)
+        if config['chunk_size'] < 1:
+            raise ValueError("chunk_size must be positive")
+        cutoff_date = timezone.now().date() - timedelta(days=config['retention_days'])
+        stats = {'deleted': 0, 'archived': 0, 'chunks': 0, 'elapsed': 0.0, 'rows_per_second': 0.0}
+        
+        first_id, last_id = AvailabilitySlotRepository.get_past_id_bounds(cutoff_date)
+        if first_id is None:
+            return stats
+        
+        touched = []
+        started = _time.perf_counter()
+        for chunk_first, chunk_last in SlotCleanupService.iter_id_ranges(first_id, last_id, config['chunk_size']):
+            if stats['chunks'] and config['pause']:
+                _time.sleep(config['pause'])
+            chunk = SlotCleanupService.clean_chunk(chunk_first, chunk_last, cutoff_date, config['archive_booked'])
+            stats['deleted'] += chunk['deleted']
+            stats['archived'] += chunk['archived']
+            stats['chunks'] += 1
+            if chunk['deleted']:
+                touched += [chunk['first_date'], chunk['last_date']]
+        
+        stats['elapsed'] = _time.perf_counter() - started
+        if stats['elapsed']:
+            stats['rows_per_second'] = stats['deleted'] / stats['elapsed']
+        
+        if touched:
+            # Past days only: the earliest slot index and upcoming rosters are unaffected
+            DailyAvailabilityService.rebuild(min(touched), max(touched))
+        
+        logger.info(
+            f"Slot cleanup removed {stats['deleted']} slots ({stats['archived']} archived) "
+            f"in {stats['chunks']} chunks, {stats['rows_per_second']:.0f} rows/s"
+        )
+        return stats
+
+
+class LowAvailabilityService:
+    """
+    Fleet-wide low-availability detection and notification.
+    
+    Detection is one grouped query over the daily rollup; notifications go
+    out in batches over a single mail connection.
+    
+    Configuration (all optional) lives in ``settings.SCHEDULES_LOW_AVAILABILITY``:
+        threshold: Default available/total ratio (0.2 = alert below 20%)
+        specialization_thresholds: {specialization: ratio} overrides
+        window_days: Days ahead to inspect
+        batch_size: Messages per send_messages call
+    """
+    
+    DEFAULTS = {
+        'threshold': 0.2,
+        'specialization_thresholds': {},
+        'window_days': 7,
+        'batch_size': 100,
+    }
+    
+    @staticmethod
+    def get_config(**overrides) -> Dict:
+        """Merge defaults, settings.SCHEDULES_LOW_AVAILABILITY and explicit overrides"""
+        return merge_config(LowAvailabilityService.DEFAULTS, 'SCHEDULES_LOW_AVAILABILITY', overrides)
+    
+    @staticmethod
+    def detect(start_date, end_date, threshold: float,
+               specialization_thresholds: Optional[Dict[str, float]] = None) -> List[Dict]:
+        """
+        Find doctors whose available share of slots in the window is below threshold.
+        
+        Returns:
+            List of dictionaries with doctor details, counts and the availability ratio
+        """
+        rows = DoctorDailyAvailabilityRepository.get_low_availability(
+            start_date, end_date, threshold, specialization_thresholds
+        )
+        return [
+            {
+                'doctor_id': row['doctor_id'],
+                'email': row['doctor__user__email'],
+                'name': f"{row['doctor__user__first_name']} {row['doctor__user__last_name']}".strip(),
+                'specialization': row['doctor__specialization'],
+                'total_slots': row['total'],
+                'available_slots': row['available'],
+                'ratio': row['available'] / row['total'],
+            }
+            for row in rows
+        ]
+    
+    @staticmethod
+    def build_message(doctor: Dict, start_date, end_date) -> EmailMessage:
+        """Build the notification email for one doctor"""
+        body = (
+            f"Dear Dr. {doctor['name']},\n\n"
+            f"Only {doctor['available_slots']} of your {doctor['total_slots']} slots between "
+            f"{start_date} and {end_date} are still open for booking "
+            f"({doctor['ratio']:.0%}).\n\n"
+            "Please review your shifts and leave so patients can find a free slot.\n\n"
+            "Best regards,\nMedApp Team"
+        )
+        return EmailMessage(
+            subject="Low availability in your upcoming schedule",
+            body=body,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[doctor['email']],
+        )
+    
+    @staticmethod
+    def notify(doctors: List[Dict], start_date, end_date, batch_size: int = 100) -> int:
+        """
+        Email every doctor in batches over one connection.
+        
+        Returns:
+            Number of messages sent
+        """
+        messages = [
+            LowAvailabilityService.build_message(doctor, start_date, end_date)
+            for doctor in doctors if doctor['email']
+        ]
+        if not messages:
+            return 0
+        
+        sent = 0
+        with get_connection() as mail_connection:
+            for offset in range(0, len(messages), batch_size):
+                sent += mail_connection.send_messages(messages[offset:offset + batch_size]) or 0
+        return sent
+    
+    @staticmethod
+    def run(**overrides) -> Dict:
+        """
+        Detect low availability for the upcoming window and notify the doctors.
+        
+        Returns:
+            Dictionary with the window, the flagged doctors and the number of emails sent
+        """
+        config = LowAvailabilityService.get_config(**overrides)
+        start_date = timezone.now().date()
+        end_date = start_date + timedelta(days=config['window_days'])
+        
+        doctors = LowAvailabilityService.detect(
+            start_date, end_date, config['threshold'], config['specialization_thresholds']
+        )
+        sent = LowAvailabilityService.notify(doctors, start_date, end_date, config['batch_size'])
+        return {
+            'start_date': start_date,
+            'end_date': end_date,
+            'doctors': doctors,
+            'emails_sent': sent,
+        }
+
+
+class ReminderDispatchService:
+    """
+    Batch dispatcher for ScheduleReminder.
+    
+    Each batch is claimed with one conditional UPDATE over the
+    (is_sent, send_bucket, send_time) index, loaded with one query and
+    delivered with send_messages on a mail connection shared by the whole
+    run. Reminders are only marked sent after delivery; a failed batch is
+    released, and claims older than lease_seconds (a crashed worker) become
+    claimable again.
+    
+    Configuration (all optional) lives in ``settings.SCHEDULES_REMINDER_DISPATCH``:
+        batch_size: Reminders claimed and sent per batch
+        max_batches: Upper bound on batches per run
+        lookback_hours: How many past hourly buckets are still delivered
+        lease_seconds: Age after which another worker may take over a claim
+        reminder_types: Channels with a transport (only EMAIL exists today)
+    """
+    
+    DEFAULTS = {
+        'batch_size': 500,
+        'max_batches': 200,
+        'lookback_hours': 24,
+        'lease_seconds': 600,
+        'reminder_types': ['EMAIL'],
+    }
+    
+    @staticmethod
+    def get_config(**overrides) -> Dict:
+        """Merge defaults, settings.SCHEDULES_REMINDER_DISPATCH and explicit overrides"""
+        return merge_config(ReminderDispatchService.DEFAULTS, 'SCHEDULES_REMINDER_DISPATCH', overrides)
+    
+    @staticmethod
+    def build_message(reminder) -> Optional[EmailMessage]:
+        """Build the reminder email, or None when the patient has no address"""
+        schedule = reminder.schedule
+        email = schedule.patient.user.email
+        if not email:
+            return None
+        start = timezone.localtime(schedule.start_time)
+        body = (
+            f"Dear {schedule.patient.user.get_full_name() or schedule.patient.user.username},\n\n"
+            f"This is a reminder for \"{schedule.title}\" with "
+            f"Dr. {schedule.doctor.user.get_full_name()} on {start:%Y-%m-%d} at {start:%H:%M}.\n\n"
+            "Best regards,\nMedApp Team"
+        )
+        return EmailMessage(
+            subject=f"Reminder: {schedule.title}",
+            body=body,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[email],
+        )
+    
+    @staticmethod
+    def dispatch_batch(config: Dict, now, mail_connection) -> Dict:
+        """
+        Claim, deliver and mark one batch.
+        
+        Returns:
+            Dictionary with claimed, sent and skipped (no address) counts
+        """
+        token = uuid4()
+        current_bucket = epoch_hour(now)
+        claimed = ScheduleReminderRepository.claim_due(
+            token, now,
+            current_bucket - config['lookback_hours'], current_bucket,
+            config['reminder_types'],
+            now - timedelta(seconds=config['lease_seconds']),
+            config['batch_size']
+        )
+        if not claimed:
+            return {'claimed': 0, 'sent': 0, 'skipped': 0}
+        
+        sent = 0
+        try:
+            reminders = ScheduleReminderRepository.get_claimed(token)
+            messages = [ReminderDispatchService.build_message(reminder) for reminder in reminders]
+            deliverable = [message for message in messages if message is not None]
+            if deliverable:
+                sent = mail_connection.send_messages(deliverable) or 0
+        except Exception:
+            ScheduleReminderRepository.release(token)
+            raise
+        ScheduleReminderRepository.mark_sent(token, now)
+        return {'claimed': claimed, 'sent': sent, 'skipped': len(messages) - len(deliverable)}
+    
+    @staticmethod
+    def run(**overrides) -> Dict:
+        """
+        Deliver due reminders batch by batch until none are left or max_batches is hit.
+        
+        Returns:
+            Dictionary with claimed/sent/skipped/batch counts and the error of a failed batch
+        """
+        config = ReminderDispatchService.get_config(**overrides)
+        stats = {'claimed': 0, 'sent': 0, 'skipped': 0, 'batches': 0, 'error': None}
+        
+        with get_connection() as mail_connection:
+            while stats['batches'] < config['max_batches']:
+                try:
+                    batch = ReminderDispatchService.dispatch_batch(config, timezone.now(), mail_connection)
+                except Exception as e:
+                    logger.exception("Reminder batch failed; its claims were released")
+                    stats['error'] = str(e)
+                    break
+                if not batch['claimed']:
+                    break
+                stats['batches'] += 1
+                for key in ('claimed', 'sent', 'skipped'):
+                    stats[key] += batch[key]
+                if batch['claimed'] < config['batch_size']:
+                    break
+        
+        return stats
+
+
+class ScheduleExportService:
+    """
+    Streaming CSV / iCalendar exports of schedules and reminders.
+    
+    Rows are read with ``.iterator(chunk_size=...)`` and rendered one at a
+    time, so memory stays flat no matter how many rows are exported.
+    """
+    
+    CHUNK_SIZE = 2000
+    FORMATS = ('csv', 'ics')
+    CONTENT_TYPES = {
+        'csv': 'text/csv; charset=utf-8',
+        'ics': 'text/calendar; charset=utf-8',
+    }
+    
+    # Schedule.status -> VEVENT STATUS
+    ICS_STATUS = {
+        'PENDING': 'TENTATIVE',
+        'CONFIRMED': 'CONFIRMED',
+        'COMPLETED': 'CONFIRMED',
+        'CANCELLED': 'CANCELLED',
+    }
+    
+    SCHEDULE_HEADER = (
+        'id', 'title', 'status', 'priority', 'start_time', 'end_time',
+        'doctor_id', 'doctor_name', 'patient_id', 'patient_name', 'category', 'description',
+    )
+    REMINDER_HEADER = (
+        'id', 'reminder_type', 'send_time', 'is_sent', 'schedule_id', 'schedule_title',
+        'schedule_status', 'schedule_start_time', 'doctor_id', 'doctor_name', 'patient_name',
+    )
+    
+    @staticmethod
+    def _name(row: Dict, prefix: str) -> str:
+        return f"{row[prefix + 'first_name'] or ''} {row[prefix + 'last_name'] or ''}".strip()
+    
+    @staticmethod
+    def _datetime_bounds(start_date=None, end_date=None) -> Tuple:
+        """Turn an inclusive date range into [start, end) aware datetimes"""
+        start = end = None
+        if start_date is not None:
+            start = timezone.make_aware(datetime.combine(start_date, time.min))
+        if end_date is not None:
+            end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min))
+        return start, end
+    
+    @staticmethod
+    def _iter_csv(header, rows) -> Iterator[str]:
+        writer = csv.writer(Echo())
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+    
+    @staticmethod
+    def stream(kind: str, fmt: str = 'csv', doctor_id=None, hospital_id=None,
+               start_date=None, end_date=None, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+        """
+        Stream an export.
+        
+        Args:
+            kind: 'schedules' or 'reminders'
+            fmt: 'csv' or 'ics'
+            doctor_id: Only this doctor's schedules
+            hospital_id: Only schedules of doctors with a duty at this hospital
+            start_date: First schedule date (inclusive)
+            end_date: Last schedule date (inclusive)
+            chunk_size: Rows fetched per database round trip
+        
+        Returns:
+            Iterator of text chunks
+        """
+        start, end = ScheduleExportService._datetime_bounds(start_date, end_date)
+        if kind == 'schedules':
+            rows = ScheduleExportRepository.get_schedule_rows(doctor_id, hospital_id, start, end)
+        else:
+            rows = ScheduleExportRepository.get_reminder_rows(doctor_id, hospital_id, start, end)
+        rows = rows.iterator(chunk_size=chunk_size)
+        
+        render = {
+            ('schedules', 'csv'): ScheduleExportService._schedules_csv,
+            ('schedules', 'ics'): ScheduleExportService._schedules_ics,
+            ('reminders', 'csv'): ScheduleExportService._reminders_csv,
+            ('reminders', 'ics'): ScheduleExportService._reminders_ics,
+        }[(kind, fmt)]
+        return render(rows)
+    
+    @staticmethod
+    def _schedules_csv(rows) -> Iterator[str]:
+        name = ScheduleExportService._name
+        return ScheduleExportService._iter_csv(
+            ScheduleExportService.SCHEDULE_HEADER,
+            (
+                (
+                    row['id'], row['title'], row['status'], row['priority'],
+                    row['start_time'].isoformat(), row['end_time'].isoformat(),
+                    row['doctor_id'], name(row, 'doctor__user__'),
+                    row['patient_id'], name(row, 'patient__user__'),
+                    row['category__name'] or '', row['description'] or '',
+                )
+                for row in rows
+            )
+        )
+    
+    @staticmethod
+    def _reminders_csv(rows) -> Iterator[str]:
+        name = ScheduleExportService._name
+        return ScheduleExportService._iter_csv(
+            ScheduleExportService.REMINDER_HEADER,
+            (
+                (
+                    row['id'], row['reminder_type'], row['send_time'].isoformat(), row['is_sent'],
+                    row['schedule_id'], row['schedule__title'], row['schedule__status'],
+                    row['schedule__start_time'].isoformat(), row['schedule__doctor_id'],
+                    name(row, 'schedule__doctor__user__'), name(row, 'schedule__patient__user__'),
+                )
+                for row in rows
+            )
+        )
+    
+    @staticmethod
+    def _schedules_ics(rows) -> Iterator[str]:
+        stamp = timezone.now()
+        name = ScheduleExportService._name
+        events = (
+            ics_event(
+                uid=f"schedule-{row['id']}@medapp",
+                start=row['start_time'],
+                end=row['end_time'],
+                summary=row['title'],
+                stamp=stamp,
+                description=(
+                    f"Doctor: {name(row, 'doctor__user__')}\n"
+                    f"Patient: {name(row, 'patient__user__')}\n"
+                    f"{row['description'] or ''}"
+                ).strip(),
+                status=ScheduleExportService.ICS_STATUS.get(row['status']),
+            )
+            for row in rows
+        )
+        return iter_ics_calendar(events, 'MedApp schedules')
+    
+    @staticmethod
+    def _reminders_ics(rows) -> Iterator[str]:
+        stamp = timezone.now()
+        name = ScheduleExportService._name
+        events = (
+            ics_event(
+                uid=f"schedule-{row['schedule_id']}-reminder-{row['id']}@medapp",
+                start=row['schedule__start_time'],
+                end=row['schedule__end_time'],
+                summary=row['schedule__title'],
+                stamp=stamp,
+                description=f"Doctor: {name(row, 'schedule__doctor__user__')}",
+                status=ScheduleExportService.ICS_STATUS.get(row['schedule__status']),
+                alarm_at=row['send_time'],
+            )
+            for row in rows
+        )
+        return iter_ics_calendar(events, 'MedApp schedule reminders')
+
+
+class Occurrence(NamedTuple):
+    """One concrete instance of a (possibly recurring) schedule"""
+    start: datetime
+    end: datetime
+    schedule: Schedule
+
+
+@lru_cache(maxsize=4096)
+def _expand_month(pattern: str, dtstart: datetime, month_start: datetime, month_end: datetime) -> Tuple[datetime, ...]:
+    """
+    Occurrence start times of one recurrence in one calendar month.
+    
+    Keyed on the rule inputs rather than the schedule id, so editing a
+    schedule's start or pattern can never serve stale occurrences. Month
+    buckets keep the hit rate high for sliding windows such as "from now".
+    """
+    return tuple(iter_occurrences(dtstart, parse_recurrence(pattern), month_start, month_end))
+
+
+class RecurrenceService:
+    """
+    Expands recurring schedules on demand instead of materialising rows.
+    
+    Recurring schedules are expanded lazily one calendar month at a time
+    (each month is LRU-cached), then merged with one-off schedules in start
+    order, so "all occurrences between A and B" only costs two queries.
+    """
+    
+    @staticmethod
+    def _month_windows(start: datetime, end: datetime) -> Iterator[Tuple[datetime, datetime]]:
+        """Yield [month_start, next_month_start) windows covering [start, end)"""
+        month = start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        while month < end:
+            next_month = (month + timedelta(days=32)).replace(day=1)
+            yield month, next_month
+            month = next_month
+    
+    @staticmethod
+    def expand(schedule: Schedule, start: datetime, end: datetime) -> Iterator[Occurrence]:
+        """Lazily yield a schedule's occurrences that start in [start, end)"""
+        duration = schedule.end_time - schedule.start_time
+        dtstart = timezone.localtime(schedule.start_time)
+        
+        if not schedule.is_recurring:
+            if start <= dtstart < end:
+                yield Occurrence(dtstart, dtstart + duration, schedule)
+            return
+        
+        try:
+            rule = parse_recurrence(schedule.recurrence_pattern)
+        except ValueError as e:
+            logger.warning(f"Schedule {schedule.id} has an invalid recurrence pattern: {e}")
+            if start <= dtstart < end:
+                yield Occurrence(dtstart, dtstart + duration, schedule)
+            return
+        
+        local_start = timezone.localtime(max(start, dtstart))
+        for month_start, month_end in RecurrenceService._month_windows(local_start, end):
+            if rule.until and month_start.date() > rule.until:
+                return
+            for occurrence in _expand_month(schedule.recurrence_pattern, dtstart, month_start, month_end):
+                if start <= occurrence < end:
+                    yield Occurrence(occurrence, occurrence + duration, schedule)
+    
+    @staticmethod
+    def occurrences(queryset, start: datetime, end: datetime) -> Iterator[Occurrence]:
+        """
+        All occurrences of the schedules in ``queryset`` that start in [start, end), in start order.
+        
+        Args:
+            queryset: Schedule queryset (already filtered by doctor, status, permissions, ...)
+            start: Window start (aware)
+            end: Window end (aware, exclusive)
+        """
+        one_off = queryset.filter(
+            is_recurring=False, start_time__gte=start, start_time__lt=end
+        ).order_by('start_time')
+        recurring = queryset.filter(is_recurring=True, start_time__lt=end)
+        
+        streams = [
+            (
+                Occurrence(timezone.localtime(schedule.start_time), timezone.localtime(schedule.end_time), schedule)
+                for schedule in one_off.iterator()
+            )
+        ]
+        streams.extend(RecurrenceService.expand(schedule, start, end) for schedule in recurring)
+        return heapq.merge(*streams, key=lambda occurrence: occurrence.start)
+    
+    @staticmethod
+    def occurrences_for_doctor(doctor, start: datetime, end: datetime, statuses=None) -> Iterator[Occurrence]:
+        """All occurrences between start and end for one doctor"""
+        queryset = Schedule.objects.filter(doctor=doctor).select_related('patient', 'category')
+        if statuses:
+            queryset = queryset.filter(status__in=statuses)
+        return RecurrenceService.occurrences(queryset, start, end)
+
+
+class EarliestSlotIndexService:
+    """
+    Maintains and queries the EarliestSlotIndex.
+    
+    Each (doctor, hospital) keeps its next ``per_doctor`` free slots. Any
+    slot change for a doctor re-ranks that doctor's free slots in one
+    query once the change commits, so bookings and cancellations pull the
+    next slot in or push it out without lengthening their own transaction.
+    """
+    
+    DEFAULT_PER_DOCTOR = 5
+    DEFAULT_LIMIT = 10
+    MAX_LIMIT = 100
+    
+    @staticmethod
+    def per_doctor() -> int:
+        return getattr(settings, 'SCHEDULES_EARLIEST_SLOTS_PER_DOCTOR', EarliestSlotIndexService.DEFAULT_PER_DOCTOR)
+    
+    @staticmethod
+    @transaction.atomic
+    def refresh(doctor_ids=None) -> int:
+        """
+        Rebuild the index entries of some doctors (or all when None).
+        
+        Returns:
+            Number of index rows written
+        """
+        if doctor_ids is not None:
+            doctor_ids = list(doctor_ids)
+            if not doctor_ids:
+                return 0
+        rows = EarliestSlotIndexRepository.get_next_free_slots(
+            doctor_ids, timezone.now().date(), EarliestSlotIndexService.per_doctor()
+        )
+        return EarliestSlotIndexRepository.replace_for_doctors(doctor_ids, rows)
+    
+    @staticmethod
+    def refresh_on_commit(doctor_ids) -> None:
+        """
+        Refresh some doctors' entries after the current transaction commits
+        (at once in autocommit). A failed refresh is logged, never raised
+        into the committed change; the daily rebuild repairs the index.
+        """
+        doctor_ids = list(doctor_ids)
+        transaction.on_commit(lambda: EarliestSlotIndexService.refresh(doctor_ids), robust=True)
+    
+    @staticmethod
+    def rebuild_all(chunk_size: int = 2000) -> int:
+        """Rebuild the index for every doctor with active duties, one chunk per transaction"""
+        EarliestSlotIndexRepository.delete_stale(timezone.now().date())
+        written = 0
+        for chunk in DutyRepository.iter_active_doctor_ids(chunk_size):
+            written += EarliestSlotIndexService.refresh(chunk)
+        return written
+    
+    @staticmethod
+    def search(specialization: str, start_date=None, end_date=None, limit: int = DEFAULT_LIMIT,
+               hospital_id: Optional[int] = None, min_rating: Optional[float] = None,
+               min_experience: Optional[int] = None) -> List[Dict]:
+        """
+        Top-K earliest free slots for a specialization.
+        
+        Args:
+            specialization: Doctor specialization
+            start_date: First date (default today; never earlier than now)
+            end_date: Last date (default start_date + 7 days)
+            limit: Number of slots to return (capped at MAX_LIMIT)
+            hospital_id: Only this hospital
+            min_rating: Minimum doctor rating
+            min_experience: Minimum years of experience
+        
+        Returns:
+            List of slot dictionaries ordered by date and start time
+        """
+        now = timezone.localtime()
+        start_date = max(start_date or now.date(), now.date())
+        end_date = end_date or start_date + timedelta(days=7)
+        after_time = now.time() if start_date == now.date() else time.min
+        limit = max(1, min(limit, EarliestSlotIndexService.MAX_LIMIT))
+        
+        entries = EarliestSlotIndexRepository.search(
+            specialization, start_date, after_time, end_date, limit,
+            hospital_id=hospital_id, min_rating=min_rating, min_experience=min_experience
+        )
+        return [
+            {
+                'slot_id': entry.slot_id,
+                'date': entry.date.isoformat(),
+                'start_time': entry.start_time.strftime('%H:%M'),
+                'doctor_id': entry.doctor_id,
+                'doctor_name': entry.doctor.user.get_full_name(),
+                'hospital_id': entry.hospital_id,
+                'hospital_name': entry.hospital.hospital_name,
+                'specialization': entry.specialization,
+                'rating': entry.rating,
+                'experience_years': entry.experience_years,
+            }
+            for entry in entries
+        ]
@@ -0,0 +1,105 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+import logging
+
+from doctors.models import DoctorProfile as DoctorDirectoryProfile
+from .models import (
+    Duty, Shift, AvailabilitySlot, DoctorLeave, ScheduleOverride, EarliestSlotIndex, Schedule, ChangeLogEntry
+)
+from .repositories import SlotInvalidationRepository
+from .services import HospitalRosterService, SlotChangeService, ChangeFeedService
+
+logger = logging.getLogger(__name__)
+
+
+def _invalidate(doctor_id, start_date, end_date):
+    """Record a future date range whose slots must be re-materialised."""
+    today = timezone.now().date()
+    if end_date < today:
+        return
+    SlotInvalidationRepository.create_invalidation(doctor_id, max(start_date, today), end_date)
+    logger.debug(f"Slots invalidated for doctor {doctor_id} from {start_date} to {end_date}")
+
+
+@receiver(post_save, sender=DoctorLeave)
+@receiver(post_delete, sender=DoctorLeave)
+def invalidate_slots_for_leave(sender, instance, **kwargs):
+    """
+    Leave changes can free days that were skipped during slot generation.
+    The nightly rolling-horizon job regenerates the recorded range.
+    """
+    _invalidate(instance.doctor_id, instance.start_date, instance.end_date)
+
+
+@receiver(post_save, sender=ScheduleOverride)
+@receiver(post_delete, sender=ScheduleOverride)
+def invalidate_slots_for_override(sender, instance, **kwargs):
+    """
+    Override changes can make a previously skipped day available again.
+    """
+    _invalidate(instance.doctor_id, instance.date, instance.date)
+
+
+@receiver(post_save, sender=Duty)
+@receiver(post_delete, sender=Duty)
+def invalidate_roster_for_duty(sender, instance, **kwargs):
+    """A duty change can add or remove a doctor from the hospital roster."""
+    HospitalRosterService.invalidate([instance.hospital_id])
+
+
+@receiver(post_save, sender=Shift)
+@receiver(post_delete, sender=Shift)
+def invalidate_roster_for_shift(sender, instance, **kwargs):
+    """Shift timings are part of the cached roster."""
+    hospital_id = (
+        Duty.objects.filter(id=instance.duty_id).values_list('hospital_id', flat=True).first()
+    )
+    if hospital_id is not None:
+        HospitalRosterService.invalidate([hospital_id])
+
+
+@receiver(post_save, sender=AvailabilitySlot)
+def slot_saved(sender, instance, **kwargs):
+    """
+    Single-slot saves (booking, cancellation, admin edits) change the daily
+    rollup and roster counts. Set-based slot updates and deletes report their
+    own changes through SlotChangeService; there is deliberately no
+    post_delete receiver so bulk deletes stay fast.
+    """
+    duty = (
+        Shift.objects.filter(id=instance.shift_id)
+        .values('duty__doctor_id', 'duty__hospital_id').first()
+    )
+    if duty is not None:
+        SlotChangeService.slots_changed(
+            [duty['duty__doctor_id']], instance.date, instance.date,
+            hospital_ids=[duty['duty__hospital_id']]
+        )
+
+
+@receiver(post_save, sender=DoctorDirectoryProfile)
+def sync_earliest_slot_ranking(sender, instance, **kwargs):
+    """Keep the rating / experience copied into the earliest slot index current."""
+    EarliestSlotIndex.objects.filter(doctor__user_id=instance.user_id).update(
+        rating=instance.rating,
+        experience_years=instance.experience_years
+    )
+
+
+@receiver(post_save, sender=Schedule)
+@receiver(post_delete, sender=Schedule)
+def log_schedule_change(sender, instance, **kwargs):
+    """Feed schedule saves and deletes to delta-sync clients."""
+    ChangeFeedService.record_object(
+        ChangeLogEntry.ObjectType.SCHEDULE, instance, deleted=kwargs['signal'] is post_delete
+    )
+
+
+@receiver(post_save, sender='appointments.Appointment')
+@receiver(post_delete, sender='appointments.Appointment')
+def log_appointment_change(sender, instance, **kwargs):
+    """Feed appointment saves and deletes to delta-sync clients."""
+    ChangeFeedService.record_object(
+        ChangeLogEntry.ObjectType.APPOINTMENT, instance, deleted=kwargs['signal'] is post_delete
+    )
@@ -8,37 +8,57 @@ Handles automated slot generation, cleanup, and notifications.
 from celery import shared_task
 from django.utils import timezone
 from datetime import timedelta
-from .services import AvailabilitySlotService
-from .repositories import ShiftRepository, AvailabilitySlotRepository
-from doctors.models import DoctorProfile
+from .services import (
+    AvailabilitySlotService, SlotHorizonService, FleetSlotGenerationService, LowAvailabilityService,
+    EarliestSlotIndexService, SlotCleanupService, ReminderDispatchService, ChangeFeedService
+)
+from .repositories import ShiftRepository
+from .models import DoctorProfile
+from appointments.tasks import send_due_appointment_reminders
 
 
 @shared_task
-def auto_generate_slots_for_all_doctors():
+def auto_generate_slots_for_all_doctors(days_ahead=30, incremental=True, sharded=False,
+                                        workers=None, shard_size=None, executor=None):
     """
     Automatically generate availability slots for all active doctors.
     Should be scheduled to run daily.
+    
+    Args:
+        days_ahead: Length of the rolling horizon in days
+        incremental: Only materialise days past each shift's watermark plus
+            invalidated days, instead of regenerating the whole horizon
+        sharded: Split doctors into shards and run them on a worker pool;
+            returns per-shard counts, failures and timings
+        workers, shard_size, executor: Pool options (default to
+            settings.SCHEDULES_FLEET_GENERATION)
     """
     try:
+        if sharded:
+            return FleetSlotGenerationService.run(
+                days_ahead=days_ahead, incremental=incremental,
+                workers=workers, shard_size=shard_size, executor=executor
+            )
+        
+        if incremental:
+            stats = SlotHorizonService.advance(horizon_days=days_ahead)
+            return (
+                f"Generated {stats['slots_created']} slots for {stats['shifts_advanced']} shifts "
+                f"and {stats['invalidations']} invalidated ranges "
+                f"({stats['queries']} queries, {stats['elapsed_ms']} ms)"
+            )
+        
         doctors = DoctorProfile.objects.filter(user__is_active=True)
         today = timezone.now().date()
-        end_date = today + timedelta(days=30)  # Generate slots for next 30 days
+        end_date = today + timedelta(days=days_ahead)
         
         total_slots_created = 0
         
         for doctor in doctors:
-            shifts = ShiftRepository.get_doctor_shifts(doctor)
-            
-            for shift in shifts:
-                success, message, count = AvailabilitySlotService.generate_slots_for_shift(
-                    shift_id=shift.id,
-                    start_date=today,
-                    end_date=end_date,
-                    slot_duration_minutes=30
-                )
-                
-                if success:
-                    total_slots_created += count
+            stats = AvailabilitySlotService.generate_slots_for_doctor(
+                doctor, today, end_date, slot_duration_minutes=30
+            )
+            total_slots_created += stats['slots_created']
         
         return f"Generated {total_slots_created} slots for {len(doctors)} doctors"
     
@@ -47,82 +67,105 @@ def auto_generate_slots_for_all_doctors():
 
 
 @shared_task
-def generate_slots_for_doctor(doctor_id, days_ahead=30):
+def generate_slots_for_doctor(doctor_id, days_ahead=30, sharded=False):
     """
     Generate availability slots for a specific doctor.
     
     Args:
         doctor_id: Doctor profile ID
         days_ahead: Number of days to generate slots for
+        sharded: Run through the fleet shard runner and return its
+            structured result instead of a message
     """
     try:
-        from doctors.models import DoctorProfile
+        if sharded:
+            return FleetSlotGenerationService.run(
+                days_ahead=days_ahead, incremental=False, doctor_ids=[doctor_id], workers=1
+            )
         
         doctor = DoctorProfile.objects.get(id=doctor_id)
-        shifts = ShiftRepository.get_doctor_shifts(doctor)
         
         today = timezone.now().date()
         end_date = today + timedelta(days=days_ahead)
         
-        total_slots = 0
-        for shift in shifts:
-            success, message, count = AvailabilitySlotService.generate_slots_for_shift(
-                shift_id=shift.id,
-                start_date=today,
-                end_date=end_date,
-                slot_duration_minutes=30
-            )
-            if success:
-                total_slots += count
+        stats = AvailabilitySlotService.generate_slots_for_doctor(
+            doctor, today, end_date, slot_duration_minutes=30
+        )
         
-        return f"Generated {total_slots} slots for doctor {doctor.user.get_full_name()}"
+        return (
+            f"Generated {stats['slots_created']} slots for doctor {doctor.user.get_full_name()} "
+            f"({stats['queries']} queries, {stats['elapsed_ms']} ms)"
+        )
     
     except Exception as e:
         return f"Error: {str(e)}"
 
 
 @shared_task
-def cleanup_past_slots():
+def cleanup_past_slots(retention_days=None, chunk_size=None, pause=None, archive_booked=None):
     """
-    Clean up old unbooked availability slots.
+    Clean up old availability slots in primary-key chunks.
     Should be scheduled to run daily.
+    
+    Args:
+        retention_days, chunk_size, pause, archive_booked: Override
+            settings.SCHEDULES_SLOT_CLEANUP (see SlotCleanupService)
     """
     try:
-        cutoff_date = timezone.now().date() - timedelta(days=7)
-        
-        deleted_count = AvailabilitySlotRepository.get_slots_by_date_range(
-            None, timezone.now().date() - timedelta(days=365), cutoff_date
-        ).filter(is_booked=False).delete()[0]
+        stats = SlotCleanupService.run(
+            retention_days=retention_days, chunk_size=chunk_size,
+            pause=pause, archive_booked=archive_booked
+        )
         
-        return f"Deleted {deleted_count} old unbooked slots"
+        return (
+            f"Deleted {stats['deleted']} old slots ({stats['archived']} archived) "
+            f"in {stats['chunks']} chunks at {stats['rows_per_second']:.0f} rows/s"
+        )
     
     except Exception as e:
         return f"Error cleaning up slots: {str(e)}"
 
 
 @shared_task
-def send_appointment_reminders():
+def compact_change_log(chunk_size=None):
     """
-    Send reminders for upcoming appointments.
-    Should be scheduled to run hourly.
+    Drop change log entries superseded by a later entry for the same object.
+    Should be scheduled to run daily.
     """
     try:
-        tomorrow = timezone.now().date() + timedelta(days=1)
-        
-        slots = AvailabilitySlotRepository.get_slots_by_date_range(
-            None, tomorrow, tomorrow
-        ).filter(is_booked=True).select_related('booked_by', 'shift__duty__doctor__user')
-        
-        reminder_count = 0
-        for slot in slots:
-            # TODO: Send email/SMS reminder to patient
-            # NotificationService.send_appointment_reminder(slot)
-            reminder_count += 1
+        deleted = ChangeFeedService.compact_log(chunk_size=chunk_size)
+        return f"Compacted change log: {deleted} superseded entries removed"
+    
+    except Exception as e:
+        return f"Error compacting change log: {str(e)}"
+
+
+# Appointment reminders are sent by appointments.tasks; the old name is kept
+# for existing imports, and only that task should be scheduled
+send_appointment_reminders = send_due_appointment_reminders
+
+
+@shared_task
+def dispatch_schedule_reminders(batch_size=None, max_batches=None):
+    """
+    Deliver due schedule reminders in claimed batches.
+    Should be scheduled to run every few minutes; concurrent runs are safe.
+    
+    Batch size, lease and lookback come from settings.SCHEDULES_REMINDER_DISPATCH;
+    arguments override them.
+    """
+    try:
+        stats = ReminderDispatchService.run(batch_size=batch_size, max_batches=max_batches)
         
-        return f"Sent {reminder_count} appointment reminders"
+        if stats['error']:
+            return f"Error dispatching reminders after {stats['sent']} sent: {stats['error']}"
+        return (
+            f"Sent {stats['sent']} schedule reminders in {stats['batches']} batches "
+            f"({stats['skipped']} without an email address)"
+        )
     
     except Exception as e:
-        return f"Error sending reminders: {str(e)}"
+        return f"Error dispatching reminders: {str(e)}"
 
 
 @shared_task
@@ -132,65 +175,46 @@ def process_expired_leaves():
     Should be scheduled to run daily.
     """
     try:
-        from .repositories import DoctorLeaveRepository
+        from .models import DoctorLeave
+        from .services import SlotMaskingService
         
-        yesterday = timezone.now().date() - timedelta(days=1)
+        today = timezone.now().date()
+        yesterday = today - timedelta(days=1)
         
-        # Find leaves that ended yesterday
-        from .models import DoctorLeave
-        expired_leaves = DoctorLeave.objects.filter(
+        # Doctors whose leaves ended yesterday
+        doctor_ids = list(DoctorLeave.objects.filter(
             status='APPROVED',
             end_date=yesterday
-        )
+        ).values_list('doctor_id', flat=True).distinct())
         
-        processed_count = 0
-        for leave in expired_leaves:
-            # Reactivate future slots for this doctor
-            today = timezone.now().date()
-            slots = AvailabilitySlotRepository.get_slots_by_date_range(
-                leave.doctor, today, today + timedelta(days=30)
-            ).filter(is_booked=False)
-            
-            for slot in slots:
-                slot.is_available = True
-                slot.save()
-            
-            processed_count += 1
-        
-        return f"Processed {processed_count} expired leaves"
+        if not doctor_ids:
+            return "Processed 0 expired leaves"
+        
+        # One UPDATE for every affected doctor; days still covered stay masked
+        reactivated = SlotMaskingService.unmask(doctor_ids, today, today + timedelta(days=30))
+        
+        return f"Processed expired leaves for {len(doctor_ids)} doctors, reactivated {reactivated} slots"
     
     except Exception as e:
         return f"Error processing leaves: {str(e)}"
 
 
 @shared_task
-def notify_low_availability():
+def notify_low_availability(threshold=None, window_days=None):
     """
     Notify doctors with low availability.
     Should be scheduled to run weekly.
+    
+    Thresholds, per-specialization overrides and batch size come from
+    settings.SCHEDULES_LOW_AVAILABILITY; arguments override them.
     """
     try:
-        from doctors.models import DoctorProfile
-        
-        doctors = DoctorProfile.objects.filter(user__is_active=True)
-        today = timezone.now().date()
-        week_ahead = today + timedelta(days=7)
-        
-        low_availability_doctors = []
+        result = LowAvailabilityService.run(threshold=threshold, window_days=window_days)
         
-        for doctor in doctors:
-            slots = AvailabilitySlotRepository.get_slots_by_date_range(
-                doctor, today, week_ahead
-            )
-            
-            available_count = sum(1 for s in slots if s.is_available and not s.is_booked)
-            
-            # Alert if less than 20% availability
-            if slots and (available_count / len(slots)) < 0.2:
-                low_availability_doctors.append(doctor)
-                # TODO: Send notification to doctor
-        
-        return f"Notified {len(low_availability_doctors)} doctors about low availability"
+        return (
+            f"Notified {len(result['doctors'])} doctors about low availability "
+            f"({result['emails_sent']} emails sent)"
+        )
     
     except Exception as e:
         return f"Error: {str(e)}"
@@ -225,25 +249,37 @@ def generate_weekly_schedule_report():
     Should be scheduled to run weekly.
     """
     try:
-        from hospitals.models import HospitalProfile
-        from .services import ScheduleAnalyticsService
+        from .repositories import DutyRepository
+        from .services import HospitalRosterService
         
-        hospitals = HospitalProfile.objects.filter(user__is_active=True)
         today = timezone.now().date()
         
         # Find Monday of current week
         week_start = today - timedelta(days=today.weekday())
         
         reports_generated = 0
-        for hospital in hospitals:
-            schedules = ScheduleAnalyticsService.get_hospital_doctor_schedules(
-                hospital, today
-            )
-            
+        for hospital_id in DutyRepository.get_active_hospital_ids():
+            schedules = HospitalRosterService.get_roster(hospital_id, today)
+
             # TODO: Send report to hospital admin
             reports_generated += 1
         
         return f"Generated {reports_generated} weekly schedule reports"
     
     except Exception as e:
-        return f"Error: {str(e)}"
\ No newline at end of file
+        return f"Error: {str(e)}"
+
+
+@shared_task
+def refresh_earliest_slot_index():
+    """
+    Rebuild the earliest free slot index for all doctors.
+    Bookings keep it current during the day; this drops slots that have
+    passed and backfills the next ones. Should be scheduled to run daily.
+    """
+    try:
+        written = EarliestSlotIndexService.rebuild_all()
+        return f"Indexed {written} upcoming free slots"
+    
+    except Exception as e:
+        return f"Error refreshing earliest slot index: {str(e)}"
@@ -0,0 +1,1209 @@
+# schedules/tests/test_servicees.py
+
+import time as _time
+from datetime import date, datetime, time, timedelta
+from collections import defaultdict
+from io import StringIO
+from unittest import mock
+from uuid import uuid4
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from accounts.models import DoctorProfile, HospitalProfile, AdminProfile, PatientProfile
+from schedules.models import (
+    Duty, Shift, AvailabilitySlot, DoctorLeave, ScheduleOverride, SlotInvalidation, DoctorDailyAvailability,
+    Schedule, ScheduleReminder, EarliestSlotIndex, ArchivedSlot, ChangeLogEntry
+)
+from schedules.repositories import DoctorDailyAvailabilityRepository
+from schedules.services import (
+    AvailabilitySlotService, SlotGenerationEngine, SlotHorizonService, FleetSlotGenerationService,
+    SlotMaskingService, DoctorLeaveService, ScheduleAnalyticsService, HospitalRosterService,
+    DailyAvailabilityService, LowAvailabilityService, RecurrenceService, EarliestSlotIndexService,
+    SlotCleanupService, ShiftService, ShiftConflictService, ReminderDispatchService,
+    RosterSolverService, CoverageRequirement, RotationTemplateService, SlotUtilizationService,
+    ChangeFeedService
+)
+from schedules.utils import (
+    build_slot_template, parse_recurrence, iter_occurrences, ShiftInterval, find_overlaps, epoch_hour,
+    parse_appointment_mix, pack_slot_template, merge_config
+)
+
+User = get_user_model()
+
+# Monday well in the future so nothing depends on "today"
+MONDAY = date(2030, 1, 7)
+
+
+class ScheduleFixturesMixin:
+    """Creates one doctor with an OPD duty and a Monday shift"""
+
+    def setUp(self):
+        self.doctor_user = User.objects.create_user(username='dr_slots', password='pass', role='DOCTOR')
+        self.hospital_user = User.objects.create_user(username='city', password='pass', role='HOSPITAL')
+        self.admin_user = User.objects.create_user(username='approver', password='pass', role='ADMIN')
+        self.doctor = DoctorProfile.objects.create(
+            user=self.doctor_user, specialization='cardiology', license_number='D-1'
+        )
+        self.hospital = HospitalProfile.objects.create(
+            user=self.hospital_user, hospital_name='City Hospital', license_number='H-1'
+        )
+        self.admin = AdminProfile.objects.create(user=self.admin_user, full_name='Approver')
+        self.duty = Duty.objects.create(
+            doctor=self.doctor, hospital=self.hospital, duty_type='OPD', start_date=MONDAY
+        )
+        self.shift = Shift.objects.create(
+            duty=self.duty, day_of_week=0,
+            start_time=time(9, 0), end_time=time(12, 0),
+            break_start=time(10, 0), break_end=time(10, 30),
+        )
+
+
+# -------------------------------
+# Slot Template Tests
+# -------------------------------
+class SlotTemplateTest(TestCase):
+    def test_template_skips_break_and_keeps_grid(self):
+        template = build_slot_template(time(9, 0), time(11, 0), 30, time(10, 0), time(10, 30))
+        self.assertEqual(
+            [start for start, _ in template],
+            [time(9, 0), time(9, 30), time(10, 30)]
+        )
+
+    def test_template_drops_partial_last_slot(self):
+        template = build_slot_template(time(9, 0), time(10, 10), 30)
+        self.assertEqual(template[-1], (time(9, 30), time(10, 0)))
+
+    @override_settings(SCHEDULES_TEST_CONFIG={'batch_size': 50, 'lease_seconds': 30})
+    def test_merge_config_layers_settings_and_overrides(self):
+        config = merge_config(
+            {'batch_size': 10, 'lease_seconds': 60, 'max_batches': 5},
+            'SCHEDULES_TEST_CONFIG', {'lease_seconds': 90, 'max_batches': None}
+        )
+        self.assertEqual(config, {'batch_size': 50, 'lease_seconds': 90, 'max_batches': 5})
+
+
+# -------------------------------
+# Slot Generation Engine Tests
+# -------------------------------
+class SlotGenerationEngineTest(ScheduleFixturesMixin, TestCase):
+    def test_generates_matching_weekdays_only(self):
+        stats = SlotGenerationEngine.generate([self.shift], MONDAY, MONDAY + timedelta(days=13))
+        self.assertEqual(stats['dates'], 2)
+        self.assertEqual(stats['slots_created'], 10)
+        self.assertEqual(
+            set(AvailabilitySlot.objects.values_list('date', flat=True)),
+            {MONDAY, MONDAY + timedelta(days=7)}
+        )
+
+    def test_skips_leave_and_unavailable_override_days(self):
+        DoctorLeave.objects.create(
+            doctor=self.doctor, leave_type='VACATION', status='APPROVED',
+            start_date=MONDAY, end_date=MONDAY + timedelta(days=1)
+        )
+        ScheduleOverride.objects.create(
+            doctor=self.doctor, date=MONDAY + timedelta(days=7), is_available=False
+        )
+        stats = SlotGenerationEngine.generate([self.shift], MONDAY, MONDAY + timedelta(days=20))
+        self.assertEqual(stats['dates'], 1)
+        self.assertFalse(AvailabilitySlot.objects.exclude(date=MONDAY + timedelta(days=14)).exists())
+
+    def test_rerun_counts_only_inserted_slots(self):
+        SlotGenerationEngine.generate([self.shift], MONDAY, MONDAY + timedelta(days=6))
+        stats = SlotGenerationEngine.generate([self.shift], MONDAY, MONDAY + timedelta(days=13))
+        self.assertEqual(stats['slots_created'], 5)
+        rerun = SlotGenerationEngine.generate([self.shift], MONDAY, MONDAY + timedelta(days=13))
+        self.assertEqual(rerun['slots_created'], 0)
+        self.assertEqual(AvailabilitySlot.objects.count(), 10)
+
+    def test_query_count_is_independent_of_range(self):
+        short = SlotGenerationEngine.generate([self.shift], MONDAY, MONDAY + timedelta(days=6))
+        AvailabilitySlot.objects.all().delete()
+        long = SlotGenerationEngine.generate([self.shift], MONDAY, MONDAY + timedelta(days=89))
+        self.assertEqual(short['queries'], long['queries'])
+
+    def test_generate_slots_for_shift_keeps_tuple_contract(self):
+        success, message, count = AvailabilitySlotService.generate_slots_for_shift(
+            self.shift.id, MONDAY, MONDAY
+        )
+        self.assertTrue(success)
+        self.assertEqual(count, 5)
+
+
+# -------------------------------
+# Rolling Horizon Tests
+# -------------------------------
+class SlotHorizonServiceTest(ScheduleFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.now().date()
+        Duty.objects.filter(id=self.duty.id).update(start_date=self.today)
+        Shift.objects.filter(id=self.shift.id).update(day_of_week=self.today.weekday())
+
+    def test_second_run_only_covers_new_days(self):
+        first = SlotHorizonService.advance(horizon_days=14)
+        self.assertEqual(first['slots_created'], 15)
+        self.shift.refresh_from_db()
+        self.assertEqual(self.shift.slots_generated_through, self.today + timedelta(days=14))
+
+        second = SlotHorizonService.advance(horizon_days=14)
+        self.assertEqual(second['shifts_advanced'], 0)
+        self.assertEqual(second['slots_created'], 0)
+
+        third = SlotHorizonService.advance(horizon_days=21)
+        self.assertEqual(third['slots_created'], 5)
+        self.assertEqual(AvailabilitySlot.objects.count(), 20)
+
+    def test_deleted_leave_days_are_rematerialised(self):
+        leave = DoctorLeave.objects.create(
+            doctor=self.doctor, leave_type='SICK', status='APPROVED',
+            start_date=self.today, end_date=self.today
+        )
+        SlotHorizonService.advance(horizon_days=7)
+        self.assertFalse(AvailabilitySlot.objects.filter(date=self.today).exists())
+
+        leave.delete()
+        stats = SlotHorizonService.advance(horizon_days=7)
+        self.assertEqual(stats['invalidations'], 1)
+        self.assertEqual(AvailabilitySlot.objects.filter(date=self.today).count(), 5)
+        self.assertFalse(SlotInvalidation.objects.exists())
+
+
+# -------------------------------
+# Fleet Generation Tests
+# -------------------------------
+class FleetSlotGenerationServiceTest(ScheduleFixturesMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.now().date()
+        Duty.objects.filter(id=self.duty.id).update(start_date=self.today)
+        Shift.objects.filter(id=self.shift.id).update(day_of_week=self.today.weekday())
+
+    def test_iter_shards_splits_ids(self):
+        shards = list(FleetSlotGenerationService.iter_shards(2, doctor_ids=[1, 2, 3, 4, 5]))
+        self.assertEqual(shards, [[1, 2], [3, 4], [5]])
+
+    def test_run_reports_per_shard_results(self):
+        result = FleetSlotGenerationService.run(days_ahead=6, workers=1, shard_size=10)
+        self.assertEqual(result['doctors'], 1)
+        self.assertEqual(result['slots_created'], 5)
+        self.assertEqual(result['failures'], 0)
+        self.assertEqual(len(result['shards']), 1)
+        self.assertIn('elapsed_ms', result['shards'][0])
+
+
+# -------------------------------
+# Slot Constraint / Query Plan Tests
+# -------------------------------
+class SlotSchemaTest(ScheduleFixturesMixin, TestCase):
+    def test_duplicate_slot_is_rejected(self):
+        AvailabilitySlot.objects.create(
+            shift=self.shift, date=MONDAY, start_time=time(9, 0), end_time=time(9, 30)
+        )
+        with self.assertRaises(IntegrityError):
+            AvailabilitySlot.objects.create(
+                shift=self.shift, date=MONDAY, start_time=time(9, 0), end_time=time(9, 30)
+            )
+
+    def test_regeneration_does_not_duplicate(self):
+        SlotGenerationEngine.generate([self.shift], MONDAY, MONDAY)
+        SlotGenerationEngine.generate([self.shift], MONDAY, MONDAY)
+        self.assertEqual(AvailabilitySlot.objects.count(), 5)
+
+    def test_slot_queries_use_indexes(self):
+        out = StringIO()
+        call_command('explain_slot_queries', stdout=out)
+        self.assertNotIn('FULL SCAN', out.getvalue())
+
+
+# -------------------------------
+# Slot Masking Tests
+# -------------------------------
+class SlotMaskingServiceTest(ScheduleFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        SlotGenerationEngine.generate([self.shift], MONDAY, MONDAY + timedelta(days=13))
+        self.booked = AvailabilitySlot.objects.filter(date=MONDAY).first()
+        AvailabilitySlot.objects.filter(id=self.booked.id).update(is_booked=True)
+
+    def test_mask_is_one_update_and_skips_booked(self):
+        with CaptureQueriesContext(connection) as ctx:
+            masked = SlotMaskingService.mask([self.doctor.id], MONDAY, MONDAY + timedelta(days=13))
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(masked, 9)
+        self.booked.refresh_from_db()
+        self.assertTrue(self.booked.is_available)
+
+    def test_unmask_keeps_days_covered_by_other_leave(self):
+        SlotMaskingService.mask([self.doctor.id], MONDAY, MONDAY + timedelta(days=13))
+        DoctorLeave.objects.create(
+            doctor=self.doctor, leave_type='SICK', status='APPROVED',
+            start_date=MONDAY + timedelta(days=7), end_date=MONDAY + timedelta(days=7)
+        )
+        unmasked = SlotMaskingService.unmask([self.doctor.id], MONDAY, MONDAY + timedelta(days=13))
+        self.assertEqual(unmasked, 4)
+        self.assertFalse(
+            AvailabilitySlot.objects.filter(date=MONDAY + timedelta(days=7), is_available=True).exists()
+        )
+
+    def test_approve_leave_masks_window(self):
+        leave = DoctorLeave.objects.create(
+            doctor=self.doctor, leave_type='VACATION',
+            start_date=MONDAY, end_date=MONDAY + timedelta(days=6)
+        )
+        success, message = DoctorLeaveService.approve_leave(leave.id, self.admin)
+        self.assertTrue(success)
+        self.assertEqual(
+            AvailabilitySlot.objects.filter(date=MONDAY, is_available=False).count(), 4
+        )
+
+
+# -------------------------------
+# Weekly Schedule Tests
+# -------------------------------
+class WeeklyScheduleTest(ScheduleFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        SlotGenerationEngine.generate([self.shift], MONDAY, MONDAY + timedelta(days=27))
+        booked = AvailabilitySlot.objects.filter(date=MONDAY).first()
+        AvailabilitySlot.objects.filter(id=booked.id).update(is_booked=True)
+        DoctorLeave.objects.create(
+            doctor=self.doctor, leave_type='SICK', status='APPROVED',
+            start_date=MONDAY + timedelta(days=2), end_date=MONDAY + timedelta(days=3)
+        )
+
+    def test_week_counts_and_flags(self):
+        week = ScheduleAnalyticsService.get_weekly_schedule(self.doctor, MONDAY)
+        self.assertEqual(week['Monday']['total_slots'], 5)
+        self.assertEqual(week['Monday']['available_slots'], 4)
+        self.assertEqual(week['Monday']['booked_slots'], 1)
+        self.assertEqual(week['Monday']['shifts'][0]['hospital'], 'City Hospital')
+        self.assertEqual(week['Tuesday']['shifts'], [])
+        self.assertTrue(week['Thursday']['is_on_leave'])
+        self.assertFalse(week['Friday']['is_on_leave'])
+
+    def test_query_count_is_independent_of_weeks(self):
+        with CaptureQueriesContext(connection) as one:
+            ScheduleAnalyticsService.get_weekly_schedules(self.doctor, MONDAY, weeks=1)
+        with CaptureQueriesContext(connection) as four:
+            schedules = ScheduleAnalyticsService.get_weekly_schedules(self.doctor, MONDAY, weeks=4)
+        self.assertEqual(len(one.captured_queries), 4)
+        self.assertEqual(len(four.captured_queries), 4)
+        self.assertEqual(len(schedules), 4)
+        self.assertEqual(schedules[(MONDAY + timedelta(days=21)).isoformat()]['Monday']['total_slots'], 5)
+
+
+# -------------------------------
+# Hospital Roster Tests
+# -------------------------------
+class HospitalRosterServiceTest(ScheduleFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        # Second duty for the same doctor at the same hospital
+        ipd = Duty.objects.create(
+            doctor=self.doctor, hospital=self.hospital, duty_type='IPD', start_date=MONDAY
+        )
+        Shift.objects.create(duty=ipd, day_of_week=0, start_time=time(14, 0), end_time=time(15, 0))
+        SlotGenerationEngine.generate(list(Shift.objects.select_related('duty')), MONDAY, MONDAY)
+
+    def test_roster_deduplicates_doctors_in_constant_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            roster = HospitalRosterService.get_roster(self.hospital.id, MONDAY, use_cache=False)
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertEqual(len(roster), 1)
+        self.assertEqual(roster[0]['specialty'], 'cardiology')
+        self.assertEqual(len(roster[0]['shifts']), 2)
+        self.assertEqual(roster[0]['total_slots'], 7)
+
+    def test_cached_roster_is_invalidated_by_booking(self):
+        HospitalRosterService.get_roster(self.hospital.id, MONDAY)
+        with CaptureQueriesContext(connection) as ctx:
+            HospitalRosterService.get_roster(self.hospital.id, MONDAY)
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+        slot = AvailabilitySlot.objects.filter(date=MONDAY).first()
+        slot.is_booked = True
+        with self.captureOnCommitCallbacks(execute=True):
+            slot.save()
+        roster = ScheduleAnalyticsService.get_hospital_doctor_schedules(self.hospital, MONDAY)
+        self.assertEqual(roster[0]['booked_slots'], 1)
+
+    def test_masking_invalidates_roster(self):
+        HospitalRosterService.get_roster(self.hospital.id, MONDAY)
+        with self.captureOnCommitCallbacks(execute=True):
+            SlotMaskingService.mask([self.doctor.id], MONDAY, MONDAY)
+        roster = HospitalRosterService.get_roster(self.hospital.id, MONDAY)
+        self.assertEqual(roster[0]['available_slots'], 0)
+    
+    def test_invalidation_waits_for_commit(self):
+        HospitalRosterService.get_roster(self.hospital.id, MONDAY)
+        with self.captureOnCommitCallbacks(execute=True):
+            SlotMaskingService.mask([self.doctor.id], MONDAY, MONDAY)
+            # Still inside the transaction: the cached roster is served
+            roster = HospitalRosterService.get_roster(self.hospital.id, MONDAY)
+            self.assertEqual(roster[0]['available_slots'], 7)
+        roster = HospitalRosterService.get_roster(self.hospital.id, MONDAY)
+        self.assertEqual(roster[0]['available_slots'], 0)
+
+
+# -------------------------------
+# Daily Availability Rollup Tests
+# -------------------------------
+class DailyAvailabilityTest(ScheduleFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        SlotGenerationEngine.generate([self.shift], MONDAY, MONDAY + timedelta(days=13))
+
+    def rollup(self, day):
+        return DoctorDailyAvailability.objects.get(doctor=self.doctor, date=day)
+
+    def test_generation_populates_rollup(self):
+        self.assertEqual(DoctorDailyAvailability.objects.count(), 2)
+        self.assertEqual(self.rollup(MONDAY).total_slots, 5)
+        self.assertEqual(self.rollup(MONDAY).available_slots, 5)
+
+    def test_booking_and_masking_update_rollup(self):
+        slot = AvailabilitySlot.objects.filter(date=MONDAY).first()
+        slot.is_booked = True
+        slot.save()
+        self.assertEqual(self.rollup(MONDAY).booked_slots, 1)
+        self.assertEqual(self.rollup(MONDAY).available_slots, 4)
+
+        SlotMaskingService.mask([self.doctor.id], MONDAY, MONDAY)
+        self.assertEqual(self.rollup(MONDAY).available_slots, 0)
+        self.assertEqual(self.rollup(MONDAY + timedelta(days=7)).available_slots, 5)
+
+    def test_availability_reads_rollup_only(self):
+        with CaptureQueriesContext(connection) as ctx:
+            availability = AvailabilitySlotService.get_doctor_availability(
+                self.doctor, MONDAY, MONDAY + timedelta(days=13)
+            )
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIn('doctordailyavailability', ctx.captured_queries[0]['sql'])
+        self.assertEqual(availability[MONDAY.isoformat()]['total_slots'], 5)
+
+        summary = ScheduleAnalyticsService.get_doctor_schedule_summary(
+            self.doctor, MONDAY, MONDAY + timedelta(days=13)
+        )
+        self.assertEqual(summary['total_slots'], 10)
+        self.assertEqual(summary['working_days'], 2)
+
+    def test_checker_detects_and_fixes_drift(self):
+        call_command('check_daily_availability', stdout=StringIO())
+
+        AvailabilitySlot.objects.filter(date=MONDAY).update(is_booked=True)
+        with self.assertRaises(CommandError):
+            call_command('check_daily_availability', stdout=StringIO())
+
+        call_command('check_daily_availability', '--fix', stdout=StringIO())
+        self.assertEqual(self.rollup(MONDAY).booked_slots, 5)
+        self.assertEqual(DailyAvailabilityService.diff(MONDAY, MONDAY + timedelta(days=13)), [])
+
+    def test_rebuild_from_scratch(self):
+        DoctorDailyAvailability.objects.all().delete()
+        DoctorDailyAvailability.objects.create(doctor=self.doctor, date=MONDAY - timedelta(days=1), total_slots=3)
+        call_command('rebuild_daily_availability', stdout=StringIO())
+        self.assertEqual(
+            sorted(DoctorDailyAvailability.objects.values_list('date', flat=True)),
+            [MONDAY, MONDAY + timedelta(days=7)]
+        )
+
+    def test_low_availability_is_one_grouped_query(self):
+        SlotMaskingService.mask([self.doctor.id], MONDAY, MONDAY)
+        with CaptureQueriesContext(connection) as ctx:
+            rows = list(DoctorDailyAvailabilityRepository.get_low_availability(
+                MONDAY, MONDAY + timedelta(days=13), 0.6
+            ))
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(
+            [(row['doctor_id'], row['total'], row['available']) for row in rows],
+            [(self.doctor.id, 10, 5)]
+        )
+
+
+# -------------------------------
+# Low Availability Tests
+# -------------------------------
+class LowAvailabilityServiceTest(ScheduleFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.now().date()
+        self.doctor_user.email = 'busy@example.com'
+        self.doctor_user.save()
+        Duty.objects.filter(id=self.duty.id).update(start_date=self.today)
+        Shift.objects.filter(id=self.shift.id).update(day_of_week=self.today.weekday())
+
+        other_user = User.objects.create_user(
+            username='dr_free', password='pass', role='DOCTOR', email='free@example.com'
+        )
+        self.other = DoctorProfile.objects.create(user=other_user, specialization='neurology', license_number='D-2')
+        other_duty = Duty.objects.create(doctor=self.other, hospital=self.hospital, duty_type='OPD', start_date=self.today)
+        Shift.objects.create(
+            duty=other_duty, day_of_week=self.today.weekday(), start_time=time(9, 0), end_time=time(10, 0)
+        )
+
+        SlotGenerationEngine.generate(
+            list(Shift.objects.select_related('duty')), self.today, self.today + timedelta(days=7)
+        )
+        SlotMaskingService.mask([self.doctor.id], self.today, self.today + timedelta(days=7))
+
+    def test_detect_is_one_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            doctors = LowAvailabilityService.detect(self.today, self.today + timedelta(days=7), 0.2)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual([d['doctor_id'] for d in doctors], [self.doctor.id])
+        self.assertEqual(doctors[0]['ratio'], 0)
+
+    def test_specialization_threshold_overrides_default(self):
+        doctors = LowAvailabilityService.detect(
+            self.today, self.today + timedelta(days=7), 0.2, {'neurology': 1.5}
+        )
+        self.assertEqual({d['doctor_id'] for d in doctors}, {self.doctor.id, self.other.id})
+
+    def test_run_sends_batched_emails(self):
+        result = LowAvailabilityService.run(specialization_thresholds={'neurology': 1.5}, batch_size=1)
+        self.assertEqual(result['emails_sent'], 2)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['busy@example.com', 'free@example.com'])
+
+
+# -------------------------------
+# Recurrence Tests
+# -------------------------------
+class RecurrenceRuleTest(TestCase):
+    def setUp(self):
+        self.start = timezone.make_aware(datetime(2030, 1, 7, 9, 0))
+
+    def test_weekly_byday_with_count(self):
+        rule = parse_recurrence('RRULE:FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH;COUNT=4')
+        self.assertEqual(
+            [occurrence.date() for occurrence in iter_occurrences(self.start, rule)],
+            [date(2030, 1, 7), date(2030, 1, 10), date(2030, 1, 21), date(2030, 1, 24)]
+        )
+
+    def test_window_skips_ahead_without_enumerating(self):
+        rule = parse_recurrence('DAILY')
+        window_start = self.start + timedelta(days=100000)
+        occurrences = list(iter_occurrences(self.start, rule, window_start, window_start + timedelta(days=3)))
+        self.assertEqual(len(occurrences), 3)
+        self.assertEqual(occurrences[0], window_start)
+
+    def test_monthly_skips_short_months(self):
+        rule = parse_recurrence('FREQ=MONTHLY;UNTIL=20300601')
+        start = timezone.make_aware(datetime(2030, 1, 31, 9, 0))
+        self.assertEqual(
+            [occurrence.month for occurrence in iter_occurrences(start, rule)],
+            [1, 3, 5]
+        )
+
+    def test_invalid_patterns_are_rejected(self):
+        for pattern in ('', 'FREQ=HOURLY', 'FREQ=MONTHLY;BYDAY=MO', 'FREQ=DAILY;COUNT=0'):
+            with self.assertRaises(ValueError):
+                parse_recurrence(pattern)
+
+
+class RecurrenceServiceTest(ScheduleFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        patient_user = User.objects.create_user(username='pt_recur', password='pass', role='PATIENT')
+        self.patient = PatientProfile.objects.create(user=patient_user, date_of_birth=date(1990, 1, 1))
+        self.start = timezone.make_aware(datetime(2030, 1, 7, 9, 0))
+        self.weekly = Schedule.objects.create(
+            title='Dialysis', doctor=self.doctor, patient=self.patient,
+            start_time=self.start, end_time=self.start + timedelta(hours=1),
+            is_recurring=True, recurrence_pattern='WEEKLY'
+        )
+        self.one_off = Schedule.objects.create(
+            title='Consult', doctor=self.doctor, patient=self.patient,
+            start_time=self.start + timedelta(days=8), end_time=self.start + timedelta(days=8, minutes=30)
+        )
+
+    def test_occurrences_are_merged_in_order(self):
+        with CaptureQueriesContext(connection) as ctx:
+            occurrences = list(RecurrenceService.occurrences_for_doctor(
+                self.doctor, self.start, self.start + timedelta(days=21)
+            ))
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertEqual(
+            [(o.schedule.title, o.start.date()) for o in occurrences],
+            [('Dialysis', date(2030, 1, 7)), ('Dialysis', date(2030, 1, 14)),
+             ('Consult', date(2030, 1, 15)), ('Dialysis', date(2030, 1, 21))]
+        )
+        self.assertEqual(occurrences[1].end - occurrences[1].start, timedelta(hours=1))
+
+    def test_far_window_does_not_expand_history(self):
+        far = self.start + timedelta(weeks=520)
+        occurrences = list(RecurrenceService.occurrences_for_doctor(self.doctor, far, far + timedelta(days=7)))
+        self.assertEqual([o.start for o in occurrences], [far])
+
+
+# -------------------------------
+# Slot Booking Tests
+# -------------------------------
+class SlotBookingTest(ScheduleFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        SlotGenerationEngine.generate([self.shift], MONDAY, MONDAY)
+        self.slot = AvailabilitySlot.objects.filter(date=MONDAY).first()
+        patient_user = User.objects.create_user(username='pt_book', password='pass', role='PATIENT')
+        self.patient = PatientProfile.objects.create(user=patient_user, date_of_birth=date(1990, 1, 1))
+
+    def test_claim_is_a_single_conditional_update(self):
+        with CaptureQueriesContext(connection) as ctx:
+            success, message = AvailabilitySlotService.book_slot(self.slot.id, self.patient)
+        self.assertTrue(success)
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('is_booked', updates[0].split('WHERE')[1])
+
+        success, message = AvailabilitySlotService.book_slot(self.slot.id, self.patient)
+        self.assertFalse(success)
+        self.assertEqual(message, "Slot is not available for booking")
+        self.assertEqual(DoctorDailyAvailability.objects.get(date=MONDAY).booked_slots, 1)
+
+    def test_cancel_releases_slot(self):
+        AvailabilitySlotService.book_slot(self.slot.id, self.patient)
+        success, message = AvailabilitySlotService.cancel_slot_booking(self.slot.id)
+        self.assertTrue(success)
+        self.slot.refresh_from_db()
+        self.assertFalse(self.slot.is_booked)
+        self.assertIsNone(self.slot.booked_by_id)
+        self.assertFalse(AvailabilitySlotService.cancel_slot_booking(self.slot.id)[0])
+
+    def test_masked_slot_cannot_be_booked(self):
+        SlotMaskingService.mask([self.doctor.id], MONDAY, MONDAY)
+        self.assertFalse(AvailabilitySlotService.book_slot(self.slot.id, self.patient)[0])
+        self.assertEqual(AvailabilitySlotService.book_slot(0, self.patient), (False, "Slot not found"))
+
+
+class SlotBookingBenchmarkTest(TransactionTestCase):
+    def test_benchmark_reports_no_double_booking(self):
+        out = StringIO()
+        call_command(
+            'benchmark_slot_booking', threads=4, attempts=40, slots=5, seed=1, stdout=out
+        )
+        self.assertIn('No double bookings', out.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='bench_').exists())
+
+
+# -------------------------------
+# Earliest Slot Index Tests
+# -------------------------------
+class EarliestSlotIndexTest(ScheduleFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.now().date()
+        self.tomorrow = self.today + timedelta(days=1)
+        Duty.objects.filter(id=self.duty.id).update(start_date=self.today)
+        Shift.objects.filter(id=self.shift.id).update(day_of_week=self.tomorrow.weekday())
+        self.shift.refresh_from_db()
+        # The index is refreshed once the slot changes commit
+        with self.settings(SCHEDULES_EARLIEST_SLOTS_PER_DOCTOR=2), self.captureOnCommitCallbacks(execute=True):
+            SlotGenerationEngine.generate([self.shift], self.tomorrow, self.tomorrow)
+        patient_user = User.objects.create_user(username='pt_early', password='pass', role='PATIENT')
+        self.patient = PatientProfile.objects.create(user=patient_user, date_of_birth=date(1990, 1, 1))
+
+    def test_index_keeps_next_n_per_doctor(self):
+        with self.settings(SCHEDULES_EARLIEST_SLOTS_PER_DOCTOR=2):
+            EarliestSlotIndexService.refresh([self.doctor.id])
+        self.assertEqual(
+            list(EarliestSlotIndex.objects.order_by('start_time').values_list('start_time', flat=True)),
+            [time(9, 0), time(9, 30)]
+        )
+
+    def test_booking_pulls_in_next_slot(self):
+        with self.settings(SCHEDULES_EARLIEST_SLOTS_PER_DOCTOR=2):
+            first = EarliestSlotIndex.objects.order_by('start_time').first()
+            with self.captureOnCommitCallbacks(execute=True):
+                AvailabilitySlotService.book_slot(first.slot_id, self.patient)
+            self.assertEqual(
+                list(EarliestSlotIndex.objects.order_by('start_time').values_list('start_time', flat=True)),
+                [time(9, 30), time(10, 30)]
+            )
+            with self.captureOnCommitCallbacks(execute=True):
+                AvailabilitySlotService.cancel_slot_booking(first.slot_id)
+        self.assertEqual(EarliestSlotIndex.objects.order_by('start_time').first().slot_id, first.slot_id)
+
+    def test_search_is_one_query_with_filters(self):
+        with CaptureQueriesContext(connection) as ctx:
+            results = EarliestSlotIndexService.search('cardiology', limit=1)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual([r['start_time'] for r in results], ['09:00'])
+        self.assertEqual(results[0]['hospital_name'], 'City Hospital')
+
+        self.assertEqual(EarliestSlotIndexService.search('cardiology', min_rating=4.0), [])
+        self.assertEqual(EarliestSlotIndexService.search('neurology'), [])
+        self.assertEqual(EarliestSlotIndexService.search('cardiology', hospital_id=0), [])
+
+
+# -------------------------------
+# Slot Cleanup Tests
+# -------------------------------
+class SlotCleanupServiceTest(ScheduleFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        today = timezone.now().date()
+        self.old_day = today - timedelta(days=30)
+        self.recent_day = today - timedelta(days=2)
+        patient_user = User.objects.create_user(username='pt_cleanup', password='pass', role='PATIENT')
+        self.patient = PatientProfile.objects.create(user=patient_user, date_of_birth=date(1990, 1, 1))
+        AvailabilitySlot.objects.bulk_create([
+            AvailabilitySlot(shift=self.shift, date=day, start_time=time(9, minute), end_time=time(9, minute + 10))
+            for day in (self.old_day, self.recent_day)
+            for minute in (0, 10, 20, 30, 40)
+        ])
+        AvailabilitySlot.objects.filter(date=self.old_day, start_time=time(9, 0)).update(
+            is_booked=True, is_available=False, booked_by=self.patient
+        )
+        DailyAvailabilityService.refresh(None, self.old_day, self.recent_day)
+
+    def test_deletes_old_unbooked_slots_in_chunks(self):
+        stats = SlotCleanupService.run(chunk_size=2, pause=0)
+        self.assertEqual(stats['deleted'], 4)
+        self.assertEqual(stats['archived'], 0)
+        self.assertEqual(stats['chunks'], 3)
+        self.assertEqual(AvailabilitySlot.objects.filter(date=self.old_day).count(), 1)
+        self.assertEqual(AvailabilitySlot.objects.filter(date=self.recent_day).count(), 5)
+        rollup = DoctorDailyAvailability.objects.get(doctor=self.doctor, date=self.old_day)
+        self.assertEqual((rollup.total_slots, rollup.booked_slots), (1, 1))
+
+    def test_archives_booked_slots_before_deleting(self):
+        stats = SlotCleanupService.run(chunk_size=100, pause=0, archive_booked=True)
+        self.assertEqual((stats['deleted'], stats['archived']), (5, 1))
+        self.assertFalse(AvailabilitySlot.objects.filter(date=self.old_day).exists())
+        archived = ArchivedSlot.objects.get()
+        self.assertEqual(archived.month, self.old_day.replace(day=1))
+        self.assertEqual((archived.doctor_id, archived.patient_id), (self.doctor.id, self.patient.id))
+        self.assertFalse(DoctorDailyAvailability.objects.filter(date=self.old_day).exists())
+
+    def test_nothing_to_clean(self):
+        stats = SlotCleanupService.run(retention_days=60)
+        self.assertEqual((stats['deleted'], stats['chunks']), (0, 0))
+
+
+# -------------------------------
+# Shift Conflict Tests
+# -------------------------------
+class FindOverlapsTest(TestCase):
+    def interval(self, shift_id, start, end, doctor_id=1, day=0, valid_from=MONDAY, valid_until=None):
+        return ShiftInterval(shift_id, doctor_id, 1, day, start, end, valid_from, valid_until)
+
+    def test_sweep_reports_each_overlapping_pair(self):
+        a = self.interval(1, 540, 720)
+        b = self.interval(2, 600, 660)
+        c = self.interval(3, 700, 800)
+        adjacent = self.interval(4, 800, 900)
+        other_day = self.interval(5, 540, 720, day=1)
+        other_doctor = self.interval(6, 540, 720, doctor_id=2)
+        pairs = find_overlaps([c, adjacent, a, b, other_day, other_doctor])
+        self.assertEqual(
+            sorted((first.shift_id, second.shift_id) for first, second in pairs),
+            [(1, 2), (1, 3)]
+        )
+
+    def test_duty_date_ranges_must_overlap(self):
+        ended = self.interval(1, 540, 720, valid_until=MONDAY + timedelta(days=30))
+        later = self.interval(2, 600, 660, valid_from=MONDAY + timedelta(days=31))
+        self.assertEqual(find_overlaps([ended, later]), [])
+
+    def test_candidates_only_report_their_own_clashes(self):
+        a, b = self.interval(1, 540, 720), self.interval(2, 600, 660)
+        candidate = self.interval(None, 480, 560)
+        pairs = find_overlaps([a, b], [candidate])
+        self.assertEqual([(first.shift_id, second.shift_id) for first, second in pairs], [(None, 1)])
+
+
+class ShiftConflictServiceTest(ScheduleFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        other_user = User.objects.create_user(username='general', password='pass', role='HOSPITAL')
+        self.other_hospital = HospitalProfile.objects.create(
+            user=other_user, hospital_name='General Hospital', license_number='H-2'
+        )
+        self.other_duty = Duty.objects.create(
+            doctor=self.doctor, hospital=self.other_hospital, duty_type='OPD', start_date=MONDAY
+        )
+
+    def test_create_rejects_overlap_at_another_hospital_with_one_extra_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            success, message, shift = ShiftService.create_shift(self.other_duty.id, 0, time(11, 0), time(14, 0))
+        self.assertFalse(success)
+        self.assertIsNone(shift)
+        self.assertIn('Monday 09:00-12:00 / 11:00-14:00', message)
+        # Duty lookup plus the interval query, inside the atomic savepoint
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('SELECT')]), 2)
+
+        success, _, shift = ShiftService.create_shift(self.other_duty.id, 0, time(12, 0), time(14, 0))
+        self.assertTrue(success)
+
+    def test_create_multiple_and_allow_overlap(self):
+        success, message, shifts = ShiftService.create_multiple_shifts(
+            self.other_duty.id, [0, 1], time(8, 0), time(10, 0)
+        )
+        self.assertFalse(success)
+        self.assertEqual(shifts, [])
+        success, _, shifts = ShiftService.create_multiple_shifts(
+            self.other_duty.id, [0, 1], time(8, 0), time(10, 0), allow_overlap=True
+        )
+        self.assertTrue(success)
+        self.assertEqual(len(shifts), 2)
+
+    def test_update_checks_new_timing_but_not_itself(self):
+        other = Shift.objects.create(duty=self.other_duty, day_of_week=0, start_time=time(13, 0), end_time=time(15, 0))
+        success, _, _ = ShiftService.update_shift(self.shift.id, end_time=time(12, 30))
+        self.assertTrue(success)
+        success, message, _ = ShiftService.update_shift(other.id, start_time=time(12, 0))
+        self.assertFalse(success)
+        self.assertIn('Monday', message)
+
+    def test_audit_command_fails_on_conflicts(self):
+        call_command('audit_shift_conflicts', stdout=StringIO())
+        Shift.objects.create(duty=self.other_duty, day_of_week=0, start_time=time(11, 0), end_time=time(13, 0))
+        self.assertEqual(len(ShiftConflictService.audit()), 1)
+        with self.assertRaises(CommandError):
+            call_command('audit_shift_conflicts', stdout=StringIO())
+
+
+# -------------------------------
+# Reminder Dispatch Tests
+# -------------------------------
+class ReminderDispatchServiceTest(ScheduleFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        patient_user = User.objects.create_user(
+            username='pt_remind', password='pass', role='PATIENT', email='pt@example.com'
+        )
+        self.patient = PatientProfile.objects.create(user=patient_user, date_of_birth=date(1990, 1, 1))
+
+    def reminder(self, title, send_time, reminder_type=ScheduleReminder.ReminderType.EMAIL, **fields):
+        start = self.now + timedelta(days=1)
+        schedule = Schedule.objects.create(
+            title=title, doctor=self.doctor, patient=self.patient,
+            start_time=start, end_time=start + timedelta(minutes=30)
+        )
+        return ScheduleReminder.objects.create(
+            schedule=schedule, reminder_type=reminder_type, send_time=send_time, **fields
+        )
+
+    def test_save_keeps_send_bucket_in_step(self):
+        reminder = self.reminder('Bucketed', self.now)
+        self.assertEqual(reminder.send_bucket, epoch_hour(self.now))
+        reminder.send_time = self.now + timedelta(hours=5)
+        reminder.save(update_fields=['send_time'])
+        reminder.refresh_from_db()
+        self.assertEqual(reminder.send_bucket, epoch_hour(self.now) + 5)
+
+    def test_due_reminders_are_sent_once_in_batches(self):
+        due = [self.reminder(f'Due {index}', self.now - timedelta(minutes=index)) for index in range(3)]
+        future = self.reminder('Later', self.now + timedelta(hours=2))
+        sms = self.reminder('Text', self.now - timedelta(minutes=5), ScheduleReminder.ReminderType.SMS)
+        expired = self.reminder('Stale', self.now - timedelta(days=3))
+
+        stats = ReminderDispatchService.run(batch_size=2)
+        self.assertEqual((stats['sent'], stats['batches'], stats['error']), (3, 2, None))
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].to, ['pt@example.com'])
+        self.assertEqual(ScheduleReminder.objects.filter(id__in=[r.id for r in due], is_sent=True).count(), 3)
+        for untouched in (future, sms, expired):
+            untouched.refresh_from_db()
+            self.assertFalse(untouched.is_sent)
+
+        self.assertEqual(ReminderDispatchService.run()['sent'], 0)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_live_claims_are_skipped_and_stale_claims_taken_over(self):
+        self.reminder('Held', self.now - timedelta(minutes=1), claim_token=uuid4(), claimed_at=self.now)
+        abandoned = self.reminder(
+            'Abandoned', self.now - timedelta(minutes=1),
+            claim_token=uuid4(), claimed_at=self.now - timedelta(hours=1)
+        )
+        self.assertEqual(ReminderDispatchService.run()['sent'], 1)
+        abandoned.refresh_from_db()
+        self.assertTrue(abandoned.is_sent)
+        self.assertIsNone(abandoned.claim_token)
+
+    def test_failed_batch_releases_its_claims(self):
+        reminder = self.reminder('Flaky', self.now - timedelta(minutes=1))
+        with mock.patch(
+            'django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('smtp down')
+        ), self.assertLogs('schedules.services', 'ERROR'):
+            stats = ReminderDispatchService.run()
+        self.assertEqual(stats['error'], 'smtp down')
+        reminder.refresh_from_db()
+        self.assertFalse(reminder.is_sent)
+        self.assertIsNone(reminder.claim_token)
+
+
+# -------------------------------
+# Roster Solver Tests
+# -------------------------------
+class RosterSolverServiceTest(ScheduleFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.free_doctor = DoctorProfile.objects.create(
+            user=User.objects.create_user(username='dr_free', password='pass', role='DOCTOR'),
+            specialization='cardiology', license_number='D-2'
+        )
+        self.away_doctor = DoctorProfile.objects.create(
+            user=User.objects.create_user(username='dr_away', password='pass', role='DOCTOR'),
+            specialization='cardiology', license_number='D-3'
+        )
+        DoctorLeave.objects.create(
+            doctor=self.away_doctor, leave_type='VACATION', status='APPROVED',
+            start_date=MONDAY, end_date=MONDAY + timedelta(days=6)
+        )
+
+    def requirement(self, day, start, end, doctors, specialization='cardiology'):
+        return CoverageRequirement(None, specialization, day, start, end, doctors)
+
+    def test_respects_existing_shifts_and_leave_and_reports_gaps(self):
+        plan = RosterSolverService.solve(
+            self.hospital.id, MONDAY + timedelta(days=2), 1, [self.requirement(0, time(11, 0), time(14, 0), 3)]
+        )
+        self.assertEqual(plan['start_date'], MONDAY)
+        self.assertEqual([a['doctor_id'] for a in plan['assignments']], [self.free_doctor.id])
+        self.assertEqual(len(plan['gaps']), 1)
+        self.assertEqual((plan['gaps'][0]['assigned'], plan['gaps'][0]['missing']), (1, 2))
+
+    def test_inactive_doctors_are_not_rostered(self):
+        User.objects.filter(id=self.free_doctor.user_id).update(is_active=False)
+        plan = RosterSolverService.solve(
+            self.hospital.id, MONDAY, 1, [self.requirement(1, time(13, 0), time(15, 0), 1)],
+            doctor_ids=[self.doctor.id, self.free_doctor.id]
+        )
+        self.assertEqual({a['doctor_id'] for a in plan['assignments']}, {self.doctor.id})
+
+    def test_weekly_hours_limit_and_load_balancing(self):
+        requirements = [self.requirement(day, time(13, 0), time(19, 0), 1) for day in (1, 2, 3)]
+        plan = RosterSolverService.solve(
+            self.hospital.id, MONDAY, 2, requirements, max_hours_per_week=9,
+            doctor_ids=[self.doctor.id, self.free_doctor.id]
+        )
+        # The fixture doctor already works 3 hours on Mondays, so each doctor
+        # fits one 6-hour block a week and one block per week stays uncovered
+        self.assertEqual(plan['blocks_filled'], 4)
+        self.assertEqual(len(plan['gaps']), 2)
+        per_week = {(a['doctor_id'], a['week_start']) for a in plan['assignments']}
+        self.assertEqual(len(per_week), 4)
+
+    def test_dry_run_writes_nothing_and_apply_bulk_creates(self):
+        requirements = RosterSolverService.parse_requirements([
+            {'specialization': 'cardiology', 'days': [1, 2], 'start': '14:00', 'end': '18:00', 'doctors': 1}
+        ])
+        duties_before = Duty.objects.count()
+        plan = RosterSolverService.run(self.hospital.id, MONDAY, 1, requirements)
+        self.assertEqual((plan['duties_created'], plan['shifts_created']), (0, 0))
+        self.assertEqual(Duty.objects.count(), duties_before)
+
+        plan = RosterSolverService.run(self.hospital.id, MONDAY, 1, requirements, dry_run=False)
+        self.assertEqual(plan['shifts_created'], 2)
+        created = Duty.objects.filter(notes='Assigned by the roster solver')
+        self.assertEqual(created.count(), plan['duties_created'])
+        self.assertTrue(all(duty.end_date == MONDAY + timedelta(days=6) for duty in created))
+        self.assertEqual(ShiftConflictService.audit(), [])
+
+    def test_parse_requirements_rejects_bad_items(self):
+        with self.assertRaises(ValueError):
+            RosterSolverService.parse_requirements([{'day_of_week': 9, 'start': '09:00', 'end': '10:00', 'doctors': 1}])
+        with self.assertRaises(ValueError):
+            RosterSolverService.parse_requirements([{'day_of_week': 1, 'start': '11:00', 'end': '10:00', 'doctors': 1}])
+
+    def test_assign_scales_to_a_large_fleet(self):
+        candidates = {doctor_id: f'spec{doctor_id % 10}' for doctor_id in range(500)}
+        requirements = [
+            CoverageRequirement(department, f'spec{department}', day, time(start, 0), time(start + 4, 0), 4)
+            for department in range(10) for day in range(7) for start in (8, 12, 16)
+        ]
+        started = _time.perf_counter()
+        assignments, gaps = RosterSolverService.assign(
+            requirements, candidates, MONDAY, 4, defaultdict(list), defaultdict(int), set(), 40 * 60
+        )
+        self.assertLess(_time.perf_counter() - started, 5)
+        self.assertEqual(gaps, [])
+        self.assertEqual(len(assignments), len(requirements) * 4 * 4)
+
+
+# -------------------------------
+# Rotation Template Tests
+# -------------------------------
+class RotationTemplateServiceTest(ScheduleFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.now().date()
+        self.duties = [self.duty]
+        for index in range(3):
+            doctor = DoctorProfile.objects.create(
+                user=User.objects.create_user(username=f'dr_rot_{index}', password='pass', role='DOCTOR'),
+                specialization='cardiology', license_number=f'D-R{index}'
+            )
+            self.duties.append(Duty.objects.create(
+                doctor=doctor, hospital=self.hospital, duty_type='OPD', start_date=self.today
+            ))
+        success, _, self.template = RotationTemplateService.create_template(
+            'Alternate Tuesdays',
+            [
+                {'day_of_week': 1, 'start_time': time(14, 0), 'end_time': time(16, 0)},
+                {'week_index': 1, 'day_of_week': 3, 'start_time': time(8, 0), 'end_time': time(10, 0)},
+            ],
+            cycle_weeks=2
+        )
+        self.assertTrue(success)
+
+    def test_create_template_validates_blocks(self):
+        success, message, _ = RotationTemplateService.create_template(
+            'Broken', [{'week_index': 2, 'day_of_week': 0, 'start_time': time(9, 0), 'end_time': time(10, 0)}],
+            cycle_weeks=2
+        )
+        self.assertFalse(success)
+        self.assertIn('week_index', message)
+        success, message, _ = RotationTemplateService.create_template('Alternate Tuesdays', [
+            {'day_of_week': 0, 'start_time': time(9, 0), 'end_time': time(10, 0)}
+        ])
+        self.assertFalse(success)
+
+    def test_apply_bulk_creates_in_chunks_and_generates_only_new_shifts(self):
+        new_duty_ids = [duty.id for duty in self.duties[1:]]
+        with CaptureQueriesContext(connection) as ctx:
+            success, _, stats = RotationTemplateService.apply_template(
+                self.template.id, new_duty_ids, chunk_size=4, horizon_days=28
+            )
+        self.assertTrue(success)
+        self.assertEqual(stats['shifts_created'], 6)
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "schedules_shift"')]
+        self.assertEqual(len(inserts), 2)
+
+        created = Shift.objects.filter(duty_id__in=new_duty_ids)
+        self.assertTrue(all(shift.slots_generated_through == self.today + timedelta(days=28) for shift in created))
+        self.assertIsNone(Shift.objects.get(id=self.shift.id).slots_generated_through)
+        # Each block only runs in its own week of the two-week cycle
+        self.assertEqual(stats['slots_created'], AvailabilitySlot.objects.filter(shift__in=created).count())
+        for shift in created:
+            dates = sorted(set(AvailabilitySlot.objects.filter(shift=shift).values_list('date', flat=True)))
+            self.assertTrue(dates)
+            self.assertTrue(all((later - earlier).days == 14 for earlier, later in zip(dates, dates[1:])))
+
+        success, _, stats = RotationTemplateService.apply_template(self.template.id, new_duty_ids)
+        self.assertTrue(success)
+        self.assertEqual((stats['shifts_created'], stats['shifts_skipped']), (0, 6))
+
+    def test_apply_refuses_conflicts_without_writing(self):
+        Shift.objects.create(duty=self.duties[1], day_of_week=1, start_time=time(15, 0), end_time=time(17, 0))
+        shifts_before = Shift.objects.count()
+        success, message, stats = RotationTemplateService.apply_template(
+            self.template.id, [duty.id for duty in self.duties[1:]]
+        )
+        self.assertFalse(success)
+        self.assertEqual(len(stats['conflicts']), 1)
+        self.assertEqual(Shift.objects.count(), shifts_before)
+
+    def test_engine_and_conflicts_honour_rotation_weeks(self):
+        odd_week = Shift.objects.create(
+            duty=self.duty, day_of_week=0, start_time=time(9, 0), end_time=time(12, 0),
+            rotation_cycle_weeks=2, rotation_week_index=1
+        )
+        SlotGenerationEngine.generate([odd_week], MONDAY, MONDAY + timedelta(days=27))
+        self.assertEqual(
+            sorted(set(AvailabilitySlot.objects.filter(shift=odd_week).values_list('date', flat=True))),
+            [MONDAY + timedelta(days=7), MONDAY + timedelta(days=21)]
+        )
+        # The fixture's weekly Monday shift meets it every other week
+        self.assertEqual(len(ShiftConflictService.audit([self.doctor.id])), 1)
+        Shift.objects.filter(id=self.shift.id).update(rotation_cycle_weeks=2, rotation_week_index=0)
+        self.assertEqual(ShiftConflictService.audit([self.doctor.id]), [])
+
+    def test_create_shift_checks_rotation_weeks(self):
+        Shift.objects.filter(id=self.shift.id).update(rotation_cycle_weeks=2, rotation_week_index=0)
+        success, message, shift = ShiftService.create_shift(
+            self.duty.id, 0, time(9, 0), time(12, 0), rotation_cycle_weeks=2, rotation_week_index=1
+        )
+        self.assertTrue(success, message)
+        success, message, shifts = ShiftService.create_multiple_shifts(
+            self.duty.id, [0], time(9, 0), time(12, 0), rotation_cycle_weeks=2, rotation_week_index=1
+        )
+        self.assertFalse(success)
+
+    def test_schedules_and_rosters_skip_off_weeks(self):
+        Shift.objects.filter(id=self.shift.id).update(rotation_cycle_weeks=2, rotation_week_index=1)
+        schedules = ScheduleAnalyticsService.get_weekly_schedules(self.doctor, MONDAY, weeks=2)
+        self.assertEqual(schedules[MONDAY.isoformat()]['Monday']['shifts'], [])
+        self.assertEqual(len(schedules[(MONDAY + timedelta(days=7)).isoformat()]['Monday']['shifts']), 1)
+
+        self.assertEqual(HospitalRosterService.build_roster(self.hospital.id, MONDAY), [])
+        self.assertEqual(len(HospitalRosterService.build_roster(self.hospital.id, MONDAY + timedelta(days=7))), 1)
+        self.assertEqual(ShiftService.get_shifts_for_date(self.doctor, MONDAY), [])
+
+
+# -------------------------------
+# Appointment Mix Tests
+# -------------------------------
+
+class AppointmentMixTest(ScheduleFixturesMixin, TestCase):
+    MIX = [{'type': 'FOLLOW_UP', 'minutes': 15, 'ratio': 2}, {'type': 'NEW_PATIENT', 'minutes': 45, 'ratio': 1}]
+
+    def test_parse_rejects_malformed_mixes(self):
+        self.assertEqual(parse_appointment_mix([]), ())
+        for mix in ({'type': 'X'}, [{'minutes': 10}], [{'type': 'X', 'minutes': 0}],
+                    [{'type': 'X', 'minutes': 10}, {'type': 'X', 'minutes': 20}]):
+            with self.assertRaises(ValueError):
+                parse_appointment_mix(mix)
+
+    def test_packing_follows_ratios_and_skips_the_break(self):
+        template = pack_slot_template(
+            time(9, 0), time(12, 0), parse_appointment_mix(self.MIX), time(10, 0), time(10, 30)
+        )
+        self.assertTrue(all(
+            end <= time(10, 0) or start >= time(10, 30) for start, end, _ in template
+        ))
+        self.assertTrue(all(earlier[1] <= later[0] for earlier, later in zip(template, template[1:])))
+        counts = defaultdict(int)
+        for _, _, appointment_type in template:
+            counts[appointment_type] += 1
+        self.assertEqual(counts['FOLLOW_UP'], 2 * counts['NEW_PATIENT'])
+        # Every one of the 150 working minutes is bookable
+        minutes = sum((end.hour * 60 + end.minute) - (start.hour * 60 + start.minute) for start, end, _ in template)
+        self.assertEqual(minutes, 150)
+
+    def test_engine_creates_typed_slots_and_reports_utilization(self):
+        Shift.objects.filter(id=self.shift.id).update(appointment_mix=self.MIX)
+        SlotGenerationEngine.generate(Shift.objects.filter(id=self.shift.id), MONDAY, MONDAY)
+        slots = AvailabilitySlot.objects.filter(shift=self.shift, date=MONDAY)
+        self.assertEqual(set(slots.values_list('appointment_type', flat=True)), {'FOLLOW_UP', 'NEW_PATIENT'})
+
+        slots.filter(appointment_type='NEW_PATIENT').update(is_booked=True, is_available=False)
+        report = SlotUtilizationService.report(MONDAY, MONDAY, doctor_ids=[self.doctor.id])
+        self.assertEqual(report['slot_minutes'], 150)
+        self.assertEqual(report['by_type']['NEW_PATIENT']['utilization'], 1.0)
+        self.assertEqual(report['by_type']['FOLLOW_UP']['booked'], 0)
+        self.assertEqual(report['utilization'], round(report['booked_minutes'] / 150, 4))
+
+        gain = SlotUtilizationService.packing_gain(Shift.objects.get(id=self.shift.id))
+        self.assertEqual((gain['grid_minutes'], gain['packed_minutes'], gain['gain_minutes']), (150, 150, 0))
+
+    def test_invalid_mix_falls_back_to_the_grid(self):
+        Shift.objects.filter(id=self.shift.id).update(appointment_mix=[{'type': 'BROKEN'}])
+        with self.assertLogs('schedules.services', 'WARNING'):
+            SlotGenerationEngine.generate(Shift.objects.filter(id=self.shift.id), MONDAY, MONDAY)
+        slots = AvailabilitySlot.objects.filter(shift=self.shift, date=MONDAY)
+        self.assertEqual(slots.count(), 5)
+        self.assertEqual(set(slots.values_list('appointment_type', flat=True)), {''})
+
+
+# -------------------------------
+# Change Feed Tests
+# -------------------------------
+
+class ChangeFeedServiceTest(ScheduleFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.patient_user = User.objects.create_user(username='pt_sync', password='pass', role='PATIENT')
+        self.patient = PatientProfile.objects.create(user=self.patient_user, date_of_birth=date(1990, 1, 1))
+        self.other_user = User.objects.create_user(username='pt_other', password='pass', role='PATIENT')
+        self.token = ChangeFeedService.changes(settle_seconds=0)['token']
+
+    def changes(self, **kwargs):
+        return ChangeFeedService.changes(self.token, settle_seconds=0, **kwargs)
+
+    def test_slot_changes_are_sent_per_doctor_range(self):
+        # Entries are written when the change commits
+        with self.captureOnCommitCallbacks(execute=True):
+            SlotGenerationEngine.generate([self.shift], MONDAY, MONDAY + timedelta(days=6))
+            slot = AvailabilitySlot.objects.filter(shift=self.shift).first()
+            slot.is_booked = True
+            slot.save()
+
+        page = self.changes()
+        self.assertEqual(len(page['slots']), 1)
+        doctor_slots = page['slots'][0]
+        self.assertEqual(doctor_slots['doctor_id'], self.doctor.id)
+        self.assertEqual(doctor_slots['start_date'], MONDAY)
+        self.assertEqual(len(doctor_slots['slots']), 5)
+        self.assertTrue(any(row['is_booked'] for row in doctor_slots['slots']))
+        self.assertEqual(self.changes(hospital_id=self.hospital.id + 1)['slots'][0]['slots'], [])
+
+        self.assertEqual(ChangeFeedService.changes(page['token'], settle_seconds=0)['slots'], [])
+
+    def test_objects_are_compacted_to_their_latest_state(self):
+        start = timezone.make_aware(datetime(2030, 1, 7, 9, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            kept = Schedule.objects.create(
+                title='Consult', doctor=self.doctor, patient=self.patient,
+                start_time=start, end_time=start + timedelta(minutes=30)
+            )
+            kept.status = 'CONFIRMED'
+            kept.save()
+            dropped = Schedule.objects.create(
+                title='Scan', doctor=self.doctor, patient=self.patient,
+                start_time=start, end_time=start + timedelta(minutes=30)
+            )
+            dropped_id = dropped.id
+            dropped.delete()
+
+        page = self.changes()
+        self.assertEqual([row['status'] for row in page['schedules']['changed']], ['CONFIRMED'])
+        self.assertEqual(page['schedules']['deleted'], [dropped_id])
+        self.assertEqual(len(self.changes(user=self.patient_user)['schedules']['changed']), 1)
+        self.assertEqual(self.changes(user=self.other_user)['schedules']['changed'], [])
+
+    def test_pages_resume_from_the_token(self):
+        start = timezone.make_aware(datetime(2030, 1, 7, 9, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            for index in range(3):
+                Schedule.objects.create(
+                    title=f'Visit {index}', doctor=self.doctor, patient=self.patient,
+                    start_time=start, end_time=start + timedelta(minutes=30)
+                )
+        first = self.changes(limit=2)
+        self.assertTrue(first['has_more'])
+        second = ChangeFeedService.changes(first['token'], limit=2, settle_seconds=0)
+        self.assertFalse(second['has_more'])
+        titles = [row['title'] for row in first['schedules']['changed'] + second['schedules']['changed']]
+        self.assertEqual(sorted(titles), ['Visit 0', 'Visit 1', 'Visit 2'])
+
+    def test_unsettled_entries_are_held_back(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ChangeFeedService.record_slots([self.doctor.id], MONDAY)
+        self.assertTrue(ChangeLogEntry.objects.exists())
+        page = ChangeFeedService.changes(self.token, settle_seconds=60)
+        self.assertEqual((page['token'], page['slots']), (self.token, []))
+
+    def test_entries_are_written_at_commit_without_loading_owners(self):
+        start = timezone.make_aware(datetime(2030, 1, 7, 9, 0))
+        schedule_id = Schedule.objects.create(
+            title='Consult', doctor=self.doctor, patient=self.patient,
+            start_time=start, end_time=start + timedelta(minutes=30)
+        ).id
+        ChangeLogEntry.objects.all().delete()
+
+        # A rolled-back change leaves no entry behind
+        try:
+            with transaction.atomic():
+                ChangeFeedService.record_slots([self.doctor.id], MONDAY)
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        self.assertFalse(ChangeLogEntry.objects.exists())
+
+        schedule = Schedule.objects.get(id=schedule_id)
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+            schedule.save()
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('SELECT "accounts_')])
+        entry = ChangeLogEntry.objects.get()
+        self.assertEqual((entry.doctor_user_id, entry.patient_user_id), (self.doctor_user.id, self.patient_user.id))
+
+    def test_compaction_keeps_the_latest_covering_entry(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ChangeFeedService.record_slots([self.doctor.id], MONDAY, MONDAY)
+            ChangeFeedService.record_slots(
+                [self.doctor.id], MONDAY + timedelta(days=1), MONDAY + timedelta(days=1)
+            )
+            ChangeFeedService.record_slots([self.doctor.id], MONDAY)
+        self.assertEqual(ChangeFeedService.compact_log(chunk_size=1), 2)
+        entry = ChangeLogEntry.objects.get()
+        self.assertEqual((entry.start_date, entry.end_date), (MONDAY, None))
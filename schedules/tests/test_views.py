@@ -1,6 +1,6 @@
 # schedules/tests/test_views.py
 
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
@@ -8,7 +8,7 @@ from rest_framework import status
 from accounts.models import DoctorProfile, PatientProfile, AdminProfile, HospitalProfile, Department
 from schedules.models import (
     ScheduleCategory, Schedule, ScheduleReminder,
-    Duty, Shift, AvailabilitySlot, DoctorLeave, ScheduleOverride
+    Duty, Shift, AvailabilitySlot, DoctorLeave, ScheduleOverride, ChangeLogEntry
 )
 from django.utils import timezone
 from datetime import timedelta
@@ -172,3 +172,130 @@ class ScheduleViewsTest(TestCase):
             'end_time': (timezone.now() + timedelta(days=2, hours=1)).isoformat()
         })
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ScheduleExportViewsTest(TestCase):
+    def setUp(self):
+        self.staff_user = User.objects.create_user(
+            username='exporter', password='pass', role='ADMIN', is_staff=True
+        )
+        doctor_user = User.objects.create_user(
+            username='dr_export', password='pass', role='DOCTOR', first_name='Ann', last_name='Lee'
+        )
+        other_user = User.objects.create_user(username='dr_other', password='pass', role='DOCTOR')
+        patient_user = User.objects.create_user(
+            username='pt_export', password='pass', role='PATIENT', first_name='Bo', last_name='Ray'
+        )
+        hospital_user = User.objects.create_user(username='hosp_export', password='pass', role='HOSPITAL')
+        self.doctor = DoctorProfile.objects.create(user=doctor_user, specialization='cardiology', license_number='E-1')
+        other = DoctorProfile.objects.create(user=other_user, specialization='neurology', license_number='E-2')
+        patient = PatientProfile.objects.create(user=patient_user, date_of_birth='1990-01-01')
+        self.hospital = HospitalProfile.objects.create(
+            user=hospital_user, hospital_name='Export Hospital', license_number='H-E'
+        )
+        Duty.objects.create(doctor=self.doctor, hospital=self.hospital, duty_type='OPD', start_date='2030-01-01')
+
+        start = timezone.make_aware(timezone.datetime(2030, 1, 7, 9, 0))
+        self.schedule = Schedule.objects.create(
+            title='Check-up, follow; up', doctor=self.doctor, patient=patient,
+            start_time=start, end_time=start + timedelta(minutes=30), status='CONFIRMED'
+        )
+        Schedule.objects.create(
+            title='Other', doctor=other, patient=patient,
+            start_time=start + timedelta(days=30), end_time=start + timedelta(days=30, minutes=30)
+        )
+        ScheduleReminder.objects.create(schedule=self.schedule, send_time=start - timedelta(hours=2))
+        self.client.force_login(self.staff_user)
+
+    def export(self, name, **params):
+        response = self.client.get(reverse(f'schedules:{name}'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export_filters_by_hospital(self):
+        body = self.export('export-schedules', hospital=self.hospital.id)
+        lines = body.strip().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('"Check-up, follow; up"', lines[1])
+        self.assertIn('Ann Lee', lines[1])
+
+    def test_csv_export_filters_by_date_range(self):
+        body = self.export('export-schedules', **{'from': '2030-02-01', 'to': '2030-02-28'})
+        lines = body.strip().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Other', lines[1])
+
+    def test_ics_export_is_rfc5545(self):
+        body = self.export('export-schedules', doctor=self.doctor.id, format='ics')
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertTrue(body.endswith('END:VCALENDAR\r\n'))
+        self.assertIn(f'UID:schedule-{self.schedule.id}@medapp\r\n', body)
+        self.assertIn('DTSTART:20300107T', body)
+        self.assertIn('SUMMARY:Check-up\\, follow\\; up\r\n', body)
+        self.assertIn('STATUS:CONFIRMED', body)
+        self.assertTrue(all(len(line.encode()) <= 75 for line in body.split('\r\n')))
+
+    def test_reminder_ics_has_alarm(self):
+        body = self.export('export-reminders', format='ics')
+        self.assertEqual(body.count('BEGIN:VEVENT'), 1)
+        self.assertIn('BEGIN:VALARM', body)
+        self.assertIn('TRIGGER;VALUE=DATE-TIME:', body)
+
+    def test_invalid_filters_are_rejected(self):
+        response = self.client.get(reverse('schedules:export-schedules'), {'from': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('schedules:export-schedules'), {'format': 'xlsx'})
+        self.assertEqual(response.status_code, 400)
+
+
+class UpcomingRecurringSchedulesTest(TestCase):
+    def setUp(self):
+        self.staff_user = User.objects.create_user(username='recur_admin', password='pass', role='ADMIN', is_staff=True)
+        doctor_user = User.objects.create_user(username='dr_recur', password='pass', role='DOCTOR')
+        patient_user = User.objects.create_user(username='pt_recur', password='pass', role='PATIENT')
+        doctor = DoctorProfile.objects.create(user=doctor_user, specialization='cardiology', license_number='R-1')
+        patient = PatientProfile.objects.create(user=patient_user, date_of_birth='1990-01-01')
+        start = timezone.now() + timedelta(hours=1)
+        Schedule.objects.create(
+            title='Daily physio', doctor=doctor, patient=patient, status='CONFIRMED',
+            start_time=start, end_time=start + timedelta(minutes=30),
+            is_recurring=True, recurrence_pattern='DAILY'
+        )
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(self.staff_user)
+
+    def test_upcoming_expands_recurring_schedule(self):
+        response = self.api_client.get(reverse('schedules:schedule-upcoming-schedules'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 10)
+        self.assertEqual(len({item['start_time'] for item in response.data}), 10)
+
+    def test_stats_count_occurrences(self):
+        response = self.api_client.get(reverse('schedules:schedule-schedule-stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['recurring_schedules'], 1)
+        self.assertEqual(response.data['occurrences_next_30_days'], 30)
+
+
+@override_settings(SCHEDULES_CHANGE_FEED={'settle_seconds': 0})
+class ChangeFeedViewTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='kiosk', password='pass', role='HOSPITAL')
+        doctor_user = User.objects.create_user(username='dr_sync', password='pass', role='DOCTOR')
+        self.doctor = DoctorProfile.objects.create(user=doctor_user, specialization='cardiology', license_number='S-1')
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user)
+
+    def test_bootstrap_then_poll(self):
+        token = self.api_client.get(reverse('schedules:change-feed')).data['token']
+        ChangeLogEntry.objects.create(object_type='SLOTS', object_id=self.doctor.id, start_date='2030-01-07')
+        response = self.api_client.get(reverse('schedules:change-feed'), {'since': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['slots'][0]['doctor_id'], self.doctor.id)
+        self.assertGreater(response.data['token'], token)
+
+    def test_invalid_token_is_rejected(self):
+        for params in ({'since': 'abc'}, {'since': -1}, {'since': 0, 'limit': 0}):
+            response = self.api_client.get(reverse('schedules:change-feed'), params)
+            self.assertEqual(response.status_code, 400)
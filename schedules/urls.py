@@ -48,6 +48,12 @@ urlpatterns = [
              name='unsent-reminders'),
     ])),
     
+    # Earliest free slot search
+    path('api/earliest-slots/', views.EarliestSlotView.as_view(), name='earliest-slots'),
+    
+    # Delta sync feed
+    path('api/sync/', views.ChangeFeedView.as_view(), name='change-feed'),
+    
     # Utility Routes
     path('export/', include([
         path('schedules/', views.export_schedules_view, name='export-schedules'),
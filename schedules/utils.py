@@ -0,0 +1,598 @@
+"""
+schedules/utils.py
+
+Pure helpers shared by the schedule services and tasks.
+Nothing in here issues queries of its own.
+"""
+
+import calendar
+import heapq
+import math
+import time as _time
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection
+
+
+def time_to_minutes(value: time) -> int:
+    """Convert a time of day to minutes since midnight"""
+    return value.hour * 60 + value.minute
+
+
+def minutes_to_time(minutes: int) -> time:
+    """Convert minutes since midnight back to a time of day"""
+    return time(minutes // 60, minutes % 60)
+
+
+def epoch_hour(value: datetime) -> int:
+    """Hours since the Unix epoch for an aware datetime (the reminder send bucket)"""
+    return int(value.timestamp()) // 3600
+
+
+def merge_config(defaults: Dict, setting_name: str, overrides: Dict) -> Dict:
+    """
+    Merge a service's defaults, its settings dict and explicit overrides.
+
+    Later sources win; overrides set to None are ignored, so optional task
+    arguments can be passed straight through.
+    """
+    config = dict(defaults)
+    config.update(getattr(settings, setting_name, {}))
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    return config
+
+
+def build_slot_template(start_time: time, end_time: time, slot_duration_minutes: int,
+                        break_start: Optional[time] = None,
+                        break_end: Optional[time] = None) -> List[Tuple[time, time]]:
+    """
+    Build the list of (start, end) slot times for one working day.
+
+    Slots follow a fixed grid from ``start_time``; grid steps that overlap the
+    break are skipped, so slots after the break stay aligned with the grid.
+
+    Args:
+        start_time: Shift start time
+        end_time: Shift end time
+        slot_duration_minutes: Duration of each slot in minutes
+        break_start: Optional break start time
+        break_end: Optional break end time
+
+    Returns:
+        List of (start_time, end_time) tuples in chronological order
+    """
+    if slot_duration_minutes <= 0:
+        return []
+
+    start = time_to_minutes(start_time)
+    end = time_to_minutes(end_time)
+    has_break = break_start is not None and break_end is not None
+    if has_break:
+        break_from = time_to_minutes(break_start)
+        break_to = time_to_minutes(break_end)
+
+    template = []
+    current = start
+    while current + slot_duration_minutes <= end:
+        slot_end = current + slot_duration_minutes
+        if not has_break or slot_end <= break_from or current >= break_to:
+            template.append((minutes_to_time(current), minutes_to_time(slot_end)))
+        current = slot_end
+
+    return template
+
+
+class AppointmentMixEntry(NamedTuple):
+    """One appointment type of a shift's mix; weight is its relative share of appointments"""
+    appointment_type: str
+    minutes: int
+    weight: float
+
+
+def parse_appointment_mix(mix) -> Tuple[AppointmentMixEntry, ...]:
+    """
+    Validate a shift's appointment mix.
+    
+    Args:
+        mix: List of {"type": str, "minutes": int, "ratio": number} dictionaries
+    
+    Returns:
+        Tuple of entries (empty for an empty mix), usable as a cache key
+    
+    Raises:
+        ValueError: On a malformed mix
+    """
+    if not mix:
+        return ()
+    if not isinstance(mix, list):
+        raise ValueError("Appointment mix must be a list")
+    entries = []
+    for item in mix:
+        try:
+            entry = AppointmentMixEntry(str(item['type']), int(item['minutes']), float(item.get('ratio', 1)))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise ValueError("Each appointment type needs a type, minutes and an optional ratio")
+        if not entry.appointment_type or len(entry.appointment_type) > 30:
+            raise ValueError("Appointment type names must be 1-30 characters")
+        if entry.minutes <= 0 or entry.weight <= 0:
+            raise ValueError(f"{entry.appointment_type}: minutes and ratio must be positive")
+        entries.append(entry)
+    if len({entry.appointment_type for entry in entries}) != len(entries):
+        raise ValueError("Appointment types must be unique")
+    return tuple(entries)
+
+
+def pack_slot_template(start_time: time, end_time: time, mix: Tuple[AppointmentMixEntry, ...],
+                       break_start: Optional[time] = None,
+                       break_end: Optional[time] = None) -> List[Tuple[time, time, str]]:
+    """
+    Pack variable-length slots of an appointment mix into one working day.
+    
+    The day is split into free segments around the break and filled left to
+    right. The next type is chosen by smooth weighted round-robin among the
+    types that still fit the segment: every type earns its weight in credit,
+    the richest fitting type is placed and pays back the total weight. This
+    keeps the counts close to the target ratios at every prefix of the day,
+    interleaves the types, and lets short types fill the tail of a segment
+    that a long type no longer fits.
+    
+    Returns:
+        List of (start_time, end_time, appointment_type) tuples in chronological order
+    """
+    start = time_to_minutes(start_time)
+    end = time_to_minutes(end_time)
+    segments = [(start, end)]
+    if break_start is not None and break_end is not None:
+        break_from, break_to = time_to_minutes(break_start), time_to_minutes(break_end)
+        segments = [(start, min(end, break_from)), (max(start, break_to), end)]
+    
+    total_weight = sum(entry.weight for entry in mix)
+    credit = [0.0] * len(mix)
+    template = []
+    for cursor, segment_end in segments:
+        while True:
+            fitting = [index for index, entry in enumerate(mix) if entry.minutes <= segment_end - cursor]
+            if not fitting:
+                break
+            for index, entry in enumerate(mix):
+                credit[index] += entry.weight
+            chosen = max(fitting, key=lambda index: credit[index])
+            credit[chosen] -= total_weight
+            entry = mix[chosen]
+            template.append(
+                (minutes_to_time(cursor), minutes_to_time(cursor + entry.minutes), entry.appointment_type)
+            )
+            cursor += entry.minutes
+    return template
+
+
+class QueryCounter:
+    """
+    Context manager that counts queries and wall time on the default connection.
+
+    Usage:
+        with QueryCounter() as counter:
+            ...
+        counter.queries, counter.elapsed_ms
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.elapsed_ms = 0.0
+        self._started = None
+        self._wrapper = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        self._started = _time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed_ms = round((_time.perf_counter() - self._started) * 1000, 2)
+        self._wrapper.__exit__(exc_type, exc_value, traceback)
+        return False
+
+
+# -------------------------------
+# Streaming Export Helpers
+# -------------------------------
+class Echo:
+    """File-like object whose write() returns the value, for streaming csv.writer output"""
+
+    def write(self, value):
+        return value
+
+
+ICS_LINE_LIMIT = 75
+
+
+def ics_escape(value) -> str:
+    """Escape a TEXT value (RFC 5545 section 3.3.11)"""
+    if value is None:
+        return ''
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace(';', '\\;')
+        .replace(',', '\\,')
+        .replace('\r\n', '\\n')
+        .replace('\n', '\\n')
+    )
+
+
+def ics_datetime(value: datetime) -> str:
+    """Format an aware datetime as a UTC DATE-TIME value"""
+    return value.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def ics_fold(line: str) -> str:
+    """
+    Fold a content line at 75 octets (RFC 5545 section 3.1) and add CRLF.
+
+    Continuation lines start with a single space; multi-byte characters are
+    never split.
+    """
+    encoded = line.encode('utf-8')
+    if len(encoded) <= ICS_LINE_LIMIT:
+        return line + '\r\n'
+
+    parts = []
+    current = ''
+    limit = ICS_LINE_LIMIT
+    for char in line:
+        if len((current + char).encode('utf-8')) > limit:
+            parts.append(current)
+            current = ''
+            # Following lines lose one octet to the leading space
+            limit = ICS_LINE_LIMIT - 1
+        current += char
+    parts.append(current)
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def ics_event(uid: str, start: datetime, end: datetime, summary: str,
+              stamp: datetime, description: str = '', status: str = None,
+              alarm_at: Optional[datetime] = None) -> str:
+    """Render one VEVENT (with an optional display VALARM) as folded content lines"""
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:{uid}',
+        f'DTSTAMP:{ics_datetime(stamp)}',
+        f'DTSTART:{ics_datetime(start)}',
+        f'DTEND:{ics_datetime(end)}',
+        f'SUMMARY:{ics_escape(summary)}',
+    ]
+    if description:
+        lines.append(f'DESCRIPTION:{ics_escape(description)}')
+    if status:
+        lines.append(f'STATUS:{status}')
+    if alarm_at is not None:
+        lines.extend([
+            'BEGIN:VALARM',
+            'ACTION:DISPLAY',
+            f'DESCRIPTION:{ics_escape(summary)}',
+            f'TRIGGER;VALUE=DATE-TIME:{ics_datetime(alarm_at)}',
+            'END:VALARM',
+        ])
+    lines.append('END:VEVENT')
+    return ''.join(ics_fold(line) for line in lines)
+
+
+def iter_ics_calendar(events: Iterable[str], name: str) -> Iterator[str]:
+    """Wrap rendered VEVENTs in a VCALENDAR, yielding chunk by chunk"""
+    yield ics_fold('BEGIN:VCALENDAR')
+    yield ics_fold('VERSION:2.0')
+    yield ics_fold('PRODID:-//MedApp//Schedules//EN')
+    yield ics_fold('CALSCALE:GREGORIAN')
+    yield ics_fold(f'X-WR-CALNAME:{ics_escape(name)}')
+    yield from events
+    yield ics_fold('END:VCALENDAR')
+
+
+# -------------------------------
+# Recurrence Rules
+# -------------------------------
+WEEKDAY_CODES = {'MO': 0, 'TU': 1, 'WE': 2, 'TH': 3, 'FR': 4, 'SA': 5, 'SU': 6}
+
+# Plain-word patterns accepted in Schedule.recurrence_pattern
+RECURRENCE_ALIASES = {
+    'DAILY': 'FREQ=DAILY',
+    'WEEKDAYS': 'FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR',
+    'WEEKLY': 'FREQ=WEEKLY',
+    'BIWEEKLY': 'FREQ=WEEKLY;INTERVAL=2',
+    'MONTHLY': 'FREQ=MONTHLY',
+    'YEARLY': 'FREQ=YEARLY',
+}
+
+
+class RecurrenceRule(NamedTuple):
+    """Parsed subset of an RFC 5545 RRULE"""
+    freq: str
+    interval: int = 1
+    byday: Tuple[int, ...] = ()
+    count: Optional[int] = None
+    until: Optional[date] = None
+
+
+def parse_recurrence(pattern: str) -> RecurrenceRule:
+    """
+    Parse a recurrence pattern into a RecurrenceRule.
+
+    Supports FREQ (DAILY, WEEKLY, MONTHLY, YEARLY), INTERVAL, BYDAY (plain
+    weekday codes, DAILY/WEEKLY only), COUNT and UNTIL (date or UTC date-time),
+    with or without an ``RRULE:`` prefix, plus the words in RECURRENCE_ALIASES.
+
+    Raises:
+        ValueError: If the pattern is empty, malformed or uses unsupported parts
+    """
+    text = (pattern or '').strip().upper()
+    text = RECURRENCE_ALIASES.get(text, text)
+    if text.startswith('RRULE:'):
+        text = text[len('RRULE:'):]
+    if not text:
+        raise ValueError("Recurrence pattern is empty")
+
+    parts = {}
+    for part in text.split(';'):
+        key, sep, value = part.partition('=')
+        if not sep or not value:
+            raise ValueError(f"Malformed recurrence part '{part}'")
+        parts[key] = value
+
+    unsupported = set(parts) - {'FREQ', 'INTERVAL', 'BYDAY', 'COUNT', 'UNTIL', 'WKST'}
+    if unsupported:
+        raise ValueError(f"Unsupported recurrence parts: {', '.join(sorted(unsupported))}")
+
+    freq = parts.get('FREQ')
+    if freq not in ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY'):
+        raise ValueError(f"Unsupported FREQ '{freq}'")
+
+    try:
+        interval = int(parts.get('INTERVAL', 1))
+        count = int(parts['COUNT']) if 'COUNT' in parts else None
+    except ValueError:
+        raise ValueError("INTERVAL and COUNT must be integers")
+    if interval < 1 or (count is not None and count < 1):
+        raise ValueError("INTERVAL and COUNT must be positive")
+    if count is not None and 'UNTIL' in parts:
+        raise ValueError("COUNT and UNTIL cannot be combined")
+
+    byday = ()
+    if 'BYDAY' in parts:
+        if freq not in ('DAILY', 'WEEKLY'):
+            raise ValueError("BYDAY is only supported with DAILY or WEEKLY")
+        try:
+            byday = tuple(sorted({WEEKDAY_CODES[code] for code in parts['BYDAY'].split(',')}))
+        except KeyError as e:
+            raise ValueError(f"Unknown weekday {e.args[0]!r} in BYDAY")
+
+    until = None
+    if 'UNTIL' in parts:
+        try:
+            until = datetime.strptime(parts['UNTIL'][:8], '%Y%m%d').date()
+        except ValueError:
+            raise ValueError("UNTIL must be a date (YYYYMMDD) or date-time")
+
+    return RecurrenceRule(freq, interval, byday, count, until)
+
+
+def _add_months(day: date, months: int) -> Optional[date]:
+    """Same day-of-month ``months`` later, or None when that month is too short"""
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    if day.day > calendar.monthrange(year, month)[1]:
+        return None
+    return date(year, month, day.day)
+
+
+def _iter_period_dates(first: date, rule: RecurrenceRule, skip_periods: int = 0) -> Iterator[date]:
+    """Yield candidate dates in order, starting ``skip_periods`` periods after ``first``"""
+    period = skip_periods
+    if rule.freq == 'DAILY':
+        while True:
+            current = first + timedelta(days=period * rule.interval)
+            if not rule.byday or current.weekday() in rule.byday:
+                yield current
+            period += 1
+    elif rule.freq == 'WEEKLY':
+        week_start = first - timedelta(days=first.weekday())
+        weekdays = rule.byday or (first.weekday(),)
+        while True:
+            monday = week_start + timedelta(weeks=period * rule.interval)
+            for weekday in weekdays:
+                current = monday + timedelta(days=weekday)
+                if current >= first:
+                    yield current
+            period += 1
+    else:
+        months = 12 if rule.freq == 'YEARLY' else 1
+        while True:
+            current = _add_months(first, period * rule.interval * months)
+            # RFC 5545: invalid dates (e.g. Feb 30) are skipped, not clamped
+            if current is not None:
+                yield current
+            period += 1
+
+
+def _skippable_periods(first: date, rule: RecurrenceRule, window_start: date) -> int:
+    """Whole periods that end before ``window_start`` (only safe without COUNT)"""
+    if rule.count is not None or window_start <= first:
+        return 0
+    if rule.freq == 'DAILY':
+        return (window_start - first).days // rule.interval
+    if rule.freq == 'WEEKLY':
+        week_start = first - timedelta(days=first.weekday())
+        return max((window_start - week_start).days // 7 // rule.interval - 1, 0)
+    months = 12 if rule.freq == 'YEARLY' else 1
+    elapsed = (window_start.year - first.year) * 12 + window_start.month - first.month
+    return max(elapsed // (rule.interval * months) - 1, 0)
+
+
+def iter_occurrences(dtstart: datetime, rule: RecurrenceRule,
+                     window_start: Optional[datetime] = None,
+                     window_end: Optional[datetime] = None) -> Iterator[datetime]:
+    """
+    Lazily yield occurrence start times of a recurring event.
+
+    ``dtstart`` is always the first occurrence. Dates are generated on the
+    wall clock of ``dtstart``'s timezone, so a 09:00 event stays at 09:00
+    across DST changes. Without COUNT, whole periods before ``window_start``
+    are skipped arithmetically instead of being enumerated.
+
+    Args:
+        dtstart: Start of the first occurrence (aware or naive)
+        rule: Parsed recurrence rule
+        window_start: Only yield occurrences at or after this time
+        window_end: Stop before this time (required for unbounded rules to terminate)
+    """
+    tzinfo = dtstart.tzinfo
+    first = dtstart.date()
+    start_time = dtstart.time()
+
+    def at(day):
+        # Attaching the zone per date keeps the offset right on both sides of a DST change
+        return datetime.combine(day, start_time, tzinfo=tzinfo)
+
+    skip = _skippable_periods(first, rule, window_start.date()) if window_start else 0
+    emitted = 0
+    if skip == 0:
+        emitted = 1
+        if (window_start is None or dtstart >= window_start) and (window_end is None or dtstart < window_end):
+            yield dtstart
+        if rule.count == 1:
+            return
+
+    for day in _iter_period_dates(first, rule, skip):
+        if day == first:
+            continue
+        if rule.until and day > rule.until:
+            return
+        occurrence = at(day)
+        if window_end is not None and occurrence >= window_end:
+            return
+        emitted += 1
+        if window_start is None or occurrence >= window_start:
+            yield occurrence
+        if rule.count is not None and emitted >= rule.count:
+            return
+
+
+# -------------------------------
+# Shift Conflicts
+# -------------------------------
+def rotation_week(day: date, valid_from: date, cycle_weeks: int) -> int:
+    """Week of a rotation cycle that ``day`` falls in, counted from the Monday of ``valid_from``"""
+    anchor = valid_from - timedelta(days=valid_from.weekday())
+    return ((day - anchor).days // 7) % cycle_weeks
+
+
+class ShiftInterval(NamedTuple):
+    """One weekly shift as a minute interval, valid over its duty's date range"""
+    shift_id: Optional[int]
+    doctor_id: int
+    hospital_id: int
+    day_of_week: int
+    start: int
+    end: int
+    valid_from: date
+    valid_until: Optional[date]
+    cycle_weeks: int = 1
+    week_index: int = 0
+
+
+def runs_on(interval: ShiftInterval, day: date) -> bool:
+    """Whether a shift interval is worked on a date (weekday, duty range and rotation week)"""
+    return (
+        day.weekday() == interval.day_of_week and
+        interval.valid_from <= day and
+        (interval.valid_until is None or day <= interval.valid_until) and
+        rotation_week(day, interval.valid_from, interval.cycle_weeks) == interval.week_index
+    )
+
+
+def shift_runs_on(shift, day: date) -> bool:
+    """Whether a Shift (with its duty loaded) is worked on a date, rotation week included"""
+    duty = shift.duty
+    return (
+        day.weekday() == shift.day_of_week and
+        duty.start_date <= day and
+        (duty.end_date is None or day <= duty.end_date) and
+        rotation_week(day, duty.start_date, shift.rotation_cycle_weeks) == shift.rotation_week_index
+    )
+
+
+def _dates_overlap(first: ShiftInterval, second: ShiftInterval) -> bool:
+    """
+    Whether two intervals can fall on the same day: their duty date ranges
+    share a day (None = open-ended) and their rotation weeks can coincide.
+    """
+    if not (
+        (second.valid_until is None or first.valid_from <= second.valid_until) and
+        (first.valid_until is None or second.valid_from <= first.valid_until)
+    ):
+        return False
+    if first.cycle_weeks == 1 and second.cycle_weeks == 1:
+        return True
+    # Absolute week w runs first iff w = offset_1 (mod cycle_1); two such
+    # congruences have a common solution iff the offsets agree modulo the gcd
+    epoch = date(1970, 1, 5)
+    offsets = [
+        ((interval.valid_from - timedelta(days=interval.valid_from.weekday()) - epoch).days // 7
+         + interval.week_index)
+        for interval in (first, second)
+    ]
+    return (offsets[0] - offsets[1]) % math.gcd(first.cycle_weeks, second.cycle_weeks) == 0
+
+
+def find_overlaps(intervals: Iterable[ShiftInterval],
+                  candidates: Iterable[ShiftInterval] = ()) -> List[Tuple[ShiftInterval, ShiftInterval]]:
+    """
+    Find pairs of shifts of the same doctor that overlap on a weekday.
+    
+    Intervals are grouped per (doctor, weekday), sorted by start and swept
+    left to right with a heap of the active intervals' end minutes, so the
+    cost is O(n log n) plus the number of overlapping pairs. Intervals are
+    half-open: a shift ending at 12:00 does not clash with one starting at
+    12:00. Shifts whose duties never run at the same time do not conflict.
+    
+    Args:
+        intervals: Existing shifts
+        candidates: Proposed shifts; when given, only pairs involving a
+            candidate are reported (candidates are also checked against each other)
+    
+    Returns:
+        (earlier, later) pairs ordered by start minute
+    """
+    groups: Dict[Tuple[int, int], List[Tuple[int, int, bool, ShiftInterval]]] = defaultdict(list)
+    candidates = list(candidates)
+    focused = bool(candidates)
+    for position, (interval, is_candidate) in enumerate(
+        [(interval, False) for interval in intervals] + [(interval, True) for interval in candidates]
+    ):
+        if interval.end > interval.start:
+            groups[(interval.doctor_id, interval.day_of_week)].append(
+                (interval.start, position, is_candidate, interval)
+            )
+    
+    overlaps = []
+    for entries in groups.values():
+        entries.sort()
+        active = []
+        for start, position, is_candidate, interval in entries:
+            while active and active[0][0] <= start:
+                heapq.heappop(active)
+            for _, _, other_is_candidate, other in active:
+                if focused and not (is_candidate or other_is_candidate):
+                    continue
+                if _dates_overlap(other, interval):
+                    overlaps.append((other, interval))
+            heapq.heappush(active, (interval.end, position, is_candidate, interval))
+    return overlaps
@@ -5,7 +5,9 @@
 # -------------------------------
 from django.shortcuts import render
 from django.views.generic import TemplateView
-from django.http import JsonResponse
+from datetime import date, timedelta
+from itertools import islice
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils import timezone
 from django.db.models import Count, Q
 
@@ -19,9 +21,10 @@ from rest_framework.permissions import IsAuthenticated
 # -------------------------------
 # DRF Imports
 # -------------------------------
-from rest_framework import viewsets, status
+from rest_framework import viewsets, status, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
 # -------------------------------
 # Local Imports
@@ -41,6 +44,7 @@ from .serializers import (
 from .permissions import (
     IsScheduleOwnerOrAdmin, StrictScheduleAccess, ScheduleReminderPermission
 )
+from .services import ScheduleExportService, RecurrenceService, EarliestSlotIndexService, ChangeFeedService
 
 # -------------------------------
 # Logging Setup
@@ -49,26 +53,137 @@ import logging
 logger = logging.getLogger(__name__)
 
 # -------------------------------
-# Export Views (Placeholder)
+# Export Views
 # -------------------------------
+def _parse_export_filters(request):
+    """
+    Read ?doctor=&hospital=&from=&to=&format= from the query string.
+    Raises ValueError with a user-facing message on bad input.
+    """
+    params = request.GET
+    filters = {'fmt': params.get('format', 'csv').lower()}
+    if filters['fmt'] not in ScheduleExportService.FORMATS:
+        raise ValueError(f"Unsupported format '{filters['fmt']}'")
+
+    for param, key in (('doctor', 'doctor_id'), ('hospital', 'hospital_id')):
+        value = params.get(param)
+        if value:
+            if not value.isdigit():
+                raise ValueError(f"'{param}' must be an integer id")
+            filters[key] = int(value)
+
+    for param, key in (('from', 'start_date'), ('to', 'end_date')):
+        value = params.get(param)
+        if value:
+            try:
+                filters[key] = date.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"'{param}' must be a date in YYYY-MM-DD format")
+
+    if filters.get('start_date') and filters.get('end_date') and filters['start_date'] > filters['end_date']:
+        raise ValueError("'from' must not be after 'to'")
+    return filters
+
+
+def _export_response(request, kind):
+    """Build a streaming export response for schedules or reminders"""
+    try:
+        filters = _parse_export_filters(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    fmt = filters['fmt']
+    logger.info(f"{kind.capitalize()} export ({fmt}) triggered by {request.user}")
+    response = StreamingHttpResponse(
+        ScheduleExportService.stream(kind, **filters),
+        content_type=ScheduleExportService.CONTENT_TYPES[fmt]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{kind}-{timezone.now():%Y%m%d}.{fmt}"'
+    return response
+
+
 @staff_member_required
 def export_schedules_view(request):
     """
-    Placeholder view to export schedules.
-    Replace with actual export logic (e.g., CSV, Excel, PDF).
+    Stream schedules as CSV (default) or iCalendar.
+    Filters: ?doctor=<id>&hospital=<id>&from=YYYY-MM-DD&to=YYYY-MM-DD&format=csv|ics
     """
-    logger.info(f"Schedule export triggered by {request.user}")
-    return JsonResponse({'message': 'Schedule export not yet implemented.'})
+    return _export_response(request, 'schedules')
 
 
 @staff_member_required
 def export_reminders_view(request):
     """
-    Placeholder view to export schedule reminders.
-    Replace with actual export logic (e.g., CSV, Excel, PDF).
+    Stream schedule reminders as CSV (default) or iCalendar (one event with an alarm per reminder).
+    Accepts the same filters as export_schedules_view, applied to the reminder's schedule.
+    """
+    return _export_response(request, 'reminders')
+
+# -------------------------------
+# Earliest Available Slot Search
+# -------------------------------
+class EarliestSlotView(APIView):
+    """
+    Returns the top-K earliest free slots for a specialization.
+
+    Query params:
+        specialization (required), hospital, from, to (YYYY-MM-DD),
+        min_rating, min_experience, limit (default 10, max 100)
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        specialization = params.get('specialization')
+        if not specialization:
+            return Response({'error': "'specialization' is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            filters = {
+                'start_date': date.fromisoformat(params['from']) if params.get('from') else None,
+                'end_date': date.fromisoformat(params['to']) if params.get('to') else None,
+                'limit': int(params.get('limit', EarliestSlotIndexService.DEFAULT_LIMIT)),
+                'hospital_id': int(params['hospital']) if params.get('hospital') else None,
+                'min_rating': float(params['min_rating']) if params.get('min_rating') else None,
+                'min_experience': int(params['min_experience']) if params.get('min_experience') else None,
+            }
+        except ValueError:
+            return Response(
+                {'error': 'Invalid filter value (dates are YYYY-MM-DD, ids and limits are integers)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(EarliestSlotIndexService.search(specialization, **filters))
+
+class ChangeFeedView(APIView):
+    """
+    Delta sync for slots, schedules and appointments.
+
+    Query params:
+        since: token from the previous response (omit to get the current
+            token before loading the full lists)
+        limit: log entries per page (default 500)
+        hospital: only return slots of this hospital
+
+    Keep requesting with the returned token while has_more is true.
     """
-    logger.info(f"Reminder export triggered by {request.user}")
-    return JsonResponse({'message': 'Reminder export not yet implemented.'})
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            since = int(params['since']) if params.get('since') else None
+            limit = int(params['limit']) if params.get('limit') else None
+            hospital_id = int(params['hospital']) if params.get('hospital') else None
+            if (since is not None and since < 0) or (limit is not None and limit < 1):
+                raise ValueError
+        except ValueError:
+            return Response(
+                {'error': "'since' must be a token from a previous response and 'limit' a positive integer"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(ChangeFeedService.changes(since, limit, user=request.user, hospital_id=hospital_id))
 
 # -------------------------------
 # Schedule Category ViewSet
@@ -104,6 +219,9 @@ class ScheduleViewSet(viewsets.ModelViewSet):
     serializer_class = ScheduleSerializer
     permission_classes = [IsScheduleOwnerOrAdmin]
 
+    # How far ahead upcoming_schedules looks for occurrences
+    UPCOMING_HORIZON_DAYS = 365
+
     def get_queryset(self):
         """
         Filters schedules based on user role.
@@ -116,17 +234,30 @@ class ScheduleViewSet(viewsets.ModelViewSet):
             Q(doctor__user=user) | Q(patient__user=user)
         )
 
+    def _serialize_occurrence(self, occurrence):
+        """Serialize a schedule with the occurrence's own start and end times"""
+        data = self.get_serializer(occurrence.schedule).data
+        data['start_time'] = serializers.DateTimeField().to_representation(occurrence.start)
+        data['end_time'] = serializers.DateTimeField().to_representation(occurrence.end)
+        return data
+
     @action(detail=False, methods=['GET'])
     def upcoming_schedules(self, request):
         """
-        Returns next 10 upcoming schedules.
+        Returns next 10 upcoming schedules, with recurring schedules
+        expanded into their individual occurrences.
         """
-        upcoming = self.get_queryset().filter(
-            start_time__gt=timezone.now(),
-            status__in=['PENDING', 'CONFIRMED']
-        ).order_by('start_time')[:10]
-        serializer = self.get_serializer(upcoming, many=True)
-        return Response(serializer.data)
+        now = timezone.now()
+        occurrences = RecurrenceService.occurrences(
+            self.get_queryset().filter(status__in=['PENDING', 'CONFIRMED']),
+            now, now + timedelta(days=self.UPCOMING_HORIZON_DAYS)
+        )
+        return Response([
+            self._serialize_occurrence(occurrence)
+            for occurrence in islice(
+                (occurrence for occurrence in occurrences if occurrence.start > now), 10
+            )
+        ])
 
     @action(detail=False, methods=['GET'])
     def schedule_stats(self, request):
@@ -134,8 +265,14 @@ class ScheduleViewSet(viewsets.ModelViewSet):
         Returns statistics on schedule status and priority.
         """
         qs = self.get_queryset()
+        now = timezone.now()
+        upcoming = RecurrenceService.occurrences(
+            qs.filter(status__in=['PENDING', 'CONFIRMED']), now, now + timedelta(days=30)
+        )
         return Response({
             'total_schedules': qs.count(),
+            'recurring_schedules': qs.filter(is_recurring=True).count(),
+            'occurrences_next_30_days': sum(1 for _ in upcoming),
             'status_breakdown': list(qs.values('status').annotate(count=Count('status'))),
             'priority_breakdown': list(qs.values('priority').annotate(count=Count('priority')))
         })
@@ -167,9 +304,9 @@ class ScheduleReminderViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['GET'])
     def unsent_reminders(self, request):
         """
-        Returns reminders that haven't been sent yet.
+        Returns reminders that haven't been sent yet, soonest first.
         """
-        unsent = self.get_queryset().filter(is_sent=False)
+        unsent = self.get_queryset().filter(is_sent=False).order_by('send_bucket', 'send_time')
         serializer = self.get_serializer(unsent, many=True)
         return Response(serializer.data)
 